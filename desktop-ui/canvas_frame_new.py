@@ -41,13 +41,15 @@ class CanvasFrame(ctk.CTkFrame):
         self.canvas = ctk.CTkCanvas(self, bg="#2B2B2B", highlightthickness=0)
         self.canvas.grid(row=0, column=0, sticky="nsew")
 
-        self.x_scrollbar = ctk.CTkScrollbar(self, orientation="horizontal", command=self.canvas.xview)
+        self.x_scrollbar = ctk.CTkScrollbar(self, orientation="horizontal", command=self._on_x_scroll)
         self.x_scrollbar.grid(row=1, column=0, sticky="ew")
 
-        self.y_scrollbar = ctk.CTkScrollbar(self, orientation="vertical", command=self.canvas.yview)
+        self.y_scrollbar = ctk.CTkScrollbar(self, orientation="vertical", command=self._on_y_scroll)
         self.y_scrollbar.grid(row=0, column=1, sticky="ns")
 
         self.canvas.configure(xscrollcommand=self.x_scrollbar.set, yscrollcommand=self.y_scrollbar.set)
+        # 画布只绘制可见瓦片，尺寸变化时需要补画新露出的区域
+        self.canvas.bind("<Configure>", self._on_canvas_configure, add="+")
 
         self.renderer = CanvasRenderer(self.canvas, self.transform_service)
         self.regions = []
@@ -111,6 +113,18 @@ class CanvasFrame(ctk.CTkFrame):
             # 立即重绘，适用于重要的状态变化
             self.renderer.redraw_all(**redraw_kwargs)
 
+    def _on_canvas_configure(self, event):
+        self.redraw_canvas()
+
+    def _on_x_scroll(self, *args):
+        self.canvas.xview(*args)
+        # 滚动条拖动后补画新进入视口的瓦片
+        self.redraw_canvas(use_debounce=True)
+
+    def _on_y_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.redraw_canvas(use_debounce=True)
+
     def load_image(self, image_path):
         self.renderer.set_image(image_path)
         self.redraw_canvas()
@@ -1,11 +1,13 @@
 from PIL import Image, ImageTk
 import copy
+import math
 from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 import cv2
 from manga_translator.utils import TextBlock
 from manga_translator.rendering import resize_regions_to_font_size
 from .text_renderer_backend import BackendTextRenderer
+from .tile_pyramid import TilePyramid
 from services.transform_service import TransformService
 
 class CanvasRenderer:
@@ -24,10 +26,10 @@ class CanvasRenderer:
         self.removed_mask = None
         self.show_removed_mask = False
         
-        # 性能优化缓存
-        self._resized_image_cache = {}
-        self._last_zoom_level = None
-        self._last_dimensions = None
+        # 性能优化缓存：原图和修复图的瓦片金字塔，以及当前可见瓦片的PhotoImage
+        self._pyramid: Optional[TilePyramid] = None
+        self._inpainted_pyramid: Optional[TilePyramid] = None
+        self._tile_photos: Dict[str, ImageTk.PhotoImage] = {}
         self._redraw_scheduled = False
         
         # 防抖定时器
@@ -43,13 +45,18 @@ class CanvasRenderer:
             
         self.image = Image.open(image_path)
         self._clear_cache()  # 清除缓存因为图像已更改
+        self._pyramid = TilePyramid(self.image)
         self.redraw_all()
     
     def _clear_cache(self):
         """清除图像缓存"""
-        self._resized_image_cache.clear()
-        self._last_zoom_level = None
-        self._last_dimensions = None
+        if self._pyramid:
+            self._pyramid.close()
+            self._pyramid = None
+        if self._inpainted_pyramid:
+            self._inpainted_pyramid.close()
+            self._inpainted_pyramid = None
+        self._tile_photos.clear()
     
     def redraw_debounced(self, delay=0.05, **kwargs):
         """防抖重绘 - 避免频繁重绘"""
@@ -62,10 +69,10 @@ class CanvasRenderer:
 
     def set_inpainted_image(self, image):
         self.inpainted_image = image
-        # 清除inpainted图像的缓存，确保显示新渲染的图像
-        keys_to_remove = [key for key in self._resized_image_cache.keys() if key.startswith('inpaint_')]
-        for key in keys_to_remove:
-            del self._resized_image_cache[key]
+        # 重建inpainted图像的金字塔，确保显示新渲染的图像
+        if self._inpainted_pyramid:
+            self._inpainted_pyramid.close()
+        self._inpainted_pyramid = TilePyramid(image) if image else None
 
     def set_inpainted_alpha(self, alpha):
         self.inpainted_alpha = alpha
@@ -101,41 +108,81 @@ class CanvasRenderer:
 
         self.transform_service.set_transform(zoom_level, x_offset, y_offset)
 
+    def _visible_image_rect(self) -> Tuple[float, float, float, float]:
+        """当前视口在原图坐标系中的范围（已裁剪到图像边界）"""
+        zoom_level = self.transform_service.zoom_level
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1 or zoom_level <= 0:
+            # 画布尚未完成布局，按整张图处理
+            return 0, 0, self.image.width, self.image.height
+
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x0 = (left - self.transform_service.x_offset) / zoom_level
+        y0 = (top - self.transform_service.y_offset) / zoom_level
+        x1 = x0 + width / zoom_level
+        y1 = y0 + height / zoom_level
+        return max(0, x0), max(0, y0), min(self.image.width, x1), min(self.image.height, y1)
+
+    def _draw_tiles(self, pyramid: TilePyramid, view_rect, tag: str, photos: Dict[str, ImageTk.PhotoImage],
+                    alpha: Optional[float] = None):
+        """绘制金字塔中与视口相交的瓦片，PhotoImage在缩放不变时跨重绘复用"""
+        zoom_level = self.transform_service.zoom_level
+        origin_x = round(self.transform_service.x_offset)
+        origin_y = round(self.transform_service.y_offset)
+        alpha_value = int(alpha * 255) if alpha is not None else None
+
+        for key, sx, sy, tile in pyramid.visible_tiles(zoom_level, view_rect):
+            photo_key = f"{key}#{alpha_value}"
+            photo = self._tile_photos.get(photo_key)
+            if photo is None:
+                if alpha_value is not None:
+                    tile = tile.copy()
+                    tile.putalpha(alpha_value)
+                photo = ImageTk.PhotoImage(tile)
+            photos[photo_key] = photo
+            self.canvas.create_image(origin_x + sx, origin_y + sy, anchor="nw", image=photo, tags=tag)
+
+    def _draw_mask(self, mask: np.ndarray, color: List[int], tag: str) -> Optional[ImageTk.PhotoImage]:
+        """只将视口内的蒙版部分放大到屏幕尺寸并绘制"""
+        zoom_level = self.transform_service.zoom_level
+        x0, y0, x1, y1 = self._visible_image_rect()
+        # 蒙版分辨率可能与图像不同
+        scale_x = mask.shape[1] / self.image.width
+        scale_y = mask.shape[0] / self.image.height
+        mx0, my0 = int(x0 * scale_x), int(y0 * scale_y)
+        mx1 = min(mask.shape[1], int(math.ceil(x1 * scale_x)))
+        my1 = min(mask.shape[0], int(math.ceil(y1 * scale_y)))
+        if mx1 <= mx0 or my1 <= my0:
+            return None
+
+        screen_x0 = round(self.transform_service.x_offset + mx0 / scale_x * zoom_level)
+        screen_y0 = round(self.transform_service.y_offset + my0 / scale_y * zoom_level)
+        screen_x1 = round(self.transform_service.x_offset + mx1 / scale_x * zoom_level)
+        screen_y1 = round(self.transform_service.y_offset + my1 / scale_y * zoom_level)
+        if screen_x1 <= screen_x0 or screen_y1 <= screen_y0:
+            return None
+
+        crop = mask[my0:my1, mx0:mx1]
+        overlay = np.zeros((crop.shape[0], crop.shape[1], 4), dtype=np.uint8)
+        overlay[crop > 0] = color
+        resized = Image.fromarray(overlay).resize((screen_x1 - screen_x0, screen_y1 - screen_y0), Image.NEAREST)
+        photo = ImageTk.PhotoImage(resized)
+        self.canvas.create_image(screen_x0, screen_y0, anchor="nw", image=photo, tags=tag)
+        return photo
+
     def redraw_mask_overlay(self):
         self.canvas.delete("mask_overlay")
         self.canvas.delete("removed_mask_overlay")
+        if not self.image:
+            return
         
         # Draw refined mask in blue
         if self.refined_mask is not None and self.show_mask:
-            zoom_level = self.transform_service.zoom_level
-            x_offset = self.transform_service.x_offset
-            y_offset = self.transform_service.y_offset
-            new_width = int(self.image.width * zoom_level)
-            new_height = int(self.image.height * zoom_level)
-
-            if new_width > 0 and new_height > 0:
-                mask_overlay = np.zeros((self.refined_mask.shape[0], self.refined_mask.shape[1], 4), dtype=np.uint8)
-                mask_overlay[self.refined_mask > 0] = [0, 0, 255, 200]
-                mask_pil = Image.fromarray(mask_overlay)
-                resized_mask = mask_pil.resize((new_width, new_height), Image.NEAREST)
-                self.tk_mask_image = ImageTk.PhotoImage(resized_mask)
-                self.canvas.create_image(x_offset, y_offset, anchor="nw", image=self.tk_mask_image, tags="mask_overlay")
+            self.tk_mask_image = self._draw_mask(self.refined_mask, [0, 0, 255, 200], "mask_overlay")
 
         # Draw removed mask in red
         if self.removed_mask is not None and self.show_removed_mask:
-            zoom_level = self.transform_service.zoom_level
-            x_offset = self.transform_service.x_offset
-            y_offset = self.transform_service.y_offset
-            new_width = int(self.image.width * zoom_level)
-            new_height = int(self.image.height * zoom_level)
-
-            if new_width > 0 and new_height > 0:
-                removed_overlay = np.zeros((self.removed_mask.shape[0], self.removed_mask.shape[1], 4), dtype=np.uint8)
-                removed_overlay[self.removed_mask > 0] = [255, 0, 0, 150]  # Red with transparency
-                removed_pil = Image.fromarray(removed_overlay)
-                resized_removed = removed_pil.resize((new_width, new_height), Image.NEAREST)
-                self.tk_removed_mask_image = ImageTk.PhotoImage(resized_removed)
-                self.canvas.create_image(x_offset, y_offset, anchor="nw", image=self.tk_removed_mask_image, tags="removed_mask_overlay")
+            self.tk_removed_mask_image = self._draw_mask(self.removed_mask, [255, 0, 0, 150], "removed_mask_overlay")  # Red with transparency
 
     def redraw_all(self, regions=None, selected_indices=None, hide_indices=None, fast_mode=False, view_mode='normal', raw_mask=None, original_size=None, hyphenate: bool = True, line_spacing: float = None, disable_font_border: bool = False):
         self.canvas.delete("all")
@@ -151,51 +198,20 @@ class CanvasRenderer:
         
         if new_width <= 0 or new_height <= 0: return
 
-        # 使用缓存的调整尺寸图像
-        cache_key = f"main_{new_width}x{new_height}"
-        current_dimensions = (new_width, new_height)
-        
-        # 检查是否需要重新生成缓存的图像
-        if (cache_key not in self._resized_image_cache or 
-            self._last_zoom_level != zoom_level or 
-            self._last_dimensions != current_dimensions):
-            
-            # 生成新的调整尺寸图像
-            resized_image = self.image.resize((new_width, new_height), Image.LANCZOS)
-            self.tk_image = ImageTk.PhotoImage(resized_image)
-            self._resized_image_cache[cache_key] = self.tk_image
-            
-            # 更新缓存状态
-            self._last_zoom_level = zoom_level
-            self._last_dimensions = current_dimensions
-            
-            # 限制缓存大小
-            if len(self._resized_image_cache) > 5:
-                # 移除最旧的缓存项
-                oldest_key = next(iter(self._resized_image_cache))
-                del self._resized_image_cache[oldest_key]
-        else:
-            # 使用缓存的图像
-            self.tk_image = self._resized_image_cache[cache_key]
+        # 只绘制视口内的瓦片，开销与图像总像素数无关
+        view_rect = self._visible_image_rect()
+        photos: Dict[str, ImageTk.PhotoImage] = {}
+        if self._pyramid is None:
+            self._pyramid = TilePyramid(self.image)
+        self._draw_tiles(self._pyramid, view_rect, "base_image", photos)
 
-        self.canvas.create_image(x_offset, y_offset, anchor="nw", image=self.tk_image)
+        # Draw inpainted image if available and alpha > 0
+        if self._inpainted_pyramid and self.inpainted_alpha > 0:
+            self._draw_tiles(self._inpainted_pyramid, view_rect, "inpainted_image", photos,
+                             alpha=self.inpainted_alpha)
 
-        # Draw inpainted image if available and alpha > 0 (优化类似)
-        if self.inpainted_image and self.inpainted_alpha > 0:
-            inpaint_cache_key = f"inpaint_{new_width}x{new_height}_{self.inpainted_alpha}"
-            
-            if inpaint_cache_key not in self._resized_image_cache:
-                # 调整修复图像大小
-                resized_inpainted = self.inpainted_image.resize((new_width, new_height), Image.LANCZOS)
-                # 创建透明版本
-                alpha_img = resized_inpainted.copy()
-                alpha_img.putalpha(int(self.inpainted_alpha * 255))
-                self.tk_inpainted_image = ImageTk.PhotoImage(alpha_img)
-                self._resized_image_cache[inpaint_cache_key] = self.tk_inpainted_image
-            else:
-                self.tk_inpainted_image = self._resized_image_cache[inpaint_cache_key]
-            
-            self.canvas.create_image(x_offset, y_offset, anchor="nw", image=self.tk_inpainted_image)
+        # 只保留本次绘制用到的PhotoImage，平移时可直接复用
+        self._tile_photos = photos
 
         if view_mode == 'mask':
             # Only redraw the full mask overlay when the zoom action is finished (not in fast_mode)
@@ -216,7 +232,11 @@ class CanvasRenderer:
                     disable_font_border=disable_font_border
                 )
 
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        # 滚动区域始终覆盖整张图像，而不仅是已绘制的瓦片
+        image_rect = (x_offset, y_offset, x_offset + new_width, y_offset + new_height)
+        bbox = self.canvas.bbox("all") or image_rect
+        self.canvas.config(scrollregion=(min(bbox[0], image_rect[0]), min(bbox[1], image_rect[1]),
+                                         max(bbox[2], image_rect[2]), max(bbox[3], image_rect[3])))
 
     def recalculate_render_data(self, regions: List[Dict[str, Any]], render_config: Dict[str, Any] = None):
         """Performs the expensive calculation and caches the result."""
@@ -0,0 +1,113 @@
+"""
+图像瓦片金字塔
+在后台按2的幂次预先生成逐级缩小的图像，绘制时只取当前视口可见的瓦片，
+从最接近当前缩放的层级重采样，使缩放和平移的开销与图像总像素数无关。
+重采样后的瓦片缓存在 performance_optimizer.ImageCache 中，受其内存上限约束。
+"""
+import itertools
+import logging
+import math
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from services.performance_optimizer import ImageCache, get_performance_optimizer
+
+_pyramid_ids = itertools.count(1)
+
+
+class TilePyramid:
+    """
+    图像金字塔
+
+    - levels[0] 为原图，levels[n] 为缩小 2^n 倍的图像，直到长边不超过一个瓦片
+    - 缩放为 zoom 时选取分辨率不低于显示分辨率的最粗层级，每个瓦片最多缩小一半
+    - 后台尚未生成的层级会回退到已生成的更精细层级
+    """
+
+    def __init__(self, image: Image.Image, tile_size: int = 512, cache: Optional[ImageCache] = None,
+                 build_async: bool = True):
+        self.logger = logging.getLogger(__name__)
+        self.tile_size = tile_size
+        optimizer = get_performance_optimizer()
+        self.cache = cache or optimizer.image_cache
+        self.key = f"tile_pyramid_{next(_pyramid_ids)}/"
+        self._closed = False
+
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        image.load()
+        self.levels: List[Image.Image] = [image]
+
+        if build_async:
+            optimizer.thread_pool.submit(self._build_levels)
+        else:
+            self._build_levels()
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.levels[0].size
+
+    def _build_levels(self):
+        """逐级生成缩小图像（在线程池中运行）"""
+        try:
+            level = self.levels[-1]
+            while max(level.size) > self.tile_size and not self._closed:
+                level = level.reduce(2)
+                self.levels.append(level)
+            self.logger.debug(f"图像金字塔 {self.key} 生成完成，共 {len(self.levels)} 层")
+        except Exception as e:
+            self.logger.error(f"生成图像金字塔失败: {e}")
+
+    def level_for(self, zoom: float) -> int:
+        """返回缩放 zoom 时使用的层级"""
+        if zoom >= 1:
+            return 0
+        return max(0, min(int(math.floor(math.log2(1 / zoom))), len(self.levels) - 1))
+
+    def visible_tiles(self, zoom: float, view_rect: Tuple[float, float, float, float],
+                      resample=Image.LANCZOS) -> Iterator[Tuple[str, int, int, Image.Image]]:
+        """
+        生成与 view_rect（原图坐标）相交的瓦片，已重采样为屏幕尺寸。
+
+        Yields:
+            (缓存键, 相对图像原点的屏幕x, 屏幕y, 瓦片图像)
+        """
+        n = self.level_for(zoom)
+        level = self.levels[n]
+        scale = 2 ** n
+        factor = zoom * scale  # 层级图像中每个像素对应的屏幕像素
+        if factor <= 0:
+            return
+        # 放大显示时缩小源瓦片，使输出瓦片仍约为 tile_size 大小
+        step = self.tile_size if factor <= 1 else max(8, int(math.ceil(self.tile_size / factor)))
+        level_w, level_h = level.size
+
+        vx0, vy0, vx1, vy1 = view_rect
+        tx0 = max(0, int(vx0 / scale) // step)
+        ty0 = max(0, int(vy0 / scale) // step)
+        tx1 = min(math.ceil(level_w / step), int(math.ceil(vx1 / scale)) // step + 1)
+        ty1 = min(math.ceil(level_h / step), int(math.ceil(vy1 / scale)) // step + 1)
+
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                # 屏幕边界取整后再反推源区域，相邻瓦片之间没有缝隙
+                sx0, sy0 = round(tx * step * factor), round(ty * step * factor)
+                sx1 = round(min((tx + 1) * step, level_w) * factor)
+                sy1 = round(min((ty + 1) * step, level_h) * factor)
+                if sx1 <= sx0 or sy1 <= sy0:
+                    continue
+
+                cache_key = f"{self.key}L{n}/{step}/{tx}_{ty}@{factor:.6f}"
+                tile = self.cache.get_image(cache_key)
+                if tile is None:
+                    box = (sx0 / factor, sy0 / factor, min(sx1 / factor, level_w), min(sy1 / factor, level_h))
+                    tile = level.resize((sx1 - sx0, sy1 - sy0), resample, box=box)
+                    self.cache.put_image(cache_key, tile)
+                yield cache_key, sx0, sy0, tile
+
+    def close(self):
+        """停止后台生成并释放缓存中的瓦片"""
+        self._closed = True
+        self.cache.remove_prefix(self.key)
@@ -55,7 +55,7 @@ class EditorFrame(ctk.CTkFrame):
         self.removed_mask: Optional[np.ndarray] = None  # 存储被优化掉的原始蒙版区域
         self.mask_edit_mode: str = "不选择"
         self.mask_brush_size: int = 20
-        self.mask_edit_start_state: Optional[np.ndarray] = None
+        self.mask_edit_active = False
         self.is_mask_edit_expanded: bool = True
         
         self.history_manager = EditorStateManager()
@@ -226,9 +226,7 @@ class EditorFrame(ctk.CTkFrame):
 
     def _apply_action(self, action: Any, is_undo: bool):
         if isinstance(action, GroupedAction):
-            actions = action.actions
-            if is_undo:
-                actions.reverse()
+            actions = reversed(action.actions) if is_undo else action.actions
             for sub_action in actions:
                 self._apply_single_action(sub_action, is_undo)
         else:
@@ -237,23 +235,22 @@ class EditorFrame(ctk.CTkFrame):
         self._on_region_selected([])
 
     def _apply_single_action(self, action: Any, is_undo: bool):
-        data_to_use = action.old_data if is_undo else action.new_data
         if action.action_type == ActionType.ADD:
             if is_undo:
                 self.regions_data.pop(action.region_index)
             else:
-                self.regions_data.insert(action.region_index, data_to_use)
+                self.regions_data.insert(action.region_index, action.resolve(None, is_undo))
         elif action.action_type == ActionType.DELETE:
             if is_undo:
-                self.regions_data.insert(action.region_index, data_to_use)
+                self.regions_data.insert(action.region_index, action.resolve(None, is_undo))
             else:
                 self.regions_data.pop(action.region_index)
         elif action.action_type == ActionType.EDIT_MASK:
-            # Use a deepcopy to prevent modifying the history state directly
-            self.refined_mask = copy.deepcopy(data_to_use)
+            # 蒙版补丁直接写回当前蒙版
+            self.refined_mask = action.resolve(self.refined_mask, is_undo)
             self.canvas_frame.set_refined_mask(self.refined_mask)
         else:
-            self.regions_data[action.region_index] = data_to_use
+            self.regions_data[action.region_index] = action.resolve(self.regions_data[action.region_index], is_undo)
 
     def _update_history_buttons(self):
         can_undo = self.history_manager.can_undo()
@@ -376,7 +373,7 @@ class EditorFrame(ctk.CTkFrame):
         self.refined_mask = None
         self.inpainted_image = None
         self.inpainting_in_progress = False
-        self.mask_edit_start_state = None
+        self.mask_edit_active = False
         
         # 清理历史记录（新文件应该有新的历史记录）
         if hasattr(self, 'history_manager'):
@@ -877,24 +874,31 @@ class EditorFrame(ctk.CTkFrame):
             show_toast(self, f"更新蒙版失败: {e}", level="error")
 
     def _on_mask_edit_start(self):
-        if self.refined_mask is not None:
-            self.mask_edit_start_state = self.refined_mask.copy()
+        self.mask_edit_active = self.refined_mask is not None
 
     def _on_mask_edit_end(self, points: List[Tuple[int, int]]):
-        if self.refined_mask is not None and self.mask_edit_start_state is not None:
+        if self.refined_mask is not None and self.mask_edit_active and points:
             # Calculate the brush size in image space by accounting for zoom
             # Use int() instead of int(round()) to make the line slightly thinner to compensate for anti-aliasing perception.
             brush_thickness = int(self.mask_brush_size / self.transform_service.zoom_level)
             brush_thickness = max(1, brush_thickness) # Ensure thickness is at least 1
 
+            # 笔画只会影响其包围盒（含笔刷半径和抗锯齿边缘），历史记录只保存这一块
+            pts = np.array(points, dtype=np.int64).reshape(-1, 2)
+            pad = brush_thickness // 2 + 2
+            height, width = self.refined_mask.shape[:2]
+            x0, y0 = max(0, int(pts[:, 0].min()) - pad), max(0, int(pts[:, 1].min()) - pad)
+            x1, y1 = min(width, int(pts[:, 0].max()) + pad + 1), min(height, int(pts[:, 1].max()) + pad + 1)
+            old_patch = self.refined_mask[y0:y1, x0:x1].copy()
+
             for i in range(len(points) - 1):
                 p1 = (int(points[i][0]), int(points[i][1]))
                 p2 = (int(points[i+1][0]), int(points[i+1][1]))
                 color = 255 if self.mask_edit_mode == "画笔" else 0
                 cv2.line(self.refined_mask, p1, p2, color, brush_thickness, cv2.LINE_AA)
             
-            self.history_manager.save_state(ActionType.EDIT_MASK, 0, self.mask_edit_start_state, self.refined_mask.copy(), description="Mask Edit")
-            self.mask_edit_start_state = None
+            self.history_manager.save_mask_patch(old_patch, self.refined_mask, (x0, y0), description="Mask Edit")
+            self.mask_edit_active = False
             self.canvas_frame.set_refined_mask(self.refined_mask)
             self._update_history_buttons()
 
@@ -1,13 +1,19 @@
 """
 编辑器历史管理器
 支持撤销/重做操作，管理编辑器状态历史
+区域修改保存为结构化差异，蒙版修改保存为压缩的脏矩形补丁，每步的内存开销与改动大小成正比
 """
 import copy
+import sys
+import zlib
+import pickle
 import logging
-from typing import List, Any, Optional, Dict
+from typing import List, Any, Optional, Dict, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
+import numpy as np
+
 class ActionType(Enum):
     """操作类型"""
     MOVE = "move"
@@ -20,15 +26,173 @@ class ActionType(Enum):
     EDIT_MASK = "edit_mask"
     GROUP = "group" # New action type for grouped actions
 
+# 键在修改前或修改后不存在
+_MISSING = object()
+
+def _values_equal(a: Any, b: Any) -> bool:
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape and np.array_equal(a, b)
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+def _copy_value(value: Any) -> Any:
+    return value if value is _MISSING else copy.deepcopy(value)
+
+def _estimate_size(obj: Any) -> int:
+    """估算对象占用的内存（字节）"""
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
+
+class RegionDiff:
+    """区域字典的结构化差异，只保存发生变化的键在修改前后的值"""
+
+    def __init__(self, changes: Dict[str, Tuple[Any, Any]]):
+        self.changes = changes
+        self.size_bytes = _estimate_size({
+            key: tuple(None if v is _MISSING else v for v in pair) for key, pair in changes.items()
+        })
+
+    @classmethod
+    def compute(cls, old: Dict[str, Any], new: Dict[str, Any]) -> 'RegionDiff':
+        changes = {}
+        for key in old.keys() | new.keys():
+            old_value = old.get(key, _MISSING)
+            new_value = new.get(key, _MISSING)
+            if old_value is _MISSING or new_value is _MISSING or not _values_equal(old_value, new_value):
+                changes[key] = (_copy_value(old_value), _copy_value(new_value))
+        return cls(changes)
+
+    def is_empty(self) -> bool:
+        return not self.changes
+
+    def apply(self, region: Dict[str, Any], is_undo: bool) -> Dict[str, Any]:
+        """基于当前区域数据重建撤销/重做后的区域"""
+        result = dict(region)
+        for key, (old_value, new_value) in self.changes.items():
+            value = old_value if is_undo else new_value
+            if value is _MISSING:
+                result.pop(key, None)
+            else:
+                result[key] = _copy_value(value)
+        return result
+
+    def merge(self, later: 'RegionDiff') -> 'RegionDiff':
+        """合并紧接在本差异之后的另一个差异"""
+        changes = dict(self.changes)
+        for key, (old_value, new_value) in later.changes.items():
+            if key in changes:
+                old_value = changes[key][0]
+            if old_value is not _MISSING and new_value is not _MISSING and _values_equal(old_value, new_value):
+                changes.pop(key, None)
+            else:
+                changes[key] = (old_value, new_value)
+        return RegionDiff(changes)
+
+class MaskPatch:
+    """
+    蒙版的脏矩形补丁
+    每个矩形压缩保存变化区域修改前后的像素，合并连续笔画时追加矩形
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype: np.dtype, rects: List[Tuple[Tuple[int, int, int, int], bytes, bytes]]):
+        self.shape = shape
+        self.dtype = dtype
+        self.rects = rects
+        self.size_bytes = sum(len(old) + len(new) for _, old, new in rects)
+
+    @staticmethod
+    def _compress(array: np.ndarray) -> bytes:
+        return zlib.compress(np.ascontiguousarray(array).tobytes(), 1)
+
+    def _decompress(self, data: bytes, bbox: Tuple[int, int, int, int]) -> np.ndarray:
+        x0, y0, x1, y1 = bbox
+        return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape((y1 - y0, x1 - x0) + tuple(self.shape[2:]))
+
+    @classmethod
+    def from_crop(cls, old_crop: np.ndarray, new_mask: np.ndarray, origin: Tuple[int, int]) -> Optional['MaskPatch']:
+        """由修改前的局部像素和修改后的完整蒙版生成补丁，无变化时返回None"""
+        x, y = origin
+        new_crop = new_mask[y:y + old_crop.shape[0], x:x + old_crop.shape[1]]
+        if old_crop.size == 0 or old_crop.shape != new_crop.shape:
+            return None
+        changed = old_crop != new_crop
+        if changed.ndim > 2:
+            changed = changed.any(axis=tuple(range(2, changed.ndim)))
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(changed.any(axis=0))
+        # 收缩到实际变化的像素范围
+        cy0, cy1, cx0, cx1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        bbox = (x + int(cx0), y + int(cy0), x + int(cx1), y + int(cy1))
+        return cls(new_mask.shape, new_mask.dtype, [(
+            bbox, cls._compress(old_crop[cy0:cy1, cx0:cx1]), cls._compress(new_crop[cy0:cy1, cx0:cx1])
+        )])
+
+    def apply(self, mask: np.ndarray, is_undo: bool) -> np.ndarray:
+        """在当前蒙版上原地写回补丁"""
+        rects = reversed(self.rects) if is_undo else self.rects
+        for bbox, old, new in rects:
+            x0, y0, x1, y1 = bbox
+            mask[y0:y1, x0:x1] = self._decompress(old if is_undo else new, bbox)
+        return mask
+
+    def merge(self, later: 'MaskPatch') -> 'MaskPatch':
+        return MaskPatch(self.shape, self.dtype, self.rects + later.rects)
+
+class MaskSnapshot:
+    """蒙版被整体替换（或尺寸改变）时的压缩快照"""
+
+    def __init__(self, old_mask: Optional[np.ndarray], new_mask: Optional[np.ndarray]):
+        self.old = self._pack(old_mask)
+        self.new = self._pack(new_mask)
+        self.size_bytes = sum(len(packed[0]) for packed in (self.old, self.new) if packed)
+
+    @staticmethod
+    def _pack(mask: Optional[np.ndarray]):
+        if mask is None:
+            return None
+        return MaskPatch._compress(mask), mask.shape, mask.dtype
+
+    def apply(self, mask: Optional[np.ndarray], is_undo: bool) -> Optional[np.ndarray]:
+        packed = self.old if is_undo else self.new
+        if packed is None:
+            return None
+        data, shape, dtype = packed
+        return np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape).copy()
+
+def diff_masks(old_mask: Optional[np.ndarray], new_mask: Optional[np.ndarray]):
+    """返回两个蒙版之间的补丁，尺寸一致时只保存变化的矩形区域，无变化时返回None"""
+    if old_mask is None or new_mask is None or old_mask.shape != new_mask.shape or old_mask.dtype != new_mask.dtype:
+        if old_mask is None and new_mask is None:
+            return None
+        return MaskSnapshot(old_mask, new_mask)
+    return MaskPatch.from_crop(old_mask, new_mask, (0, 0))
+
 @dataclass
 class EditorAction:
-    """编辑器操作"""
+    """
+    编辑器操作
+    区域修改和蒙版修改保存为差异（diff），添加/删除区域保存完整数据（old_data/new_data）
+    """
     action_type: ActionType
     region_index: Optional[int] # Can be None for grouped actions
     old_data: Any
     new_data: Any
     timestamp: float = field(default_factory=lambda: __import__('time').time())
     description: str = ""
+    diff: Any = None
+    size_bytes: int = 0
+
+    def resolve(self, current: Any, is_undo: bool) -> Any:
+        """返回撤销/重做后的数据，差异基于当前数据重建"""
+        if self.diff is not None:
+            return self.diff.apply(current, is_undo)
+        return copy.deepcopy(self.old_data if is_undo else self.new_data)
 
 @dataclass
 class GroupedAction(EditorAction):
@@ -40,14 +204,24 @@ class GroupedAction(EditorAction):
     new_data: Any = None
 
 class EditorHistory:
-    """编辑器历史管理器"""
-    
-    def __init__(self, max_history: int = 50):
-        self.max_history = max_history
+    """
+    编辑器历史管理器
+    按内存预算而非条数限制历史，超出预算时丢弃最早的操作。
+    短时间内连续的同类蒙版笔画和文本/样式修改会合并为一步。
+    """
+
+    # 可以合并的操作类型
+    COALESCE_TYPES = (ActionType.EDIT_MASK, ActionType.MODIFY_TEXT, ActionType.MODIFY_STYLE)
+
+    def __init__(self, max_memory_mb: float = 256, coalesce_window: float = 1.0):
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.coalesce_window = coalesce_window
         self.history: List[EditorAction] = []
         self.current_index = -1
+        self.memory_usage = 0
         self.grouping = False
         self.grouped_actions: List[EditorAction] = []
+        self._last_added: Optional[EditorAction] = None
         self.logger = logging.getLogger(__name__)
 
     def start_action_group(self):
@@ -57,7 +231,8 @@ class EditorHistory:
 
     def end_action_group(self, description: str = "Batch Operation"):
         if self.grouping and self.grouped_actions:
-            group = GroupedAction(description=description, actions=self.grouped_actions)
+            group = GroupedAction(description=description, actions=self.grouped_actions,
+                                  size_bytes=sum(action.size_bytes for action in self.grouped_actions))
             self.grouping = False
             self.grouped_actions = []
             self._add_action_to_history(group)
@@ -70,18 +245,46 @@ class EditorHistory:
         else:
             self._add_action_to_history(action)
 
+    def _try_coalesce(self, action: EditorAction) -> bool:
+        """将操作合并到紧邻的上一步中（上一步之后没有撤销/重做）"""
+        if not self.history or self.history[-1] is not self._last_added:
+            return False
+        last = self.history[-1]
+        if (action.action_type not in self.COALESCE_TYPES or last.action_type != action.action_type
+                or last.region_index != action.region_index or last.description != action.description
+                or action.timestamp - last.timestamp > self.coalesce_window
+                or last.diff is None or action.diff is None or type(last.diff) is not type(action.diff)
+                or not hasattr(last.diff, 'merge')):
+            return False
+
+        last.diff = last.diff.merge(action.diff)
+        self.memory_usage -= last.size_bytes
+        last.size_bytes = last.diff.size_bytes
+        self.memory_usage += last.size_bytes
+        last.timestamp = action.timestamp
+        return True
+
     def _add_action_to_history(self, action: EditorAction):
         if self.current_index < len(self.history) - 1:
+            for dropped in self.history[self.current_index + 1:]:
+                self.memory_usage -= dropped.size_bytes
             self.history = self.history[:self.current_index + 1]
-        
-        self.history.append(action)
-        self.current_index += 1
-        
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
+
+        if self._try_coalesce(action):
+            self.logger.debug(f"Coalesced action: {action.action_type.value} - {action.description}")
+        else:
+            self.history.append(action)
+            self.current_index += 1
+            self.memory_usage += action.size_bytes
+            self._last_added = action
+
+        while self.memory_usage > self.max_memory_bytes and len(self.history) > 1:
+            dropped = self.history.pop(0)
+            self.memory_usage -= dropped.size_bytes
             self.current_index -= 1
         
-        self.logger.debug(f"Added action: {action.action_type.value} - {action.description}")
+        self.logger.debug(f"Added action: {action.action_type.value} - {action.description}, "
+                          f"{len(self.history)} steps using {self.memory_usage / (1024 * 1024):.1f}MB")
     
     def can_undo(self) -> bool:
         return self.current_index >= 0
@@ -93,6 +296,7 @@ class EditorHistory:
         if not self.can_undo(): return None
         action = self.history[self.current_index]
         self.current_index -= 1
+        self._last_added = None
         self.logger.debug(f"Undoing action: {action.action_type.value}")
         return action
     
@@ -100,12 +304,15 @@ class EditorHistory:
         if not self.can_redo(): return None
         self.current_index += 1
         action = self.history[self.current_index]
+        self._last_added = None
         self.logger.debug(f"Redoing action: {action.action_type.value}")
         return action
 
     def clear(self):
         self.history.clear()
         self.current_index = -1
+        self.memory_usage = 0
+        self._last_added = None
         self.logger.debug("Cleared edit history")
 
 class EditorStateManager:
@@ -118,12 +325,53 @@ class EditorStateManager:
         
     def save_state(self, action_type: ActionType, region_index: int, 
                    old_data: Any, new_data: Any, description: str = ""):
+        """记录一次操作。修改前后数据相同时不记录"""
+        if action_type == ActionType.EDIT_MASK:
+            diff = diff_masks(old_data, new_data)
+            if diff is None:
+                return
+            self._add_diff_action(action_type, region_index, diff, description)
+        elif isinstance(old_data, dict) and isinstance(new_data, dict):
+            diff = RegionDiff.compute(old_data, new_data)
+            if diff.is_empty():
+                return
+            self._add_diff_action(action_type, region_index, diff, description)
+        else:
+            old_data = copy.deepcopy(old_data)
+            new_data = copy.deepcopy(new_data)
+            action = EditorAction(
+                action_type=action_type,
+                region_index=region_index,
+                old_data=old_data,
+                new_data=new_data,
+                description=description,
+                size_bytes=_estimate_size(old_data) + _estimate_size(new_data)
+            )
+            self.history.add_action(action)
+
+    def save_mask_patch(self, old_crop: np.ndarray, new_mask: np.ndarray, origin: Tuple[int, int],
+                        description: str = ""):
+        """
+        记录一次局部蒙版修改，无需复制整张蒙版
+
+        Args:
+            old_crop: 修改前 origin 处的蒙版局部像素
+            new_mask: 修改后的完整蒙版
+            origin: old_crop 左上角在蒙版中的坐标 (x, y)
+        """
+        patch = MaskPatch.from_crop(old_crop, new_mask, origin)
+        if patch is not None:
+            self._add_diff_action(ActionType.EDIT_MASK, 0, patch, description)
+
+    def _add_diff_action(self, action_type: ActionType, region_index: int, diff: Any, description: str):
         action = EditorAction(
             action_type=action_type,
             region_index=region_index,
-            old_data=copy.deepcopy(old_data),
-            new_data=copy.deepcopy(new_data),
-            description=description
+            old_data=None,
+            new_data=None,
+            description=description,
+            diff=diff,
+            size_bytes=diff.size_bytes
         )
         self.history.add_action(action)
 
@@ -2,13 +2,11 @@
 # -*- coding: utf-8 -*-
 """
 导出服务
-负责将编辑器中的内容导出为后端渲染的图片
+负责将编辑器中的内容导出为后端渲染的图片，渲染由常驻渲染服务完成
 """
 
 import os
 import json
-import asyncio
-import tempfile
 import threading
 from typing import Dict, Any, List, Optional
 from PIL import Image
@@ -16,6 +14,7 @@ import logging
 import numpy as np
 
 from utils.json_encoder import CustomJSONEncoder
+from services.render_service import get_render_service
 
 
 class ExportService:
@@ -129,51 +128,27 @@ class ExportService:
         """在后台线程中执行后端渲染导出"""
         try:
             if progress_callback:
-                progress_callback("准备导出环境...")
-            
-            # 创建临时目录
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 保存当前图片到临时文件
-                temp_image_path = os.path.join(temp_dir, "temp_image.png")
-                image.save(temp_image_path)
-                
-                # 保存区域数据到JSON文件，使用load_text模式期望的文件名格式
-                base_name = os.path.splitext(os.path.basename(temp_image_path))[0]
-                regions_json_path = os.path.join(temp_dir, f"{base_name}_translations.json")
-                self._save_regions_data(regions_data, regions_json_path, mask)
-                
-                if progress_callback:
-                    progress_callback("初始化翻译引擎...")
-                
-                # 准备翻译器参数
-                translator_params = self._prepare_translator_params(config)
-                
-                # 创建翻译器实例并执行渲染
-                result_image = self._execute_backend_render(
-                    temp_image_path, regions_json_path, translator_params, config, progress_callback
-                )
-                
-                if result_image:
-                    # Handle RGBA to RGB conversion for JPEG
-                    if output_path.lower().endswith(('.jpg', '.jpeg')):
-                        self.logger.info("Output is JPEG, converting from RGBA to RGB...")
-                        if result_image.mode == 'RGBA':
-                            # Create a white background and paste the image onto it
-                            background = Image.new('RGB', result_image.size, (255, 255, 255))
-                            background.paste(result_image, mask=result_image.split()[3])  # 3 is the alpha channel
-                            result_image = background
-                            
-                    # 保存结果图片
-                    result_image.save(output_path)
-                    
-                    if success_callback:
-                        success_callback(f"图片已导出到: {output_path}")
-                    
-                    self.logger.info(f"图片已成功导出到: {output_path}")
-                else:
-                    if error_callback:
-                        error_callback("导出失败: 没有生成结果图片")
-                    
+                progress_callback("执行后端渲染...")
+
+            # 区域数据和蒙版直接在内存中交给常驻渲染服务，不再经过临时文件
+            regions = self.normalize_regions(regions_data)
+            translator_params = self._prepare_translator_params(config)
+            render_service = get_render_service()
+            result_image = render_service.submit(
+                render_service.render(image, regions, config, translator_params, mask)
+            ).result()
+
+            if result_image:
+                self.save_result_image(result_image, output_path)
+
+                if success_callback:
+                    success_callback(f"图片已导出到: {output_path}")
+
+                self.logger.info(f"图片已成功导出到: {output_path}")
+            else:
+                if error_callback:
+                    error_callback("导出失败: 没有生成结果图片")
+
         except Exception as e:
             self.logger.error(f"后端渲染导出失败: {e}")
             import traceback
@@ -181,10 +156,18 @@ class ExportService:
             
             if error_callback:
                 error_callback(f"后端渲染导出失败: {e}")
-    
-    def _save_regions_data(self, regions_data: List[Dict[str, Any]], json_path: str, mask: Optional[np.ndarray] = None):
-        """保存区域数据到JSON文件，确保格式与TextBlock兼容"""
-        # 准备保存数据，确保数据格式正确
+
+    def save_result_image(self, result_image: Image.Image, output_path: str):
+        """保存渲染结果，JPEG格式时将RGBA合成到白色背景上"""
+        if output_path.lower().endswith(('.jpg', '.jpeg')) and result_image.mode == 'RGBA':
+            self.logger.info("Output is JPEG, converting from RGBA to RGB...")
+            background = Image.new('RGB', result_image.size, (255, 255, 255))
+            background.paste(result_image, mask=result_image.split()[3])  # 3 is the alpha channel
+            result_image = background
+        result_image.save(output_path)
+
+    def normalize_regions(self, regions_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """规范化区域数据，确保格式与TextBlock兼容，跳过无效区域"""
         save_data = []
         for region in regions_data:
             region_copy = region.copy()
@@ -253,7 +236,12 @@ class ExportService:
                 region_copy['target_lang'] = 'CHS'  # 默认目标语言
             
             save_data.append(region_copy)
-        
+        return save_data
+
+    def _save_regions_data(self, regions_data: List[Dict[str, Any]], json_path: str, mask: Optional[np.ndarray] = None):
+        """保存区域数据到JSON文件，确保格式与TextBlock兼容"""
+        save_data = self.normalize_regions(regions_data)
+
         # load_text模式期望的格式：字典，键为图片路径，值为包含regions的字典
         # 使用临时图片路径作为键
         image_key = os.path.splitext(os.path.basename(json_path.replace('_translations.json', '')))[0]
@@ -305,71 +293,13 @@ class ExportService:
         # 设置其他参数
         translator_params.update(config)
         translator_params['is_ui_mode'] = True
-        translator_params['load_text'] = True  # 关键：启用加载文本模式
         translator_params['save_text'] = False  # 不保存文本
         
-        # 关键：设置翻译器为none，跳过翻译步骤，直接渲染
+        # 设置翻译器为none，跳过翻译步骤，直接渲染
         translator_params['translator'] = 'none'
-        self.logger.info("设置翻译器为none，启用load_text模式，跳过翻译步骤，直接进行渲染")
         
         return translator_params
     
-    def _execute_backend_render(self, image_path: str, regions_json_path: str, 
-                              translator_params: Dict[str, Any], config: Dict[str, Any],
-                              progress_callback: Optional[callable] = None) -> Optional[Image.Image]:
-        """执行后端渲染"""
-        try:
-            from manga_translator.manga_translator import MangaTranslator
-            from manga_translator.config import Config, RenderConfig
-            
-            if progress_callback:
-                progress_callback("创建翻译器实例...")
-            
-            # 创建翻译器实例
-            translator = MangaTranslator(params=translator_params)
-            
-            if progress_callback:
-                progress_callback("加载图片和配置...")
-            
-            # 加载图片
-            image = Image.open(image_path)
-            image.name = image_path  # 确保图片名称正确，用于load_text模式查找翻译文件
-            
-            # 创建配置对象
-            render_config = config.get('render', {})
-            render_cfg = RenderConfig(**render_config)
-            
-            # 创建翻译器配置，设置为none以跳过翻译
-            from manga_translator.config import TranslatorConfig
-            translator_cfg = TranslatorConfig(translator='none')
-            
-            cfg = Config(render=render_cfg, translator=translator_cfg)
-            
-            if progress_callback:
-                progress_callback("执行后端渲染...")
-            
-            # 执行翻译（实际是渲染）
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                ctx = loop.run_until_complete(translator.translate(image, cfg, image_name=image.name))
-                
-                if ctx.result is not None:
-                    # ctx.result is already a PIL Image object, no conversion needed.
-                    result_image = ctx.result
-                    return result_image
-                else:
-                    self.logger.error("后端渲染没有生成结果")
-                    return None
-                    
-            finally:
-                loop.close()
-                
-        except Exception as e:
-            self.logger.error(f"执行后端渲染时出错: {e}")
-            raise
-    
     def export_regions_json(self, regions_data: List[Dict[str, Any]], output_path: str) -> bool:
         """导出区域数据为JSON文件"""
         try:
@@ -1,16 +1,21 @@
 """
 轻量级擦除算法接口
 为实时预览优化的图像修复算法实现，适配后端的多种inpainter算法
+
+同一张图像的连续预览是增量的：图像以版本标识而非像素哈希识别，
+每次只重新修复蒙版变化涉及的脏矩形并合成到上一次的结果上，新的请求会取消同一图像上仍在进行的旧请求。
 """
 import asyncio
 import logging
 import numpy as np
 import cv2
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, List, Hashable
 from dataclasses import dataclass
 from enum import Enum
+from collections import OrderedDict
 import threading
 import time
+import weakref
 from concurrent.futures import ThreadPoolExecutor
 
 from .erase_config_service import InpainterType, EraseConfigService, get_erase_config_service
@@ -33,16 +38,45 @@ class PreviewResult:
         self.cached = cached
         self.timestamp = time.time()
 
+class PreviewCancelledError(Exception):
+    """预览请求被同一图像上更新的请求取代"""
+
+class _PreviewSession:
+    """一张图像在某个算法/配置下的增量预览状态"""
+
+    def __init__(self, image: np.ndarray, preview_image: np.ndarray, scale: float):
+        self.image_ref = weakref.ref(image)
+        self.preview_image = preview_image
+        self.scale = scale
+        self.preview_mask: Optional[np.ndarray] = None
+        self.preview_result: Optional[np.ndarray] = None
+        self.full_result: Optional[np.ndarray] = None
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.preview_image, self.preview_mask, self.preview_result, self.full_result)
+        return sum(a.nbytes for a in arrays if a is not None)
+
 class LightweightInpainter:
     """轻量级图像修复器"""
+
+    # 脏矩形向外扩展的像素数（预览分辨率下）：写回范围覆盖模糊/膨胀的影响半径，
+    # 处理时再多取一圈上下文，保证写回区域与整图处理的结果一致
+    DIRTY_MARGIN = 10
+    CONTEXT_MARGIN = 10
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.config_service = get_erase_config_service()
         
-        # 预览缓存
-        self.preview_cache: Dict[str, PreviewResult] = {}
-        self.cache_max_size = 10
+        # 预览会话缓存，每个会话保存一张图像的预览分辨率副本、上次的蒙版和结果
+        self.preview_cache: "OrderedDict[tuple, _PreviewSession]" = OrderedDict()
+        self.cache_max_size = 4
+        self._cache_lock = threading.Lock()
+        # 每个会话最新请求的序号，用于取消过期的请求
+        self._latest_requests: Dict[tuple, int] = {}
+        self._request_counter = 0
         
         # 线程池用于异步处理
         self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preview")
@@ -59,14 +93,48 @@ class LightweightInpainter:
         
         self.logger.info("轻量级擦除算法接口初始化完成")
     
-    def _generate_cache_key(self, image: np.ndarray, mask: np.ndarray, 
-                          algorithm: InpainterType, config: PreviewConfig) -> str:
-        """生成缓存键"""
-        # 使用图像和蒙版的哈希值作为缓存键
-        img_hash = hash(image.tobytes())
-        mask_hash = hash(mask.tobytes())
-        return f"{algorithm.value}_{img_hash}_{mask_hash}_{config.max_size}_{config.quality}"
-    
+    @staticmethod
+    def image_token(image: np.ndarray) -> Hashable:
+        """
+        默认的图像版本标识，基于缓冲区地址、形状和类型，不读取像素数据。
+        原地修改图像内容后，调用方应通过 image_version 传入新的版本标识。
+        """
+        return (image.__array_interface__['data'][0], image.shape, image.dtype.str, image.strides)
+
+    def _session_key(self, image: np.ndarray, algorithm: InpainterType, config: PreviewConfig,
+                     image_version: Optional[Hashable]) -> tuple:
+        version = image_version if image_version is not None else self.image_token(image)
+        return (version, algorithm.value, config.max_size, config.quality)
+
+    def _begin_request(self, key: tuple) -> int:
+        """登记新请求，使同一会话上仍在进行的旧请求失效"""
+        with self._cache_lock:
+            self._request_counter += 1
+            self._latest_requests[key] = self._request_counter
+            return self._request_counter
+
+    def _check_cancelled(self, key: tuple, request: int):
+        latest = self._latest_requests.get(key)
+        if latest is not None and latest != request:
+            raise PreviewCancelledError()
+
+    def _get_session(self, key: tuple, image: np.ndarray, config: PreviewConfig) -> _PreviewSession:
+        with self._cache_lock:
+            session = self.preview_cache.get(key)
+            # 默认标识基于内存地址，原图对象已释放时地址可能被新图像复用
+            if session is not None and session.image_ref() is not image and key[0] == self.image_token(image):
+                session = None
+            if session is None:
+                preview_image, scale = self._resize_for_preview(image, config.max_size)
+                session = _PreviewSession(image, preview_image, scale)
+                self.preview_cache[key] = session
+                while len(self.preview_cache) > self.cache_max_size:
+                    old_key, _ = self.preview_cache.popitem(last=False)
+                    self._latest_requests.pop(old_key, None)
+            else:
+                self.preview_cache.move_to_end(key)
+            return session
+
     def _resize_for_preview(self, image: np.ndarray, max_size: int) -> Tuple[np.ndarray, float]:
         """调整图像尺寸用于预览"""
         h, w = image.shape[:2]
@@ -134,50 +202,88 @@ class LightweightInpainter:
     
     async def preview_async(self, image: np.ndarray, mask: np.ndarray, 
                           algorithm: Optional[InpainterType] = None,
-                          config: Optional[PreviewConfig] = None) -> PreviewResult:
-        """异步预览擦除效果"""
+                          config: Optional[PreviewConfig] = None,
+                          image_version: Optional[Hashable] = None) -> PreviewResult:
+        """
+        异步预览擦除效果
+
+        Raises:
+            PreviewCancelledError: 同一图像上有更新的预览请求
+        """
         if config is None:
             config = PreviewConfig()
         
         if algorithm is None:
             algorithm = self.config_service.get_current_config().inpainter
-        
-        start_time = time.time()
-        
-        # 检查缓存
-        if config.cache_enabled:
-            cache_key = self._generate_cache_key(image, mask, algorithm, config)
-            if cache_key in self.preview_cache:
-                cached_result = self.preview_cache[cache_key]
-                self.logger.debug(f"使用缓存结果: {algorithm.value}")
-                return PreviewResult(
-                    cached_result.image.copy(), 
-                    algorithm, 
-                    time.time() - start_time,
-                    cached=True
-                )
-        
-        # 异步处理
+
         loop = asyncio.get_event_loop()
-        result_image = await loop.run_in_executor(
+        return await loop.run_in_executor(
             self.executor, 
-            self._process_preview, 
-            image, mask, algorithm, config
+            self._preview, 
+            image, mask, algorithm, config, image_version, self._begin_request_for(image, algorithm, config, image_version)
         )
+
+    def preview_sync(self, image: np.ndarray, mask: np.ndarray,
+                    algorithm: Optional[InpainterType] = None,
+                    config: Optional[PreviewConfig] = None,
+                    image_version: Optional[Hashable] = None) -> PreviewResult:
+        """
+        同步预览擦除效果
+
+        Raises:
+            PreviewCancelledError: 同一图像上有更新的预览请求
+        """
+        if config is None:
+            config = PreviewConfig()
         
+        if algorithm is None:
+            algorithm = self.config_service.get_current_config().inpainter
+
+        return self._preview(image, mask, algorithm, config, image_version,
+                             self._begin_request_for(image, algorithm, config, image_version))
+
+    def _begin_request_for(self, image: np.ndarray, algorithm: InpainterType, config: PreviewConfig,
+                           image_version: Optional[Hashable]) -> Optional[int]:
+        if not config.cache_enabled:
+            return None
+        return self._begin_request(self._session_key(image, algorithm, config, image_version))
+
+    def _preview(self, image: np.ndarray, mask: np.ndarray, algorithm: InpainterType, config: PreviewConfig,
+                 image_version: Optional[Hashable], request: Optional[int]) -> PreviewResult:
+        start_time = time.time()
+
+        if not config.cache_enabled:
+            result_image = self._process_preview(image, mask, algorithm, config)
+            return PreviewResult(result_image, algorithm, time.time() - start_time)
+
+        key = self._session_key(image, algorithm, config, image_version)
+        session = self._get_session(key, image, config)
+        with session.lock:
+            self._check_cancelled(key, request)
+            try:
+                result_image, cached = self._process_incremental(session, key, request, mask, algorithm, config)
+            except PreviewCancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"预览处理失败: {e}")
+                # 回退到最简单的处理
+                return PreviewResult(self._inpaint_none(image, mask), algorithm, time.time() - start_time)
+
         process_time = time.time() - start_time
-        result = PreviewResult(result_image, algorithm, process_time)
-        
-        # 存储到缓存
-        if config.cache_enabled:
-            self._update_cache(cache_key, result)
-        
-        self.logger.debug(f"预览完成: {algorithm.value}, 耗时: {process_time:.3f}s")
-        return result
-    
+        self.logger.debug(f"预览完成: {algorithm.value}, 耗时: {process_time:.3f}s, 缓存: {cached}")
+        return PreviewResult(result_image, algorithm, process_time, cached=cached)
+
+    def _run_algorithm(self, image: np.ndarray, mask: np.ndarray,
+                       algorithm: InpainterType, config: PreviewConfig) -> np.ndarray:
+        """按算法和配置选择最优实现"""
+        handler = self.algorithm_handlers.get(algorithm, self._inpaint_simple_blur)
+        if algorithm in [InpainterType.DEFAULT, InpainterType.LAMA_MPE] and config.quality > 0.7:
+            return self._inpaint_advanced_fill(image, mask)
+        return handler(image, mask)
+
     def _process_preview(self, image: np.ndarray, mask: np.ndarray,
                         algorithm: InpainterType, config: PreviewConfig) -> np.ndarray:
-        """处理预览（在线程池中执行）"""
+        """非增量地处理整张图（缓存关闭时使用）"""
         try:
             # 调整尺寸
             preview_image, scale = self._resize_for_preview(image, config.max_size)
@@ -185,17 +291,7 @@ class LightweightInpainter:
                                     (preview_image.shape[1], preview_image.shape[0]), 
                                     interpolation=cv2.INTER_NEAREST)
             
-            # 选择算法处理
-            handler = self.algorithm_handlers.get(algorithm, self._inpaint_simple_blur)
-            
-            # 根据算法和配置选择最优实现
-            if algorithm in [InpainterType.DEFAULT, InpainterType.LAMA_MPE]:
-                if config.quality > 0.7:
-                    result = self._inpaint_advanced_fill(preview_image, preview_mask)
-                else:
-                    result = handler(preview_image, preview_mask)
-            else:
-                result = handler(preview_image, preview_mask)
+            result = self._run_algorithm(preview_image, preview_mask, algorithm, config)
             
             # 如果调整了尺寸，需要恢复到原始尺寸
             if scale != 1.0:
@@ -208,66 +304,129 @@ class LightweightInpainter:
             self.logger.error(f"预览处理失败: {e}")
             # 回退到最简单的处理
             return self._inpaint_none(image, mask)
-    
-    def preview_sync(self, image: np.ndarray, mask: np.ndarray,
-                    algorithm: Optional[InpainterType] = None,
-                    config: Optional[PreviewConfig] = None) -> PreviewResult:
-        """同步预览擦除效果"""
-        if config is None:
-            config = PreviewConfig()
-        
-        if algorithm is None:
-            algorithm = self.config_service.get_current_config().inpainter
-        
-        start_time = time.time()
-        
-        # 检查缓存
-        if config.cache_enabled:
-            cache_key = self._generate_cache_key(image, mask, algorithm, config)
-            if cache_key in self.preview_cache:
-                cached_result = self.preview_cache[cache_key]
-                self.logger.debug(f"使用缓存结果: {algorithm.value}")
-                return PreviewResult(
-                    cached_result.image.copy(), 
-                    algorithm, 
-                    time.time() - start_time,
-                    cached=True
-                )
-        
-        # 同步处理
-        result_image = self._process_preview(image, mask, algorithm, config)
-        process_time = time.time() - start_time
-        result = PreviewResult(result_image, algorithm, process_time)
-        
-        # 存储到缓存
-        if config.cache_enabled:
-            self._update_cache(cache_key, result)
-        
-        return result
-    
-    def _update_cache(self, cache_key: str, result: PreviewResult):
-        """更新缓存"""
-        # 检查缓存大小限制
-        if len(self.preview_cache) >= self.cache_max_size:
-            # 删除最旧的缓存项
-            oldest_key = min(self.preview_cache.keys(), 
-                           key=lambda k: self.preview_cache[k].timestamp)
-            del self.preview_cache[oldest_key]
-        
-        self.preview_cache[cache_key] = result
-    
+
+    def _process_incremental(self, session: _PreviewSession, key: tuple, request: int, mask: np.ndarray,
+                             algorithm: InpainterType, config: PreviewConfig) -> Tuple[np.ndarray, bool]:
+        """
+        在会话上一次的结果基础上，只重新处理蒙版变化的脏矩形。
+        会话缓存的结果会被之后的预览原地更新，因此返回其副本。
+        """
+        ph, pw = session.preview_image.shape[:2]
+        full_h, full_w = mask.shape[:2]
+        if session.scale != 1.0:
+            preview_mask = cv2.resize(mask, (pw, ph), interpolation=cv2.INTER_NEAREST)
+        else:
+            preview_mask = mask.copy()
+
+        if session.preview_result is None or session.preview_mask.shape != preview_mask.shape:
+            rects = None
+        else:
+            rects = self._dirty_rects(session.preview_mask, preview_mask)
+            if not rects:
+                return session.full_result.copy(), True
+
+        # 在副本上处理，被取消时会话保持一致
+        if rects is None:
+            preview_result = self._run_algorithm(session.preview_image, preview_mask, algorithm, config)
+        else:
+            preview_result = session.preview_result.copy()
+            for x0, y0, x1, y1 in rects:
+                self._check_cancelled(key, request)
+                cx0, cy0 = max(0, x0 - self.CONTEXT_MARGIN), max(0, y0 - self.CONTEXT_MARGIN)
+                cx1, cy1 = min(pw, x1 + self.CONTEXT_MARGIN), min(ph, y1 + self.CONTEXT_MARGIN)
+                patch = self._run_algorithm(session.preview_image[cy0:cy1, cx0:cx1],
+                                            np.ascontiguousarray(preview_mask[cy0:cy1, cx0:cx1]), algorithm, config)
+                preview_result[y0:y1, x0:x1] = patch[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+        self._check_cancelled(key, request)
+
+        # 提交新状态，并将变化部分放大写回原始尺寸的结果
+        if session.scale == 1.0:
+            full_result = preview_result
+        elif rects is None or session.full_result is None:
+            full_result = cv2.resize(preview_result, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+        else:
+            full_result = session.full_result
+            for rect in rects:
+                self._upscale_rect(preview_result, full_result, rect)
+        session.preview_mask = preview_mask
+        session.preview_result = preview_result
+        session.full_result = full_result
+        return full_result.copy(), False
+
+    def _dirty_rects(self, old_mask: np.ndarray, new_mask: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        计算两次蒙版之间需要重新处理的矩形 (x0, y0, x1, y1)。
+        填充结果取决于整个蒙版连通域，因此矩形扩展到与变化像素相连的整个连通域。
+        """
+        changed = old_mask != new_mask
+        if changed.ndim > 2:
+            changed = changed.any(axis=2)
+        if not changed.any():
+            return []
+
+        h, w = changed.shape
+        union = ((old_mask > 0) | (new_mask > 0)).astype(np.uint8)
+        if union.ndim > 2:
+            union = union.max(axis=2)
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(union, connectivity=8)
+        rects = []
+        for label in np.unique(labels[changed]):
+            if label == 0:
+                continue
+            x, y, rw, rh = stats[label, :4]
+            rects.append([max(0, x - self.DIRTY_MARGIN), max(0, y - self.DIRTY_MARGIN),
+                          min(w, x + rw + self.DIRTY_MARGIN), min(h, y + rh + self.DIRTY_MARGIN)])
+
+        # 合并重叠的矩形
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        rects.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(int(v) for v in r) for r in rects]
+
+    @staticmethod
+    def _upscale_rect(preview: np.ndarray, full: np.ndarray, rect: Tuple[int, int, int, int]):
+        """按 cv2.resize 的坐标映射，将预览结果中的一个矩形线性放大写回原始尺寸"""
+        ph, pw = preview.shape[:2]
+        full_h, full_w = full.shape[:2]
+        sx, sy = pw / full_w, ph / full_h
+        x0, y0, x1, y1 = rect
+        # 双线性插值会读取相邻的一个预览像素
+        fx0, fy0 = max(0, int(np.floor((x0 - 1) / sx))), max(0, int(np.floor((y0 - 1) / sy)))
+        fx1, fy1 = min(full_w, int(np.ceil((x1 + 1) / sx))), min(full_h, int(np.ceil((y1 + 1) / sy)))
+        if fx1 <= fx0 or fy1 <= fy0:
+            return
+        matrix = np.array([[sx, 0, (fx0 + 0.5) * sx - 0.5],
+                           [0, sy, (fy0 + 0.5) * sy - 0.5]], dtype=np.float64)
+        full[fy0:fy1, fx0:fx1] = cv2.warpAffine(preview, matrix, (fx1 - fx0, fy1 - fy0),
+                                                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                                borderMode=cv2.BORDER_REPLICATE)
+
     def clear_cache(self):
         """清空缓存"""
-        self.preview_cache.clear()
+        with self._cache_lock:
+            self.preview_cache.clear()
+            self._latest_requests.clear()
         self.logger.info("预览缓存已清空")
     
     def get_cache_info(self) -> Dict[str, Any]:
         """获取缓存信息"""
+        with self._cache_lock:
+            sessions = list(self.preview_cache.items())
         return {
-            "cache_size": len(self.preview_cache),
+            "cache_size": len(sessions),
             "max_size": self.cache_max_size,
-            "algorithms": list(set(result.algorithm for result in self.preview_cache.values())),
-            "total_memory_mb": sum(result.image.nbytes for result in self.preview_cache.values()) / (1024 * 1024)
+            "algorithms": list(set(key[1] for key, _ in sessions)),
+            "total_memory_mb": sum(session.nbytes for _, session in sessions) / (1024 * 1024)
         }
     
     def is_algorithm_suitable_for_preview(self, algorithm: InpainterType) -> bool:
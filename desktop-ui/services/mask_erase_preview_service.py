@@ -5,7 +5,7 @@
 import asyncio
 import logging
 import numpy as np
-from typing import Dict, Any, Optional, List, Callable
+from typing import Dict, Any, Optional, List, Callable, Hashable
 from dataclasses import dataclass
 from enum import Enum
 import threading
@@ -13,7 +13,8 @@ import time
 from concurrent.futures import ThreadPoolExecutor, Future
 
 from .erase_config_service import InpainterType, EraseConfigService, get_erase_config_service
-from .lightweight_inpainter import LightweightInpainter, PreviewConfig, PreviewResult, get_lightweight_inpainter
+from .lightweight_inpainter import (LightweightInpainter, PreviewConfig, PreviewResult, PreviewCancelledError,
+                                   get_lightweight_inpainter)
 
 class PreviewStatus(Enum):
     """预览状态"""
@@ -33,6 +34,7 @@ class PreviewRequest:
     config: PreviewConfig
     callback: Optional[Callable] = None
     timestamp: float = None
+    image_version: Optional[Hashable] = None
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -93,8 +95,13 @@ class MaskErasePreviewService:
     def submit_preview_request(self, image: np.ndarray, mask: np.ndarray,
                              algorithm: Optional[InpainterType] = None,
                              config: Optional[PreviewConfig] = None,
-                             callback: Optional[Callable] = None) -> str:
-        """提交预览请求"""
+                             callback: Optional[Callable] = None,
+                             image_version: Optional[Hashable] = None) -> str:
+        """
+        提交预览请求
+        同一图像上更新的请求会取消仍在进行的旧请求。图像不会被复制，
+        原地修改图像后需传入新的 image_version。
+        """
         if algorithm is None:
             algorithm = self.config_service.get_recommended_preview_algorithm()
         
@@ -104,11 +111,12 @@ class MaskErasePreviewService:
         request_id = self.generate_request_id()
         request = PreviewRequest(
             request_id=request_id,
-            image=image.copy(),
+            image=image,
             mask=mask.copy(),
             algorithm=algorithm,
             config=config,
-            callback=callback
+            callback=callback,
+            image_version=image_version
         )
         
         # 初始化状态
@@ -157,7 +165,8 @@ class MaskErasePreviewService:
                 request.image, 
                 request.mask, 
                 request.algorithm, 
-                request.config
+                request.config,
+                request.image_version
             )
             
             # 更新状态为完成
@@ -176,6 +185,16 @@ class MaskErasePreviewService:
             
             self._notify_callbacks(request_id, state)
             self.logger.debug(f"预览请求完成: {request_id}, 耗时: {process_time:.3f}s")
+
+        except PreviewCancelledError:
+            with self._lock:
+                state = self.request_states[request_id]
+                state.status = PreviewStatus.CANCELLED
+                state.end_time = time.time()
+                self.stats["cancelled_requests"] += 1
+
+            self._notify_callbacks(request_id, state)
+            self.logger.debug(f"预览请求被更新的请求取代: {request_id}")
             
         except Exception as e:
             self.logger.error(f"预览请求处理失败: {request_id}, 错误: {e}")
@@ -320,15 +339,17 @@ class MaskErasePreviewService:
     
     async def preview_async(self, image: np.ndarray, mask: np.ndarray,
                           algorithm: Optional[InpainterType] = None,
-                          config: Optional[PreviewConfig] = None) -> PreviewResult:
+                          config: Optional[PreviewConfig] = None,
+                          image_version: Optional[Hashable] = None) -> PreviewResult:
         """异步预览（简化版本，直接调用轻量级算法）"""
-        return await self.lightweight_inpainter.preview_async(image, mask, algorithm, config)
+        return await self.lightweight_inpainter.preview_async(image, mask, algorithm, config, image_version)
     
     def preview_sync(self, image: np.ndarray, mask: np.ndarray,
                    algorithm: Optional[InpainterType] = None,
-                   config: Optional[PreviewConfig] = None) -> PreviewResult:
+                   config: Optional[PreviewConfig] = None,
+                   image_version: Optional[Hashable] = None) -> PreviewResult:
         """同步预览（简化版本，直接调用轻量级算法）"""
-        return self.lightweight_inpainter.preview_sync(image, mask, algorithm, config)
+        return self.lightweight_inpainter.preview_sync(image, mask, algorithm, config, image_version)
     
     def shutdown(self):
         """关闭服务"""
@@ -73,6 +73,12 @@ class ImageCache:
             self.memory_usage -= oldest_data['size_mb']
             self.logger.debug(f"移除缓存: {oldest_key}")
     
+    def remove_prefix(self, prefix: str):
+        """移除键以 prefix 开头的所有缓存项"""
+        with self.lock:
+            for key in [key for key in self.cache if key.startswith(prefix)]:
+                self.memory_usage -= self.cache.pop(key)['size_mb']
+
     def clear(self):
         """清空缓存"""
         with self.lock:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻渲染服务
+在桌面UI进程内保持一个翻译器实例（及其已加载的修复模型、字体）常驻，
+直接在内存中接收区域数据进行渲染，无需每页重新创建翻译器和读写临时JSON文件。
+"""
+
+import json
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+class RenderService:
+    """
+    常驻渲染服务
+
+    - 在独立的事件循环线程中运行，不阻塞UI和AsyncService
+    - 翻译器按参数缓存复用，只有字体等初始化参数改变时才重新创建
+    - 同时提交的多次导出依次渲染，共用同一个翻译器
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._translator = None
+        self._translator_key = None
+        self._render_lock: Optional[asyncio.Lock] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="RenderService")
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._render_lock = asyncio.Lock()
+        self._loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        """在渲染线程的事件循环中执行协程，可从任意线程调用"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # ---------- 翻译器与配置 ----------
+
+    def _get_translator(self, translator_params: Dict[str, Any]):
+        """返回常驻的翻译器实例，初始化参数变化时才重新创建"""
+        key = json.dumps({k: v for k, v in translator_params.items() if not isinstance(v, dict)}, sort_keys=True, default=str)
+        if self._translator is None or key != self._translator_key:
+            from manga_translator.manga_translator import MangaTranslator
+            self.logger.info("创建常驻渲染翻译器实例...")
+            self._translator = MangaTranslator(params=translator_params)
+            self._translator_key = key
+        return self._translator
+
+    @staticmethod
+    def build_config(config: Dict[str, Any]):
+        from manga_translator.config import Config, RenderConfig, TranslatorConfig
+        render_cfg = RenderConfig(**config.get('render', {}))
+        # 翻译器设置为none，只做渲染
+        return Config(render=render_cfg, translator=TranslatorConfig(translator='none'))
+
+    @staticmethod
+    def regions_to_textblocks(regions: List[Dict[str, Any]], target_lang: Optional[str] = None):
+        """将规范化后的区域字典转换为TextBlock，与--load-text读取JSON后的结果一致"""
+        from manga_translator.utils import TextBlock
+        text_blocks = []
+        for region in regions:
+            region = dict(region)
+            region['lines'] = np.asarray(region['lines']).astype(np.int32)
+            if not region.get('target_lang') and target_lang:
+                region['target_lang'] = target_lang
+            text_blocks.append(TextBlock(**region))
+        return text_blocks
+
+    # ---------- 渲染 ----------
+
+    async def render(self, image: Image.Image, regions: List[Dict[str, Any]], config: Dict[str, Any],
+                     translator_params: Dict[str, Any], mask: Optional[np.ndarray] = None) -> Optional[Image.Image]:
+        """渲染单页。regions 为已规范化的区域字典（见 ExportService.normalize_regions）"""
+        translator = self._get_translator(translator_params)
+        cfg = self.build_config(config)
+        text_blocks = self.regions_to_textblocks(regions, cfg.translator.target_lang)
+        if not text_blocks:
+            return None
+        async with self._render_lock:
+            ctx = await translator.render_regions(image, text_blocks, cfg, mask=mask, mask_is_refined=mask is not None)
+        return ctx.result
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+# 全局渲染服务实例
+_render_service: Optional[RenderService] = None
+_render_service_lock = threading.Lock()
+
+def get_render_service() -> RenderService:
+    """获取常驻渲染服务实例"""
+    global _render_service
+    with _render_service_lock:
+        if _render_service is None:
+            _render_service = RenderService()
+        return _render_service
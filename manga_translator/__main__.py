@@ -16,6 +16,7 @@ from .utils import (
     get_logger,
     set_log_level,
     natural_sort,
+    is_archive,
 )
 
 # TODO: Dynamic imports to reduce ram usage in web(-server) mode. Will require dealing with args.py imports.
@@ -35,7 +36,7 @@ async def dispatch(args: Namespace):
         pre_dict = load_dictionary(args.pre_dict)
         post_dict = load_dictionary(args.post_dict)
 
-        if len(args.input) == 1 and os.path.isfile(args.input[0]):
+        if len(args.input) == 1 and os.path.isfile(args.input[0]) and not is_archive(args.input[0]):
             dest = args.dest
             if not dest:
                 dest = os.path.join(BASE_PATH, 'result/final.png')
@@ -75,6 +76,12 @@ async def dispatch(args: Namespace):
         from manga_translator.mode.share import MangaShare
         translator = MangaShare(args_dict)
         await translator.listen(args_dict)
+    elif args.mode == 'benchmark':
+        from manga_translator.benchmark import run_benchmark
+        regressions = await run_benchmark(args_dict)
+        if regressions:
+            sys.exit(1)
+
     elif args.mode == 'config-help':
         import json
         config = Config.schema()
@@ -8,7 +8,7 @@ from .inpainting import INPAINTERS
 from .translators import VALID_LANGUAGES, TRANSLATORS, TranslatorChain
 from .upscaling import UPSCALERS
 from .colorization import COLORIZERS
-from .save import OUTPUT_FORMATS
+from .save import OUTPUT_FORMATS, SAVE_PRESETS, DEFAULT_SAVE_PRESET
 
 def url_decode(s):
     s = unquote(s)
@@ -100,6 +100,14 @@ def general_parser(g_parser):
                         help='Use concurrent mode for batch translation - process each image separately instead of merging into large batches. Helps prevent model output truncation and hallucination.')
     g_parser.add_argument('--disable-memory-optimization', action='store_true',
                         help='Disable automatic memory optimization during processing')
+    g_parser.add_argument('--io-workers', default=2, type=int,
+                        help='Number of background threads encoding and writing result and debug images')
+    g_parser.add_argument('--io-queue-size', default=8, type=int,
+                        help='Maximum number of images waiting to be written before translation waits for the disk')
+    g_parser.add_argument('--trace', action='store_true',
+                        help='Record per-stage timings, memory and input sizes and print a summary table after every job (local mode only)')
+    g_parser.add_argument('--trace-file', default=None, type=str,
+                        help='Path of the exported Chrome trace JSON, implies --trace. Defaults to result/trace_<timestamp>.json')
     
 
 
@@ -116,7 +124,7 @@ subparsers = parser.add_subparsers(dest='mode', required=True, help='Mode of ope
 
 # Batch mode
 parser_batch = subparsers.add_parser('local', help='Run in batch translation mode')
-parser_batch.add_argument('-i', '--input', required=True, type=path, nargs='+', help='Path to an image folder')
+parser_batch.add_argument('-i', '--input', required=True, type=path, nargs='+', help='Path to an image folder, image or comic archive (cbz/zip/cbr/pdf), results of archives are written into a cbz/zip archive')
 parser_batch.add_argument('-o', '--dest', default='', type=str, help='Path to the destination folder for translated images')
 parser_batch.add_argument('-f', '--format', default=None, choices=OUTPUT_FORMATS, help='Output format of the translation.')
 parser_batch.add_argument('--overwrite', action='store_true', help='Overwrite already translated images')
@@ -129,6 +137,8 @@ g_batch.add_argument('--save-text-file', default='', type=str, help='Like --save
 parser_batch.add_argument('--template', action='store_true', help='Generate a translation template JSON where the translation field is a copy of the original text.')
 parser_batch.add_argument('--prep-manual', action='store_true', help='Prepare for manual typesetting by outputting blank, inpainted images, plus copies of the original for reference')
 parser_batch.add_argument('--save-quality', default=100, type=int, help='Quality of saved JPEG image, range from 0 to 100 with 100 being best')
+parser_batch.add_argument('--save-preset', default=DEFAULT_SAVE_PRESET, choices=SAVE_PRESETS, help='Encoder settings of the output format, from fastest to smallest files. "fast" gives lossless PNG with fast compression')
+parser_batch.add_argument('--save-threads', default=0, type=int, help='Number of threads encoding result images, 0 to encode on the output writer threads')
 parser_batch.add_argument('--config-file', default=None, type=str, help='path to the config file')
 parser_batch.add_argument('--no-save-mask', action='store_true', help='Do not save the raw mask in the translation JSON file.')
 
@@ -139,6 +149,10 @@ parser_ws.add_argument('--port', default=5003, type=int, help='Port for WebSocke
 parser_ws.add_argument('--nonce', default=os.getenv('MT_WEB_NONCE', ''), type=str, help='Nonce for securing internal WebSocket communication')
 parser_ws.add_argument('--ws-url', default='ws://localhost:5000', type=str, help='Server URL for WebSocket mode')
 parser_ws.add_argument('--models-ttl', default='0', type=int, help='How long to keep models in memory in seconds after last use (0 means forever)')
+parser_ws.add_argument('--ws-prefetch', default=2, type=int, help='Number of tasks downloading and decoding their image while another task is translated')
+parser_ws.add_argument('--ws-translation-concurrency', default=4, type=int, help='Number of tasks waiting for an online translator at the same time')
+parser_ws.add_argument('--ws-priority-aging', default=1.0, type=float, help='How many newer tasks a waiting task overtakes per second of waiting')
+parser_ws.add_argument('--ws-max-queue-time', default=0, type=float, help='Give up tasks waiting longer than this many seconds for the GPU (0 means never)')
 
 # API mode
 parser_api = subparsers.add_parser('shared', help='Run in API mode')
@@ -148,4 +162,29 @@ parser_api.add_argument('--nonce', default=os.getenv('MT_WEB_NONCE', ''), type=s
 parser_api.add_argument("--report", default=None,type=str, help='reports to server to register instance')
 parser_api.add_argument('--models-ttl', default='0', type=int, help='models TTL in memory in seconds')
 
+# Benchmark mode
+parser_bench = subparsers.add_parser('benchmark', help='Benchmark every stage and the full pipeline on synthetic pages, offline')
+parser_bench.add_argument('--stages', default=None, type=str, help='Comma separated stages to run (detection,ocr,textline_merge,mask_refinement,inpainting,rendering,translation,llm,e2e). Defaults to all')
+parser_bench.add_argument('--pages', default=3, type=int, help='Number of synthetic pages')
+parser_bench.add_argument('--webtoon-pages', default=1, type=int, help='Number of additional long webtoon strips')
+parser_bench.add_argument('--seed', default=0, type=int, help='Seed of the page generator, the same seed always produces the same pages')
+parser_bench.add_argument('--repeat', default=3, type=int, help='How often every page is processed per benchmark')
+parser_bench.add_argument('--warmup', default=1, type=int, help='Untimed runs before measuring (model loading, caches)')
+parser_bench.add_argument('--detectors', default='default', type=str, help='Comma separated detectors to benchmark')
+parser_bench.add_argument('--ocrs', default='48px', type=str, help='Comma separated OCRs to benchmark')
+parser_bench.add_argument('--inpainters', default='original,lama_large', type=str, help='Comma separated inpainters to benchmark, the last one is used end-to-end')
+parser_bench.add_argument('--translators', default='none,original', type=str, help='Comma separated translators to benchmark')
+parser_bench.add_argument('--llm-translators', default='chatgpt,gemini,deepseek', type=str, help='Comma separated online LLM translators to benchmark against the local mock server (llm stage)')
+parser_bench.add_argument('--mock-latency-ms', default=300, type=float, help='Mean time to first token of the mock LLM server')
+parser_bench.add_argument('--mock-tokens-per-second', default=0, type=float, help='Completion throughput of the mock LLM server, 0 for instant completions')
+parser_bench.add_argument('--mock-error-rate', default=0, type=float, help='Share of mock LLM requests answered with a server error')
+parser_bench.add_argument('--mock-rate-limit-rate', default=0, type=float, help='Share of mock LLM requests answered with 429')
+parser_bench.add_argument('--mock-rpm', default=0, type=int, help='Requests per minute the mock LLM server accepts before answering with 429')
+parser_bench.add_argument('--mock-max-concurrency', default=0, type=int, help='Concurrent requests the mock LLM server accepts before answering with 429')
+parser_bench.add_argument('--baseline', default=None, type=str, help='Baseline report to compare against')
+parser_bench.add_argument('--save-baseline', default=None, type=str, help='Write the report as new baseline to this path')
+parser_bench.add_argument('--threshold', default=0.1, type=float, help='Relative change that counts as a regression')
+parser_bench.add_argument('--output', default=None, type=str, help='Write the JSON report to this path')
+parser_bench.add_argument('--save-pages', default=None, type=str, help='Write the generated pages to this folder for inspection')
+
 subparsers.add_parser('config-help', help='Print help information for config file')
@@ -0,0 +1,3 @@
+from .synthetic import SyntheticPage, generate_page, generate_pages
+from .suite import STAGES, BenchmarkResult, BenchmarkSuite, compare_to_baseline, run_benchmark
+from .mock_llm import MockLLMConfig, MockLLMServer, mock_completion, use_mock_endpoints
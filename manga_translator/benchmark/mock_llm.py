@@ -0,0 +1,514 @@
+"""
+Local mock LLM server for load testing the online translators offline.
+
+Speaks the OpenAI chat completions protocol (`.../chat/completions`, used by the
+chatgpt, deepseek, groq, sakura and custom_openai translators and Gemini's OpenAI
+compatible endpoint) and the Gemini `generateContent`/`streamGenerateContent`
+protocol, both streaming and non-streaming. Responses are deterministic
+translations in the format the translators' parsers expect:
+
+- numbered prompts (`<|1|>text`) are answered with the same ids
+- JSON mode (`{"TextList": [{"ID": .., "text": ..}]}`) with the same ids
+- anything else line by line
+
+Latency, token throughput, errors and 429 responses are configurable, so batching,
+retries, rate limiting and concurrency can be measured without a paid endpoint.
+`use_mock_endpoints()` points the translators at a running server.
+
+Standalone: `python -m manga_translator.benchmark.mock_llm --port 8765 --latency-ms 500`
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from ..translators.ratelimit import estimate_tokens
+from ..utils import get_logger
+
+logger = get_logger('mock_llm')
+
+MOCK_API_KEY = 'mock-key'
+MOCK_MODEL = 'mock-model'
+
+# Output limit reported for the mock Gemini models, the translator sizes its requests by it
+GEMINI_OUTPUT_TOKEN_LIMIT = 8192
+
+_ID_TAG = re.compile(r'<\|(\d+)\|>(.*?)(?=<\|\d+\|>|$)', re.DOTALL)
+
+
+class MockLLMConfig:
+    """
+    Behaviour of the mock server.
+
+    Args:
+        latency_ms: Mean time to the first token
+        latency_jitter: Relative spread of the latency
+        latency_distribution: 'fixed', 'uniform' or 'lognormal'
+        tokens_per_second: Completion throughput, 0 for instant completions
+        error_rate: Share of requests answered with a 500 error
+        rate_limit_rate: Share of requests answered with a 429 error
+        rpm: Requests per minute before answering with 429, 0 for unlimited
+        max_concurrency: Concurrent requests before answering with 429, 0 for unlimited
+        retry_after: Retry-After seconds sent with 429 responses
+        mode: 'numbered' answers "Mock translation <n>", 'echo' returns the source text
+        seed: Seed of the random latency and error injection
+    """
+    def __init__(self, latency_ms: float = 300, latency_jitter: float = 0.3, latency_distribution: str = 'lognormal',
+                 tokens_per_second: float = 0, error_rate: float = 0, rate_limit_rate: float = 0, rpm: int = 0,
+                 max_concurrency: int = 0, retry_after: float = 1, mode: str = 'numbered', seed: int = 0,
+                 models: List[str] = None):
+        if latency_distribution not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution: {latency_distribution}')
+        if mode not in ('numbered', 'echo'):
+            raise ValueError(f'Unknown mock translation mode: {mode}')
+        self.latency_ms = max(0.0, latency_ms)
+        self.latency_jitter = max(0.0, latency_jitter)
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = max(0.0, tokens_per_second)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.mode = mode
+        self.seed = seed
+        self.models = models or [MOCK_MODEL]
+
+
+class MockLLMStats:
+    def __init__(self):
+        self.requests = 0
+        self.streamed = 0
+        self.succeeded = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.concurrent = 0
+        self.peak_concurrency = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.lines = 0
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in self.__dict__.items() if k != 'concurrent'}
+
+
+def _translate_line(text: str, n: int, mode: str) -> str:
+    if mode == 'echo':
+        return text
+    return f'Mock translation {n}'
+
+def mock_completion(prompt: str, mode: str = 'numbered', json_mode: bool = False) -> Tuple[str, int]:
+    """
+    Answers `prompt` the way a well-behaved model would.
+
+    Returns:
+        The completion text and the number of translated lines
+    """
+    text = prompt.strip()
+    if json_mode or text.startswith('{'):
+        try:
+            items = json.loads(text)['TextList']
+            result = [{'ID': item['ID'], 'text': _translate_line(item['text'], item['ID'] + 1, mode)} for item in items]
+            return json.dumps({'TextList': result}, ensure_ascii=False), len(result)
+        except (ValueError, KeyError, TypeError):
+            pass
+
+    tagged = _ID_TAG.findall(text)
+    if tagged:
+        lines = [f'<|{n}|>{_translate_line(line.strip(), int(n), mode)}' for n, line in tagged]
+        return '\n'.join(lines), len(lines)
+
+    # groq: {"untranslated": "..."}, sakura: "...翻译成中文：<lines>"
+    match = re.search(r'\{"untranslated": "(.*)"\}', text, re.DOTALL)
+    if match:
+        text = match.group(1)
+    elif '翻译成中文：' in text:
+        text = text.rsplit('翻译成中文：', 1)[1]
+    lines = [_translate_line(line, i, mode) for i, line in enumerate(text.split('\n'), start=1)]
+    return '\n'.join(lines), len(lines)
+
+
+class MockLLMServer:
+    def __init__(self, config: MockLLMConfig = None):
+        self.config = config or MockLLMConfig()
+        self.stats = MockLLMStats()
+        self.base_url = None
+        self._random = random.Random(self.config.seed)
+        self._request_times: List[float] = []
+        self._runner = None
+        self._thread = None
+        self._thread_loop = None
+
+    # ---- lifecycle ----
+
+    def _app(self):
+        from aiohttp import web
+        app = web.Application(client_max_size=64 * 2**20)
+        app.router.add_post('/{prefix:.*}chat/completions', self._openai_chat)
+        app.router.add_get('/{version}/models', self._gemini_models)
+        app.router.add_get('/{version}/models/{model}', self._gemini_model)
+        app.router.add_post('/{version}/models/{target}', self._gemini_generate)
+        app.router.add_get('/mock/stats', self._stats)
+        app.router.add_post('/mock/reset', self._reset)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Starts serving on the running loop, returns the base url."""
+        from aiohttp import web
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://{host}:{port}'
+        logger.info(f'Mock LLM server listening on {self.base_url}')
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_background(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """
+        Serves from a background thread with its own event loop, returns the base url.
+        Needed when the clients block the caller's loop, e.g. the synchronous
+        `genai.Client` calls of the Gemini translator's constructor.
+        """
+        self._thread_loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._thread_loop.run_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), self._thread_loop).result()
+
+    def stop_background(self):
+        if self._thread_loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._thread_loop).result()
+        self._thread_loop.call_soon_threadsafe(self._thread_loop.stop)
+        self._thread.join()
+        self._thread_loop.close()
+        self._thread = self._thread_loop = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def reset(self):
+        concurrent = self.stats.concurrent
+        self.stats = MockLLMStats()
+        # Requests in flight still decrement the counter when they finish
+        self.stats.concurrent = concurrent
+        self._random = random.Random(self.config.seed)
+        self._request_times.clear()
+
+    # ---- simulation ----
+
+    def _latency(self) -> float:
+        mean = self.config.latency_ms / 1000
+        jitter = self.config.latency_jitter
+        if self.config.latency_distribution == 'fixed' or mean == 0 or jitter == 0:
+            return mean
+        if self.config.latency_distribution == 'uniform':
+            return max(0.0, self._random.uniform(mean * (1 - jitter), mean * (1 + jitter)))
+        # Lognormal with the configured mean: long tail like real endpoints
+        sigma = math.sqrt(math.log(1 + jitter ** 2))
+        return self._random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+    def _admit(self) -> Optional[int]:
+        """Counts the request, returns an error status to answer with or None."""
+        self.stats.requests += 1
+        now = time.monotonic()
+        self._request_times = [t for t in self._request_times if now - t < 60]
+        self._request_times.append(now)
+        if self.config.rpm and len(self._request_times) > self.config.rpm:
+            return 429
+        if self.config.max_concurrency and self.stats.concurrent >= self.config.max_concurrency:
+            return 429
+        if self._random.random() < self.config.rate_limit_rate:
+            return 429
+        if self._random.random() < self.config.error_rate:
+            return 500
+        return None
+
+    def _generation_time(self, tokens: int) -> float:
+        return tokens / self.config.tokens_per_second if self.config.tokens_per_second else 0.0
+
+    def _error(self, status: int, gemini: bool):
+        from aiohttp import web
+        if status == 429:
+            self.stats.rate_limited += 1
+            message, kind = 'Rate limit reached (mock)', 'RESOURCE_EXHAUSTED' if gemini else 'rate_limit_exceeded'
+            headers = {'Retry-After': str(self.config.retry_after)}
+        else:
+            self.stats.errors += 1
+            message, kind = 'Internal server error (mock)', 'INTERNAL' if gemini else 'server_error'
+            headers = {}
+        if gemini:
+            body = {'error': {'code': status, 'message': message, 'status': kind}}
+        else:
+            body = {'error': {'message': message, 'type': kind, 'code': kind}}
+        return web.json_response(body, status=status, headers=headers)
+
+    async def _respond(self, request, prompt: str, json_mode: bool, stream: bool, gemini: bool, model: str,
+                       include_usage: bool = False):
+        from aiohttp import web
+        status = self._admit()
+        if status == 429:
+            # Real endpoints reject over-limit requests right away
+            return self._error(status, gemini)
+
+        self.stats.concurrent += 1
+        self.stats.peak_concurrency = max(self.stats.peak_concurrency, self.stats.concurrent)
+        try:
+            await asyncio.sleep(self._latency())
+            if status is not None:
+                return self._error(status, gemini)
+
+            completion, lines = mock_completion(prompt, self.config.mode, json_mode)
+            prompt_tokens = estimate_tokens(prompt)
+            completion_tokens = estimate_tokens(completion)
+            self.stats.prompt_tokens += prompt_tokens
+            self.stats.completion_tokens += completion_tokens
+            self.stats.lines += lines
+            usage = (prompt_tokens, completion_tokens)
+
+            if not stream:
+                await asyncio.sleep(self._generation_time(completion_tokens))
+                self.stats.succeeded += 1
+                body = self._gemini_body(completion, usage, model) if gemini else self._openai_body(completion, usage, model)
+                return web.json_response(body)
+
+            self.stats.streamed += 1
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+            await response.prepare(request)
+            # One chunk per line, paced by the token throughput
+            chunks = re.split(r'(?<=\n)', completion)
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(self._generation_time(estimate_tokens(chunk)))
+                last = i == len(chunks) - 1
+                if gemini:
+                    data = self._gemini_body(chunk, usage if last else None, model, finished=last)
+                else:
+                    data = self._openai_chunk(chunk, model, finished=last)
+                await response.write(f'data: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            if not gemini:
+                if include_usage:
+                    data = self._openai_chunk('', model, usage=usage)
+                    await response.write(f'data: {json.dumps(data)}\n\n'.encode('utf-8'))
+                await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+            self.stats.succeeded += 1
+            return response
+        finally:
+            self.stats.concurrent -= 1
+
+    # ---- OpenAI protocol ----
+
+    @staticmethod
+    def _openai_usage(usage) -> dict:
+        return {'prompt_tokens': usage[0], 'completion_tokens': usage[1], 'total_tokens': usage[0] + usage[1]}
+
+    def _openai_body(self, text: str, usage, model: str) -> dict:
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': self._openai_usage(usage),
+        }
+
+    def _openai_chunk(self, text: str, model: str, finished: bool = False, usage=None) -> dict:
+        chunk = {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [] if usage else [{
+                'index': 0,
+                'delta': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop' if finished else None,
+            }],
+        }
+        if usage:
+            chunk['usage'] = self._openai_usage(usage)
+        return chunk
+
+    async def _openai_chat(self, request):
+        body = await request.json()
+        messages = body.get('messages') or []
+        user = [m for m in messages if m.get('role') == 'user']
+        content = user[-1].get('content', '') if user else ''
+        if isinstance(content, list):
+            # Multimodal messages, only the text parts are translated
+            content = '\n'.join(part.get('text', '') for part in content if part.get('type') == 'text')
+        response_format = (body.get('response_format') or {}).get('type', '')
+        return await self._respond(
+            request, content,
+            json_mode=response_format in ('json_object', 'json_schema'),
+            stream=bool(body.get('stream')),
+            gemini=False,
+            model=body.get('model', MOCK_MODEL),
+            include_usage=bool((body.get('stream_options') or {}).get('include_usage')),
+        )
+
+    # ---- Gemini protocol ----
+
+    def _gemini_model_info(self, name: str) -> dict:
+        return {
+            'name': f'models/{name}',
+            'displayName': name,
+            'inputTokenLimit': 1048576,
+            'outputTokenLimit': GEMINI_OUTPUT_TOKEN_LIMIT,
+            # No `createCachedContent`: the translators fall back to sending the system prompt
+            'supportedGenerationMethods': ['generateContent', 'countTokens'],
+        }
+
+    def _gemini_body(self, text: str, usage, model: str, finished: bool = True) -> dict:
+        body = {
+            'candidates': [{
+                'content': {'role': 'model', 'parts': [{'text': text}]},
+                'index': 0,
+                **({'finishReason': 'STOP'} if finished else {}),
+            }],
+            'modelVersion': model,
+        }
+        if usage:
+            body['usageMetadata'] = {
+                'promptTokenCount': usage[0],
+                'candidatesTokenCount': usage[1],
+                'totalTokenCount': usage[0] + usage[1],
+            }
+        return body
+
+    async def _gemini_models(self, request):
+        from aiohttp import web
+        return web.json_response({'models': [self._gemini_model_info(m) for m in self.config.models]})
+
+    async def _gemini_model(self, request):
+        from aiohttp import web
+        return web.json_response(self._gemini_model_info(request.match_info['model']))
+
+    async def _gemini_generate(self, request):
+        from aiohttp import web
+        model, _, action = request.match_info['target'].partition(':')
+        body = await request.json()
+        contents = body.get('contents') or []
+        user = [c for c in contents if c.get('role', 'user') == 'user']
+        prompt = '\n'.join(part.get('text', '') for part in (user[-1].get('parts', []) if user else []))
+        if action == 'countTokens':
+            return web.json_response({'totalTokens': estimate_tokens(prompt)})
+        if action not in ('generateContent', 'streamGenerateContent'):
+            return web.json_response({'error': {'code': 404, 'message': f'Unknown action {action}', 'status': 'NOT_FOUND'}}, status=404)
+        generation_config = body.get('generationConfig') or {}
+        return await self._respond(
+            request, prompt,
+            json_mode=generation_config.get('responseMimeType') == 'application/json',
+            stream=action == 'streamGenerateContent',
+            gemini=True,
+            model=model,
+        )
+
+    # ---- control ----
+
+    async def _stats(self, request):
+        from aiohttp import web
+        return web.json_response(self.stats.as_dict())
+
+    async def _reset(self, request):
+        from aiohttp import web
+        self.reset()
+        return web.json_response({'ok': True})
+
+
+def use_mock_endpoints(base_url: str, model: str = MOCK_MODEL) -> Dict[str, str]:
+    """
+    Points the online LLM translators at the mock server at `base_url`.
+
+    The API keys and endpoints are read into the translator modules at import time,
+    so they are set both in the environment and on the already imported modules, and
+    cached translator instances are dropped.
+
+    Returns:
+        The environment variables that were set
+    """
+    import os
+    import sys
+    from .. import translators
+    from ..config import Translator
+
+    env = {
+        'OPENAI_API_KEY': MOCK_API_KEY, 'OPENAI_API_BASE': f'{base_url}/v1', 'OPENAI_MODEL': model,
+        'DEEPSEEK_API_KEY': MOCK_API_KEY, 'DEEPSEEK_API_BASE': f'{base_url}/v1', 'DEEPSEEK_MODEL': model,
+        'GEMINI_API_KEY': MOCK_API_KEY, 'GEMINI_API_BASE': base_url, 'GEMINI_MODEL': model,
+        'GROQ_API_KEY': MOCK_API_KEY, 'GROQ_MODEL': model,
+        # Read by the groq SDK when the client is created
+        'GROQ_BASE_URL': base_url,
+        'SAKURA_API_BASE': f'{base_url}/v1',
+        'CUSTOM_OPENAI_API_KEY': MOCK_API_KEY, 'CUSTOM_OPENAI_API_BASE': f'{base_url}/v1', 'CUSTOM_OPENAI_MODEL': model,
+    }
+    os.environ.update(env)
+    for name, module in list(sys.modules.items()):
+        if name.startswith(translators.__name__ + '.') and module is not None:
+            for key, value in env.items():
+                if hasattr(module, key):
+                    setattr(module, key, value)
+    for key in (Translator.chatgpt, Translator.deepseek, Translator.gemini, Translator.groq,
+                Translator.sakura, Translator.custom_openai):
+        translators.translator_cache.pop(key, None)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the OpenAI and Gemini APIs for offline translator load tests')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=8765, type=int)
+    parser.add_argument('--latency-ms', default=300, type=float, help='Mean time to the first token')
+    parser.add_argument('--latency-jitter', default=0.3, type=float, help='Relative spread of the latency')
+    parser.add_argument('--latency-distribution', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--tokens-per-second', default=0, type=float, help='Completion throughput, 0 for instant completions')
+    parser.add_argument('--error-rate', default=0, type=float, help='Share of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', default=0, type=float, help='Share of requests answered with 429')
+    parser.add_argument('--rpm', default=0, type=int, help='Requests per minute before answering with 429')
+    parser.add_argument('--max-concurrency', default=0, type=int, help='Concurrent requests before answering with 429')
+    parser.add_argument('--retry-after', default=1, type=float, help='Retry-After seconds of 429 responses')
+    parser.add_argument('--mode', default='numbered', choices=['numbered', 'echo'])
+    parser.add_argument('--models', default=MOCK_MODEL, type=str, help='Comma separated model names to report')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    config = MockLLMConfig(
+        latency_ms=args.latency_ms, latency_jitter=args.latency_jitter, latency_distribution=args.latency_distribution,
+        tokens_per_second=args.tokens_per_second, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        rpm=args.rpm, max_concurrency=args.max_concurrency, retry_after=args.retry_after, mode=args.mode,
+        seed=args.seed, models=[m.strip() for m in args.models.split(',') if m.strip()],
+    )
+
+    async def serve():
+        server = MockLLMServer(config)
+        base_url = await server.start(args.host, args.port)
+        print(f'Mock LLM server on {base_url}, e.g. OPENAI_API_BASE={base_url}/v1, GEMINI_API_BASE={base_url}')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            print(json.dumps(server.stats.as_dict(), indent=2))
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+import gc
+import os
+import asyncio
+import json
+import time
+import platform
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .synthetic import SyntheticPage, generate_pages
+from .mock_llm import MockLLMConfig
+from .. import detection, ocr, textline_merge, mask_refinement, inpainting, rendering, translators
+from ..config import (
+    Config, Detector, Ocr, Inpainter, Translator, TranslatorChain,
+    DetectorConfig, OcrConfig, InpainterConfig, TranslatorConfig,
+)
+from ..utils import ModelWrapper, get_logger
+
+logger = get_logger('benchmark')
+
+STAGES = ['detection', 'ocr', 'textline_merge', 'mask_refinement', 'inpainting', 'rendering', 'translation', 'llm', 'e2e']
+
+
+class _MemorySampler:
+    """Samples the process RSS (and VRAM peak on cuda) on a background thread while active."""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.rss_start = 0
+        self.rss_peak = 0
+        self.vram_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = None
+
+    def _rss(self) -> int:
+        return self._process.memory_info().rss if self._process else 0
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.rss_peak = max(self.rss_peak, self._rss())
+
+    def __enter__(self):
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            pass
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.reset_peak_memory_stats()
+        except Exception:
+            pass
+        self.rss_start = self.rss_peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.rss_peak = max(self.rss_peak, self._rss())
+        try:
+            import torch
+            if torch.cuda.is_available():
+                self.vram_peak = torch.cuda.max_memory_allocated()
+        except Exception:
+            pass
+        return False
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, stage: str):
+        self.name = name
+        self.stage = stage
+        self.latencies: List[float] = []
+        self.pages = 0
+        self.pixels = 0
+        self.rss_peak_delta = 0
+        self.vram_peak = 0
+        self.skipped: Optional[str] = None
+        self.error: Optional[str] = None
+        # Additional stage specific metrics, e.g. the mock server counters of the llm stage
+        self.extra: dict = {}
+
+    def add(self, latency: float, page: SyntheticPage):
+        self.latencies.append(latency)
+        self.pages += 1
+        self.pixels += page.pixels
+
+    def add_batch(self, latency: float, pages: List[SyntheticPage]):
+        self.latencies.append(latency)
+        self.pages += len(pages)
+        self.pixels += sum(page.pixels for page in pages)
+
+    def summary(self) -> dict:
+        if self.skipped or self.error or not self.latencies:
+            return {'stage': self.stage, 'skipped': self.skipped, 'error': self.error}
+        lat = np.array(self.latencies) * 1000
+        total = float(np.sum(self.latencies))
+        return {
+            'stage': self.stage,
+            'samples': len(self.latencies),
+            'p50_ms': float(np.percentile(lat, 50)),
+            'p90_ms': float(np.percentile(lat, 90)),
+            'p99_ms': float(np.percentile(lat, 99)),
+            'mean_ms': float(np.mean(lat)),
+            'pages_per_s': self.pages / total if total else 0.0,
+            'mpix_per_s': self.pixels / 1e6 / total if total else 0.0,
+            'rss_peak_delta_mb': self.rss_peak_delta / 2**20,
+            'vram_peak_mb': self.vram_peak / 2**20,
+            **self.extra,
+        }
+
+
+def _availability(getter: Callable, key) -> Optional[str]:
+    """Returns why a model can't be benchmarked offline, or None if it can."""
+    try:
+        model = getter(key)
+    except Exception as e:
+        return f'{e.__class__.__name__}: {e}'
+    if isinstance(model, ModelWrapper) and not model.is_downloaded():
+        return 'model not downloaded'
+    return None
+
+
+class BenchmarkSuite:
+    """
+    Runs every pipeline stage and the end-to-end pipeline on deterministic synthetic pages.
+    Stages receive the page's ground truth as input (e.g. OCR gets the true textlines), so
+    each stage is measured independently of the accuracy of the previous one.
+    Models are never downloaded, stages whose model is missing are reported as skipped.
+    """
+    def __init__(self, pages: List[SyntheticPage], device: str = 'cpu', repeat: int = 3, warmup: int = 1,
+                 detectors: List[str] = None, ocrs: List[str] = None, inpainters: List[str] = None,
+                 translators: List[str] = None, font_path: str = '', target_lang: str = 'ENG',
+                 llm_translators: List[str] = None, mock_llm: MockLLMConfig = None):
+        self.pages = pages
+        self.device = device
+        self.repeat = max(1, repeat)
+        self.warmup = max(0, warmup)
+        self.detectors = [Detector(d) for d in (detectors or ['default'])]
+        self.ocrs = [Ocr(o) for o in (ocrs or ['48px'])]
+        self.inpainters = [Inpainter(i) for i in (inpainters or ['original', 'lama_large'])]
+        self.translators = [Translator(t) for t in (translators or ['none', 'original'])]
+        self.llm_translators = [Translator(t) for t in (llm_translators or ['chatgpt', 'gemini', 'deepseek'])]
+        self.mock_llm = mock_llm or MockLLMConfig()
+        self.font_path = font_path
+        self.target_lang = target_lang
+        self.results: List[BenchmarkResult] = []
+
+    async def _measure(self, name: str, stage: str, run: Callable[[SyntheticPage], Awaitable], skipped: str = None) -> BenchmarkResult:
+        result = BenchmarkResult(name, stage)
+        self.results.append(result)
+        if skipped:
+            result.skipped = skipped
+            logger.info(f'[{name}] skipped: {skipped}')
+            return result
+        logger.info(f'[{name}] {len(self.pages)} pages x {self.repeat}')
+        try:
+            for _ in range(self.warmup):
+                await run(self.pages[0])
+            gc.collect()
+            with _MemorySampler() as mem:
+                for _ in range(self.repeat):
+                    for page in self.pages:
+                        start = time.perf_counter()
+                        await run(page)
+                        result.add(time.perf_counter() - start, page)
+            result.rss_peak_delta = mem.rss_peak - mem.rss_start
+            result.vram_peak = mem.vram_peak
+        except Exception as e:
+            result.error = f'{e.__class__.__name__}: {e}'
+            logger.error(f'[{name}] failed: {result.error}')
+        return result
+
+    async def _measure_batch(self, name: str, stage: str, run: Callable[[], Awaitable], skipped: str = None) -> BenchmarkResult:
+        """Like `_measure`, but `run` processes all pages at once and every repeat is one sample."""
+        result = BenchmarkResult(name, stage)
+        self.results.append(result)
+        if skipped:
+            result.skipped = skipped
+            logger.info(f'[{name}] skipped: {skipped}')
+            return result
+        logger.info(f'[{name}] {len(self.pages)} pages at once x {self.repeat}')
+        try:
+            for _ in range(self.warmup):
+                await run()
+            gc.collect()
+            with _MemorySampler() as mem:
+                for _ in range(self.repeat):
+                    start = time.perf_counter()
+                    await run()
+                    result.add_batch(time.perf_counter() - start, self.pages)
+            result.rss_peak_delta = mem.rss_peak - mem.rss_start
+            result.vram_peak = mem.vram_peak
+        except Exception as e:
+            result.error = f'{e.__class__.__name__}: {e}'
+            logger.error(f'[{name}] failed: {result.error}')
+        return result
+
+    async def bench_detection(self):
+        for key in self.detectors:
+            async def run(page: SyntheticPage, key=key):
+                await detection.dispatch(key, page.img, 2048, 0.5, 0.7, 2.3, False, False, False, device=self.device)
+            await self._measure(f'detection/{key.value}', 'detection', run, _availability(detection.get_detector, key))
+
+    async def bench_ocr(self):
+        for key in self.ocrs:
+            async def run(page: SyntheticPage, key=key):
+                await ocr.dispatch(key, page.img, page.textlines, OcrConfig(ocr=key), device=self.device)
+            await self._measure(f'ocr/{key.value}', 'ocr', run, _availability(ocr.get_ocr, key))
+
+    async def bench_textline_merge(self):
+        async def run(page: SyntheticPage):
+            await textline_merge.dispatch(page.textlines, page.img.shape[1], page.img.shape[0])
+        await self._measure('textline_merge', 'textline_merge', run)
+
+    async def bench_mask_refinement(self):
+        for method in ('fit_text', 'crf_batched', 'guided', 'fill'):
+            async def run(page: SyntheticPage, method=method):
+                await mask_refinement.dispatch(page.regions, page.img, page.mask, method)
+            await self._measure(f'mask_refinement/{method}', 'mask_refinement', run)
+
+    async def bench_inpainting(self):
+        for key in self.inpainters:
+            async def run(page: SyntheticPage, key=key):
+                await inpainting.dispatch(key, page.img, page.mask, InpainterConfig(inpainter=key), 2048, self.device)
+            await self._measure(f'inpainting/{key.value}', 'inpainting', run, _availability(inpainting.get_inpainter, key))
+
+    async def bench_rendering(self):
+        config = Config()
+        async def run(page: SyntheticPage):
+            await rendering.dispatch(page.img.copy(), page.regions, self.font_path, config)
+        await self._measure('rendering/default', 'rendering', run)
+
+    async def bench_translation(self):
+        for key in self.translators:
+            chain = TranslatorChain(f'{key.value}:{self.target_lang}')
+            async def run(page: SyntheticPage, chain=chain):
+                await translators.dispatch(chain, [r.text for r in page.regions], device=self.device)
+            await self._measure(f'translation/{key.value}', 'translation', run, _availability(translators.get_translator, key))
+
+    async def bench_llm(self):
+        """
+        Online LLM translators against the local mock server. Every sample translates the
+        text of all pages concurrently, once with one request group per page (like
+        --batch-concurrent) and once with the pages packed by token budget. The mock
+        server's request, 429 and concurrency counters are added to the results.
+        """
+        from .mock_llm import MockLLMServer, use_mock_endpoints
+
+        server = MockLLMServer(self.mock_llm)
+        try:
+            # The Gemini translator's constructor blocks the loop, serve from a separate thread
+            base_url = server.start_background()
+        except Exception as e:
+            for key in self.llm_translators:
+                await self._measure_batch(f'llm/{key.value}', 'llm', None, f'mock server unavailable: {e}')
+            return
+        use_mock_endpoints(base_url)
+
+        config = TranslatorConfig(target_lang=self.target_lang)
+        page_texts = [[r.text for r in page.regions] for page in self.pages]
+        try:
+            for key in self.llm_translators:
+                chain = TranslatorChain(f'{key.value}:{self.target_lang}')
+                skipped = _availability(translators.get_translator, key)
+
+                async def per_page(chain=chain):
+                    await asyncio.gather(*(translators.dispatch(chain, texts, config) for texts in page_texts if texts))
+
+                async def packed(chain=chain):
+                    groups = translators.pack_pages(chain, page_texts, config)
+                    await asyncio.gather(*(translators.dispatch(chain, [t for i in group for t in page_texts[i]], config)
+                                           for group in groups))
+
+                for mode, run in (('pages', per_page), ('packed', packed)):
+                    server.reset()
+                    result = await self._measure_batch(f'llm/{key.value}/{mode}', 'llm', run, skipped)
+                    result.extra = {f'mock_{k}': v for k, v in server.stats.as_dict().items()}
+        finally:
+            server.stop_background()
+
+    async def bench_e2e(self):
+        from ..manga_translator import MangaTranslator
+
+        detector, ocr_key, inpainter = self.detectors[0], self.ocrs[0], self.inpainters[-1]
+        missing = (_availability(detection.get_detector, detector)
+                   or _availability(ocr.get_ocr, ocr_key)
+                   or _availability(inpainting.get_inpainter, inpainter))
+        translator = None
+        if not missing:
+            translator = MangaTranslator({'use_gpu': self.device != 'cpu', 'font_path': self.font_path})
+        for key in self.translators:
+            config = Config(
+                translator=TranslatorConfig(translator=key, target_lang=self.target_lang),
+                detector=DetectorConfig(detector=detector),
+                ocr=OcrConfig(ocr=ocr_key),
+                inpainter=InpainterConfig(inpainter=inpainter),
+            )
+            async def run(page: SyntheticPage, config=config):
+                await translator.translate(page.to_pil(), config, skip_context_save=True)
+            await self._measure(f'e2e/{key.value}', 'e2e', run, missing)
+
+    async def run(self, stages: List[str] = None) -> List[BenchmarkResult]:
+        for stage in stages or STAGES:
+            await getattr(self, f'bench_{stage}')()
+        return self.results
+
+
+def environment_info(device: str) -> dict:
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'device': device,
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+def compare_to_baseline(current: Dict[str, dict], baseline: Dict[str, dict], threshold: float = 0.1) -> List[dict]:
+    """
+    Compares median latency, throughput and peak memory per benchmark. A change worse than
+    `threshold` (relative) is flagged as a regression.
+    """
+    rows = []
+    checks = [('p50_ms', 1), ('pages_per_s', -1), ('rss_peak_delta_mb', 1)]
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if not base or 'p50_ms' not in cur or 'p50_ms' not in base:
+            continue
+        for metric, direction in checks:
+            old, new = base.get(metric), cur.get(metric)
+            # Memory deltas of a few MB are allocator noise
+            if not old or new is None or (metric == 'rss_peak_delta_mb' and max(old, new) < 32):
+                continue
+            change = (new - old) / old
+            rows.append({
+                'name': name, 'metric': metric, 'baseline': old, 'current': new, 'change': change,
+                'regression': change * direction > threshold,
+            })
+    return rows
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    header = f'{"benchmark":<28} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"pages/s":>8} {"MP/s":>7} {"rss+ MB":>8} {"vram MB":>8}'
+    lines = [header, '-' * len(header)]
+    for r in results:
+        s = r.summary()
+        if 'p50_ms' not in s:
+            lines.append(f'{r.name:<28} {"skipped: " + r.skipped if r.skipped else "error: " + str(r.error)}')
+            continue
+        lines.append(f'{r.name:<28.28} {s["p50_ms"]:>9.1f} {s["p90_ms"]:>9.1f} {s["p99_ms"]:>9.1f} {s["pages_per_s"]:>8.2f} '
+                     f'{s["mpix_per_s"]:>7.2f} {s["rss_peak_delta_mb"]:>8.1f} {s["vram_peak_mb"]:>8.1f}')
+    return '\n'.join(lines)
+
+def format_comparison(rows: List[dict]) -> str:
+    lines = []
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["name"]:<28.28} {row["metric"]:<18} {row["baseline"]:>10.2f} -> {row["current"]:>10.2f} '
+                     f'{row["change"] * 100:>+7.1f}% {flag}')
+    return '\n'.join(lines)
+
+async def run_benchmark(params: dict) -> int:
+    """Entry point of the `benchmark` mode, returns the number of regressions against the baseline."""
+    device = 'cuda' if params.get('use_gpu') else 'cpu'
+    pages = generate_pages(params.get('pages', 3), params.get('seed', 0), webtoon_count=params.get('webtoon_pages', 1))
+    if params.get('save_pages'):
+        import cv2
+        os.makedirs(params['save_pages'], exist_ok=True)
+        for page in pages:
+            cv2.imwrite(os.path.join(params['save_pages'], page.name), cv2.cvtColor(page.img, cv2.COLOR_RGB2BGR))
+
+    split = lambda s: [v.strip() for v in s.split(',') if v.strip()] if s else None
+    suite = BenchmarkSuite(
+        pages, device=device, repeat=params.get('repeat', 3), warmup=params.get('warmup', 1),
+        detectors=split(params.get('detectors')), ocrs=split(params.get('ocrs')),
+        inpainters=split(params.get('inpainters')), translators=split(params.get('translators')),
+        font_path=params.get('font_path') or '',
+        llm_translators=split(params.get('llm_translators')),
+        mock_llm=MockLLMConfig(
+            latency_ms=params.get('mock_latency_ms', 300),
+            tokens_per_second=params.get('mock_tokens_per_second', 0),
+            error_rate=params.get('mock_error_rate', 0),
+            rate_limit_rate=params.get('mock_rate_limit_rate', 0),
+            rpm=params.get('mock_rpm', 0),
+            max_concurrency=params.get('mock_max_concurrency', 0),
+            seed=params.get('seed', 0),
+        ),
+    )
+    results = await suite.run(split(params.get('stages')))
+    logger.info('Benchmark results:\n' + format_results(results))
+
+    report = {
+        'meta': {
+            **environment_info(device),
+            'seed': params.get('seed', 0),
+            'pages': len(pages),
+            'repeat': suite.repeat,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {r.name: r.summary() for r in results},
+    }
+
+    regressions = 0
+    baseline_path = params.get('baseline')
+    if baseline_path and os.path.isfile(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('processor') != report['meta']['processor']:
+            logger.warning('Baseline was recorded on a different machine, comparisons are indicative only')
+        rows = compare_to_baseline(report['results'], baseline.get('results', {}), params.get('threshold', 0.1))
+        report['comparison'] = rows
+        regressions = sum(row['regression'] for row in rows)
+        logger.info(f'Compared to baseline "{baseline_path}":\n' + format_comparison(rows))
+        if regressions:
+            logger.warning(f'{regressions} regression(s) beyond {params.get("threshold", 0.1) * 100:.0f}%')
+    elif baseline_path:
+        logger.warning(f'Baseline "{baseline_path}" does not exist, use --save-baseline to record one')
+
+    for path in filter(None, [params.get('output'), params.get('save_baseline')]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f'Benchmark report written to: "{path}"')
+    return regressions
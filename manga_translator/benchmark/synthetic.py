@@ -0,0 +1,186 @@
+import os
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from ..utils import BASE_PATH, Quadrilateral, TextBlock
+
+JA_FONT = os.path.join(BASE_PATH, 'fonts', 'msgothic.ttc')
+EN_FONT = os.path.join(BASE_PATH, 'fonts', 'anime_ace_3.ttf')
+
+JA_LINES = [
+    'どうしてここに', 'まさか本当に', '待ってくれ', 'もう遅いよ', 'ありがとう', '信じられない',
+    '行くぞ', 'なんだこれは', '大丈夫か', 'また明日ね', '聞こえるか', 'そんなはずは',
+]
+EN_LINES = [
+    'WHAT ARE YOU', 'DOING HERE?', 'NO WAY...', 'WAIT FOR ME!', 'THANK YOU', 'IT CAN\'T BE',
+    'LET\'S GO!', 'WHAT IS THIS?', 'ARE YOU OK?', 'SEE YOU', 'CAN YOU HEAR', 'ME?',
+]
+TRANSLATIONS = [
+    'Why are you here?', 'No way, really?', 'Wait for me!', 'It\'s already too late.', 'Thank you.',
+    'I can\'t believe it.', 'Let\'s go!', 'What is this?', 'Are you okay?', 'See you tomorrow.',
+]
+
+
+class SyntheticPage:
+    """
+    A generated page together with its ground truth: the text pixel mask, one
+    `Quadrilateral` per rendered line and one `TextBlock` per bubble.
+    """
+    def __init__(self, name: str, img: np.ndarray, mask: np.ndarray, textlines: List[Quadrilateral], regions: List[TextBlock]):
+        self.name = name
+        self.img = img
+        self.mask = mask
+        self.textlines = textlines
+        self.regions = regions
+
+    @property
+    def pixels(self) -> int:
+        return self.img.shape[0] * self.img.shape[1]
+
+    def to_pil(self) -> Image.Image:
+        image = Image.fromarray(self.img)
+        image.name = self.name
+        return image
+
+
+def _load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+def _screentone(canvas: np.ndarray, rng: np.random.Generator, x0: int, y0: int, x1: int, y1: int):
+    period = int(rng.integers(5, 10))
+    radius = period * rng.uniform(0.2, 0.4)
+    yy, xx = np.mgrid[y0:y1, x0:x1]
+    dots = (yy % period - period / 2) ** 2 + (xx % period - period / 2) ** 2 < radius ** 2
+    # Fade the tone out towards the top of the panel like a gradient
+    fade = rng.random((y1 - y0, x1 - x0)) < np.linspace(0.1, 1, y1 - y0)[:, None]
+    canvas[y0:y1, x0:x1][dots & fade] = 40
+
+def _strokes(canvas: np.ndarray, rng: np.random.Generator, x0: int, y0: int, x1: int, y1: int):
+    # Line art stand-in: hatching and curves that detectors must not mistake for text
+    for _ in range(int(rng.integers(8, 24))):
+        pts = np.stack([rng.integers(x0, x1, 4), rng.integers(y0, y1, 4)], axis=1).astype(np.int32)
+        cv2.polylines(canvas, [pts], False, int(rng.integers(0, 90)), int(rng.integers(1, 4)), cv2.LINE_AA)
+
+def _panel_layout(rng: np.random.Generator, width: int, height: int, margin: int, gutter: int) -> List[Tuple[int, int, int, int]]:
+    panels = []
+    rows = int(rng.integers(2, 5))
+    cuts = np.sort(rng.uniform(0.2, 0.8, rows - 1)) if rows > 1 else np.array([])
+    ys = [margin] + [int(margin + c * (height - 2 * margin)) for c in cuts] + [height - margin]
+    for top, bottom in zip(ys[:-1], ys[1:]):
+        cols = int(rng.integers(1, 4))
+        xs = [margin] + sorted(int(margin + c * (width - 2 * margin)) for c in rng.uniform(0.25, 0.75, cols - 1)) + [width - margin]
+        for left, right in zip(xs[:-1], xs[1:]):
+            panels.append((left + gutter // 2, top + gutter // 2, right - gutter // 2, bottom - gutter // 2))
+    return panels
+
+def _draw_bubble(canvas: np.ndarray, mask: np.ndarray, rng: np.random.Generator, panel: Tuple[int, int, int, int],
+                 vertical: bool, fonts: dict) -> Optional[Tuple[List[Quadrilateral], TextBlock]]:
+    px0, py0, px1, py1 = panel
+    font_size = int(rng.integers(22, 36))
+    lines = [str(t) for t in rng.choice(JA_LINES if vertical else EN_LINES, int(rng.integers(1, 4)), replace=False)]
+    step = int(font_size * 1.15)
+    if vertical:
+        text_w = step * len(lines)
+        text_h = step * max(len(t) for t in lines)
+    else:
+        text_w = int(font_size * 0.72 * max(len(t) for t in lines))
+        text_h = step * len(lines)
+    bw, bh = int(text_w * 1.5) + 20, int(text_h * 1.4) + 20
+    if bw >= px1 - px0 - 8 or bh >= py1 - py0 - 8:
+        return None
+    cx = int(rng.integers(px0 + bw // 2 + 4, px1 - bw // 2 - 4))
+    cy = int(rng.integers(py0 + bh // 2 + 4, py1 - bh // 2 - 4))
+    cv2.ellipse(canvas, (cx, cy), (bw // 2, bh // 2), 0, 0, 360, 255, -1, cv2.LINE_AA)
+    cv2.ellipse(canvas, (cx, cy), (bw // 2, bh // 2), 0, 0, 360, 0, 3, cv2.LINE_AA)
+
+    font = fonts['ja' if vertical else 'en'].get(font_size) or _load_font(JA_FONT if vertical else EN_FONT, font_size)
+    fonts['ja' if vertical else 'en'][font_size] = font
+    text_img = Image.new('L', (text_w + step, text_h + step), 0)
+    draw = ImageDraw.Draw(text_img)
+    boxes = []
+    for i, line in enumerate(lines):
+        if vertical:
+            # Columns run right to left
+            x = text_w - (i + 1) * step
+            for j, ch in enumerate(line):
+                draw.text((x, j * step), ch, fill=255, font=font)
+            boxes.append((x, 0, x + font_size, len(line) * step))
+        else:
+            draw.text((0, i * step), line, fill=255, font=font)
+            boxes.append((0, i * step, int(draw.textlength(line, font=font)), i * step + font_size))
+
+    ink = np.asarray(text_img)
+    ox, oy = cx - text_w // 2, cy - text_h // 2
+    th, tw = ink.shape
+    region = canvas[oy:oy + th, ox:ox + tw]
+    np.minimum(region, 255 - ink, out=region)
+    np.maximum(mask[oy:oy + th, ox:ox + tw], ink, out=mask[oy:oy + th, ox:ox + tw])
+
+    textlines = []
+    for line, (x0, y0, x1, y1) in zip(lines, boxes):
+        pts = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.int64) + [ox, oy]
+        textlines.append(Quadrilateral(pts, line, 1.0, 0, 0, 0, 255, 255, 255))
+    block = TextBlock(
+        [q.pts for q in textlines],
+        texts=[q.text for q in textlines],
+        font_size=font_size,
+        translation=str(rng.choice(TRANSLATIONS)),
+        fg_color=(0, 0, 0),
+        bg_color=(255, 255, 255),
+        direction='v' if vertical else 'h',
+        source_lang='ja' if vertical else 'en',
+        target_lang='en_US',
+    )
+    return textlines, block
+
+def generate_page(seed: int, width: int = 1200, height: int = 1700, webtoon: bool = False, vertical_ratio: float = 0.7) -> SyntheticPage:
+    """
+    Deterministically draws a manga-like page: bordered panels with line art and
+    screentone, and speech bubbles holding vertical Japanese or horizontal English text.
+    `webtoon` produces a single long strip of borderless panels instead.
+    """
+    rng = np.random.default_rng(seed)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    fonts = {'ja': {}, 'en': {}}
+
+    if webtoon:
+        panels = []
+        y = 40
+        while y < height - 300:
+            panel_h = int(rng.integers(500, 1100))
+            panels.append((30, y, width - 30, min(y + panel_h, height - 40)))
+            y += panel_h + int(rng.integers(150, 400))
+    else:
+        panels = _panel_layout(rng, width, height, margin=60, gutter=24)
+
+    textlines, regions = [], []
+    for panel in panels:
+        x0, y0, x1, y1 = panel
+        if rng.random() < 0.6:
+            _screentone(canvas, rng, x0, y0, x1, y1)
+        _strokes(canvas, rng, x0, y0, x1, y1)
+        if not webtoon:
+            cv2.rectangle(canvas, (x0, y0), (x1, y1), 0, 4)
+        for _ in range(int(rng.integers(1, 3))):
+            bubble = _draw_bubble(canvas, mask, rng, panel, rng.random() < vertical_ratio, fonts)
+            if bubble:
+                textlines.extend(bubble[0])
+                regions.append(bubble[1])
+
+    img = cv2.cvtColor(canvas, cv2.COLOR_GRAY2RGB)
+    name = f'synthetic_{"webtoon" if webtoon else "page"}_{seed}.png'
+    return SyntheticPage(name, img, mask, textlines, regions)
+
+def generate_pages(count: int, seed: int = 0, width: int = 1200, height: int = 1700, webtoon_count: int = 1,
+                   webtoon_size: Tuple[int, int] = (800, 6400)) -> List[SyntheticPage]:
+    """Returns `count` regular pages followed by `webtoon_count` long strips, identical for the same seed."""
+    pages = [generate_page(seed + i, width, height) for i in range(count)]
+    pages += [generate_page(seed + count + i, webtoon_size[0], webtoon_size[1], webtoon=True) for i in range(webtoon_count)]
+    return pages
@@ -82,6 +82,14 @@ class InpaintPrecision(str, Enum):
     def __str__(self):
         return self.name
 
+class DetectorPrecision(str, Enum):
+    fp32 = "fp32"
+    fp16 = "fp16"
+    bf16 = "bf16"
+
+    def __str__(self):
+        return self.name
+
 class Detector(str, Enum):
     default = "default"
     dbconvnext = "dbconvnext"
@@ -147,6 +155,11 @@ class Translator(str, Enum):
         raise ValueError(f"{value} is not a valid {cls.__name__}")
 
 
+class MaskRefinement(str, Enum):
+    fit_text = "fit_text"
+    crf_batched = "crf_batched"
+    guided = "guided"
+
 class Upscaler(str, Enum):
     waifu2x = "waifu2x"
     esrgan = "esrgan"
@@ -218,6 +231,14 @@ class UpscaleConfig(BaseModel):
     """Downscales the previously upscaled image after translation back to original size (Use with --upscale-ratio)."""
     upscale_ratio: Optional[int] = None
     """Image upscale ratio applied before detection. Can improve text detection."""
+    tile_size: int = 0
+    """Tile size used for upscaling. 0 chooses the largest tile that fits into the memory budget"""
+    tile_overlap: int = 16
+    """Overlap in pixels between neighbouring upscaling tiles, seams are blended over this width"""
+    tile_batch_size: int = 4
+    """Number of tiles upscaled in a single forward pass"""
+    memory_budget_mb: int = 0
+    """Memory in MB an upscaling forward pass may use. 0 uses half of the free VRAM (or RAM on cpu)"""
 
 class TranslatorConfig(BaseModel):
     translator: Translator = Translator.sugoi
@@ -244,7 +265,29 @@ class TranslatorConfig(BaseModel):
     """Minimum number of consecutive repetitions to trigger hallucination detection"""
     post_check_target_lang_threshold: float = 0.5  
     """Minimum ratio of target language in translation text for ratio check"""
-    
+
+    # 在线翻译器限流配置项
+    rate_limit_rpm: Optional[int] = None
+    """Requests per minute allowed per provider and API key, overrides the translator's built-in limit. 0 disables the limit"""
+    rate_limit_tpm: Optional[int] = None
+    """Tokens per minute allowed per provider and API key. 0 disables the limit"""
+    max_concurrent_requests: int = 4
+    """Maximum number of concurrent requests per provider and API key"""
+    adaptive_concurrency: bool = True
+    """Lower the concurrency on 429 responses and rising latency and raise it again while requests succeed"""
+    http_pool_size: int = 16
+    """Maximum number of pooled HTTP connections per translation service, shared by all translator instances"""
+    http_keepalive: float = 90
+    """Seconds an idle pooled connection is kept open for reuse"""
+    http2: bool = True
+    """Use HTTP/2 for services whose client supports it (requires the h2 package)"""
+    request_token_budget: int = 0
+    """Token budget of one LLM translation request (prompt plus expected completion). Consecutive lines, also of several pages with --batch-concurrent, are packed into requests up to this budget. 0 uses the translator's own limit"""
+    verify_token_counts: bool = False
+    """Verify the local token estimate of the Gemini translators with the count_tokens API. Runs asynchronously, once per session and for prompts close to the minimum context cache size"""
+    stream_translations: bool = False
+    """Stream the responses of the chatgpt and gemini translators and report translated lines as they arrive. Finished pages are rendered early either way. Needs an endpoint that supports streaming"""
+
     _translator_gen = None
     _gpt_config = None
 
@@ -292,6 +335,14 @@ class DetectorConfig(BaseModel):
     """Threshold for bbox generation"""
     unclip_ratio: float = 2.3
     """How much to extend text skeleton to form bounding box"""
+    det_precision: DetectorPrecision = DetectorPrecision.fp32
+    """Inference precision of the torch detectors, bf16 is fastest on recent CPUs and fp16 on GPUs. The boxes are compared with fp32 on first use, falls back to fp32 if they disagree"""
+    det_channels_last: bool = False
+    """Run the torch detectors in channels-last memory format"""
+    det_compile: bool = False
+    """Compile the torch detectors with torch.compile, compiled graphs are cached in the model directory"""
+    det_batch_size: int = 0
+    """Pages detected in one forward pass when translating in batches, 0 picks it from the free device memory, 1 disables batching"""
 
 class InpainterConfig(BaseModel):
     inpainter: Inpainter = Inpainter.lama_large
@@ -321,6 +372,20 @@ class OcrConfig(BaseModel):
     prob: float | None = None
     """Minimum probability of a text region to be considered valid. If None, uses the model default."""
 
+class MaskRefinementConfig(BaseModel):
+    method: MaskRefinement = MaskRefinement.fit_text
+    """Mask refinement method. fit_text runs a CRF per textline, crf_batched runs one CRF per group of nearby textlines at a reduced resolution, guided uses a fast guided filter instead of a CRF"""
+    crf_iterations: int = 5
+    """Number of CRF inference iterations (crf_batched)"""
+    group_gap: float = 1.0
+    """Textlines closer than this many font sizes share a refinement problem (crf_batched, guided)"""
+    working_font_size: int = 24
+    """Groups are downscaled until their font size is about this many pixels before refinement, 0 disables downscaling (crf_batched, guided)"""
+    guided_radius: int = 4
+    """Radius of the guided filter (guided)"""
+    guided_eps: float = 0.01
+    """Regularization of the guided filter, larger values smooth more (guided)"""
+
 class Config(BaseModel):
     # General
     filter_text: Optional[str] = None
@@ -339,6 +404,8 @@ class Config(BaseModel):
     """inpainter configs"""
     ocr: OcrConfig = OcrConfig()
     """Ocr configs"""
+    mask_refinement: MaskRefinementConfig = MaskRefinementConfig()
+    """Mask refinement configs"""
     # ?
     force_simple_sort: bool = False
     """Don't use panel detection for sorting, use a simpler fallback logic instead"""
@@ -1,4 +1,5 @@
 import numpy as np
+from typing import List
 
 from .default import DefaultDetector
 from .dbnet_convnext import DBConvNextDetector
@@ -7,6 +8,7 @@ from .craft import CRAFTDetector
 from .paddle_rust import PaddleDetector
 from .none import NoneDetector
 from .common import CommonDetector, OfflineDetector
+from .inference_mode import InferenceMode
 from ..config import Detector
 
 DETECTORS = {
@@ -33,11 +35,33 @@ async def prepare(detector_key: Detector):
         await detector.download()
 
 async def dispatch(detector_key: Detector, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float, unclip_ratio: float,
-                   invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, device: str = 'cpu', verbose: bool = False):
+                   invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, device: str = 'cpu', verbose: bool = False,
+                   inference_mode: InferenceMode = None, chapter: str = None):
     detector = get_detector(detector_key)
     if isinstance(detector, OfflineDetector):
         await detector.load(device)
-    return await detector.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct, rotate, auto_rotate, verbose)
+        detector.set_inference_mode(inference_mode or InferenceMode())
+    return await detector.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct, rotate, auto_rotate, verbose,
+                                 chapter=chapter)
+
+async def dispatch_batch(detector_key: Detector, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                         unclip_ratio: float, invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, device: str = 'cpu',
+                         verbose: bool = False, inference_mode: InferenceMode = None, chapters: List[str] = None, batch_size: int = 0):
+    """
+    `dispatch` for several pages with the same detection settings, torch detectors run
+    up to `batch_size` pages of similar size in one forward pass (0: chosen from the
+    free device memory).
+    """
+    detector = get_detector(detector_key)
+    if isinstance(detector, OfflineDetector):
+        await detector.load(device)
+        detector.set_inference_mode(inference_mode or InferenceMode())
+    if not isinstance(detector, CommonDetector):
+        return [await detector.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct, rotate,
+                                      auto_rotate, verbose, chapter=chapter)
+                for image, chapter in zip(images, chapters or [None] * len(images))]
+    return await detector.detect_batch(images, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct, rotate,
+                                       auto_rotate, verbose, chapters=chapters, batch_size=batch_size)
 
 async def unload(detector_key: Detector):
     detector_cache.pop(detector_key, None)
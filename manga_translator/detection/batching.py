@@ -0,0 +1,87 @@
+"""
+Detection of several pages in one forward pass.
+
+Pages are resized for detection individually, then pages with similar input sizes
+are letterboxed (zero padded at the bottom and right, like the single page inputs
+already are) into one batch. Each output map is cropped back to its page before the
+usual post-processing, so pages of the same size give the same result as a single
+page detection. Pages whose input size differs too much are put into separate
+batches instead of wasting compute on padding.
+
+Without an explicit batch size, it is chosen so that the activations of a batch use
+at most half of the free device memory (`upscaling.tiling.get_memory_budget`).
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from ..upscaling.tiling import get_memory_budget
+
+# Upper limit of the automatic batch size, larger batches hardly improve utilization
+MAX_AUTO_BATCH_SIZE = 16
+# Share of a letterboxed input that may be padding added for batching
+MAX_PADDING = 0.25
+
+
+def auto_batch_size(device: str, input_shapes: Sequence[Tuple[int, int]], bytes_per_pixel: int,
+                    reduced_precision: bool = False) -> int:
+    """
+    Number of pages of the largest of `input_shapes` whose activations fit into the
+    memory budget of `device`. `bytes_per_pixel` is the peak activation memory of the
+    model per input pixel in fp32.
+    """
+    if not input_shapes:
+        return 1
+    pixels = max(h * w for h, w in input_shapes)
+    if reduced_precision:
+        bytes_per_pixel //= 2
+    size = get_memory_budget(str(device)) // max(1, pixels * bytes_per_pixel)
+    return int(max(1, min(MAX_AUTO_BATCH_SIZE, size)))
+
+
+def group_pages(input_shapes: Sequence[Tuple[int, int]], batch_size: int, max_padding: float = MAX_PADDING) -> List[List[int]]:
+    """
+    Splits the indices of `input_shapes` into batches of at most `batch_size` pages,
+    where letterboxing a page to the batch shape adds at most `max_padding` of padding.
+    """
+    order = sorted(range(len(input_shapes)), key=lambda i: (input_shapes[i][0] * input_shapes[i][1], input_shapes[i]),
+                   reverse=True)
+    groups: List[List[int]] = []
+    group_shapes: List[Tuple[int, int]] = []
+    for i in order:
+        h, w = input_shapes[i]
+        for k, (gh, gw) in enumerate(group_shapes):
+            gh, gw = max(gh, h), max(gw, w)
+            # Pages are sorted by area, the current page is the smallest of the group
+            if len(groups[k]) < batch_size and 1 - h * w / (gh * gw) <= max_padding:
+                groups[k].append(i)
+                group_shapes[k] = (gh, gw)
+                break
+        else:
+            groups.append([i])
+            group_shapes.append((h, w))
+    return groups
+
+
+def letterbox(inputs: Sequence[np.ndarray]) -> np.ndarray:
+    """Stacks (h, w, c) inputs, zero padding them at the bottom and right to the largest size."""
+    if len(set(x.shape for x in inputs)) == 1:
+        return np.stack(inputs)
+    h = max(x.shape[0] for x in inputs)
+    w = max(x.shape[1] for x in inputs)
+    batch = np.zeros((len(inputs), h, w) + inputs[0].shape[2:], dtype=inputs[0].dtype)
+    for i, x in enumerate(inputs):
+        batch[i, :x.shape[0], :x.shape[1]] = x
+    return batch
+
+
+def crop_output(output: np.ndarray, index: int, input_shape: Tuple[int, int], batch_shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Output map of page `index` of a (n, c, h, w) batch output, cropped to the page's
+    part of the letterboxed input. Keeps the batch dimension.
+    """
+    out_h, out_w = output.shape[-2:]
+    h = int(round(input_shape[0] * out_h / batch_shape[0]))
+    w = int(round(input_shape[1] * out_w / batch_shape[1]))
+    return output[index:index + 1, ..., :h, :w]
@@ -1,23 +1,182 @@
 from abc import abstractmethod
-from typing import List, Tuple
-from collections import Counter
+from typing import Dict, List, Tuple
+from collections import Counter, OrderedDict
 import numpy as np
 import cv2
 
+from .batching import auto_batch_size
+from .inference_mode import InferenceMode, TorchInference, box_agreement
 from ..utils import InfererModule, ModelWrapper, Quadrilateral
 
 
+def quad_areas(pts: np.ndarray) -> np.ndarray:
+    '''
+    Areas of (N, 4, 2) quadrilaterals, the convex hull area like `Quadrilateral.area`
+    but for all of them at once.
+    '''
+    pts = np.asarray(pts, dtype=np.float64)
+    if len(pts) == 0:
+        return np.zeros((0,))
+    x, y = pts[:, :, 0], pts[:, :, 1]
+
+    def shoelace(order):
+        xs, ys = x[:, order], y[:, order]
+        return np.abs((xs * np.roll(ys, -1, axis=1) - np.roll(xs, -1, axis=1) * ys).sum(axis=1)) / 2
+
+    # The hull of 4 points is either one of the quadrilaterals through them or a triangle
+    areas = [shoelace(order) for order in ([0, 1, 2, 3], [0, 1, 3, 2], [0, 2, 1, 3])]
+    areas += [shoelace(order) for order in ([0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 3])]
+    return np.max(areas, axis=0)
+
+
+def quadrilaterals_from_boxes(boxes: np.ndarray, scores: np.ndarray, min_area: float = 0) -> List[Quadrilateral]:
+    '''
+    Textlines of (N, 4, 2) boxes. Boxes with an area up to `min_area` are dropped
+    before any Quadrilateral is built.
+    '''
+    if len(boxes) == 0:
+        return []
+    boxes = np.asarray(boxes).astype(int)
+    keep = quad_areas(boxes) > min_area
+    return [Quadrilateral(pts, '', score) for pts, score in zip(boxes[keep], np.asarray(scores)[keep])]
+
+
+def _filter_small(textlines: List[Quadrilateral], min_area: float) -> List[Quadrilateral]:
+    if not textlines:
+        return textlines
+    keep = quad_areas(np.stack([txtln.pts for txtln in textlines])) > min_area
+    return [txtln for txtln, k in zip(textlines, keep) if k]
+
+
+def _majority_orientation(textlines: List[Quadrilateral]) -> str:
+    if not textlines:
+        return 'h'
+    orientations = ['h' if txtln.aspect_ratio > 1 else 'v' for txtln in textlines]
+    return Counter(orientations).most_common(1)[0][0]
+
+
 class CommonDetector(InfererModule):
+    # Number of chapters whose orientation is remembered for `auto_rotate`
+    _MAX_CHAPTERS = 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._chapter_rotations: 'OrderedDict[str, bool]' = OrderedDict()
 
     async def detect(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float, unclip_ratio: float,
-                     invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, verbose: bool = False):
+                     invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, verbose: bool = False,
+                     chapter: str = None):
         '''
         Returns textblock list and text mask.
+
+        With `auto_rotate` the detection is repeated with 90° rotation if most textlines
+        are horizontal. The orientation is guessed first, from the previous pages of
+        the same `chapter` or from a detection at half resolution, and the full
+        detection only runs a second time if its result contradicts the guess.
+        '''
+        args = (detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct)
+        if not auto_rotate:
+            result, _ = await self._detect_pass(image, *args, rotate, verbose)
+            return result
+
+        flip = await self._guess_rotation(image, args, rotate, verbose, chapter)
+        result, orientation = await self._detect_pass(image, *args, rotate != flip, verbose)
+        return await self._confirm_rotation(image, args, rotate, verbose, chapter, flip, result, orientation)
+
+    async def detect_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False,
+                           verbose: bool = False, chapters: List[str] = None, batch_size: int = 0):
         '''
+        `detect` for several pages. Detectors that support it run the pages through the
+        model together, `batch_size` pages per forward pass (0: chosen from the free
+        device memory).
+        '''
+        args = (detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct)
+        chapters = chapters or [None] * len(images)
+        flips = [False] * len(images)
+        if auto_rotate:
+            flips = [await self._guess_rotation(image, args, rotate, verbose, chapter)
+                     for image, chapter in zip(images, chapters)]
+        passes = await self._detect_passes(images, [rotate != flip for flip in flips], *args, batch_size=batch_size,
+                                           verbose=verbose)
+        if not auto_rotate:
+            return [result for result, _ in passes]
+        return [await self._confirm_rotation(image, args, rotate, verbose, chapter, flip, result, orientation)
+                for image, chapter, flip, (result, orientation) in zip(images, chapters, flips, passes)]
 
-        # Apply filters
+    async def _guess_rotation(self, image: np.ndarray, args: tuple, rotate: bool, verbose: bool, chapter: str = None) -> bool:
+        flip = self._chapter_rotations.get(chapter) if chapter else None
+        if flip is None:
+            flip = await self._probe_rotation(image, *args, rotate, verbose)
+        return flip
+
+    async def _confirm_rotation(self, image: np.ndarray, args: tuple, rotate: bool, verbose: bool, chapter: str,
+                                flip: bool, result: tuple, orientation: str):
+        if orientation == 'h':
+            # Same decision as detecting without rotation first: rotate if that
+            # detection is mostly horizontal
+            self.logger.info('Rerunning detection in the other orientation')
+            other, other_orientation = await self._detect_pass(image, *args, rotate == flip, verbose)
+            if not flip or other_orientation != 'h':
+                result, flip = other, not flip
+        if chapter:
+            self._chapter_rotations[chapter] = flip
+            self._chapter_rotations.move_to_end(chapter)
+            while len(self._chapter_rotations) > self._MAX_CHAPTERS:
+                self._chapter_rotations.popitem(last=False)
+        return result
+
+    async def _probe_rotation(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
+                              unclip_ratio: float, invert: bool, gamma_correct: bool, rotate: bool, verbose: bool = False) -> bool:
+        '''
+        Guesses whether `auto_rotate` will rotate the page from a detection on a thumbnail
+        at half resolution, about a quarter of the cost of a full detection.
+        '''
+        img_h, img_w = image.shape[:2]
+        thumbnail = cv2.resize(image, (max(1, img_w // 2), max(1, img_h // 2)), interpolation=cv2.INTER_AREA)
+        (textlines, _, _), orientation = await self._detect_pass(thumbnail, max(detect_size // 2, 256), text_threshold,
+                                                                 box_threshold, unclip_ratio, invert, gamma_correct,
+                                                                 rotate, verbose)
+        # Without textlines the full detection decides
+        return bool(textlines) and orientation == 'h'
+
+    async def _detect_pass(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, invert: bool, gamma_correct: bool, rotate: bool, verbose: bool = False):
+        '''
+        One detection. Returns the result and the majority orientation of the textlines
+        in the detected, possibly rotated, image.
+        '''
+        passes = await self._detect_passes([image], [rotate], detect_size, text_threshold, box_threshold, unclip_ratio,
+                                           invert, gamma_correct, verbose=verbose)
+        return passes[0]
+
+    async def _detect_passes(self, images: List[np.ndarray], rotations: List[bool], detect_size: int, text_threshold: float,
+                             box_threshold: float, unclip_ratio: float, invert: bool, gamma_correct: bool,
+                             batch_size: int = 0, verbose: bool = False):
+        filtered = [self._apply_filters(image, invert, gamma_correct, rotate) for image, rotate in zip(images, rotations)]
+
+        # Run detection
+        if len(filtered) == 1:
+            outputs = [await self._detect(filtered[0][0], detect_size, text_threshold, box_threshold, unclip_ratio, verbose)]
+        else:
+            outputs = await self._detect_batch([image for image, _ in filtered], detect_size, text_threshold, box_threshold,
+                                               unclip_ratio, batch_size, verbose)
+
+        # Remove filters
+        passes = []
+        for (image, add_border), (textlines, raw_mask, mask), original, rotate in zip(filtered, outputs, images, rotations):
+            img_h, img_w = original.shape[:2]
+            textlines = _filter_small(textlines, 1)
+            if add_border:
+                textlines, raw_mask, mask = self._remove_border(image, img_w, img_h, textlines, raw_mask, mask)
+            orientation = _majority_orientation(textlines)
+            if rotate:
+                textlines, raw_mask, mask = self._remove_rotation(textlines, raw_mask, mask, img_w, img_h)
+            passes.append(((textlines, raw_mask, mask), orientation))
+        return passes
+
+    def _apply_filters(self, image: np.ndarray, invert: bool, gamma_correct: bool, rotate: bool) -> Tuple[np.ndarray, bool]:
         img_h, img_w = image.shape[:2]
-        orig_image = image.copy()
         minimum_image_size = 400
         # Automatically add border if image too small (instead of simply resizing due to them more likely containing large fonts)
         add_border = min(img_w, img_h) < minimum_image_size
@@ -39,29 +198,16 @@ class CommonDetector(InfererModule):
 
         # cv2.imwrite('histogram.png', image)
         # cv2.waitKey(0)
+        return image, add_border
 
-        # Run detection
-        textlines, raw_mask, mask = await self._detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
-        textlines = list(filter(lambda x: x.area > 1, textlines))
-
-        # Remove filters
-        if add_border:
-            textlines, raw_mask, mask = self._remove_border(image, img_w, img_h, textlines, raw_mask, mask)
-        if auto_rotate:
-            # Rotate if horizontal aspect ratios are prevalent to potentially improve detection
-            if len(textlines) > 0:
-                orientations = ['h' if txtln.aspect_ratio > 1 else 'v' for txtln in textlines]
-                majority_orientation = Counter(orientations).most_common(1)[0][0]
-            else:
-                majority_orientation = 'h'
-            if majority_orientation == 'h':
-                self.logger.info('Rerunning detection with 90° rotation')
-                return await self.detect(orig_image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct,
-                                         rotate=(not rotate), auto_rotate=False, verbose=verbose)
-        if rotate:
-            textlines, raw_mask, mask = self._remove_rotation(textlines, raw_mask, mask, img_w, img_h)
-
-        return textlines, raw_mask, mask
+    async def _detect_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                            unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        '''
+        Detects the already filtered `images`. Detectors that can run several pages
+        in one forward pass override this.
+        '''
+        return [await self._detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+                for image in images]
 
     @abstractmethod
     async def _detect(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
@@ -87,15 +233,14 @@ class CommonDetector(InfererModule):
             mask = mask[:old_h, :old_w]
 
         # Filter out regions within the border and clamp the points of the remaining regions
-        new_textlines = []
-        for txtln in textlines:
-            if txtln.xyxy[0] >= old_w and txtln.xyxy[1] >= old_h:
-                continue
-            points = txtln.pts
-            points[:,0] = np.clip(points[:,0], 0, old_w)
-            points[:,1] = np.clip(points[:,1], 0, old_h)
-            new_txtln = Quadrilateral(points, txtln.text, txtln.prob)
-            new_textlines.append(new_txtln)
+        if not textlines:
+            return textlines, raw_mask, mask
+        pts = np.stack([txtln.pts for txtln in textlines])
+        keep = ~((pts[:, :, 0].min(axis=1) >= old_w) & (pts[:, :, 1].min(axis=1) >= old_h))
+        pts[:, :, 0] = np.clip(pts[:, :, 0], 0, old_w)
+        pts[:, :, 1] = np.clip(pts[:, :, 1], 0, old_h)
+        new_textlines = [Quadrilateral(points, txtln.text, txtln.prob)
+                         for points, txtln, k in zip(pts, textlines, keep) if k]
         return new_textlines, raw_mask, mask
 
     def _add_rotation(self, image: np.ndarray):
@@ -106,10 +251,11 @@ class CommonDetector(InfererModule):
         if mask is not None:
             mask = np.ascontiguousarray(np.rot90(mask).astype(np.uint8))
 
-        for i, txtln in enumerate(textlines):
-            rotated_pts = txtln.pts[:,[1,0]]
-            rotated_pts[:,1] = -rotated_pts[:,1] + img_h
-            textlines[i] = Quadrilateral(rotated_pts, txtln.text, txtln.prob)
+        if not textlines:
+            return textlines, raw_mask, mask
+        rotated_pts = np.stack([txtln.pts for txtln in textlines])[:, :, [1, 0]]
+        rotated_pts[:, :, 1] = -rotated_pts[:, :, 1] + img_h
+        textlines = [Quadrilateral(points, txtln.text, txtln.prob) for points, txtln in zip(rotated_pts, textlines)]
         return textlines, raw_mask, mask
 
     def _add_inversion(self, image: np.ndarray):
@@ -120,8 +266,9 @@ class CommonDetector(InfererModule):
         mid = 0.5
         mean = np.mean(gray)
         gamma = np.log(mid * 255) / np.log(mean)
-        img_gamma = np.power(image, gamma).clip(0,255).astype(np.uint8)
-        return img_gamma
+        # Same values as applying np.power to every pixel, computed once per intensity
+        lut = np.power(np.arange(256, dtype=np.float64), gamma).clip(0,255).astype(np.uint8)
+        return cv2.LUT(image, lut)
 
     def _add_histogram_equalization(self, image: np.ndarray):
         img_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
@@ -136,10 +283,94 @@ class CommonDetector(InfererModule):
 
 class OfflineDetector(CommonDetector, ModelWrapper):
     _MODEL_SUB_DIR = 'detection'
+    # Share of boxes that have to match the fp32 boxes to keep a reduced precision mode
+    _MIN_BOX_AGREEMENT = 0.95
+    # Peak activation memory of the model per input pixel in fp32, sizes detection batches
+    _BATCH_BYTES_PER_PIXEL = 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inference_mode = InferenceMode()
+        self._torch_models: List[TorchInference] = []
+        self._checked_modes: Dict[InferenceMode, bool] = {}
+
+    def _torch_inference(self, model) -> TorchInference:
+        """
+        Wraps a torch module of the detector, call the returned object instead of the
+        module to run it in the configured inference mode. Use in `_load`.
+        """
+        runner = TorchInference(model, self.device)
+        runner.set_mode(self.inference_mode)
+        self._torch_models.append(runner)
+        return runner
+
+    def set_inference_mode(self, mode: InferenceMode):
+        if self._checked_modes.get(mode) is False:
+            mode = InferenceMode(channels_last=mode.channels_last)
+        self.inference_mode = mode
+        for runner in self._torch_models:
+            runner.set_mode(mode)
+
+    async def unload(self):
+        await super().unload()
+        self._torch_models = []
 
     async def _detect(self, *args, **kwargs):
+        mode = self.inference_mode
+        if self._torch_models and not mode.is_reference and mode not in self._checked_modes:
+            return await self._check_inference_mode(mode, *args, **kwargs)
         return await self.infer(*args, **kwargs)
 
+    async def _detect_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                            unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        results = []
+        mode = self.inference_mode
+        if images and self._torch_models and not mode.is_reference and mode not in self._checked_modes:
+            # The first page checks the inference mode
+            results.append(await self._detect(images[0], detect_size, text_threshold, box_threshold, unclip_ratio, verbose))
+            images = images[1:]
+        if images:
+            if not self.is_loaded():
+                raise Exception(f'{self._key}: Tried to forward pass without having loaded the model.')
+            results += await self._infer_batch(images, detect_size, text_threshold, box_threshold, unclip_ratio,
+                                               batch_size, verbose)
+        return results
+
+    async def _infer_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        '''
+        `_infer` for several pages, torch detectors override it to run the pages
+        through the model together.
+        '''
+        return [await self._infer(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+                for image in images]
+
+    def _batch_size(self, batch_size: int, input_shapes: List[Tuple[int, int]]) -> int:
+        if batch_size > 0:
+            return batch_size
+        return auto_batch_size(self.device, input_shapes, self._BATCH_BYTES_PER_PIXEL,
+                               reduced_precision=self.inference_mode.precision != 'fp32')
+
+    async def _check_inference_mode(self, mode: InferenceMode, *args, **kwargs):
+        """Runs the first detection in fp32 as well and keeps `mode` only if the boxes agree."""
+        reference_mode = InferenceMode(channels_last=mode.channels_last)
+        self.set_inference_mode(reference_mode)
+        reference = await self.infer(*args, **kwargs)
+        self.set_inference_mode(mode)
+        try:
+            result = await self.infer(*args, **kwargs)
+            agreement = box_agreement(reference[0], result[0])
+        except Exception as e:
+            self.logger.warning(f'Detection failed in {mode.precision}{" compiled" if mode.compile else ""}: {e}')
+            agreement = 0.
+        self._checked_modes[mode] = agreement >= self._MIN_BOX_AGREEMENT
+        if not self._checked_modes[mode]:
+            self.logger.warning(f'Only {agreement:.1%} of the boxes in {mode.precision} agree with fp32, using fp32')
+            self.set_inference_mode(reference_mode)
+            return reference
+        self.logger.info(f'Detection in {mode.precision}: {agreement:.1%} of the boxes agree with fp32')
+        return result
+
     @abstractmethod
     async def _infer(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
                        unclip_ratio: float, verbose: bool = False):
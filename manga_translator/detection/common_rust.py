@@ -38,7 +38,8 @@ class RustDetector:
 
     async def detect(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
                      unclip_ratio: float,
-                     invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, verbose: bool = False):
+                     invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False, verbose: bool = False,
+                     chapter: str = None):
         '''
         Returns textblock list and text mask.
         '''
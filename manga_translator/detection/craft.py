@@ -18,6 +18,7 @@ from typing import List, Tuple
 
 from .default_utils.DBNet_resnet34 import TextDetection as TextDetectionDefault
 from .default_utils import imgproc, dbnet_utils, craft_utils
+from .batching import group_pages, letterbox
 from .common import OfflineDetector
 from ..utils import TextBlock, Quadrilateral, det_rearrange_forward
 from shapely.geometry import Polygon, MultiPoint
@@ -141,6 +142,8 @@ class CRAFTDetector(OfflineDetector):
         if device == 'cuda' or device == 'mps':
             self.model = self.model.to(self.device)
             self.model_refiner = self.model_refiner.to(self.device)
+        self.craft = self._torch_inference(self.model)
+        self.refiner = self._torch_inference(self.model_refiner)
         global MODEL
         MODEL = self.model
 
@@ -158,17 +161,43 @@ class CRAFTDetector(OfflineDetector):
         x = torch.from_numpy(x).permute(2, 0, 1)    # [h, w, c] to [c, h, w]
         x = x.unsqueeze(0).to(self.device)                # [c, h, w] to [b, c, h, w]
 
-        with torch.no_grad() :
-            y, feature = self.model(x)
+        y, feature = self.craft(x)
 
         # make score and link map
         score_text = y[0,:,:,0].cpu().data.numpy()
         score_link = y[0,:,:,1].cpu().data.numpy()
 
         # refine link
-        y_refiner = self.model_refiner(y, feature)
+        y_refiner = self.refiner(y, feature)
         score_link = y_refiner[0,:,:,0].cpu().data.numpy()
 
+        return self._postprocess(image, score_text, score_link, ratio_w, ratio_h, text_threshold, box_threshold)
+
+    async def _infer_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        inputs = [imgproc.resize_aspect_ratio(image, detect_size, interpolation = cv2.INTER_CUBIC, mag_ratio = 1) for image in images]
+        shapes = [img_resized.shape[:2] for img_resized, *_ in inputs]
+        results = [None] * len(images)
+        for group in group_pages(shapes, self._batch_size(batch_size, shapes)):
+            batch = letterbox([inputs[i][0] for i in group])
+            x = np.stack([imgproc.normalizeMeanVariance(img) for img in batch])
+            x = torch.from_numpy(x).permute(0, 3, 1, 2).to(self.device)    # [b, h, w, c] to [b, c, h, w]
+
+            y, feature = self.craft(x)
+            y_refiner = self.refiner(y, feature)
+            score_text = y[..., 0].cpu().data.numpy()
+            score_link = y_refiner[..., 0].cpu().data.numpy()
+
+            for j, i in enumerate(group):
+                # The score maps are at half the input resolution
+                h, w = (shapes[i][0] + 1) // 2, (shapes[i][1] + 1) // 2
+                ratio = 1 / inputs[i][1]
+                results[i] = self._postprocess(images[i], score_text[j, :h, :w], score_link[j, :h, :w], ratio, ratio,
+                                               text_threshold, box_threshold)
+        return results
+
+    def _postprocess(self, image: np.ndarray, score_text: np.ndarray, score_link: np.ndarray, ratio_w: float, ratio_h: float,
+                     text_threshold: float, box_threshold: float):
         # Post-processing
         boxes, polys = craft_utils.getDetBoxes(score_text, score_link, text_threshold, box_threshold, box_threshold, True)
 
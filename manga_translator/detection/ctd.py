@@ -2,7 +2,7 @@ import os
 import shutil
 import numpy as np
 import einops
-from typing import Union, Tuple
+from typing import List, Union, Tuple
 import cv2
 import torch
 
@@ -12,7 +12,7 @@ from .ctd_utils.utils.db_utils import SegDetectorRepresenter
 from .ctd_utils.utils.imgproc_utils import letterbox
 from .ctd_utils.textmask import REFINEMASK_INPAINT, refine_mask
 from .common import OfflineDetector
-from ..utils import Quadrilateral, det_rearrange_forward
+from ..utils import Quadrilateral, det_rearrange_forward, det_requires_rearrange
 
 def preprocess_img(img, input_size=(1024, 1024), device='cpu', bgr2rgb=True, half=False, to_tensor=True):
     if bgr2rgb:
@@ -60,6 +60,7 @@ def postprocess_yolo(det, conf_thresh, nms_thresh, resize_ratio, sort_func=None)
 
 
 class ComicTextDetector(OfflineDetector):
+    _BATCH_BYTES_PER_PIXEL = 512
     _MODEL_MAPPING = {
         'model-cuda': {
             'url': 'https://github.com/zyddnys/manga-image-translator/releases/download/beta-0.3/comictextdetector.pt',
@@ -86,6 +87,7 @@ class ComicTextDetector(OfflineDetector):
         if self.device == 'cuda' or self.device == 'mps':
             self.model = TextDetBase(self._get_file_path('comictextdetector.pt'), device=self.device, act='leaky')
             self.model.to(self.device)
+            self.torch_model = self._torch_inference(self.model)
             self.backend = 'torch'
         else:
             model_path = self._get_file_path('comictextdetector.pt.onnx')
@@ -108,7 +110,7 @@ class ComicTextDetector(OfflineDetector):
         if isinstance(self.model, TextDetBase):
             batch = einops.rearrange(batch.astype(np.float32) / 255., 'n h w c -> n c h w')
             batch = torch.from_numpy(batch).to(device)
-            _, mask, lines = self.model(batch)
+            _, mask, lines = self.torch_model(batch)
             mask = mask.detach().cpu().numpy()
             lines = lines.detach().cpu().numpy()
         elif isinstance(self.model, TextDetBaseDNN):
@@ -133,25 +135,58 @@ class ComicTextDetector(OfflineDetector):
         # keep_undetected_mask = False
         # refine_mode = REFINEMASK_INPAINT
 
-        im_h, im_w = image.shape[:2]
         lines_map, mask = det_rearrange_forward(image, self.det_batch_forward_ctd, self.input_size[0], 4, self.device, verbose)
         # blks = []
         # resize_ratio = [1, 1]
         if lines_map is None:
             img_in, ratio, dw, dh = preprocess_img(image, input_size=self.input_size, device=self.device, half=self.half, to_tensor=self.backend=='torch')
-            blks, mask, lines_map = self.model(img_in)
+            blks, mask, lines_map = (self.torch_model if self.backend == 'torch' else self.model)(img_in)
 
             if self.backend == 'opencv':
                 if mask.shape[1] == 2: # some version of opencv spit out reversed result
                     tmp = mask
                     mask = lines_map
                     lines_map = tmp
-            mask = mask.squeeze()
             # resize_ratio = (im_w / (self.input_size[0] - dw), im_h / (self.input_size[1] - dh))
             # blks = postprocess_yolo(blks, self.conf_thresh, self.nms_thresh, resize_ratio)
-            mask = mask[..., :mask.shape[0]-dh, :mask.shape[1]-dw]
-            lines_map = lines_map[..., :lines_map.shape[2]-dh, :lines_map.shape[3]-dw]
-
+            mask, lines_map = self._remove_letterbox(mask, lines_map, dw, dh)
+
+        return self._postprocess(image, mask, lines_map)
+
+    async def _infer_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        if self.backend != 'torch':
+            return await super()._infer_batch(images, detect_size, text_threshold, box_threshold, unclip_ratio, batch_size, verbose)
+
+        results = [None] * len(images)
+        inputs = {}
+        for i, image in enumerate(images):
+            if det_requires_rearrange(image, self.input_size[0]):
+                # Already split into a batch of patches
+                results[i] = await self._infer(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+            else:
+                inputs[i] = preprocess_img(image, input_size=self.input_size, device=self.device, half=self.half)
+
+        # Every page is letterboxed to the input size
+        indices = list(inputs)
+        batch_size = self._batch_size(batch_size, [self.input_size] * len(indices))
+        for start in range(0, len(indices), batch_size):
+            group = indices[start:start + batch_size]
+            _, mask, lines_map = self.torch_model(torch.cat([inputs[i][0] for i in group]))
+            for j, i in enumerate(group):
+                _, _, dw, dh = inputs[i]
+                page_mask, page_lines_map = self._remove_letterbox(mask[j:j + 1], lines_map[j:j + 1], dw, dh)
+                results[i] = self._postprocess(images[i], page_mask, page_lines_map)
+        return results
+
+    def _remove_letterbox(self, mask, lines_map, dw: int, dh: int):
+        mask = mask.squeeze()
+        mask = mask[..., :mask.shape[0]-dh, :mask.shape[1]-dw]
+        lines_map = lines_map[..., :lines_map.shape[2]-dh, :lines_map.shape[3]-dw]
+        return mask, lines_map
+
+    def _postprocess(self, image: np.ndarray, mask, lines_map):
+        im_h, im_w = image.shape[:2]
         mask = postprocess_mask(mask)
         lines, scores = self.seg_rep(None, lines_map, height=im_h, width=im_w)
         box_thresh = 0.6
@@ -8,8 +8,9 @@ from typing import List, Tuple
 
 from .default_utils.DBNet_resnet34 import TextDetection as TextDetectionDefault
 from .default_utils import imgproc, dbnet_utils, craft_utils
-from .common import OfflineDetector
-from ..utils import TextBlock, Quadrilateral, det_rearrange_forward
+from .batching import crop_output, group_pages, letterbox
+from .common import OfflineDetector, quadrilaterals_from_boxes
+from ..utils import TextBlock, det_rearrange_forward, det_requires_rearrange, bilateral_filter_cached
 
 MODEL = None
 def det_batch_forward_default(batch: np.ndarray, device: str):
@@ -25,6 +26,7 @@ def det_batch_forward_default(batch: np.ndarray, device: str):
     return db, mask
 
 class DefaultDetector(OfflineDetector):
+    _BATCH_BYTES_PER_PIXEL = 512
     _MODEL_MAPPING = {
         'model': {
             'url': 'https://github.com/zyddnys/manga-image-translator/releases/download/beta-0.3/detect-20241225.ckpt',
@@ -48,11 +50,14 @@ class DefaultDetector(OfflineDetector):
         if device == 'cuda' or device == 'mps':
             self.model = self.model.to(self.device)
         global MODEL
-        MODEL = self.model
+        MODEL = self._torch_inference(self.model)
 
     async def _unload(self):
         del self.model
 
+    def _resize(self, image: np.ndarray, detect_size: int):
+        return imgproc.resize_aspect_ratio(bilateral_filter_cached(image, 17, 80, 80), detect_size, cv2.INTER_LINEAR, mag_ratio = 1)
+
     async def _infer(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
                      unclip_ratio: float, verbose: bool = False):
 
@@ -61,7 +66,7 @@ class DefaultDetector(OfflineDetector):
 
         if db is None:
             # rearrangement is not required, fallback to default forward
-            img_resized, target_ratio, _, pad_w, pad_h = imgproc.resize_aspect_ratio(cv2.bilateralFilter(image, 17, 80, 80), detect_size, cv2.INTER_LINEAR, mag_ratio = 1)
+            img_resized, target_ratio, _, pad_w, pad_h = self._resize(image, detect_size)
             img_resized_h, img_resized_w = img_resized.shape[:2]
             ratio_h = ratio_w = 1 / target_ratio
             db, mask = det_batch_forward_default([img_resized], self.device)
@@ -69,6 +74,36 @@ class DefaultDetector(OfflineDetector):
             img_resized_h, img_resized_w = image.shape[:2]
             ratio_w = ratio_h = 1
             pad_h = pad_w = 0
+        return self._postprocess(db, mask, img_resized_w, img_resized_h, ratio_w, ratio_h, pad_w, pad_h,
+                                 text_threshold, box_threshold, unclip_ratio)
+
+    async def _infer_batch(self, images: List[np.ndarray], detect_size: int, text_threshold: float, box_threshold: float,
+                           unclip_ratio: float, batch_size: int = 0, verbose: bool = False):
+        results = [None] * len(images)
+        inputs = {}
+        for i, image in enumerate(images):
+            if det_requires_rearrange(image, detect_size):
+                # Already split into a batch of patches
+                results[i] = await self._infer(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+            else:
+                inputs[i] = self._resize(image, detect_size)
+
+        indices = list(inputs)
+        shapes = [inputs[i][0].shape[:2] for i in indices]
+        for group in group_pages(shapes, self._batch_size(batch_size, shapes)):
+            batch = letterbox([inputs[indices[k]][0] for k in group])
+            db, mask = det_batch_forward_default(batch, self.device)
+            for j, k in enumerate(group):
+                _, target_ratio, _, pad_w, pad_h = inputs[indices[k]]
+                img_resized_h, img_resized_w = shapes[k]
+                results[indices[k]] = self._postprocess(crop_output(db, j, shapes[k], batch.shape[1:3]),
+                                                        crop_output(mask, j, shapes[k], batch.shape[1:3]),
+                                                        img_resized_w, img_resized_h, 1 / target_ratio, 1 / target_ratio,
+                                                        pad_w, pad_h, text_threshold, box_threshold, unclip_ratio)
+        return results
+
+    def _postprocess(self, db: np.ndarray, mask: np.ndarray, img_resized_w: int, img_resized_h: int, ratio_w: float,
+                     ratio_h: float, pad_w: int, pad_h: int, text_threshold: float, box_threshold: float, unclip_ratio: float):
         self.logger.info(f'Detection resolution: {img_resized_w}x{img_resized_h}')
 
         mask = mask[0, 0, :, :]
@@ -80,13 +115,12 @@ class DefaultDetector(OfflineDetector):
             polys = []
         else:
             idx = boxes.reshape(boxes.shape[0], -1).sum(axis=1) > 0
-            polys, _ = boxes[idx], scores[idx]
+            polys, scores = boxes[idx], scores[idx]
             polys = polys.astype(np.float64)
             polys = craft_utils.adjustResultCoordinates(polys, ratio_w, ratio_h, ratio_net=1)
             polys = polys.astype(np.int64)
 
-        textlines = [Quadrilateral(pts.astype(int), '', score) for pts, score in zip(polys, scores)]
-        textlines = list(filter(lambda q: q.area > 16, textlines))
+        textlines = quadrilaterals_from_boxes(polys, scores, min_area=16)
         mask_resized = cv2.resize(mask, (mask.shape[1] * 2, mask.shape[0] * 2), interpolation=cv2.INTER_LINEAR)
         if pad_h > 0:
             mask_resized = mask_resized[:-pad_h, :]
@@ -6,12 +6,14 @@ from shapely.geometry import Polygon
 import torch
 
 class SegDetectorRepresenter():
-    def __init__(self, thresh=0.6, box_thresh=0.8, max_candidates=1000, unclip_ratio=2.2):
+    def __init__(self, thresh=0.6, box_thresh=0.8, max_candidates=1000, unclip_ratio=2.2, batched=True):
         self.min_size = 3
         self.thresh = thresh
         self.box_thresh = box_thresh
         self.max_candidates = max_candidates
         self.unclip_ratio = unclip_ratio
+        # Use the vectorized boxes_from_bitmap_batched instead of the per contour boxes_from_bitmap
+        self.batched = batched
 
     def __call__(self, batch, pred, is_output_polygon=False):
         '''
@@ -36,6 +38,8 @@ class SegDetectorRepresenter():
             height, width = batch['shape'][batch_index]
             if is_output_polygon:
                 boxes, scores = self.polygons_from_bitmap(pred[batch_index], segmentation[batch_index], width, height)
+            elif self.batched:
+                boxes, scores = self.boxes_from_bitmap_batched(pred[batch_index], segmentation[batch_index], width, height)
             else:
                 boxes, scores = self.boxes_from_bitmap(pred[batch_index], segmentation[batch_index], width, height)
             boxes_batch.append(boxes)
@@ -143,6 +147,73 @@ class SegDetectorRepresenter():
             scores[index] = score
         return boxes, scores
 
+    def boxes_from_bitmap_batched(self, pred, _bitmap, dest_width, dest_height):
+        '''
+        Vectorized boxes_from_bitmap, returns only the kept boxes (N, 4, 2) and their scores.
+
+        - candidates are the outer contours, all of them are scored in one pass over the map:
+          the mean prediction of each connected component (np.bincount over the labels)
+          instead of the mean inside each filled contour, which differs by the holes only
+        - unclipping a rectangle with round joins moves each side out by the offset distance,
+          so the minimum area rectangle of the unclipped box is computed in closed form for
+          all boxes at once instead of through shapely and pyclipper
+        - box corners are ordered, scaled and rolled as arrays
+        '''
+        assert len(_bitmap.shape) == 2
+        if isinstance(pred, torch.Tensor):
+            bitmap = _bitmap.cpu().numpy()
+            pred = pred.cpu().detach().numpy()
+        else:
+            bitmap = _bitmap
+        if not isinstance(dest_width, int):
+            dest_width = dest_width.item()
+            dest_height = dest_height.item()
+        height, width = bitmap.shape
+        empty = np.zeros((0, 4, 2), dtype=np.int64), np.zeros((0,), dtype=np.float32)
+
+        bitmap = bitmap.view(np.uint8) if bitmap.dtype == bool else (bitmap > 0).view(np.uint8)
+        try:
+            contours, hierarchy = cv2.findContours(bitmap, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        except ValueError:
+            return empty
+        if not contours:
+            return empty
+        # Holes never pass the score threshold, their inside is below `thresh`
+        contours = [c for c, parent in zip(contours, hierarchy[0][:, 3]) if parent < 0][:self.max_candidates]
+
+        num_labels, labels = cv2.connectedComponents(bitmap, connectivity=8)
+        labels = labels.ravel()
+        foreground = np.flatnonzero(bitmap)
+        foreground_labels = labels[foreground]
+        component_scores = np.bincount(foreground_labels, weights=pred.ravel()[foreground], minlength=num_labels) \
+            / np.maximum(np.bincount(foreground_labels, minlength=num_labels), 1)
+        first_points = np.array([c[0, 0] for c in contours])
+        scores = component_scores[labels[first_points[:, 1] * width + first_points[:, 0]]].astype(np.float32)
+
+        rects = [cv2.minAreaRect(c) for c in contours]
+        centers = np.array([r[0] for r in rects], dtype=np.float32)
+        sizes = np.array([r[1] for r in rects], dtype=np.float32)
+        angles = np.array([r[2] for r in rects], dtype=np.float32)
+
+        keep = (sizes.min(axis=1) >= self.min_size) & (scores >= self.box_thresh)
+        centers, sizes, angles, scores = centers[keep], sizes[keep], angles[keep], scores[keep]
+
+        # Offset distance of the unclip: area * ratio / perimeter
+        distance = sizes[:, 0] * sizes[:, 1] * self.unclip_ratio / (2 * (sizes[:, 0] + sizes[:, 1]))
+        sizes = sizes + 2 * distance[:, None]
+        keep = sizes.min(axis=1) >= self.min_size + 2
+        centers, sizes, angles, scores = centers[keep], sizes[keep], angles[keep], scores[keep]
+        if len(scores) == 0:
+            return empty
+
+        boxes = _order_mini_boxes(_box_points(centers, sizes, angles))
+        boxes[:, :, 0] = np.clip(np.round(boxes[:, :, 0] / width * dest_width), 0, dest_width)
+        boxes[:, :, 1] = np.clip(np.round(boxes[:, :, 1] / height * dest_height), 0, dest_height)
+        # Start at the corner closest to the origin
+        start = boxes.sum(axis=2).argmin(axis=1)
+        boxes = boxes[np.arange(len(boxes))[:, None], (np.arange(4)[None] + start[:, None]) % 4]
+        return boxes.astype(np.int64), scores
+
     def unclip(self, box, unclip_ratio=1.8):
         poly = Polygon(box)
         distance = poly.area * unclip_ratio / poly.length
@@ -185,3 +256,23 @@ class SegDetectorRepresenter():
         box[:, 1] = box[:, 1] - ymin
         cv2.fillPoly(mask, box.reshape(1, -1, 2).astype(np.int32), 1)
         return cv2.mean(bitmap[ymin:ymax + 1, xmin:xmax + 1], mask)[0]
+
+
+def _box_points(centers: np.ndarray, sizes: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """cv2.boxPoints for (N,) rotated rectangles, returns (N, 4, 2)."""
+    rad = np.deg2rad(angles)
+    b = np.cos(rad) * 0.5
+    a = np.sin(rad) * 0.5
+    w, h = sizes[:, 0], sizes[:, 1]
+    p0 = np.stack([centers[:, 0] - a * h - b * w, centers[:, 1] + b * h - a * w], axis=-1)
+    p1 = np.stack([centers[:, 0] + a * h - b * w, centers[:, 1] - b * h - a * w], axis=-1)
+    return np.stack([p0, p1, 2 * centers - p0, 2 * centers - p1], axis=1)
+
+
+def _order_mini_boxes(points: np.ndarray) -> np.ndarray:
+    """The corner order of SegDetectorRepresenter.get_mini_boxes for (N, 4, 2) box points."""
+    points = np.take_along_axis(points, np.argsort(points[:, :, 0], axis=1, kind='stable')[:, :, None], axis=1)
+    left = points[:, 1, 1] > points[:, 0, 1]
+    right = points[:, 3, 1] > points[:, 2, 1]
+    order = np.stack([np.where(left, 0, 1), np.where(right, 2, 3), np.where(right, 3, 2), np.where(left, 1, 0)], axis=1)
+    return np.take_along_axis(points, order[:, :, None], axis=1)
@@ -0,0 +1,155 @@
+"""
+Precision, memory layout and compilation of the torch detector models.
+
+Detectors run their torch modules through `TorchInference` instead of calling them
+directly. It keeps the fp32 weights and applies the `InferenceMode` per call:
+
+- fp16/bf16 through `torch.autocast`, so switching modes never reloads a model and
+  numerically sensitive ops (normalization, sigmoid) stay in float32
+- channels-last weights and inputs, faster convolutions on most GPUs and CPUs
+- `torch.compile`, with the inductor FX graph cache enabled and placed in the model
+  directory so compiled graphs survive restarts. If compilation fails the module
+  runs eagerly instead
+
+Outputs are always returned as float32, so the post-processing is the same in every
+mode. `box_agreement` compares the boxes of a reduced mode with the fp32 ones, the
+detectors use it to check a mode on first use (`OfflineDetector`).
+"""
+
+import os
+from contextlib import nullcontext
+from typing import List, NamedTuple
+
+import numpy as np
+import torch
+
+from ..config import DetectorConfig
+from ..utils import Quadrilateral, ModelWrapper
+from ..utils.log import get_logger
+
+logger = get_logger('detection')
+
+TORCH_DTYPE_MAP = {
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
+
+
+class InferenceMode(NamedTuple):
+    precision: str = 'fp32'
+    channels_last: bool = False
+    compile: bool = False
+
+    @classmethod
+    def from_config(cls, config: DetectorConfig) -> 'InferenceMode':
+        return cls(str(config.det_precision), config.det_channels_last, config.det_compile)
+
+    @property
+    def is_reference(self) -> bool:
+        """fp32 without compilation, the mode other modes are checked against."""
+        return self.precision == 'fp32' and not self.compile
+
+
+_compile_cache_enabled = False
+
+def enable_compile_cache():
+    """Persists the compiled graphs in the model directory, unless configured otherwise."""
+    global _compile_cache_enabled
+    if _compile_cache_enabled:
+        return
+    _compile_cache_enabled = True
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(ModelWrapper._MODEL_DIR, 'torch_compile_cache'))
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except Exception as e:
+        logger.debug(f'Could not enable the inductor graph cache: {e}')
+
+
+def _to_float32(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (tuple, list)):
+        return type(outputs)(_to_float32(o) for o in outputs)
+    return outputs
+
+
+class TorchInference:
+    """Calls `model` like the module itself, in the current inference mode."""
+
+    def __init__(self, model: torch.nn.Module, device: str):
+        self.model = model
+        self.device = device
+        self.device_type = str(device).split(':')[0]
+        self.mode = InferenceMode()
+        self._channels_last = False
+        self._compiled = None
+        self._compile_failed = False
+
+    def set_mode(self, mode: InferenceMode):
+        if mode.precision == 'fp16' and self.device_type == 'cpu':
+            # CPU kernels for half precision are mostly emulated, bf16 is the fast path there
+            mode = mode._replace(precision='bf16')
+        if mode.compile and self._compile_failed:
+            mode = mode._replace(compile=False)
+        if mode.channels_last != self._channels_last:
+            self.model.to(memory_format=torch.channels_last if mode.channels_last else torch.contiguous_format)
+            self._channels_last = mode.channels_last
+        self.mode = mode
+
+    def _module(self):
+        if not self.mode.compile:
+            return self.model
+        if self._compiled is None:
+            enable_compile_cache()
+            # Detection sizes vary with the page, avoid recompiling for every shape
+            self._compiled = torch.compile(self.model, dynamic=True)
+        return self._compiled
+
+    def _autocast(self):
+        dtype = TORCH_DTYPE_MAP.get(self.mode.precision)
+        if dtype is None:
+            return nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=dtype)
+
+    def __call__(self, *args):
+        if self.mode.channels_last:
+            args = [a.contiguous(memory_format=torch.channels_last) if isinstance(a, torch.Tensor) and a.dim() == 4 else a
+                    for a in args]
+        with torch.no_grad(), self._autocast():
+            if not self.mode.compile:
+                return _to_float32(self.model(*args))
+            try:
+                outputs = self._module()(*args)
+            except Exception as e:
+                logger.warning(f'torch.compile failed, running the detector without it: {e}')
+                self._compile_failed = True
+                self.mode = self.mode._replace(compile=False)
+                outputs = self.model(*args)
+        return _to_float32(outputs)
+
+
+def _bounds(textlines: List[Quadrilateral]) -> np.ndarray:
+    pts = np.stack([txtln.pts for txtln in textlines]).astype(np.float64)
+    return np.concatenate([pts.min(axis=1), pts.max(axis=1)], axis=1)
+
+
+def box_agreement(reference: List[Quadrilateral], textlines: List[Quadrilateral], min_iou: float = 0.5) -> float:
+    """
+    Share of boxes of either list that overlap a box of the other list by at least
+    `min_iou` (of their bounding rectangles). 1 if both are empty.
+    """
+    if not reference and not textlines:
+        return 1.
+    if not reference or not textlines:
+        return 0.
+    a, b = _bounds(reference), _bounds(textlines)
+    w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    iou = inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+    matched = (iou.max(axis=1) >= min_iou).sum() + (iou.max(axis=0) >= min_iou).sum()
+    return matched / (len(reference) + len(textlines))
@@ -1,5 +1,6 @@
 
 import asyncio
+import contextvars
 import cv2
 import json
 import langcodes
@@ -11,8 +12,10 @@ import logging
 import sys
 import traceback
 import numpy as np
+from bisect import bisect_right
+from contextlib import asynccontextmanager
 from PIL import Image
-from typing import Optional, Any, List
+from typing import Optional, Any, Callable, List
 import py3langid as langid
 
 from .config import Config, Colorizer, Detector, Translator, Renderer, Inpainter
@@ -26,13 +29,17 @@ from .utils import (
     visualize_textblocks,
     is_valuable_text,
     sort_regions,
+    get_sorted_panels,
     get_color_name,
     rgb2hex,
     TextBlock,
-    imwrite_unicode
+    imwrite_unicode,
+    get_output_writer,
+    get_tracer,
+    trace_stage
 )
 
-from .detection import dispatch as dispatch_detection, prepare as prepare_detection, unload as unload_detection
+from .detection import dispatch as dispatch_detection, dispatch_batch as dispatch_detection_batch, prepare as prepare_detection, unload as unload_detection, InferenceMode
 from .upscaling import dispatch as dispatch_upscaling, prepare as prepare_upscaling, unload as unload_upscaling
 from .ocr import dispatch as dispatch_ocr, prepare as prepare_ocr, unload as unload_ocr
 from .textline_merge import dispatch as dispatch_textline_merge
@@ -42,8 +49,11 @@ from .translators import (
     dispatch as dispatch_translation,
     prepare as prepare_translation,
     unload as unload_translation,
+    pack_pages,
 )
 from .translators.common import ISO_639_1_TO_VALID_LANGUAGES
+from .translators.client_pool import configure_client_pool
+from .translators.streaming import nested_partial_results
 from .colorization import dispatch as dispatch_colorization, prepare as prepare_colorization, unload as unload_colorization
 from .rendering import dispatch as dispatch_rendering, dispatch_eng_render, dispatch_eng_render_pillow
 
@@ -97,6 +107,51 @@ def apply_dictionary(text, dictionary):
             logger.info(f'Line {line_number}: Replaced "{original_text}" with "{text}" using pattern "{pattern.pattern}" and value "{value}"')
     return text
 
+def _stage_trace_attrs(config: Config, ctx: Context, *args, **kwargs) -> dict:
+    """Input sizes of a pipeline stage for the tracer."""
+    attrs = {}
+    if ctx.img_rgb is not None:
+        attrs['pixels'] = int(ctx.img_rgb.shape[0] * ctx.img_rgb.shape[1])
+    elif ctx.input is not None:
+        attrs['pixels'] = ctx.input.width * ctx.input.height
+    regions = ctx.text_regions if ctx.text_regions else ctx.textlines
+    if regions and isinstance(regions, list):
+        attrs['regions'] = len(regions)
+        attrs['chars'] = sum(len(getattr(r, 'text', None) or '') for r in regions)
+    return attrs
+
+def _page_trace_attrs(image: Image.Image, config: Config, image_name: str = None, *args, **kwargs) -> dict:
+    attrs = {'pixels': image.width * image.height}
+    name = image_name or getattr(image, 'name', None)
+    if name:
+        attrs['image'] = os.path.basename(name)
+    return attrs
+
+class _TranslationProgress:
+    """
+    Line progress of a translation, fed by the partial results of the translators.
+    Lines received from streamed responses are provisional, they count until the
+    final lines catch up.
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.final = 0
+        self.streamed = 0
+        self.reported = -1
+        self.changed = asyncio.Event()
+
+    @property
+    def done(self) -> int:
+        return min(self.total, max(self.final, self.streamed))
+
+    def on_line(self, index: int, translation: str):
+        self.final += 1
+        self.changed.set()
+
+    def on_streamed(self, count: int):
+        self.streamed += count
+        self.changed.set()
+
 class MangaTranslator:
     verbose: bool
     ignore_errors: bool
@@ -107,6 +162,8 @@ class MangaTranslator:
     _progress_hooks: list[Any]
     result_sub_folder: str
     batch_size: int
+    # Whether the mode calls export_trace() at the end of its jobs, --trace is ignored otherwise
+    _exports_trace = False
 
     def __init__(self, params: dict = {}):
         self.pre_dict = params.get('pre_dict', None)
@@ -154,6 +211,9 @@ class MangaTranslator:
         self._current_image_context = None  # 存储当前处理图片的上下文信息
         self._saved_image_contexts = {}     # 存储批量处理中每个图片的上下文信息
         
+        # 结果图与调试图片通过后台写入线程池保存，避免阻塞事件循环
+        self._output_writer = get_output_writer(params.get('io_workers', 2), params.get('io_queue_size', 8))
+
         # 设置日志文件
         self._setup_log_file()
 
@@ -315,6 +375,17 @@ class MangaTranslator:
         self.save_mask = not params.get('no_save_mask', False)
         self.template = params.get('template', False)
         self.is_ui_mode = params.get('is_ui_mode', False)
+        # Per-stage tracing, exported as a Chrome trace by export_trace()
+        self.trace_file = params.get('trace_file', None)
+        if (params.get('trace', False) or self.trace_file) and not self._exports_trace:
+            # Spans would pile up without ever being written
+            logger.warning('--trace is only supported in local mode, tracing stays disabled')
+            self.trace_file = None
+        elif params.get('trace', False) or self.trace_file:
+            if not self.trace_file:
+                from datetime import datetime
+                self.trace_file = os.path.join(BASE_PATH, 'result', f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            get_tracer().enable()
         
         
         # batch_concurrent 已在初始化时设置并验证
@@ -368,6 +439,7 @@ class MangaTranslator:
     def using_gpu(self):
         return self.device.startswith('cuda') or self.device == 'mps'
 
+    @trace_stage('page', 'page', _page_trace_attrs)
     async def translate(self, image: Image.Image, config: Config, image_name: str = None, skip_context_save: bool = False) -> Context:
         """
         Translates a single image.
@@ -402,56 +474,7 @@ class MangaTranslator:
             loaded_regions, loaded_mask, mask_is_refined = self._load_text_and_regions_from_file(ctx.image_name, config)
             if loaded_regions:
                 logger.info("Successfully loaded translations. Skipping detection, OCR and translation.")
-
-                # In --load-text mode, TextBlock objects are missing calculated fields like font_size.
-                # We must add a reasonable font_size based on the bounding box height to prevent rendering errors.
-                for region in loaded_regions:
-                    if not hasattr(region, 'font_size') or not region.font_size:
-                        box_height = np.max(region.lines[:,:,1]) - np.min(region.lines[:,:,1])
-                        # Heuristic: Set font size to 80% of box height, but cap at a max of 128 to be safe.
-                        region.font_size = min(int(box_height * 0.8), 128)
-
-                ctx.text_regions = loaded_regions
-                ctx.img_rgb, ctx.img_alpha = load_image(ctx.input)
-
-                # 加载文本模式不需要翻译处理，直接跳过到渲染阶段
-                
-                if loaded_mask is not None:
-                    if mask_is_refined:
-                        ctx.mask = loaded_mask
-                    else:
-                        ctx.mask_raw = loaded_mask
-                else:
-                    # Manually create raw mask from loaded regions if not present in JSON
-                    if ctx.mask_raw is None:
-                        logger.debug("Creating raw mask from loaded regions for --load-text mode (mask_raw not in JSON).")
-                        mask = np.zeros_like(ctx.img_rgb[:, :, 0])
-                        polygons = [p.reshape((-1, 1, 2)) for r in ctx.text_regions for p in r.lines]
-                        cv2.fillPoly(mask, polygons, 255)
-                        ctx.mask_raw = mask
-                
-                # Mask generation
-                if ctx.mask is None:  # Only run mask refinement if no pre-refined mask is loaded
-                    await self._report_progress('mask-generation')
-                    ctx.mask = await self._run_mask_refinement(config, ctx)
-                else:
-                    logger.info("Using pre-refined mask from JSON, skipping mask refinement")
-                if self.verbose and ctx.mask is not None:
-                    imwrite_unicode(self._result_path('mask_final.png'), ctx.mask, logger)
-
-                # Inpainting
-                await self._report_progress('inpainting')
-                ctx.img_inpainted = await self._run_inpainting(config, ctx)
-                if self.verbose:
-                    imwrite_unicode(self._result_path('inpainted.png'), cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR), logger)
-
-                # Rendering
-                await self._report_progress('rendering')
-                ctx.img_rendered = await self._run_text_rendering(config, ctx)
-                
-                await self._report_progress('finished', True)
-                ctx.result = dump_image(ctx.input, ctx.img_rendered, ctx.img_alpha)
-                return await self._revert_upscale(config, ctx)
+                return await self._render_loaded_regions(config, ctx, loaded_regions, loaded_mask, mask_is_refined)
             else:
                 logger.warning("--load-text specified, but no translation file found or failed to parse. Proceeding with normal translation.")
 
@@ -462,7 +485,7 @@ class MangaTranslator:
                 if len(input_img.shape) == 3:  # 彩色图片，转换BGR顺序
                     input_img = cv2.cvtColor(input_img, cv2.COLOR_RGB2BGR)
                 result_path = self._result_path('input.png')
-                imwrite_unicode(result_path, input_img, logger)
+                await self._write_debug_image(result_path, input_img)
             except Exception as e:
                 logger.error(f"Error saving input.png debug image: {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -497,6 +520,74 @@ class MangaTranslator:
 
         return ctx
 
+    async def render_regions(self, image: Image.Image, regions: List[TextBlock], config: Config,
+                             mask: Optional[np.ndarray] = None, mask_is_refined: bool = False) -> Context:
+        """
+        Renders already translated regions onto an image, skipping detection, OCR and translation.
+        Same as --load-text but regions and mask are passed in memory instead of through a JSON file,
+        so a long-lived translator can render many pages with its models kept loaded.
+        """
+        ctx = Context()
+        ctx.input = image
+        ctx.image_name = getattr(image, 'name', None)
+        ctx.result = None
+        ctx.verbose = self.verbose
+        if self.verbose:
+            self._set_image_context(config, image)
+        return await self._render_loaded_regions(config, ctx, regions, mask, mask_is_refined)
+
+    async def _render_loaded_regions(self, config: Config, ctx: Context, loaded_regions: List[TextBlock],
+                                     loaded_mask: Optional[np.ndarray], mask_is_refined: bool) -> Context:
+        # In --load-text mode, TextBlock objects are missing calculated fields like font_size.
+        # We must add a reasonable font_size based on the bounding box height to prevent rendering errors.
+        for region in loaded_regions:
+            if not hasattr(region, 'font_size') or not region.font_size:
+                box_height = np.max(region.lines[:,:,1]) - np.min(region.lines[:,:,1])
+                # Heuristic: Set font size to 80% of box height, but cap at a max of 128 to be safe.
+                region.font_size = min(int(box_height * 0.8), 128)
+
+        ctx.text_regions = loaded_regions
+        ctx.img_rgb, ctx.img_alpha = load_image(ctx.input)
+
+        # 加载文本模式不需要翻译处理，直接跳过到渲染阶段
+        
+        if loaded_mask is not None:
+            if mask_is_refined:
+                ctx.mask = loaded_mask
+            else:
+                ctx.mask_raw = loaded_mask
+        else:
+            # Manually create raw mask from loaded regions if not present in JSON
+            if ctx.mask_raw is None:
+                logger.debug("Creating raw mask from loaded regions for --load-text mode (mask_raw not in JSON).")
+                mask = np.zeros_like(ctx.img_rgb[:, :, 0])
+                polygons = [p.reshape((-1, 1, 2)) for r in ctx.text_regions for p in r.lines]
+                cv2.fillPoly(mask, polygons, 255)
+                ctx.mask_raw = mask
+        
+        # Mask generation
+        if ctx.mask is None:  # Only run mask refinement if no pre-refined mask is loaded
+            await self._report_progress('mask-generation')
+            ctx.mask = await self._run_mask_refinement(config, ctx)
+        else:
+            logger.info("Using pre-refined mask from JSON, skipping mask refinement")
+        if self.verbose and ctx.mask is not None:
+            await self._write_debug_image(self._result_path('mask_final.png'), ctx.mask)
+
+        # Inpainting
+        await self._report_progress('inpainting')
+        ctx.img_inpainted = await self._run_inpainting(config, ctx)
+        if self.verbose:
+            await self._write_debug_image(self._result_path('inpainted.png'), cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR))
+
+        # Rendering
+        await self._report_progress('rendering')
+        ctx.img_rendered = await self._run_text_rendering(config, ctx)
+        
+        await self._report_progress('finished', True)
+        ctx.result = dump_image(ctx.input, ctx.img_rendered, ctx.img_alpha)
+        return await self._revert_upscale(config, ctx)
+
     def _save_text_to_file(self, image_path: str, ctx: Context):
         text_output_file = self.text_output_file
         if not text_output_file:
@@ -729,7 +820,7 @@ class MangaTranslator:
             ctx.mask = None
 
         if self.verbose and ctx.mask_raw is not None:
-            imwrite_unicode(self._result_path('mask_raw.png'), ctx.mask_raw, logger)
+            await self._write_debug_image(self._result_path('mask_raw.png'), ctx.mask_raw)
 
         if not ctx.textlines:
             await self._report_progress('skip-no-regions', True)
@@ -741,7 +832,7 @@ class MangaTranslator:
             img_bbox_raw = np.copy(ctx.img_rgb)
             for txtln in ctx.textlines:
                 cv2.polylines(img_bbox_raw, [txtln.pts], True, color=(255, 0, 0), thickness=2)
-            imwrite_unicode(self._result_path('bboxes_unfiltered.png'), cv2.cvtColor(img_bbox_raw, cv2.COLOR_RGB2BGR), logger)
+            await self._write_debug_image(self._result_path('bboxes_unfiltered.png'), cv2.cvtColor(img_bbox_raw, cv2.COLOR_RGB2BGR))
 
         # -- OCR
         await self._report_progress('ocr')
@@ -772,8 +863,9 @@ class MangaTranslator:
         if self.verbose and ctx.text_regions:
             show_panels = not config.force_simple_sort  # 当不使用简单排序时显示panel
             bboxes = visualize_textblocks(cv2.cvtColor(ctx.img_rgb, cv2.COLOR_BGR2RGB), ctx.text_regions, 
-                                        show_panels=show_panels, img_rgb=ctx.img_rgb, right_to_left=config.render.rtl)
-            imwrite_unicode(self._result_path('bboxes.png'), bboxes, logger)
+                                        show_panels=show_panels, img_rgb=ctx.img_rgb, right_to_left=config.render.rtl,
+                                        panels=ctx.panels)
+            await self._write_debug_image(self._result_path('bboxes.png'), bboxes)
 
         # Apply pre-dictionary after textline merge
         pre_dict = load_dictionary(self.pre_dict)
@@ -875,8 +967,8 @@ class MangaTranslator:
         if self.verbose and ctx.mask is not None:
             inpaint_input_img = await dispatch_inpainting(Inpainter.none, ctx.img_rgb, ctx.mask, config.inpainter,config.inpainter.inpainting_size,
                                                           self.device, self.verbose)
-            imwrite_unicode(self._result_path('inpaint_input.png'), cv2.cvtColor(inpaint_input_img, cv2.COLOR_RGB2BGR), logger)
-            imwrite_unicode(self._result_path('mask_final.png'), ctx.mask, logger)
+            await self._write_debug_image(self._result_path('inpaint_input.png'), cv2.cvtColor(inpaint_input_img, cv2.COLOR_RGB2BGR))
+            await self._write_debug_image(self._result_path('mask_final.png'), ctx.mask)
 
         # -- Inpainting
         await self._report_progress('inpainting')
@@ -894,7 +986,7 @@ class MangaTranslator:
         if self.verbose:
             try:
                 inpainted_path = self._result_path('inpainted.png')
-                imwrite_unicode(inpainted_path, cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR), logger)
+                await self._write_debug_image(inpainted_path, cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR))
             except Exception as e:
                 logger.error(f"Error saving inpainted.png debug image: {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -934,7 +1026,7 @@ class MangaTranslator:
                 if len(final_img.shape) == 3:  # 彩色图片，转换BGR顺序
                     final_img = cv2.cvtColor(final_img, cv2.COLOR_RGB2BGR)
                 final_path = self._result_path('final.png')
-                imwrite_unicode(final_path, final_img, logger)
+                await self._write_debug_image(final_path, final_img)
             except Exception as e:
                 logger.error(f"Error saving final.png debug image: {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -961,6 +1053,7 @@ class MangaTranslator:
 
         return ctx
 
+    @trace_stage('colorization', 'stage', _stage_trace_attrs)
     async def _run_colorizer(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("colorizer", config.colorizer.colorizer)] = current_time
@@ -974,21 +1067,66 @@ class MangaTranslator:
             **ctx
         )
 
+    @trace_stage('upscaling', 'stage', _stage_trace_attrs)
     async def _run_upscaling(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("upscaling", config.upscale.upscaler)] = current_time
-        return (await dispatch_upscaling(config.upscale.upscaler, [ctx.img_colorized], config.upscale.upscale_ratio, self.device))[0]
+        return (await dispatch_upscaling(config.upscale.upscaler, [ctx.img_colorized], config.upscale.upscale_ratio, self.device,
+                                         config.upscale.tile_size, config.upscale.tile_overlap,
+                                         config.upscale.tile_batch_size, config.upscale.memory_budget_mb))[0]
 
+    @trace_stage('detection', 'stage', _stage_trace_attrs)
     async def _run_detection(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("detection", config.detector.detector)] = current_time
+        chapter = self._detection_chapter(ctx.input, ctx.image_name)
         result = await dispatch_detection(config.detector.detector, ctx.img_rgb, config.detector.detection_size, config.detector.text_threshold,
                                         config.detector.box_threshold,
                                         config.detector.unclip_ratio, config.detector.det_invert, config.detector.det_gamma_correct, config.detector.det_rotate,
                                         config.detector.det_auto_rotate,
-                                        self.device, self.verbose)        
+                                        self.device, self.verbose, InferenceMode.from_config(config.detector), chapter)
         return result
 
+    @staticmethod
+    def _detection_chapter(image, image_name: str = None) -> Optional[str]:
+        # 同一文件夹的页面视为同一章节，自动旋转时复用方向判断
+        image_path = image_name or getattr(image, 'filename', None)
+        return os.path.dirname(os.path.abspath(image_path)) if image_path else None
+
+    async def _run_detection_batch(self, pages: List[tuple]) -> dict:
+        """
+        多页批量检测：没有彩色化和超分时检测输入就是原图，检测设置相同的页面一起送入检测模型
+        返回 {页面索引: (textlines, mask_raw, mask)}，不适用或检测失败的页面不在结果中，之后按单页流程检测
+        """
+        groups = {}
+        for i, (image, config) in enumerate(pages):
+            if config.colorizer.colorizer != Colorizer.none or config.upscale.upscale_ratio or config.detector.det_batch_size == 1:
+                continue
+            groups.setdefault(config.detector.model_dump_json(), []).append(i)
+
+        results = {}
+        for indices in groups.values():
+            if len(indices) < 2:
+                continue
+            detector_config = pages[indices[0]][1].detector
+            self._model_usage_timestamps[("detection", detector_config.detector)] = time.time()
+            try:
+                images = [load_image(pages[i][0])[0] for i in indices]
+                chapters = [self._detection_chapter(pages[i][0]) for i in indices]
+                detections = await dispatch_detection_batch(detector_config.detector, images, detector_config.detection_size,
+                                                            detector_config.text_threshold, detector_config.box_threshold,
+                                                            detector_config.unclip_ratio, detector_config.det_invert,
+                                                            detector_config.det_gamma_correct, detector_config.det_rotate,
+                                                            detector_config.det_auto_rotate, self.device, self.verbose,
+                                                            InferenceMode.from_config(detector_config), chapters,
+                                                            detector_config.det_batch_size)
+            except Exception as e:
+                logger.warning(f'Batch detection failed, detecting pages one by one: {e}')
+                logger.debug(traceback.format_exc())
+                continue
+            results.update(zip(indices, detections))
+        return results
+
     async def _unload_model(self, tool: str, model: str):
         logger.info(f"Unloading {tool} model: {model}")
         match tool:
@@ -1020,6 +1158,7 @@ class MangaTranslator:
                     del self._model_usage_timestamps[(tool, model)]
             await asyncio.sleep(1)
 
+    @trace_stage('ocr', 'stage', _stage_trace_attrs)
     async def _run_ocr(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("ocr", config.ocr.ocr)] = current_time
@@ -1064,6 +1203,7 @@ class MangaTranslator:
                 new_textlines.append(textline)
         return new_textlines
 
+    @trace_stage('textline_merge', 'stage', _stage_trace_attrs)
     async def _run_textline_merge(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("textline_merge", "textline_merge")] = current_time
@@ -1204,11 +1344,20 @@ class MangaTranslator:
                 new_text_regions.append(region)
         text_regions = new_text_regions
 
+        # Panels are kept on the context so that rendering and the UI can reuse them
+        ctx.panels = None
+        if not config.force_simple_sort and text_regions:
+            try:
+                ctx.panels = get_sorted_panels(ctx.img_rgb, config.render.rtl)
+            except Exception as e:
+                logger.warning(f'Panel detection failed ({e.__class__.__name__}: {str(e)[:100]}), using simple text sorting')
+
         text_regions = sort_regions(
             text_regions,
             right_to_left=config.render.rtl,
-            img=ctx.img_rgb,
-            force_simple_sort=config.force_simple_sort
+            # Without panels (detection disabled or failed) fall back to the simple sort
+            force_simple_sort=config.force_simple_sort or ctx.panels is None,
+            panels=ctx.panels
         )   
         
         
@@ -1292,6 +1441,7 @@ class MangaTranslator:
         context_type = "original text" if use_original_text else "translation results"
         return f"Here are the previous {context_type} for reference:\n" + "\n".join(numbered)
 
+    @trace_stage('translator', 'model', lambda config, texts, *args, **kwargs: {'regions': len(texts), 'chars': sum(len(t or '') for t in texts)})
     async def _dispatch_with_context(self, config: Config, texts: list[str], ctx: Context):
         # 计算实际要使用的上下文页数和跳过的空页数
         # Calculate the actual number of context pages to use and empty pages to skip
@@ -1317,6 +1467,7 @@ class MangaTranslator:
         # 如果是 ChatGPT 或 ChatGPT2Stage 翻译器，则专门处理上下文注入
         # Special handling for ChatGPT and ChatGPT2Stage translators: inject context
         if config.translator.translator in [Translator.chatgpt, Translator.chatgpt_2stage]:
+            configure_client_pool(config.translator)
             if config.translator.translator == Translator.chatgpt:
                 from .translators.chatgpt import OpenAITranslator
                 translator = OpenAITranslator()
@@ -1325,6 +1476,7 @@ class MangaTranslator:
                 translator = ChatGPT2StageTranslator()
                 
             translator.parse_args(config.translator)
+            translator.configure_rate_limit(config.translator)
             translator.set_prev_context(prev_ctx)
 
             if pages_used > 0:
@@ -1353,6 +1505,7 @@ class MangaTranslator:
             'cpu' if self._gpu_limited_memory else self.device
         )
 
+    @trace_stage('translation', 'stage', _stage_trace_attrs)
     async def _run_text_translation(self, config: Config, ctx: Context):
         # 检查text_regions是否为None或空
         if not ctx.text_regions:
@@ -1371,7 +1524,8 @@ class MangaTranslator:
                 region.translation = ""  # 空翻译将创建空白区域 / Empty translation will create blank areas
         else: # Actual network translation
             texts = [region.text.replace('\ufffd', '') for region in ctx.text_regions]
-            translated_sentences = await self._dispatch_with_context(config, texts, ctx)
+            async with self._track_translation_progress(len(texts)):
+                translated_sentences = await self._dispatch_with_context(config, texts, ctx)
 
             for region, translation in zip(ctx.text_regions, translated_sentences):
                 if config.render.uppercase:
@@ -1630,16 +1784,20 @@ class MangaTranslator:
 
         return new_text_regions
 
+    @trace_stage('mask_refinement', 'stage', _stage_trace_attrs)
     async def _run_mask_refinement(self, config: Config, ctx: Context):
         return await dispatch_mask_refinement(ctx.text_regions, ctx.img_rgb, ctx.mask_raw, 'fit_text',
-                                              config.mask_dilation_offset, config.ocr.ignore_bubble, self.verbose,self.kernel_size)
+                                              config.mask_dilation_offset, config.ocr.ignore_bubble, self.verbose,self.kernel_size,
+                                              config.mask_refinement)
 
+    @trace_stage('inpainting', 'stage', _stage_trace_attrs)
     async def _run_inpainting(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("inpainting", config.inpainter.inpainter)] = current_time
         return await dispatch_inpainting(config.inpainter.inpainter, ctx.img_rgb, ctx.mask, config.inpainter, config.inpainter.inpainting_size, self.device,
                                          self.verbose)
 
+    @trace_stage('rendering', 'stage', _stage_trace_attrs)
     async def _run_text_rendering(self, config: Config, ctx: Context):
         current_time = time.time()
         self._model_usage_timestamps[("rendering", config.render.renderer)] = current_time
@@ -1689,6 +1847,23 @@ class MangaTranslator:
             os.makedirs(dir_to_create, exist_ok=True)
         return result_path
 
+    async def _write_debug_image(self, path: str, img: np.ndarray):
+        """Queues a debug image on the output writer, `img` must not be modified afterwards."""
+        await self._output_writer.write_image_async(path, img)
+
+    def export_trace(self):
+        """
+        Writes the spans of the job as a Chrome trace, logs a per-stage summary and resets the
+        spans so the next job starts from scratch. A later job overwrites the trace file.
+        """
+        tracer = get_tracer()
+        if not tracer.enabled or not tracer.spans:
+            return
+        tracer.export_chrome_trace(self.trace_file)
+        logger.info('Stage timings:\n' + tracer.summary_table())
+        logger.info(f'Trace written to: "{self.trace_file}" (open in chrome://tracing or https://ui.perfetto.dev)')
+        tracer.reset()
+
     def add_progress_hook(self, ph):
         self._progress_hooks.append(ph)
 
@@ -1696,6 +1871,33 @@ class MangaTranslator:
         for ph in self._progress_hooks:
             await ph(state, finished)
 
+    @asynccontextmanager
+    async def _track_translation_progress(self, total: int):
+        """
+        Reports `translating-partial:{done}/{total}` while the translators inside the block
+        report translated lines. Hook errors (e.g. TranslationInterrupt) are raised on exit.
+        """
+        progress = _TranslationProgress(total)
+
+        async def report():
+            while True:
+                await progress.changed.wait()
+                progress.changed.clear()
+                if progress.done != progress.reported:
+                    progress.reported = progress.done
+                    await self._report_progress(f'translating-partial:{progress.done}/{progress.total}')
+
+        reporter = asyncio.create_task(report())
+        try:
+            with nested_partial_results(progress.on_line, progress.on_streamed):
+                yield progress
+        finally:
+            reporter.cancel()
+            try:
+                await reporter
+            except asyncio.CancelledError:
+                pass
+
     def _add_logger_hook(self):
         # TODO: Pass ctx to logger hook
         LOG_MESSAGES = {
@@ -1728,6 +1930,7 @@ class MangaTranslator:
 
         self.add_progress_hook(ph)
 
+    @trace_stage('batch', 'batch', lambda images_with_configs, *args, **kwargs: {'pages': len(images_with_configs)})
     async def translate_batch(self, images_with_configs: List[tuple], batch_size: int = None, image_names: List[str] = None) -> List[Context]:
         """
         批量翻译多张图片，在翻译阶段进行批量处理以提高效率
@@ -1771,9 +1974,15 @@ class MangaTranslator:
         # 处理所有图片到翻译之前的步骤
         logger.debug('Starting pre-processing phase...')
         pre_translation_contexts = []
-        
+        detections = {}
+
         for i, (image, config) in enumerate(images_with_configs):
             logger.debug(f'Pre-processing image {i+1}/{len(images_with_configs)}')
+
+            # 每 batch_size 页先一起检测，检测模型一次处理多页
+            if i % batch_size == 0:
+                chunk = images_with_configs[i:i + batch_size]
+                detections = {i + j: detection for j, detection in (await self._run_detection_batch(chunk)).items()}
             
             # 简化的内存检查
             if memory_optimization_enabled:
@@ -1798,7 +2007,7 @@ class MangaTranslator:
                 if self._current_image_context:
                     image_md5 = self._current_image_context['file_md5']
                     self._save_current_image_context(image_md5)
-                ctx = await self._translate_until_translation(image, config)
+                ctx = await self._translate_until_translation(image, config, detections.pop(i, None))
                 # 保存图片上下文到Context对象中，用于后续批量处理
                 if self._current_image_context:
                     ctx.image_context = self._current_image_context.copy()
@@ -1859,25 +2068,45 @@ class MangaTranslator:
             
         logger.debug(f'Pre-processing completed: {len(pre_translation_contexts)} images')
             
+        # 翻译完成的页面按顺序进入后处理（掩码细化、修复、渲染），与后续页面的翻译重叠进行
+        ready_pages = {}
+        signaled_pages = set()
+        page_ready = asyncio.Event()
+
+        def on_page_translated(i: int, ctx_config_pair: tuple):
+            if i not in signaled_pages:
+                signaled_pages.add(i)
+                ready_pages[i] = ctx_config_pair
+                page_ready.set()
+
+        post_processing = asyncio.create_task(
+            self._post_process_translated_pages(ready_pages, page_ready, len(pre_translation_contexts)))
+
         # 批量翻译处理
         logger.debug('Starting batch translation phase...')
+        total_lines = sum(len(ctx.text_regions) for ctx, _ in pre_translation_contexts if ctx.text_regions)
         try:
-            if self.batch_concurrent:
-                logger.info(f'Using concurrent mode for batch translation')
-                translated_contexts = await self._concurrent_translate_contexts(pre_translation_contexts)
-            else:
-                logger.debug(f'Using standard batch mode for translation')
-                translated_contexts = await self._batch_translate_contexts(pre_translation_contexts, batch_size)
+            async with self._track_translation_progress(total_lines):
+                if self.batch_concurrent:
+                    logger.info(f'Using concurrent mode for batch translation')
+                    translated_contexts = await self._concurrent_translate_contexts(pre_translation_contexts, on_page_translated)
+                else:
+                    logger.debug(f'Using standard batch mode for translation')
+                    translated_contexts = await self._batch_translate_contexts(pre_translation_contexts, batch_size, on_page_translated)
         except MemoryError as e:
             logger.error(f'Memory error in batch translation: {e}')
             if not memory_optimization_enabled:
                 logger.error('Consider enabling memory optimization')
+                post_processing.cancel()
                 raise
                 
             logger.warning('Batch translation failed, switching to individual page translation mode...')
-            # 降级到每页逐个翻译
+            # 降级到每页逐个翻译，已进入后处理的页面不再重新翻译
             translated_contexts = []
-            for ctx, config in pre_translation_contexts:
+            for i, (ctx, config) in enumerate(pre_translation_contexts):
+                if i in signaled_pages:
+                    translated_contexts.append((ctx, config))
+                    continue
                 try:
                     if ctx.text_regions:  # 检查text_regions是否不为None且不为空
                         # 对整页进行翻译处理
@@ -1900,27 +2129,14 @@ class MangaTranslator:
                 except Exception as individual_error:
                     logger.error(f'Individual page translation failed: {individual_error}')
                     translated_contexts.append((ctx, config))
-        
-        # 完成翻译后的处理
-        logger.debug('Starting post-processing phase...')
-        for i, (ctx, config) in enumerate(translated_contexts):
-            try:
-                if ctx.text_regions:
-                    # 恢复预处理阶段保存的图片上下文，确保使用相同的文件夹
-                    # 通过图片计算MD5来恢复上下文
-                    from .utils.generic import get_image_md5
-                    image = ctx.input  # 从context中获取原始图片
-                    image_md5 = get_image_md5(image)
-                    if not self._restore_image_context(image_md5):
-                        # 如果恢复失败，作为fallback重新设置（理论上不应该发生）
-                        logger.warning(f"Failed to restore image context for MD5 {image_md5}, creating new context")
-                        self._set_image_context(config, image)
-                    ctx = await self._complete_translation_pipeline(ctx, config)
-                results.append(ctx)
-                logger.debug(f'Image {i+1} post-processing completed')
-            except Exception as e:
-                logger.error(f'Image {i+1} post-processing error: {e}')
-                results.append(ctx)
+        except BaseException:
+            post_processing.cancel()
+            raise
+
+        # 其余页面（没有提前完成的）交给后处理，等待全部页面完成
+        for i, ctx_config_pair in enumerate(translated_contexts):
+            on_page_translated(i, ctx_config_pair)
+        results = await post_processing
         
         logger.info(f'Batch translation completed: processed {len(results)} images')
 
@@ -1942,9 +2158,43 @@ class MangaTranslator:
         
         return results
 
-    async def _translate_until_translation(self, image: Image.Image, config: Config) -> Context:
+    @trace_stage('post-processing', 'batch', lambda ready_pages, page_ready, total, *args, **kwargs: {'pages': total})
+    async def _post_process_translated_pages(self, ready_pages: dict, page_ready: asyncio.Event, total: int) -> List[Context]:
+        """
+        按页面顺序完成翻译后的处理，页面在 ready_pages 中出现（翻译完成）后立即开始，
+        不等待其余页面的翻译
+        """
+        logger.debug('Starting post-processing phase...')
+        results = []
+        for i in range(total):
+            while i not in ready_pages:
+                page_ready.clear()
+                await page_ready.wait()
+            ctx, config = ready_pages.pop(i)
+            try:
+                if ctx.text_regions:
+                    # 恢复预处理阶段保存的图片上下文，确保使用相同的文件夹
+                    # 通过图片计算MD5来恢复上下文
+                    from .utils.generic import get_image_md5
+                    image = ctx.input  # 从context中获取原始图片
+                    image_md5 = get_image_md5(image)
+                    if not self._restore_image_context(image_md5):
+                        # 如果恢复失败，作为fallback重新设置（理论上不应该发生）
+                        logger.warning(f"Failed to restore image context for MD5 {image_md5}, creating new context")
+                        self._set_image_context(config, image)
+                    ctx = await self._complete_translation_pipeline(ctx, config)
+                results.append(ctx)
+                logger.debug(f'Image {i+1} post-processing completed')
+            except Exception as e:
+                logger.error(f'Image {i+1} post-processing error: {e}')
+                results.append(ctx)
+        return results
+
+    @trace_stage('page-analysis', 'page', lambda image, config, *args, **kwargs: _page_trace_attrs(image, config))
+    async def _translate_until_translation(self, image: Image.Image, config: Config, detection: tuple = None) -> Context:
         """
         执行翻译之前的所有步骤（彩色化、上采样、检测、OCR、文本行合并）
+        detection: 批量检测已得到的 (textlines, mask_raw, mask)，为 None 时在此检测
         """
         ctx = Context()
         ctx.input = image
@@ -1957,7 +2207,7 @@ class MangaTranslator:
                 if len(input_img.shape) == 3:  # 彩色图片，转换BGR顺序
                     input_img = cv2.cvtColor(input_img, cv2.COLOR_RGB2BGR)
                 result_path = self._result_path('input.png')
-                imwrite_unicode(result_path, input_img, logger)
+                await self._write_debug_image(result_path, input_img)
             except Exception as e:
                 logger.error(f"Error saving input.png debug image: {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -2009,7 +2259,10 @@ class MangaTranslator:
         # -- Detection
         await self._report_progress('detection')
         try:
-            ctx.textlines, ctx.mask_raw, ctx.mask = await self._run_detection(config, ctx)
+            if detection is not None:
+                ctx.textlines, ctx.mask_raw, ctx.mask = detection
+            else:
+                ctx.textlines, ctx.mask_raw, ctx.mask = await self._run_detection(config, ctx)
         except Exception as e:  
             logger.error(f"Error during detection:\n{traceback.format_exc()}")  
             if not self.ignore_errors:  
@@ -2019,7 +2272,7 @@ class MangaTranslator:
             ctx.mask = None
 
         if self.verbose and ctx.mask_raw is not None:
-            imwrite_unicode(self._result_path('mask_raw.png'), ctx.mask_raw, logger)
+            await self._write_debug_image(self._result_path('mask_raw.png'), ctx.mask_raw)
 
         if not ctx.textlines:
             await self._report_progress('skip-no-regions', True)
@@ -2030,7 +2283,7 @@ class MangaTranslator:
             img_bbox_raw = np.copy(ctx.img_rgb)
             for txtln in ctx.textlines:
                 cv2.polylines(img_bbox_raw, [txtln.pts], True, color=(255, 0, 0), thickness=2)
-            imwrite_unicode(self._result_path('bboxes_unfiltered.png'), cv2.cvtColor(img_bbox_raw, cv2.COLOR_RGB2BGR), logger)
+            await self._write_debug_image(self._result_path('bboxes_unfiltered.png'), cv2.cvtColor(img_bbox_raw, cv2.COLOR_RGB2BGR))
 
         # -- OCR
         await self._report_progress('ocr')
@@ -2060,8 +2313,9 @@ class MangaTranslator:
         if self.verbose and ctx.text_regions:
             show_panels = not config.force_simple_sort  # 当不使用简单排序时显示panel
             bboxes = visualize_textblocks(cv2.cvtColor(ctx.img_rgb, cv2.COLOR_BGR2RGB), ctx.text_regions, 
-                                        show_panels=show_panels, img_rgb=ctx.img_rgb, right_to_left=config.render.rtl)
-            imwrite_unicode(self._result_path('bboxes.png'), bboxes, logger)
+                                        show_panels=show_panels, img_rgb=ctx.img_rgb, right_to_left=config.render.rtl,
+                                        panels=ctx.panels)
+            await self._write_debug_image(self._result_path('bboxes.png'), bboxes)
 
         # Apply pre-dictionary after textline merge
         pre_dict = load_dictionary(self.pre_dict)
@@ -2085,9 +2339,11 @@ class MangaTranslator:
 
         return ctx
 
-    async def _batch_translate_contexts(self, contexts_with_configs: List[tuple], batch_size: int) -> List[tuple]:
+    async def _batch_translate_contexts(self, contexts_with_configs: List[tuple], batch_size: int,
+                                        on_page_translated: Callable[[int, tuple], None] = None) -> List[tuple]:
         """
         批量处理翻译步骤，防止内存溢出
+        on_page_translated(页面索引, (ctx, config)) 在每个批次完成后对其中的页面调用，后处理可以在下一批次翻译时开始
         """
         results = []
         total_contexts = len(contexts_with_configs)
@@ -2095,6 +2351,7 @@ class MangaTranslator:
         # 按批次处理，防止内存溢出
         for i in range(0, total_contexts, batch_size):
             batch = contexts_with_configs[i:i + batch_size]
+            batch_start = i
             logger.info(f'Processing translation batch {i//batch_size + 1}/{(total_contexts + batch_size - 1)//batch_size}')
             
             # 收集当前批次的所有文本
@@ -2113,6 +2370,7 @@ class MangaTranslator:
             if not all_texts:
                 # 当前批次没有需要翻译的文本
                 results.extend(batch)
+                self._signal_translated_pages(on_page_translated, batch_start, batch)
                 continue
                 
             # 批量翻译
@@ -2269,6 +2527,7 @@ class MangaTranslator:
                         ctx.text_regions = new_text_regions
                         
                 results.extend(batch)
+                self._signal_translated_pages(on_page_translated, batch_start, batch)
                 
             except Exception as e:
                 logger.error(f"Error in batch translation: {e}")
@@ -2284,6 +2543,7 @@ class MangaTranslator:
                         region._alignment = config.render.alignment
                         region._direction = config.render.direction
                 results.extend(batch)
+                self._signal_translated_pages(on_page_translated, batch_start, batch)
                 
             # 强制垃圾回收以释放内存
             import gc
@@ -2293,9 +2553,17 @@ class MangaTranslator:
                 
         return results
 
-    async def _concurrent_translate_contexts(self, contexts_with_configs: List[tuple]) -> List[tuple]:
+    @staticmethod
+    def _signal_translated_pages(on_page_translated: Optional[Callable[[int, tuple], None]], start: int, pages: List[tuple]):
+        if on_page_translated is not None:
+            for i, ctx_config_pair in enumerate(pages):
+                on_page_translated(start + i, ctx_config_pair)
+
+    async def _concurrent_translate_contexts(self, contexts_with_configs: List[tuple],
+                                             on_page_translated: Callable[[int, tuple], None] = None) -> List[tuple]:
         """
         并发处理翻译步骤，为每个图片单独发送翻译请求，避免合并大批次
+        on_page_translated(页面索引, (ctx, config)) 在页面翻译完成时立即调用，不等待其他页面
         """
 
         # 在并发模式下，先保存所有页面的原文用于上下文
@@ -2317,8 +2585,8 @@ class MangaTranslator:
                 else:
                     batch_original_texts.append({})
 
-        async def translate_single_context(ctx_config_pair_with_index):
-            """翻译单个context的异步函数"""
+        async def translate_single_context(ctx_config_pair_with_index, translated_texts: List[str] = None):
+            """翻译单个context的异步函数，translated_texts 不为空时表示已随同组页面一起翻译，只做后处理"""
             ctx, config, page_index, batch_index = ctx_config_pair_with_index
             try:
                 if not ctx.text_regions:
@@ -2330,15 +2598,16 @@ class MangaTranslator:
                 if not texts:
                     return ctx, config
 
-                logger.debug(f'Translating {len(texts)} regions for single image in concurrent mode (page {page_index}, batch {batch_index})')
+                if translated_texts is None:
+                    logger.debug(f'Translating {len(texts)} regions for single image in concurrent mode (page {page_index}, batch {batch_index})')
 
-                # 单独翻译这一张图片的文本，传递页面索引和批次索引用于正确的上下文
-                translated_texts = await self._batch_translate_texts(
-                    texts, config, ctx,
-                    page_index=page_index,
-                    batch_index=batch_index,
-                    batch_original_texts=batch_original_texts
-                )
+                    # 单独翻译这一张图片的文本，传递页面索引和批次索引用于正确的上下文
+                    translated_texts = await self._batch_translate_texts(
+                        texts, config, ctx,
+                        page_index=page_index,
+                        batch_index=batch_index,
+                        batch_original_texts=batch_original_texts
+                    )
 
                 # 将翻译结果分配回各个region
                 for i, region in enumerate(ctx.text_regions):
@@ -2452,24 +2721,115 @@ class MangaTranslator:
                         region._direction = config.render.direction
                 return ctx, config
         
-        # 创建并发任务，为每个任务添加页面索引和批次索引
+        async def translate_and_signal(page, translated_texts: List[str] = None):
+            result = await translate_single_context(page, translated_texts)
+            if on_page_translated is not None:
+                on_page_translated(page[3], result)
+            return result
+
+        async def translate_page_group(pages):
+            """
+            把同组连续页面的文本合并为尽量少的请求翻译，再逐页做后处理。
+            翻译器上报某页的全部行后，该页立即开始后处理，不等待整组完成
+            """
+            ctx, config, page_index, batch_index = pages[0]
+            texts = [region.text for page in pages for region in page[0].text_regions]
+            offsets = []
+            offset = 0
+            for page in pages:
+                offsets.append(offset)
+                offset += len(page[0].text_regions)
+            received = [{} for _ in pages]
+            started = {}
+            # 提前开始的页面在组的上下文中运行，而不是在上报该行的翻译器内部
+            group_context = contextvars.copy_context()
+
+            def on_line(index: int, translation: str):
+                n = bisect_right(offsets, index) - 1
+                if n < 0 or n in started:
+                    return
+                line_count = len(pages[n][0].text_regions)
+                received[n][index - offsets[n]] = translation
+                if len(received[n]) == line_count:
+                    started[n] = group_context.run(asyncio.create_task,
+                        translate_and_signal(pages[n], [received[n][j] for j in range(line_count)]))
+
+            logger.debug(f'Translating {len(texts)} regions of {len(pages)} packed images in concurrent mode (pages {page_index}-{pages[-1][2]}, batch {batch_index})')
+            try:
+                # 使用组内第一页的上下文
+                with nested_partial_results(on_line):
+                    translated_texts = await self._batch_translate_texts(
+                        texts, config, ctx,
+                        page_index=page_index,
+                        batch_index=batch_index,
+                        batch_original_texts=batch_original_texts
+                    )
+            except Exception as e:
+                logger.warning(f"Packed translation of {len(pages)} images failed, translating them one by one: {e}")
+                translated_texts = None
+
+            tasks = []
+            for n, page in enumerate(pages):
+                if n in started:
+                    # 已随部分结果提前完成
+                    tasks.append(started[n])
+                elif translated_texts is None:
+                    tasks.append(translate_and_signal(page))
+                else:
+                    tasks.append(translate_and_signal(page, translated_texts[offsets[n]:offsets[n] + len(page[0].text_regions)]))
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 为每个页面添加页面索引（在整个翻译序列中的索引）和批次索引（在当前批次中的索引）
+        pages = [(*ctx_config_pair, len(self.all_page_translations) + i, i)
+                 for i, ctx_config_pair in enumerate(contexts_with_configs)]
+
+        # 按 token 预算把连续页面的文本打包到同一组请求中，没有打包的页面仍单独翻译
+        page_queries = [[region.text for region in ctx.text_regions] if ctx.text_regions else []
+                        for ctx, config in contexts_with_configs]
+        groups = []
+        if contexts_with_configs:
+            sample_config = contexts_with_configs[0][1]
+            try:
+                groups = [g for g in pack_pages(sample_config.translator.translator_gen, page_queries, sample_config.translator)
+                          if len(g) > 1]
+            except Exception as e:
+                logger.warning(f"Failed to pack pages by token budget, translating page by page: {e}")
+        grouped = {i for group in groups for i in group}
+
+        # 创建并发任务
         tasks = []
-        for i, ctx_config_pair in enumerate(contexts_with_configs):
-            # 计算当前页面在整个翻译序列中的索引
-            page_index = len(self.all_page_translations) + i
-            batch_index = i  # 在当前批次中的索引
-            ctx_config_pair_with_index = (*ctx_config_pair, page_index, batch_index)
-            task = asyncio.create_task(translate_single_context(ctx_config_pair_with_index))
-            tasks.append(task)
-        
-        logger.info(f'Starting concurrent translation of {len(tasks)} images...')
+        task_pages = []
+        for group in groups:
+            tasks.append(asyncio.create_task(translate_page_group([pages[i] for i in group])))
+            task_pages.append(group)
+        for i, page in enumerate(pages):
+            if i not in grouped:
+                tasks.append(asyncio.create_task(translate_and_signal(page)))
+                task_pages.append(None)
+
+        if groups:
+            logger.info(f'Packed {len(grouped)} images into {len(groups)} request groups by token budget')
+        logger.info(f'Starting concurrent translation of {len(pages)} images...')
         
         # 等待所有任务完成
         try:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            task_results = await asyncio.gather(*tasks, return_exceptions=True)
         except Exception as e:
             logger.error(f"Error in concurrent translation gather: {e}")
             raise
+
+        # 按页面顺序整理各任务的结果
+        results = [None] * len(pages)
+        ungrouped = iter(i for i in range(len(pages)) if i not in grouped)
+        for group, result in zip(task_pages, task_results):
+            if group is None:
+                results[next(ungrouped)] = result
+            elif isinstance(result, Exception):
+                for i in group:
+                    results[i] = result
+            else:
+                for i, page_result in zip(group, result):
+                    results[i] = page_result
         
         # 处理结果，检查是否有异常
         final_results = []
@@ -2493,6 +2853,7 @@ class MangaTranslator:
         logger.info(f'Concurrent translation completed: {len(final_results)} images processed')
         return final_results
 
+    @trace_stage('translation-batch', 'model', lambda texts, *args, **kwargs: {'regions': len(texts), 'chars': sum(len(t or '') for t in texts)})
     async def _batch_translate_texts(self, texts: List[str], config: Config, ctx: Context, batch_contexts: List[Context] = None, page_index: int = None, batch_index: int = None, batch_original_texts: List[dict] = None) -> List[str]:
         """
         批量翻译文本列表，使用现有的翻译器接口
@@ -2513,6 +2874,7 @@ class MangaTranslator:
 
         # 如果是ChatGPT翻译器（包括chatgpt和chatgpt_2stage），需要处理上下文
         if config.translator.translator in [Translator.chatgpt, Translator.chatgpt_2stage]:
+            configure_client_pool(config.translator)
             if config.translator.translator == Translator.chatgpt:
                 from .translators.chatgpt import OpenAITranslator
                 translator = OpenAITranslator()
@@ -2540,6 +2902,7 @@ class MangaTranslator:
                 logger.info(f"Context-aware translation enabled with {self.context_size} pages of history using {context_type}")
 
             translator.parse_args(config.translator)
+            translator.configure_rate_limit(config.translator)
 
             # 构建上下文 - 在并发模式下使用原文和页面索引
             prev_ctx = self._build_prev_context(
@@ -2765,6 +3128,7 @@ class MangaTranslator:
         
         return ctx.text_regions
 
+    @trace_stage('page-render', 'page', lambda ctx, config, *args, **kwargs: _stage_trace_attrs(config, ctx))
     async def _complete_translation_pipeline(self, ctx: Context, config: Config) -> Context:
         """
         完成翻译后的处理步骤（掩码细化、修复、渲染）
@@ -2798,11 +3162,11 @@ class MangaTranslator:
                 
                 # 保存inpaint_input.png
                 inpaint_input_path = self._result_path('inpaint_input.png')
-                imwrite_unicode(inpaint_input_path, cv2.cvtColor(inpaint_input_img, cv2.COLOR_RGB2BGR), logger)
+                await self._write_debug_image(inpaint_input_path, cv2.cvtColor(inpaint_input_img, cv2.COLOR_RGB2BGR))
                 
                 # 保存mask_final.png
                 mask_final_path = self._result_path('mask_final.png')
-                imwrite_unicode(mask_final_path, ctx.mask, logger)
+                await self._write_debug_image(mask_final_path, ctx.mask)
             except Exception as e:
                 logger.error(f"Error saving debug images (inpaint_input.png, mask_final.png): {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -2823,7 +3187,7 @@ class MangaTranslator:
         if self.verbose:
             try:
                 inpainted_path = self._result_path('inpainted.png')
-                imwrite_unicode(inpainted_path, cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR), logger)
+                await self._write_debug_image(inpainted_path, cv2.cvtColor(ctx.img_inpainted, cv2.COLOR_RGB2BGR))
             except Exception as e:
                 logger.error(f"Error saving inpainted.png debug image: {e}")
                 logger.debug(f"Exception details: {traceback.format_exc()}")
@@ -1,12 +1,18 @@
-from typing import List
+import time
+from typing import List, Optional
 import cv2
 import numpy as np
 
-from .text_mask_utils import complete_mask_fill, complete_mask
-from ..utils import TextBlock, Quadrilateral
+from .text_mask_utils import complete_mask_fill, complete_mask, complete_mask_batched, logger
+from ..config import MaskRefinementConfig
+from ..utils import TextBlock, Quadrilateral, bilateral_filter_cached, get_tracer
 from ..utils.bubble import is_ignore
 
-async def dispatch(text_regions: List[TextBlock], raw_image: np.ndarray, raw_mask: np.ndarray, method: str = 'fit_text', dilation_offset: int = 0, ignore_bubble: int = 0, verbose: bool = False,kernel_size:int=3) -> np.ndarray:
+async def dispatch(text_regions: List[TextBlock], raw_image: np.ndarray, raw_mask: np.ndarray, method: str = 'fit_text', dilation_offset: int = 0, ignore_bubble: int = 0, verbose: bool = False,kernel_size:int=3,
+                   config: Optional[MaskRefinementConfig] = None) -> np.ndarray:
+    start = time.perf_counter()
+    if config is not None and method == 'fit_text':
+        method = config.method.value
     # Larger sized mask images will probably have crisper and thinner mask segments due to being able to fit the text pixels better
     # so we dont want to size them down as much to not lose information
     scale_factor = max(min((raw_mask.shape[0] - raw_image.shape[0] / 3) / raw_mask.shape[0], 1), 0.5)
@@ -21,13 +27,27 @@ async def dispatch(text_regions: List[TextBlock], raw_image: np.ndarray, raw_mas
             q = Quadrilateral(l * scale_factor, '', 0)
             textlines.append(q)
 
-    final_mask = complete_mask(img_resized, mask_resized, textlines, dilation_offset=dilation_offset,kernel_size=kernel_size) if method == 'fit_text' else complete_mask_fill([txtln.aabb.xywh for txtln in textlines])
+    if method in ('crf_batched', 'guided'):
+        # Reuse the bilateral filtered page from the detector when it is still cached
+        filtered = bilateral_filter_cached(raw_image, 17, 80, 80, compute=False)
+        if filtered is not None and scale_factor != 1:
+            filtered = cv2.resize(filtered, (img_resized.shape[1], img_resized.shape[0]), interpolation = cv2.INTER_LINEAR)
+        final_mask = complete_mask_batched(img_resized, mask_resized, textlines, method, config or MaskRefinementConfig(), filtered,
+                                           dilation_offset=dilation_offset, kernel_size=kernel_size)
+    elif method == 'fit_text':
+        final_mask = complete_mask(img_resized, mask_resized, textlines, dilation_offset=dilation_offset,kernel_size=kernel_size)
+    else:
+        final_mask = complete_mask_fill([txtln.aabb.xywh for txtln in textlines], mask_resized.shape[:2])
     if final_mask is None:
         final_mask = np.zeros((raw_image.shape[0], raw_image.shape[1]), dtype = np.uint8)
     else:
         final_mask = cv2.resize(final_mask, (raw_image.shape[1], raw_image.shape[0]), interpolation = cv2.INTER_LINEAR)
         final_mask[final_mask > 0] = 255
 
+    elapsed = time.perf_counter() - start
+    logger.info(f'Mask refinement ({method}): {len(textlines)} textlines in {elapsed:.2f}s')
+    get_tracer().current().set(method=method)
+
     if ignore_bubble < 1 or ignore_bubble > 50:
         return final_mask
 
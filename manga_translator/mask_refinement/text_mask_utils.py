@@ -1,16 +1,19 @@
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 import numpy as np
 import cv2
 import math
 
 from tqdm import tqdm
+import shapely
 from shapely.geometry import Polygon
 # from sklearn.mixture import BayesianGaussianMixture
 # from functools import reduce
 # from collections import defaultdict
 # from scipy.optimize import linear_sum_assignment
 
-from ..utils import Quadrilateral, image_resize, imwrite_unicode
+from ..utils import Quadrilateral, image_resize, imwrite_unicode, get_logger
+
+logger = get_logger('mask_refinement')
 
 COLOR_RANGE_SIGMA = 1.5 # how many stddev away is considered the same color
 
@@ -59,7 +62,8 @@ def extend_rect(x, y, w, h, max_x, max_y, extend_size):
     h1 = min(h + extend_size * 2, max_y - y1 - 1)
     return x1, y1, w1, h1
 
-def complete_mask_fill(text_lines: List[Tuple[int, int, int, int]]):
+def complete_mask_fill(text_lines: List[Tuple[int, int, int, int]], shape: Tuple[int, int]):
+    final_mask = np.zeros(shape, dtype=np.uint8)
     for (x, y, w, h) in text_lines:
         final_mask = cv2.rectangle(final_mask, (x, y), (x + w, y + h), (255), -1)
     return final_mask
@@ -67,7 +71,7 @@ def complete_mask_fill(text_lines: List[Tuple[int, int, int, int]]):
 from pydensecrf.utils import compute_unary, unary_from_softmax
 import pydensecrf.densecrf as dcrf
 
-def refine_mask(rgbimg, rawmask):
+def refine_mask(rgbimg, rawmask, iterations = 5):
     if len(rawmask.shape) == 2:
         rawmask = rawmask[:, :, None]
     mask_softmax = np.concatenate([cv2.bitwise_not(rawmask)[:, :, None], rawmask], axis=2)
@@ -87,119 +91,232 @@ def refine_mask(rgbimg, rawmask):
                         compat=20,
                         kernel=dcrf.DIAG_KERNEL,
                         normalization=dcrf.NO_NORMALIZATION)
-    Q = d.inference(5)
+    Q = d.inference(iterations)
     res = np.argmax(Q, axis=0).reshape((rgbimg.shape[0], rgbimg.shape[1]))
     crf_mask = np.array(res * 255, dtype=np.uint8)
     return crf_mask
 
-def complete_mask(img: np.ndarray, mask: np.ndarray, textlines: List[Quadrilateral], keep_threshold = 1e-2, dilation_offset = 0,kernel_size=3):
+def _assign_components(stats: np.ndarray, textlines: List[Quadrilateral], polys: np.ndarray, keep_threshold: float) -> np.ndarray:
+    """
+    Returns the index of the textline every connected component belongs to, or -1.
+
+    A component belongs to the textline its bounding box overlaps the most (relative to
+    the smaller of both areas). Components that don't overlap any textline are kept if
+    the nearest textline is closer than half a character. Candidate pairs come from an
+    STRtree so only components and textlines that actually touch are intersected.
+    """
+    owner = np.full(stats.shape[0], -1, dtype=np.int64)
+    labels = np.nonzero(stats[:, cv2.CC_STAT_AREA] > 9)[0]
+    labels = labels[labels > 0]
+    if len(labels) == 0 or len(polys) == 0:
+        return owner
+
+    x = stats[labels, cv2.CC_STAT_LEFT].astype(np.float64)
+    y = stats[labels, cv2.CC_STAT_TOP].astype(np.float64)
+    w = stats[labels, cv2.CC_STAT_WIDTH].astype(np.float64)
+    h = stats[labels, cv2.CC_STAT_HEIGHT].astype(np.float64)
+    cc_areas = stats[labels, cv2.CC_STAT_AREA].astype(np.float64)
+    boxes = shapely.box(x, y, x + w, y + h)
+    poly_areas = shapely.area(polys)
+    tree = shapely.STRtree(polys)
+
+    cc_idx, tl_idx = tree.query(boxes, predicate='intersects')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = shapely.area(shapely.intersection(polys[tl_idx], boxes[cc_idx])) / np.minimum(cc_areas[cc_idx], poly_areas[tl_idx])
+    ratio = np.nan_to_num(ratio, nan=0, posinf=0).astype(np.float32)
+
+    # Highest ratio per component, lowest textline index on ties (same as argmax over all textlines)
+    order = np.lexsort((tl_idx, -ratio, cc_idx))
+    cc_idx, tl_idx, ratio = cc_idx[order], tl_idx[order], ratio[order]
+    first = np.ones(len(cc_idx), dtype=bool)
+    first[1:] = cc_idx[1:] != cc_idx[:-1]
+    best = np.zeros(len(labels), dtype=np.int64)
+    best_ratio = np.zeros(len(labels), dtype=np.float32)
+    best[cc_idx[first]] = tl_idx[first]
+    best_ratio[cc_idx[first]] = ratio[first]
+    best[best_ratio <= 0] = 0
+
+    keep = cc_areas < poly_areas[best]
+    near = keep & (best_ratio <= keep_threshold)
+    if near.any():
+        centers = shapely.points(x[near] + w[near] / 2, y[near] + h[near] / 2)
+        query_idx, nearest_idx = tree.query_nearest(centers, all_matches=True)
+        nearest = np.full(len(centers), len(polys), dtype=np.int64)
+        np.minimum.at(nearest, query_idx, nearest_idx)
+        dist = shapely.distance(polys[nearest], centers).astype(np.float32)
+        font_sizes = np.array([textlines[i].font_size for i in nearest], dtype=np.float64)
+        unit = np.maximum(np.minimum(np.minimum(font_sizes, w[near]), h[near]), 10)
+        best[near] = nearest
+        keep[near] = dist < 0.5 * unit
+
+    owner[labels[keep]] = best[keep]
+    return owner
+
+def _bilateral_region(img: np.ndarray, x: int, y: int, w: int, h: int, d: int = 17) -> np.ndarray:
+    # Filtering a crop padded by the filter radius gives the same pixels as filtering the whole image
+    pad = d // 2
+    px, py = max(x - pad, 0), max(y - pad, 0)
+    crop = np.ascontiguousarray(img[py: min(y + h + pad, img.shape[0]), px: min(x + w + pad, img.shape[1])])
+    filtered = cv2.bilateralFilter(crop, d, 80, 80)
+    return np.ascontiguousarray(filtered[y - py: y - py + h, x - px: x - px + w])
+
+def _textline_crops(mask: np.ndarray, textlines: List[Quadrilateral], keep_threshold: float, dilation_offset: int):
+    """
+    Assigns the connected components of `mask` to textlines. Returns the label image and
+    per textline its component labels, refinement rect (xywh), text size and dilation size.
+    """
     bboxes = [txtln.aabb.xywh for txtln in textlines]
-    polys = [Polygon(txtln.pts) for txtln in textlines]
+    polys = np.array([Polygon(txtln.pts) for txtln in textlines], dtype=object)
     for (x, y, w, h) in bboxes:
         cv2.rectangle(mask, (x, y), (x + w, y + h), (0), 1)
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask)
+    logger.debug(f'complete_mask: {len(textlines)} textlines, {num_labels} connected components')
 
-    M = len(textlines)
-    
-    # --- NEW DIAGNOSTIC LINES ---
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"--- MASK_REFINEMENT_DEBUG: Entering complete_mask ---")
-    logger.info(f"--- MASK_REFINEMENT_DEBUG: Number of textlines (M) = {M} ---")
-    logger.info(f"--- MASK_REFINEMENT_DEBUG: Number of connected components (num_labels) = {num_labels} ---")
-    # --- END DIAGNOSTIC ---
-
-    textline_ccs = [np.zeros_like(mask) for _ in range(M)]
-    iinfo = np.iinfo(labels.dtype)
-    textline_rects = np.full(shape = (M, 4), fill_value = [iinfo.max, iinfo.max, iinfo.min, iinfo.min], dtype = labels.dtype)
-    ratio_mat = np.zeros(shape = (num_labels, M), dtype = np.float32)
-    dist_mat = np.zeros(shape = (num_labels, M), dtype = np.float32)
-    valid = False
-    for label in range(1, num_labels):
-        # skip area too small
-        if stats[label, cv2.CC_STAT_AREA] <= 9:
-            continue
+    owner = _assign_components(stats, textlines, polys, keep_threshold)
+    assigned = np.nonzero(owner >= 0)[0]
+    if len(assigned) == 0:
+        return labels, []
 
-        x1 = stats[label, cv2.CC_STAT_LEFT]
-        y1 = stats[label, cv2.CC_STAT_TOP]
-        w1 = stats[label, cv2.CC_STAT_WIDTH]
-        h1 = stats[label, cv2.CC_STAT_HEIGHT]
-        area1 = stats[label, cv2.CC_STAT_AREA]
-        cc_pts = np.array([[x1, y1], [x1 + w1, y1], [x1 + w1, y1 + h1], [x1, y1 + h1]])
-        cc_poly = Polygon(cc_pts)
-
-        for tl_idx in range(M):
-            area2 = polys[tl_idx].area
-            overlapping_area = polys[tl_idx].intersection(cc_poly).area
-            ratio_mat[label, tl_idx] = overlapping_area / min(area1, area2)
-            dist_mat[label, tl_idx] = polys[tl_idx].distance(cc_poly.centroid)
-            # print(textlines[tl_idx].pts, cc_pts, '->', overlapping_area, min(area1, area2), '=', overlapping_area / min(area1, area2), '|', polys[tl_idx].distance(cc_poly))
-
-        avg = np.argmax(ratio_mat[label])
-        # print(avg, 'overlap:', ratio_mat[label, avg], '<=', keep_threshold)
-        area2 = polys[avg].area
-        if area1 >= area2:
-            continue
-        if ratio_mat[label, avg] <= keep_threshold:
-            avg = np.argmin(dist_mat[label])
-            area2 = polys[avg].area
-            unit = max(min([textlines[avg].font_size, w1, h1]), 10)
-            # print("unit", unit, textlines[avg].font_size, w1, h1)
-            # if area1 < 0.4 * w1 * h1:
-            #     # ccs is probably angled
-            #     unit /= 2
-            # if avg == 0:
-            # print('no intersect', area1, '>=', area2, dist_mat[label, avg], '>=', 0.5 * unit)
-            if dist_mat[label, avg] >= 0.5 * unit:
-                # print(dist_mat[label])
-                # print('CONTINUE')
-                continue
-
-        textline_ccs[avg][y1:y1+h1, x1:x1+w1][labels[y1:y1+h1, x1:x1+w1] == label] = 255
-        # if avg == 0:
-        # print(avg)
-        # cv2.imshow('ccs', image_resize(textline_ccs[avg], height = 800))
-        # cv2.waitKey(0)
-        textline_rects[avg, 0] = min(textline_rects[avg, 0], x1)
-        textline_rects[avg, 1] = min(textline_rects[avg, 1], y1)
-        textline_rects[avg, 2] = max(textline_rects[avg, 2], x1 + w1)
-        textline_rects[avg, 3] = max(textline_rects[avg, 3], y1 + h1)
-        valid = True
-
-    if not valid:
-        return None
-    
-    # tblr to xywh
-    textline_rects[:, 2] -= textline_rects[:, 0]
-    textline_rects[:, 3] -= textline_rects[:, 1]
-    
-    final_mask = np.zeros_like(mask)
-    img = cv2.bilateralFilter(img, 17, 80, 80)
-    for i, cc in enumerate(tqdm(textline_ccs, '[mask]')):
-        x1, y1, w1, h1 = textline_rects[i]
+    # Components of every textline and the rect (tblr) enclosing them
+    assigned = assigned[np.argsort(owner[assigned], kind='stable')]
+    groups = np.split(assigned, np.nonzero(np.diff(owner[assigned]))[0] + 1)
+    height, width = mask.shape[:2]
+    crops = []
+    for group in groups:
+        i = int(owner[group[0]])
+        x1 = int(stats[group, cv2.CC_STAT_LEFT].min())
+        y1 = int(stats[group, cv2.CC_STAT_TOP].min())
+        w1 = int((stats[group, cv2.CC_STAT_LEFT] + stats[group, cv2.CC_STAT_WIDTH]).max()) - x1
+        h1 = int((stats[group, cv2.CC_STAT_TOP] + stats[group, cv2.CC_STAT_HEIGHT]).max()) - y1
         text_size = min(w1, h1, textlines[i].font_size)
-        x1, y1, w1, h1 = extend_rect(x1, y1, w1, h1, img.shape[1], img.shape[0], int(text_size * 0.1))
+        x1, y1, w1, h1 = extend_rect(x1, y1, w1, h1, width, height, int(text_size * 0.1))
+        if w1 <= 0 or h1 <= 0:
+            continue
         # TODO: Need to think of better way to determine dilate_size.
         dilate_size = max((int((text_size + dilation_offset) * 0.3) // 2) * 2 + 1, 3)
-        # print(textlines[i].font_size, min(w1, h1), dilate_size)
-        kern = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (dilate_size, dilate_size))
-        cc_region = np.ascontiguousarray(cc[y1: y1 + h1, x1: x1 + w1])
-        if cc_region.size == 0:
-            continue
-        # cv2.imshow('cc before', image_resize(cc_region, height = 800))
-        img_region = np.ascontiguousarray(img[y1: y1 + h1, x1: x1 + w1])
-        # cv2.imshow('img', image_resize(img_region, height = 800))
-        cc_region = refine_mask(img_region, cc_region)
-        # cv2.imshow('cc after', image_resize(cc_region, height = 800))
-        # cv2.waitKey(0)
-        cc[y1: y1 + h1, x1: x1 + w1] = cc_region
-        # cc = cv2.dilate(cc, kern)
-        x2, y2, w2, h2 = extend_rect(x1, y1, w1, h1, img.shape[1], img.shape[0], -(-dilate_size // 2))
-        cc[y2:y2+h2, x2:x2+w2] = cv2.dilate(cc[y2:y2+h2, x2:x2+w2], kern)
-        final_mask[y2:y2+h2, x2:x2+w2] = cv2.bitwise_or(final_mask[y2:y2+h2, x2:x2+w2], cc[y2:y2+h2, x2:x2+w2])
+        crops.append((group, (x1, y1, w1, h1), text_size, dilate_size))
+    return labels, crops
+
+def _dilate_into(final_mask: np.ndarray, refined: np.ndarray, rect: Tuple[int, int, int, int], dilate_size: int):
+    # Dilates a refined textline crop and ORs it into the final mask, touching only the dilated area
+    x1, y1, w1, h1 = rect
+    x2, y2, w2, h2 = extend_rect(x1, y1, w1, h1, final_mask.shape[1], final_mask.shape[0], -(-dilate_size // 2))
+    kern = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (dilate_size, dilate_size))
+    cc = np.zeros((h2, w2), dtype=np.uint8)
+    cc[y1 - y2: y1 - y2 + h1, x1 - x2: x1 - x2 + w1] = refined
+    final_mask[y2:y2+h2, x2:x2+w2] = cv2.bitwise_or(final_mask[y2:y2+h2, x2:x2+w2], cv2.dilate(cc, kern))
+
+def complete_mask(img: np.ndarray, mask: np.ndarray, textlines: List[Quadrilateral], keep_threshold = 1e-2, dilation_offset = 0,kernel_size=3):
+    """
+    Grows the raw text mask to whole characters per textline: connected components are
+    assigned to textlines, refined with a CRF and dilated relative to the font size.
+    All per-textline work happens on crops around the textline, so memory stays
+    proportional to the page rather than to the page times the number of textlines.
+    """
+    labels, crops = _textline_crops(mask, textlines, keep_threshold, dilation_offset)
+    if not crops:
+        return None
+
+    # On dense pages the crops overlap so much that filtering the whole page once is cheaper
+    height, width = mask.shape[:2]
+    crop_area = sum((w1 + 16) * (h1 + 16) for _, (_, _, w1, h1), _, _ in crops)
+    filtered = cv2.bilateralFilter(img, 17, 80, 80) if crop_area >= height * width else None
+
+    final_mask = np.zeros_like(mask)
+    for group, (x1, y1, w1, h1), _, dilate_size in tqdm(crops, '[mask]'):
+        cc_region = np.isin(labels[y1: y1 + h1, x1: x1 + w1], group).astype(np.uint8) * 255
+        if filtered is not None:
+            img_region = np.ascontiguousarray(filtered[y1: y1 + h1, x1: x1 + w1])
+        else:
+            img_region = _bilateral_region(img, x1, y1, w1, h1)
+        _dilate_into(final_mask, refine_mask(img_region, cc_region), (x1, y1, w1, h1), dilate_size)
+    kern = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    return cv2.dilate(final_mask, kern)
+
+def guided_refine_mask(rgbimg: np.ndarray, rawmask: np.ndarray, radius: int = 4, eps: float = 1e-2) -> np.ndarray:
+    """Snaps a binary mask to the edges of `rgbimg` with a guided filter (He et al.), much cheaper than a CRF."""
+    guide = cv2.cvtColor(rgbimg, cv2.COLOR_RGB2GRAY).astype(np.float32) / 255
+    src = rawmask.astype(np.float32) / 255
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    mean = lambda a: cv2.boxFilter(a, -1, ksize, borderType=cv2.BORDER_REFLECT)
+    mean_i, mean_p = mean(guide), mean(src)
+    a = (mean(guide * src) - mean_i * mean_p) / (mean(guide * guide) - mean_i * mean_i + eps)
+    b = mean_p - a * mean_i
+    q = mean(a) * guide + mean(b)
+    return ((q > 0.5) * 255).astype(np.uint8)
+
+def _group_crops(crops: list, gap: float) -> List[List[int]]:
+    # Union-find over crops whose rects are closer than `gap` times the smaller text size
+    rects = np.array([rect for _, rect, _, _ in crops], dtype=np.float64)
+    sizes = np.array([text_size for _, _, text_size, _ in crops], dtype=np.float64)
+    x1, y1 = rects[:, 0], rects[:, 1]
+    x2, y2 = x1 + rects[:, 2], y1 + rects[:, 3]
+    dx = np.maximum(0, np.maximum(x1[:, None], x1[None]) - np.minimum(x2[:, None], x2[None]))
+    dy = np.maximum(0, np.maximum(y1[:, None], y1[None]) - np.minimum(y2[:, None], y2[None]))
+    close = np.maximum(dx, dy) <= gap * np.minimum(sizes[:, None], sizes[None])
+
+    parent = list(range(len(crops)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in zip(*np.nonzero(np.triu(close, 1))):
+        parent[find(i)] = find(j)
+    groups = {}
+    for i in range(len(crops)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+def complete_mask_batched(img: np.ndarray, mask: np.ndarray, textlines: List[Quadrilateral], method: str, config, filtered: np.ndarray = None,
+                          keep_threshold = 1e-2, dilation_offset = 0, kernel_size = 3) -> Optional[np.ndarray]:
+    """
+    Like `complete_mask`, but nearby textlines share one refinement problem which is solved
+    at a working resolution where the text is about `config.working_font_size` pixels high.
+    `method` selects a CRF (`crf_batched`) or a guided filter (`guided`). `filtered` is the
+    bilateral filtered `img`, e.g. reused from the detector, otherwise groups are filtered at
+    the working resolution.
+    """
+    labels, crops = _textline_crops(mask, textlines, keep_threshold, dilation_offset)
+    if not crops:
+        return None
+
+    use_crf = method == 'crf_batched'
+    groups = _group_crops(crops, config.group_gap)
+    logger.debug(f'complete_mask_batched: {len(crops)} textlines in {len(groups)} groups')
+    final_mask = np.zeros_like(mask)
+    for members in tqdm(groups, '[mask]'):
+        rects = np.array([crops[i][1] for i in members])
+        gx, gy = int(rects[:, 0].min()), int(rects[:, 1].min())
+        gw, gh = int((rects[:, 0] + rects[:, 2]).max()) - gx, int((rects[:, 1] + rects[:, 3]).max()) - gy
+        group_labels = np.concatenate([crops[i][0] for i in members])
+        cc_region = np.isin(labels[gy: gy + gh, gx: gx + gw], group_labels).astype(np.uint8) * 255
+        img_region = np.ascontiguousarray((filtered if filtered is not None else img)[gy: gy + gh, gx: gx + gw])
+
+        text_size = float(np.median([crops[i][2] for i in members]))
+        scale = 1.0
+        if config.working_font_size > 0 and text_size > 0:
+            scale = min(1.0, max(0.25, config.working_font_size / text_size))
+        if scale < 1:
+            size = (max(1, round(gw * scale)), max(1, round(gh * scale)))
+            img_region = cv2.resize(img_region, size, interpolation=cv2.INTER_AREA)
+            cc_region = ((cv2.resize(cc_region, size, interpolation=cv2.INTER_AREA) > 127) * 255).astype(np.uint8)
+        if filtered is None and use_crf:
+            # Smooth at the working resolution with a filter scaled along, the guided filter is edge preserving by itself
+            d = max(5, int(17 * scale) | 1)
+            img_region = cv2.bilateralFilter(img_region, d, 80, 80 * scale)
+
+        if use_crf:
+            refined = refine_mask(img_region, cc_region, config.crf_iterations)
+        else:
+            refined = guided_refine_mask(img_region, cc_region, config.guided_radius, config.guided_eps)
+        if scale < 1:
+            refined = ((cv2.resize(refined, (gw, gh), interpolation=cv2.INTER_LINEAR) > 127) * 255).astype(np.uint8)
+
+        for i in members:
+            x1, y1, w1, h1 = crops[i][1]
+            _dilate_into(final_mask, refined[y1 - gy: y1 - gy + h1, x1 - gx: x1 - gx + w1], crops[i][1], crops[i][3])
     kern = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-    # for (x, y, w, h) in text_lines:
-    #     final_mask = cv2.rectangle(final_mask, (x, y), (x + w, y + h), (255), -1)
     return cv2.dilate(final_mask, kern)
 
 def unsharp(image):
@@ -1,20 +1,23 @@
 import json
 import os
 import gc
+import asyncio
 import copy
 from typing import Union, List
 import time  
+from concurrent.futures import Future
 
 from PIL import Image
 import psutil
 
 from manga_translator import MangaTranslator, Context, TranslationInterrupt, Config
-from ..save import save_result
+from ..save import OUTPUT_FORMATS, PILFormat, save_result, encode_result, flush_formats, get_encoder_pool, is_deferred
 from ..translators import (
     LanguageUnsupportedException,
     dispatch as dispatch_translation,
 )
-from ..utils import natural_sort, replace_prefix, get_color_name, rgb2hex, get_logger
+from ..utils import natural_sort, replace_prefix, get_color_name, rgb2hex, get_logger, is_archive, open_archive, ArchiveWriter
+from ..utils.archive import OUTPUT_ARCHIVE_EXTENSIONS
 
 # 使用专用的local logger
 logger = get_logger('local')
@@ -68,18 +71,32 @@ def force_cleanup():
         pass
 
 class MangaTranslatorLocal(MangaTranslator):
+    _exports_trace = True
+
     def __init__(self, params: dict = None):
         super().__init__(params)
         self.textlines = []
         self.attempts = params.get('attempts', None)
         self.skip_no_text = params.get('skip_no_text', False)
         self.save_quality = params.get('save_quality', None)
+        self.save_preset = params.get('save_preset', None)
+        get_encoder_pool(params.get('save_threads', 0))
         self.text_regions = params.get('text_regions', None)
         self.save_text_file = params.get('save_text_file', None)
         self.save_text = params.get('save_text', None)
         self.prep_manual = params.get('prep_manual', None)
         self.batch_size = params.get('batch_size', 1)
         self.disable_memory_optimization = params.get('disable_memory_optimization', False)
+        # 翻译压缩包时页面直接从压缩包读取并写入输出压缩包，路径为虚拟路径
+        self._archive_reader = None
+        self._archive_writer = None
+        self._archive_root = None
+        # 等待结果写入完成后再报告 'saved' 的任务
+        self._save_reports = set()
+        # 当前任务中写入失败的结果 (dest, 异常)
+        self._save_errors = []
+        # 在任务结束时才写入的结果 (dest, 是否报告进度)，例如 GIMP 页面
+        self._deferred_saves = []
 
     async def translate_path(self, path: str, dest: str = None, params: dict[str, Union[int, str]] = None, config: Config = None):
         """
@@ -124,8 +141,18 @@ class MangaTranslatorLocal(MangaTranslator):
                 file_ext = 'jpg'
             elif params.get('format') != 'jpg':
                 raise ValueError('--save-quality of lower than 100 is only supported for .jpg files')
+        # 压缩包中的页面只能保存为图片格式，在开始翻译前检查
+        if file_ext and not isinstance(OUTPUT_FORMATS.get(file_ext), PILFormat) and self._contains_archives(path):
+            raise ValueError(f'Format {file_ext} can not be written into an archive')
 
-        if os.path.isfile(path):
+        if is_archive(path):
+            start_time = time.time()
+            try:
+                await self._translate_archive(path, dest, params, config, file_ext)
+            finally:
+                await self._flush_output(start_time)
+
+        elif os.path.isfile(path):
             # Determine destination file path
             if not dest:
                 # Use the same folder as the source
@@ -140,7 +167,11 @@ class MangaTranslatorLocal(MangaTranslator):
             else:
                 p, ext = os.path.splitext(dest)
                 _dest = f'{p}.{file_ext or ext[1:]}'
-            await self.translate_file(path, _dest, params,config)
+            start_time = time.time()
+            try:
+                await self.translate_file(path, _dest, params,config)
+            finally:
+                await self._flush_output(start_time)
 
         elif os.path.isdir(path):
             # Determine destination folder path
@@ -157,28 +188,36 @@ class MangaTranslatorLocal(MangaTranslator):
                 # 原有的逐个处理方式
                 start_time = time.time()  # 记录开始时间
                 translated_count = 0
-                for root, subdirs, files in os.walk(path):
-                    files = natural_sort(files)
-                    dest_root = replace_prefix(root, path, _dest)
-                    os.makedirs(dest_root, exist_ok=True)
-                    for f in files:
-                        if f.lower() == '.thumb':
-                            continue
-
-                        file_path = os.path.join(root, f)
-                        p, ext = os.path.splitext(f)
-                        if dest_root == root:
-                            output_filename = f'{p}_translated.{file_ext or ext[1:]}'
-                        else:
-                            output_filename = f'{p}.{file_ext or ext[1:]}'
-                        output_dest = os.path.join(dest_root, output_filename)
-                        try:
-                            if await self.translate_file(file_path, output_dest, params, config):
-                                translated_count += 1
-                        except Exception as e:
-                            logger.error(e)
-                            raise e
-                
+                try:
+                    for root, subdirs, files in os.walk(path):
+                        files = natural_sort(files)
+                        dest_root = replace_prefix(root, path, _dest)
+                        os.makedirs(dest_root, exist_ok=True)
+                        for f in files:
+                            if f.lower() == '.thumb':
+                                continue
+
+                            file_path = os.path.join(root, f)
+                            if is_archive(file_path):
+                                translated_count += await self._try_translate_archive(file_path, dest_root, params, config, file_ext)
+                                continue
+                            p, ext = os.path.splitext(f)
+                            if dest_root == root:
+                                output_filename = f'{p}_translated.{file_ext or ext[1:]}'
+                            else:
+                                output_filename = f'{p}.{file_ext or ext[1:]}'
+                            output_dest = os.path.join(dest_root, output_filename)
+                            try:
+                                if await self.translate_file(file_path, output_dest, params, config):
+                                    translated_count += 1
+                            except Exception as e:
+                                logger.error(e)
+                                raise e
+                finally:
+                    # 等待结果图写入完成，并单独报告I/O耗时（出错时也写出已排队的结果）
+                    failed_saves = await self._flush_output(start_time)
+                translated_count -= failed_saves
+
                 # 计算总耗时
                 total_time = time.time() - start_time
                 
@@ -201,6 +240,43 @@ class MangaTranslatorLocal(MangaTranslator):
                     except Exception as e:
                         logger.debug(f'Failed to play completion sound: {e}')
 
+    async def _flush_output(self, start_time: float) -> int:
+        """
+        Waits for queued result images to be written and reports I/O time separately from compute time.
+        Returns the number of results that failed to be written, the first failure is raised unless
+        --ignore-errors is set, as when results were saved synchronously.
+        """
+        flush_start = time.time()
+        try:
+            await self._output_writer.flush_async()
+        finally:
+            # GIMP 页面在任务结束时统一渲染，写入失败时也不能丢弃
+            failed_renders = set(await asyncio.to_thread(flush_formats))
+        if self._save_reports:
+            await asyncio.gather(*self._save_reports)
+        deferred_saves, self._deferred_saves = self._deferred_saves, []
+        for dest, report in deferred_saves:
+            if dest in failed_renders:
+                self._save_errors.append((dest, RuntimeError('GIMP failed to render the page')))
+                if report:
+                    await self._report_progress('error', True)
+            elif report:
+                await self._report_progress('saved', True)
+        stats = self._output_writer.stats()
+        if stats['files_written'] or stats['errors']:
+            compute_time = max(0.0, flush_start - start_time - stats['wait_time'])
+            logger.info(f'Compute: {compute_time:.1f}s, output writer: {self._output_writer.format_stats()}, '
+                        f'{time.time() - flush_start:.2f}s waiting for the final flush')
+        self._output_writer.reset_stats()
+        self.export_trace()
+
+        save_errors, self._save_errors = self._save_errors, []
+        for dest, e in save_errors:
+            logger.error(f'Failed to save "{dest}": {e.__class__.__name__}: {e}')
+        if save_errors and not self.ignore_errors:
+            raise save_errors[0][1]
+        return len(save_errors)
+
     async def translate_file(self, path: str, dest: str, params: dict, config: Config):
         if not params.get('overwrite') and os.path.exists(dest):
             logger.info(
@@ -262,9 +338,7 @@ class MangaTranslatorLocal(MangaTranslator):
 
         else:  # Treat as image
             try:
-                img = Image.open(path)
-                img.verify()
-                img = Image.open(path)
+                img = self._open_image(path)
             except Exception:
                 logger.warn(f'Failed to open image: {path}')
                 return False
@@ -288,8 +362,9 @@ class MangaTranslatorLocal(MangaTranslator):
                 if not (self.save_text or self.save_text_file):
                     logger.info(f'Saving "{dest}"')
                     ctx.save_quality = self.save_quality
-                    save_result(result, dest, ctx)
-                    await self._report_progress('saved', True)
+                    ctx.save_preset = self.save_preset
+                    future = await self._save_output(dest, result, ctx)
+                    self._track_save(future, dest)
 
                 if self.save_text or self.save_text_file or self.prep_manual:
                     if self.prep_manual:
@@ -297,7 +372,7 @@ class MangaTranslatorLocal(MangaTranslator):
                         p, ext = os.path.splitext(dest)
                         img_filename = p + '-orig' + ext
                         img_path = os.path.join(os.path.dirname(dest), img_filename)
-                        img.save(img_path, quality=self.save_quality)
+                        self._save_original(img, img_path, quality=self.save_quality)
                     if self.text_regions:
                         self._save_text_to_file(path, ctx)
                         logger.info(f"Translations saved to JSON for {path}")
@@ -306,6 +381,315 @@ class MangaTranslatorLocal(MangaTranslator):
 
     
 
+    def _open_image(self, path: str) -> Image.Image:
+        if self._archive_reader is not None:
+            img = self._archive_reader.open_image(self._archive_entry(path, self._archive_root))
+            img.name = path
+            return img
+        img = Image.open(path)
+        img.verify()
+        return Image.open(path)  # 重新打开因为verify会关闭文件
+
+    async def _save_output(self, dest: str, result: Image.Image, ctx: Context) -> Future:
+        if self._archive_writer is not None:
+            writer = self._archive_writer
+            name = self._archive_entry(dest, writer.path)
+            fmt = os.path.splitext(dest)[1][1:].lower()
+            return await self._output_writer.submit_async(lambda: writer.write(name, encode_result(result, fmt, ctx)))
+        return await self._output_writer.save_async(dest, save_result, result, dest, ctx)
+
+    def _track_save(self, future: Future, dest: str, report: bool = True):
+        """
+        Waits for the output writer to write `dest` without blocking the caller. Failures are
+        recorded for `_flush_output`, which takes them off the job's count and raises them.
+        """
+        async def track():
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                self._save_errors.append((dest, e))
+                if report:
+                    await self._report_progress('error', True)
+            else:
+                if is_deferred(dest):
+                    # 例如 GIMP 页面，在 _flush_output 渲染之后才报告
+                    self._deferred_saves.append((dest, report))
+                elif report:
+                    await self._report_progress('saved', True)
+        task = asyncio.create_task(track())
+        self._save_reports.add(task)
+        task.add_done_callback(self._save_reports.discard)
+
+    def _save_original(self, img: Image.Image, dest: str, **save_kwargs):
+        if self._archive_writer is not None:
+            self._archive_writer.write_image(self._archive_entry(dest, self._archive_writer.path), img, **save_kwargs)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            img.save(dest, **save_kwargs)
+
+    @staticmethod
+    def _archive_entry(path: str, root: str) -> str:
+        return os.path.relpath(path, root).replace(os.sep, '/')
+
+    @staticmethod
+    def _archive_dest(path: str, dest: str) -> str:
+        stem, ext = os.path.splitext(os.path.basename(path))
+        # rar 和 PDF 输出为 cbz
+        ext = ext.lower() if ext.lower() in OUTPUT_ARCHIVE_EXTENSIONS else '.cbz'
+        if dest and os.path.splitext(dest)[1].lower() in OUTPUT_ARCHIVE_EXTENSIONS:
+            return dest
+        if not dest:
+            return os.path.join(os.path.dirname(path), f'{stem}-translated{ext}')
+        if os.path.abspath(os.path.dirname(path)) == os.path.abspath(dest):
+            return os.path.join(dest, f'{stem}_translated{ext}')
+        return os.path.join(dest, f'{stem}{ext}')
+
+    @staticmethod
+    def _contains_archives(path: str) -> bool:
+        if os.path.isfile(path):
+            return is_archive(path)
+        return any(is_archive(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+    async def _try_translate_archive(self, path: str, dest: str, params: dict, config: Config, file_ext: str) -> int:
+        """与图片相同，压缩包无法打开或翻译失败时记录错误，仅在未设置 --ignore-errors 时中止"""
+        try:
+            return await self._translate_archive(path, dest, params, config, file_ext)
+        except Exception as e:
+            logger.error(f'Failed to translate archive "{path}": {e.__class__.__name__}: {e}',
+                         exc_info=e if self.verbose else None)
+            if not self.ignore_errors:
+                raise
+            return 0
+
+    async def _translate_archive(self, path: str, dest: str, params: dict, config: Config, file_ext: str) -> int:
+        """
+        翻译压缩包（cbz/zip/cbr）或 PDF 中的页面，结果直接写入输出压缩包，不解压到磁盘。
+        与文件夹模式的批量、跳过和保存逻辑相同，已存在的输出压缩包中的页面视为已翻译。
+        """
+        archive_dest = self._archive_dest(path, dest)
+        existing = [] if params.get('overwrite') else ArchiveWriter.existing_names(archive_dest)
+        # 页面的虚拟路径位于与压缩包同名的文件夹下，文本文件保存在此处
+        root = os.path.splitext(path)[0]
+
+        with open_archive(path) as reader:
+            pages = []
+            for name in reader.names:
+                p, ext = os.path.splitext(name)
+                out_ext = file_ext or ext[1:].lower()
+                if not isinstance(OUTPUT_FORMATS.get(out_ext), PILFormat):
+                    # 例如 bmp/tif 页面
+                    out_ext = 'png'
+                output_name = f'{p}.{out_ext}'
+                if output_name not in existing:
+                    pages.append((name, output_name))
+            logger.info(f'Translating archive: "{path}" ({len(reader.names)} pages, {len(reader.names) - len(pages)} already translated)')
+            if not pages:
+                logger.info(f'Skipping as already translated: "{archive_dest}". Use --overwrite to overwrite existing translations.')
+                return 0
+
+            if self.save_text or self.save_text_file or self.text_regions or self.template:
+                for name, _ in pages:
+                    os.makedirs(os.path.dirname(os.path.join(root, *name.split('/'))), exist_ok=True)
+
+            writer = ArchiveWriter(archive_dest)
+            self._archive_reader, self._archive_writer, self._archive_root = reader, writer, root
+            translated_count = 0
+            try:
+                writer.keep_existing(existing)
+                if self.batch_size > 1:
+                    total_batches = (len(pages) + self.batch_size - 1) // self.batch_size
+                    for i in range(0, len(pages), self.batch_size):
+                        # 每个批次只读取该批次的页面
+                        batch = []
+                        for name, output_name in pages[i:i + self.batch_size]:
+                            file_path = os.path.join(root, *name.split('/'))
+                            try:
+                                img = self._open_image(file_path)
+                            except Exception as e:
+                                logger.warning(f'Failed to open image: {file_path}, error: {e}')
+                                continue
+                            batch.append((img, config, file_path, os.path.join(archive_dest, *output_name.split('/'))))
+                        if batch:
+                            translated_count += await self._translate_image_batch(
+                                batch, i // self.batch_size + 1, total_batches, params, config,
+                                not self.disable_memory_optimization)
+                else:
+                    for name, output_name in pages:
+                        if await self.translate_file(os.path.join(root, *name.split('/')),
+                                                     os.path.join(archive_dest, *output_name.split('/')), params, config):
+                            translated_count += 1
+            finally:
+                # 等待该压缩包的结果写入后再关闭
+                await self._output_writer.flush_async()
+                self._archive_reader = self._archive_writer = self._archive_root = None
+                writer.close()
+            logger.info(f'Saved {writer.pages_written} pages ({writer.bytes_written / (1024 * 1024):.1f} MB) to "{archive_dest}"')
+        return translated_count
+
+    async def _translate_image_batch(self, batch: list, batch_num: int, total_batches: int, params: dict, config: Config,
+                                     memory_optimization_enabled: bool) -> int:
+        """翻译并保存一个批次的图片，batch 为 (img, config, file_path, output_dest) 列表，返回保存的图片数量"""
+        translated_count = 0
+
+        logger.info(f'Processing batch {batch_num}/{total_batches} (size: {len(batch)})')
+        
+        # 内存状态检查
+        memory_percent, available_mb = safe_get_memory_info()
+        logger.debug(f'Memory status before batch: {memory_percent:.1f}%, available: {available_mb}MB')
+        
+        # 如果内存严重不足，强制清理
+        if memory_optimization_enabled and memory_percent > 90:
+            logger.warning(f'High memory usage detected ({memory_percent:.1f}%), forcing cleanup...')
+            force_cleanup()
+            memory_percent, available_mb = safe_get_memory_info()
+            logger.info(f'Memory status after cleanup: {memory_percent:.1f}%, available: {available_mb}MB')
+        
+        # 创建当前批次的配置副本
+        batch_config = config
+        if memory_optimization_enabled:
+            batch_config = copy.deepcopy(config)
+            
+            # 更新批次中的配置
+            images_with_configs = [(img, batch_config) for img, _, _, _ in batch]
+        else:
+            images_with_configs = [(img, config) for img, _, _, _ in batch]
+        
+        try:
+            # 批量翻译
+            logger.debug(f'Starting batch translation for {len(batch)} images...')
+            # 不再需要提取图片名称，直接进行批量翻译
+            batch_results = await self.translate_batch(images_with_configs, len(batch))
+            
+            # 保存结果
+            for j, (ctx, (img, _, file_path, output_dest)) in enumerate(zip(batch_results, batch)):
+                # 检查是否应该跳过没有文本的图片（遵循skip_no_text参数）
+                if self.skip_no_text and ctx and not ctx.text_regions:
+                    logger.debug(f'Not saving due to --skip-no-text: {file_path}')
+                    continue
+                    
+                if ctx and ctx.result:
+                    # If --save-text is NOT specified, save the image.
+                    if not (self.save_text or self.save_text_file):
+                        logger.debug(f'Saving translation result: "{output_dest}"')
+                        save_ctx = Context(**params)
+                        save_ctx.result = ctx.result
+                        save_ctx.text_regions = ctx.text_regions
+                        save_ctx.gimp_font = batch_config.render.gimp_font
+                        save_ctx.save_quality = self.save_quality
+                        save_ctx.save_preset = self.save_preset
+                        
+                        future = await self._save_output(output_dest, ctx.result, save_ctx)
+                        self._track_save(future, output_dest, report=False)
+                        translated_count += 1
+                    
+                    # 保存文本文件（如果需要）
+                    if self.save_text or self.save_text_file or self.prep_manual:
+                        if self.prep_manual:
+                            p, ext = os.path.splitext(output_dest)
+                            img_filename = p + '-orig' + ext
+                            img_path = os.path.join(os.path.dirname(output_dest), img_filename)
+                            self._save_original(img, img_path, quality=self.save_quality)
+                        if ctx.text_regions:
+                            self._save_text_to_file(file_path, ctx)
+                else:
+                    # 处理没有结果的情况 - 改进逻辑以区分不同情况
+                    has_original_text = ctx and hasattr(ctx, 'text_regions') and ctx.text_regions
+                    
+                    if not ctx:
+                        logger.warning(f'Translation failed: {file_path} (context is None)')
+                        save_reason = "no_context"
+                    elif not hasattr(ctx, 'result'):
+                        logger.warning(f'Translation failed: {file_path} (no result attribute)')
+                        save_reason = "no_result_attr"
+                    elif ctx.result is None:
+                        if has_original_text:
+                            # 有原文但没有翻译结果，需要判断是否因为过滤导致
+                            # 检查是否所有region都被过滤掉了（有translation但为空或被过滤）
+                            filtered_by_processing = all(
+                                hasattr(region, 'translation') and 
+                                (not region.translation.strip() or  # 空翻译
+                                 region.translation.isnumeric() or  # 数字翻译
+                                 region.text.lower().strip() == region.translation.lower().strip())  # 翻译与原文相同
+                                for region in ctx.text_regions
+                            ) if ctx.text_regions else False
+                            
+                            if filtered_by_processing:
+                                # logger.warning(f'Translation filtered out by post-processing: {file_path}')
+                                save_reason = "filtered_translation"
+                            else:
+                                # logger.warning(f'Translation failed with original text present: {file_path} (result is None but has text_regions)')
+                                save_reason = "translation_failed_with_text"
+                        else:
+                            # logger.warning(f'Translation failed: {file_path} (result is None, no original text)')
+                            save_reason = "no_original_text"
+                    else:
+                        logger.warning(f'Translation failed: {file_path} (unexpected condition)')
+                        save_reason = "unexpected"
+                        
+                    # 决定是否保存图片
+                    should_save = True
+                    if save_reason == "translation_failed_with_text":
+                        # 有原文但翻译失败且不是因为过滤导致，不保存图片以便重试
+                        should_save = False
+                        # logger.info(f'Skipping save for retry: {file_path} (translation failed but has original text)')
+                    
+                    # 如果不跳过无文本图片，且决定保存，则保存原图
+                    if should_save and not self.skip_no_text:
+                        logger.info(f'Saving original image ({save_reason}): {file_path}')
+                        try:
+                            # 保存原图到目标位置
+                            if self.save_quality and self.save_quality < 100:
+                                # 如果设置了压缩质量，转换为RGB并压缩保存
+                                img_copy = img.convert('RGB') if img.mode != 'RGB' else img.copy()
+                                self._save_original(img_copy, output_dest, quality=self.save_quality, format='JPEG')
+                            else:
+                                # 保持原始格式和质量，但要处理JPEG的RGBA问题
+                                _, ext = os.path.splitext(output_dest)
+                                if ext.lower() in ['.jpg', '.jpeg'] and img.mode == 'RGBA':
+                                    self._save_original(img.convert('RGB'), output_dest)
+                                else:
+                                    self._save_original(img, output_dest)
+                            
+                            logger.info(f'Original image saved: "{output_dest}"')
+                            translated_count += 1  # 即使是原图也计入处理数量
+                        except Exception as save_error:
+                            logger.error(f'Failed to save original image: {file_path}, error: {save_error}')
+                    else:
+                        if not should_save:
+                            logger.debug(f'Skipped saving for retry: {file_path}')
+                        elif self.skip_no_text:
+                            logger.debug(f'Skipped saving due to --skip-no-text: {file_path}')
+            # 成功处理批次，重置连续错误计数
+            logger.debug(f'Batch {batch_num} processed successfully')
+                    
+        except (MemoryError, OSError) as e:
+            logger.error(f'Memory error in batch processing: {e}')
+            
+            if not memory_optimization_enabled:
+                logger.error('Consider enabling memory optimization (remove --disable-memory-optimization flag)')
+                raise
+            
+        except Exception as e:
+            logger.error(f'Other error in batch processing: {e}')
+            if not self.ignore_errors:
+                raise
+                
+        # 清理当前批次资源
+        for img, _, _, _ in batch:
+            if hasattr(img, 'close'):
+                img.close()
+            del img
+        del batch
+        
+        # 每个批次后都执行内存清理
+        force_cleanup()
+        
+        # 内存状态报告
+        memory_percent, available_mb = safe_get_memory_info()
+        logger.debug(f'Memory status after batch {batch_num}: {memory_percent:.1f}%, available: {available_mb}MB')
+
+        return translated_count
+
     async def _translate_folder_batch(self, path: str, dest: str, params: dict, config: Config, file_ext: str):
         """使用批量处理方式翻译文件夹中的图片"""
         
@@ -319,8 +703,9 @@ class MangaTranslatorLocal(MangaTranslator):
         else:
             logger.info('Memory optimization enabled')
         
-        # 收集所有需要翻译的图片文件
+        # 收集所有需要翻译的图片文件，压缩包在图片之后逐个翻译
         image_tasks = []
+        archives = []
         for root, subdirs, files in os.walk(path):
             files = natural_sort(files)
             dest_root = replace_prefix(root, path, dest)
@@ -331,6 +716,9 @@ class MangaTranslatorLocal(MangaTranslator):
                     continue
                     
                 file_path = os.path.join(root, f)
+                if is_archive(file_path):
+                    archives.append((file_path, dest_root))
+                    continue
                 p, ext = os.path.splitext(f)
                 if dest_root == root:
                     output_filename = f'{p}_translated.{file_ext or ext[1:]}'
@@ -353,186 +741,39 @@ class MangaTranslatorLocal(MangaTranslator):
                     logger.warning(f'Failed to open image: {file_path}, error: {e}')
                     continue
         
-        if not image_tasks:
+        if not image_tasks and not archives:
             logger.info('No images found to translate, use --overwrite to write over existing translations.')
             return
             
-        logger.info(f'Found {len(image_tasks)} images to translate')
+        logger.info(f'Found {len(image_tasks)} images' + (f' and {len(archives)} archives' if archives else '') + ' to translate')
         
         # 简化的内存优化策略
         base_batch_size = self.batch_size
         translated_count = 0
         i = 0
         
-        while i < len(image_tasks):
-            # 使用固定批次大小
-            current_batch_size = base_batch_size
-                
-            batch = image_tasks[i:i + current_batch_size]
-            batch_num = i // base_batch_size + 1
-            total_batches = (len(image_tasks) + base_batch_size - 1) // base_batch_size
-            
-            logger.info(f'Processing batch {batch_num}/{total_batches} (size: {len(batch)})')
-            
-            # 内存状态检查
-            memory_percent, available_mb = safe_get_memory_info()
-            logger.debug(f'Memory status before batch: {memory_percent:.1f}%, available: {available_mb}MB')
-            
-            # 如果内存严重不足，强制清理
-            if memory_optimization_enabled and memory_percent > 90:
-                logger.warning(f'High memory usage detected ({memory_percent:.1f}%), forcing cleanup...')
-                force_cleanup()
-                memory_percent, available_mb = safe_get_memory_info()
-                logger.info(f'Memory status after cleanup: {memory_percent:.1f}%, available: {available_mb}MB')
-            
-            # 创建当前批次的配置副本
-            batch_config = config
-            if memory_optimization_enabled:
-                batch_config = copy.deepcopy(config)
-                
-                # 更新批次中的配置
-                images_with_configs = [(img, batch_config) for img, _, _, _ in batch]
-            else:
-                images_with_configs = [(img, config) for img, _, _, _ in batch]
-            
-            try:
-                # 批量翻译
-                logger.debug(f'Starting batch translation for {len(batch)} images...')
-                # 不再需要提取图片名称，直接进行批量翻译
-                batch_results = await self.translate_batch(images_with_configs, len(batch))
-                
-                # 保存结果
-                for j, (ctx, (img, _, file_path, output_dest)) in enumerate(zip(batch_results, batch)):
-                    # 检查是否应该跳过没有文本的图片（遵循skip_no_text参数）
-                    if self.skip_no_text and ctx and not ctx.text_regions:
-                        logger.debug(f'Not saving due to --skip-no-text: {file_path}')
-                        continue
-                        
-                    if ctx and ctx.result:
-                        # If --save-text is NOT specified, save the image.
-                        if not (self.save_text or self.save_text_file):
-                            logger.debug(f'Saving translation result: "{output_dest}"')
-                            save_ctx = Context(**params)
-                            save_ctx.result = ctx.result
-                            save_ctx.text_regions = ctx.text_regions
-                            save_ctx.gimp_font = batch_config.render.gimp_font
-                            save_ctx.save_quality = self.save_quality
-                            
-                            save_result(ctx.result, output_dest, save_ctx)
-                            translated_count += 1
-                        
-                        # 保存文本文件（如果需要）
-                        if self.save_text or self.save_text_file or self.prep_manual:
-                            if self.prep_manual:
-                                p, ext = os.path.splitext(output_dest)
-                                img_filename = p + '-orig' + ext
-                                img_path = os.path.join(os.path.dirname(output_dest), img_filename)
-                                img.save(img_path, quality=self.save_quality)
-                            if ctx.text_regions:
-                                self._save_text_to_file(file_path, ctx)
-                    else:
-                        # 处理没有结果的情况 - 改进逻辑以区分不同情况
-                        has_original_text = ctx and hasattr(ctx, 'text_regions') and ctx.text_regions
-                        
-                        if not ctx:
-                            logger.warning(f'Translation failed: {file_path} (context is None)')
-                            save_reason = "no_context"
-                        elif not hasattr(ctx, 'result'):
-                            logger.warning(f'Translation failed: {file_path} (no result attribute)')
-                            save_reason = "no_result_attr"
-                        elif ctx.result is None:
-                            if has_original_text:
-                                # 有原文但没有翻译结果，需要判断是否因为过滤导致
-                                # 检查是否所有region都被过滤掉了（有translation但为空或被过滤）
-                                filtered_by_processing = all(
-                                    hasattr(region, 'translation') and 
-                                    (not region.translation.strip() or  # 空翻译
-                                     region.translation.isnumeric() or  # 数字翻译
-                                     region.text.lower().strip() == region.translation.lower().strip())  # 翻译与原文相同
-                                    for region in ctx.text_regions
-                                ) if ctx.text_regions else False
-                                
-                                if filtered_by_processing:
-                                    # logger.warning(f'Translation filtered out by post-processing: {file_path}')
-                                    save_reason = "filtered_translation"
-                                else:
-                                    # logger.warning(f'Translation failed with original text present: {file_path} (result is None but has text_regions)')
-                                    save_reason = "translation_failed_with_text"
-                            else:
-                                # logger.warning(f'Translation failed: {file_path} (result is None, no original text)')
-                                save_reason = "no_original_text"
-                        else:
-                            logger.warning(f'Translation failed: {file_path} (unexpected condition)')
-                            save_reason = "unexpected"
-                            
-                        # 决定是否保存图片
-                        should_save = True
-                        if save_reason == "translation_failed_with_text":
-                            # 有原文但翻译失败且不是因为过滤导致，不保存图片以便重试
-                            should_save = False
-                            # logger.info(f'Skipping save for retry: {file_path} (translation failed but has original text)')
-                        
-                        # 如果不跳过无文本图片，且决定保存，则保存原图
-                        if should_save and not self.skip_no_text:
-                            logger.info(f'Saving original image ({save_reason}): {file_path}')
-                            try:
-                                # 确保目标目录存在
-                                os.makedirs(os.path.dirname(output_dest), exist_ok=True)
-                                
-                                # 保存原图到目标位置
-                                if self.save_quality and self.save_quality < 100:
-                                    # 如果设置了压缩质量，转换为RGB并压缩保存
-                                    img_copy = img.convert('RGB') if img.mode != 'RGB' else img.copy()
-                                    img_copy.save(output_dest, quality=self.save_quality, format='JPEG')
-                                else:
-                                    # 保持原始格式和质量，但要处理JPEG的RGBA问题
-                                    _, ext = os.path.splitext(output_dest)
-                                    if ext.lower() in ['.jpg', '.jpeg'] and img.mode == 'RGBA':
-                                        img.convert('RGB').save(output_dest)
-                                    else:
-                                        img.save(output_dest)
-                                
-                                logger.info(f'Original image saved: "{output_dest}"')
-                                translated_count += 1  # 即使是原图也计入处理数量
-                            except Exception as save_error:
-                                logger.error(f'Failed to save original image: {file_path}, error: {save_error}')
-                        else:
-                            if not should_save:
-                                logger.debug(f'Skipped saving for retry: {file_path}')
-                            elif self.skip_no_text:
-                                logger.debug(f'Skipped saving due to --skip-no-text: {file_path}')
-                # 成功处理批次，重置连续错误计数
-                logger.debug(f'Batch {batch_num} processed successfully')
-                        
-            except (MemoryError, OSError) as e:
-                logger.error(f'Memory error in batch processing: {e}')
+        try:
+            while i < len(image_tasks):
+                # 使用固定批次大小
+                current_batch_size = base_batch_size
+                    
+                batch = image_tasks[i:i + current_batch_size]
+                batch_num = i // base_batch_size + 1
+                total_batches = (len(image_tasks) + base_batch_size - 1) // base_batch_size
                 
-                if not memory_optimization_enabled:
-                    logger.error('Consider enabling memory optimization (remove --disable-memory-optimization flag)')
-                    raise
+                translated_count += await self._translate_image_batch(
+                    batch, batch_num, total_batches, params, config, memory_optimization_enabled)
                 
-            except Exception as e:
-                logger.error(f'Other error in batch processing: {e}')
-                if not self.ignore_errors:
-                    raise
-                    
-            # 清理当前批次资源
-            for img, _, _, _ in batch:
-                if hasattr(img, 'close'):
-                    img.close()
-                del img
-            del batch
-            
-            # 每个批次后都执行内存清理
-            force_cleanup()
-            
-            # 内存状态报告
-            memory_percent, available_mb = safe_get_memory_info()
-            logger.debug(f'Memory status after batch {batch_num}: {memory_percent:.1f}%, available: {available_mb}MB')
-            
-            # 移动到下一批次
-            i += current_batch_size
-            
+                # 移动到下一批次
+                i += current_batch_size
+
+            for archive_path, archive_dest in archives:
+                translated_count += await self._try_translate_archive(archive_path, archive_dest, params, config, file_ext)
+        finally:
+            # 等待结果图写入完成，并单独报告I/O耗时（出错时也写出已排队的结果）
+            failed_saves = await self._flush_output(start_time)
+        translated_count -= failed_saves
+
         # 最终报告
         total_time = time.time() - start_time  # 计算总耗时
         
@@ -1,14 +1,40 @@
 import asyncio
+import io
 import logging
 import os
-from typing import Tuple
+from typing import Optional, Tuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
 from manga_translator import logger, Context, MangaTranslator, Config
-from manga_translator.utils import PriorityLock, Throttler, imwrite_unicode
+from manga_translator.utils import PriorityScheduler, Throttler, imwrite_unicode
+
+# Tasks resuming the pipeline after their online translation go before new tasks
+_RESUME_PRIORITY_BOOST = 1 << 20
+# Interval of the queue position updates sent to the server, in seconds
+_QUEUE_REPORT_INTERVAL = 1.0
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    # Decode now instead of lazily in the pipeline, which blocks the GPU stage
+    image.load()
+    return image
+
+
+def _encode_result(output: Image.Image, size: Tuple[int, int], verbose_path: Optional[str]) -> bytes:
+    output = output.resize(size, resample=Image.LANCZOS)
+    img = io.BytesIO()
+    output.save(img, format='PNG')
+    if verbose_path:
+        output.save(verbose_path)
+    return img.getvalue()
 
 
 class MangaTranslatorWS(MangaTranslator):
@@ -17,20 +43,33 @@ class MangaTranslatorWS(MangaTranslator):
         self.url = params.get('ws_url')
         self.secret = params.get('ws_secret', os.getenv('WS_SECRET', ''))
         self.ignore_errors = params.get('ignore_errors', True)
+        # Tasks downloading and decoding their image at the same time, while another task uses the GPU
+        self.prefetch = params.get('ws_prefetch', 2)
+        # Tasks waiting for an online translator at the same time
+        self.translation_concurrency = params.get('ws_translation_concurrency', 4)
+        # How many newer tasks a waiting task overtakes per second of waiting
+        self.priority_aging = params.get('ws_priority_aging', 1.0)
+        # Tasks waiting longer than this for the GPU are given up, 0 to wait indefinitely
+        self.max_queue_time = params.get('ws_max_queue_time', 0)
 
         self._task_id = None
         self._websocket = None
+        self._gpu_slot: Optional[PriorityScheduler.Slot] = None
 
     async def listen(self, translation_params: dict = None):
         from threading import Thread
-        import io
         import aioshutil
         from aiofiles import os
         import websockets
         from ..server import ws_pb2
 
         self._server_loop = asyncio.new_event_loop()
-        self.task_lock = PriorityLock()
+        # The pipeline keeps the current task on the instance, so the GPU stage runs one task at a time
+        self.scheduler = PriorityScheduler({
+            'prefetch': self.prefetch,
+            'gpu': 1,
+            'translation': self.translation_concurrency,
+        }, aging=self.priority_aging)
         self.counter = 0
 
         async def _send_and_yield(websocket, msg):
@@ -54,14 +93,24 @@ class MangaTranslatorWS(MangaTranslator):
 
         self.add_progress_hook(sync_state)
 
-        async def translate(task_id, websocket, image, params):
-            async with self.task_lock((1 << 31) - params['ws_count']):
+        async def translate(task_id, websocket, image, params, priority):
+            slot = self.scheduler.stage('gpu', priority, key=task_id)
+            try:
+                await asyncio.wait_for(slot.acquire(), self.max_queue_time or None)
+            except asyncio.TimeoutError:
+                raise QueueTimeout(f'Waited more than {self.max_queue_time}s for the GPU')
+            try:
+                self._gpu_slot = slot
                 self._task_id = task_id
                 self._websocket = websocket
-                result = await self.translate(image, params)
-                self._task_id = None
-                self._websocket = None
-            return result
+                return await self.translate(image, params)
+            finally:
+                # Only clear the state if no other task took over during the online translation
+                if self._gpu_slot is slot:
+                    self._gpu_slot = None
+                    self._task_id = None
+                    self._websocket = None
+                slot.release()
 
         async def server_send_status(websocket, task_id, status):
             msg = ws_pb2.WebSocketMessage()
@@ -88,20 +137,25 @@ class MangaTranslatorWS(MangaTranslator):
                 'ws_event_loop': asyncio.get_event_loop(),
                 'ws_count': self.counter,
             }
+            # Newer tasks first, the page the user is looking at was most likely requested last
+            priority = -self.counter
             self.counter += 1
 
-            logger_task.info(f'-- Downloading image from {task.source_image}')
-            await server_send_status(websocket, task.id, 'downloading')
-            async with session.get(task.source_image) as resp:
-                if resp.status == 200:
-                    source_image = await resp.read()
-                else:
-                    msg = ws_pb2.WebSocketMessage()
-                    msg.status.id = task.id
-                    msg.status.status = 'error-download'
-                    await websocket.send(msg.SerializeToString())
-                    await asyncio.sleep(0)
-                    return False, False
+            # Download and decode while other tasks use the GPU
+            async with self.scheduler.stage('prefetch', priority, key=task.id):
+                logger_task.info(f'-- Downloading image from {task.source_image}')
+                await server_send_status(websocket, task.id, 'downloading')
+                async with session.get(task.source_image) as resp:
+                    if resp.status == 200:
+                        source_image = await resp.read()
+                    else:
+                        msg = ws_pb2.WebSocketMessage()
+                        msg.status.id = task.id
+                        msg.status.status = 'error-download'
+                        await websocket.send(msg.SerializeToString())
+                        await asyncio.sleep(0)
+                        return False, False
+                image = await asyncio.get_running_loop().run_in_executor(None, _decode_image, source_image)
 
             logger_task.info(f'-- Translating image')
             if translation_params:
@@ -109,34 +163,32 @@ class MangaTranslatorWS(MangaTranslator):
                     current_value = params.get(p)
                     params[p] = current_value if current_value is not None else default_value
 
-            image = Image.open(io.BytesIO(source_image))
-
             (ori_w, ori_h) = image.size
             if max(ori_h, ori_w) > 1200:
                 params['upscale_ratio'] = 1
 
             await server_send_status(websocket, task.id, 'preparing')
-            # translation_dict = await self.translate(image, params)
-            translation_dict = await asyncio.wrap_future(
-                asyncio.run_coroutine_threadsafe(
-                    translate(task.id, websocket, image, params),
-                    main_loop
+            try:
+                translation_dict = await asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(
+                        translate(task.id, websocket, image, params, priority),
+                        main_loop
+                    )
                 )
-            )
+            except QueueTimeout as e:
+                logger_task.warning(f'-- {e}')
+                await server_send_status(websocket, task.id, 'error-timeout')
+                return False, False
             await send_throttler.flush()
 
             output: Image.Image = translation_dict.result
             if output is not None:
                 await server_send_status(websocket, task.id, 'saving')
 
-                output = output.resize((ori_w, ori_h), resample=Image.LANCZOS)
-
-                img = io.BytesIO()
-                output.save(img, format='PNG')
-                if self.verbose:
-                    output.save(self._result_path('ws_final.png'))
-
-                img_bytes = img.getvalue()
+                img_bytes = await asyncio.get_running_loop().run_in_executor(
+                    None, _encode_result, output, (ori_w, ori_h),
+                    self._result_path('ws_final.png') if self.verbose else None
+                )
                 logger_task.info(f'-- Uploading result to {task.translation_mask}')
                 await server_send_status(websocket, task.id, 'uploading')
                 async with session.put(task.translation_mask, data=img_bytes) as resp:
@@ -157,18 +209,43 @@ class MangaTranslatorWS(MangaTranslator):
             try:
                 (success, has_translation_mask) = await server_process_inner(main_loop, logger_task, session, websocket,
                                                                              task)
+            except asyncio.CancelledError:
+                # Abandoned by the server, nobody is waiting for the result anymore
+                logger_task.info('-- Task cancelled')
+                raise
             except Exception as e:
                 logger_task.error(f'-- Task failed with exception:')
                 logger_task.error(f'{e.__class__.__name__}: {e}', exc_info=e if self.verbose else None)
                 (success, has_translation_mask) = False, False
-            finally:
-                result = ws_pb2.WebSocketMessage()
-                result.finish_task.id = task.id
-                result.finish_task.success = success
-                result.finish_task.has_translation_mask = has_translation_mask
-                await websocket.send(result.SerializeToString())
-                await asyncio.sleep(0)
-                logger_task.info(f'-- Task finished')
+            result = ws_pb2.WebSocketMessage()
+            result.finish_task.id = task.id
+            result.finish_task.success = success
+            result.finish_task.has_translation_mask = has_translation_mask
+            await websocket.send(result.SerializeToString())
+            await asyncio.sleep(0)
+            logger_task.info(f'-- Task finished')
+
+        async def report_queue(websocket):
+            # Tells waiting tasks their place in the GPU queue, it changes with new tasks and aging
+            positions = {}
+            metrics = None
+            while True:
+                await asyncio.sleep(_QUEUE_REPORT_INTERVAL)
+                queue = self.scheduler.queue('gpu')
+                for position, task_id in enumerate(queue, 1):
+                    if positions.get(task_id) != position:
+                        positions[task_id] = position
+                        try:
+                            await server_send_status(websocket, task_id, f'pending-{position}')
+                        except websockets.ConnectionClosed:
+                            return
+                for task_id in set(positions) - set(queue):
+                    del positions[task_id]
+                if self.verbose:
+                    current = {stage: (m['running'], m['waiting']) for stage, m in self.scheduler.metrics().items()}
+                    if current != metrics:
+                        metrics = current
+                        logger.debug(f'Queue: {self.scheduler.metrics()}')
 
         async def async_server_thread(main_loop):
             from aiohttp import ClientSession, ClientTimeout
@@ -186,6 +263,7 @@ class MangaTranslatorWS(MangaTranslator):
                         logger=logger_conn
                 ):
                     bg_tasks = set()
+                    reporter = asyncio.create_task(report_queue(websocket))
                     try:
                         logger.info('-- Connected to websocket server')
 
@@ -204,6 +282,8 @@ class MangaTranslatorWS(MangaTranslator):
 
                     finally:
                         logger.info('-- Disconnected from websocket server')
+                        reporter.cancel()
+                        # Cancels waiting tasks and stops running ones at their next await
                         for bg_task in bg_tasks:
                             bg_task.cancel()
 
@@ -226,19 +306,23 @@ class MangaTranslatorWS(MangaTranslator):
 
     async def _run_text_translation(self, config: Config, ctx: Context):
         coroutine = super()._run_text_translation(config, ctx)
-        if config.translator.translator_gen.has_offline():
+        slot = self._gpu_slot
+        if config.translator.translator_gen.has_offline() or slot is None:
             return await coroutine
         else:
             task_id = self._task_id
             websocket = self._websocket
-            await self.task_lock.release()
-            result = await asyncio.wrap_future(
-                asyncio.run_coroutine_threadsafe(
-                    coroutine,
-                    ctx.ws_event_loop
+            # Let other tasks use the GPU while waiting for the online translator
+            slot.release()
+            async with self.scheduler.stage('translation', slot.priority, key=task_id):
+                result = await asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(
+                        coroutine,
+                        ctx.ws_event_loop
+                    )
                 )
-            )
-            await self.task_lock.acquire((1 << 30) - ctx.ws_count)
+            await slot.acquire(slot.priority - _RESUME_PRIORITY_BOOST)
+            self._gpu_slot = slot
             self._task_id = task_id
             self._websocket = websocket
             return result
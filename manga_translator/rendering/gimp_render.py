@@ -5,7 +5,9 @@ import cv2
 import platform
 import glob
 import os
+import shutil
 import logging
+from typing import List
 from ..utils.generic import imwrite_unicode
 
 from ..utils import Context
@@ -65,17 +67,22 @@ script_template = """
     ( gimp-item-set-lock-position background_layer TRUE )
     {text}
     {save}
-    ( gimp-quit 0 )                        
+    ( gimp-image-delete image )
 )"""
 
+# Scripts passed to one GIMP invocation are limited by the command line length (32767 characters on Windows)
+MAX_BATCH_SCRIPT_LENGTH = 24000
 
-def gimp_render(out_file, ctx: Context):
-    input_file = os.path.join(tempfile.gettempdir(), ".gimp_input.png")
-    mask_file = os.path.join(tempfile.gettempdir(), ".gimp_mask.png")
 
+def page_script(out_file, ctx: Context, input_file, mask_file):
+    """
+    Writes the inputs of a page to `input_file` and `mask_file` and returns the
+    script creating its layered `out_file`.
+    """
     extension = out_file.split(".")[-1]
 
-    ctx.upscaled.save(input_file)
+    # The input is only read back by GIMP, skip the slow default compression
+    ctx.upscaled.save(input_file, compress_level=1)
 
     # If there is no text on the page, gimp_mask will be None and there is no
     # need to add it as a layer.
@@ -129,7 +136,7 @@ def gimp_render(out_file, ctx: Context):
     )
 
     # scheme script to be ran by gimp
-    full_script = script_template.format(
+    return script_template.format(
         input_file=input_file.replace("\\", "\\\\"),
         text_init=text_init,
         text=text,
@@ -143,14 +150,71 @@ def gimp_render(out_file, ctx: Context):
         rename_mask=(rename_mask if ctx.gimp_mask is not None else ""),
     )
 
-    gimp_batch(full_script)
 
-    # Delete Files
-    os.unlink(input_file)
+class GimpBatch:
+    """
+    Collects the pages of a job and renders them with as few GIMP invocations as
+    possible, starting GIMP takes longer than rendering a page.
+    """
+
+    def __init__(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="gimp_batch_")
+        self.scripts: List[str] = []
+        self.out_files: List[str] = []
+
+    def add(self, out_file, ctx: Context):
+        n = len(self.scripts)
+        input_file = os.path.join(self.tmp_dir, f"page{n}.png")
+        mask_file = os.path.join(self.tmp_dir, f"page{n}_mask.png")
+        self.scripts.append(page_script(out_file, ctx, input_file, mask_file))
+        self.out_files.append(out_file)
+
+    def _chunks(self):
+        chunk, length = [], 0
+        for i, script in enumerate(self.scripts):
+            if chunk and length + len(script) > MAX_BATCH_SCRIPT_LENGTH:
+                yield chunk
+                chunk, length = [], 0
+            chunk.append(i)
+            length += len(script)
+        if chunk:
+            yield chunk
+
+    def run(self) -> List[str]:
+        """
+        Renders every page and returns the output files that failed. Chunks are rendered
+        independently and a failed chunk is retried page by page, so one bad page only
+        loses itself.
+        """
+        failed = []
+        try:
+            for chunk in self._chunks():
+                try:
+                    gimp_batch(*[self.scripts[i] for i in chunk])
+                    continue
+                except Exception as e:
+                    if len(chunk) == 1:
+                        logging.error(f"GIMP failed to render {self.out_files[chunk[0]]}: {e}")
+                        failed.append(self.out_files[chunk[0]])
+                        continue
+                    logging.warning(f"GIMP failed to render {len(chunk)} pages, rendering them one by one: {e}")
+                for i in chunk:
+                    try:
+                        gimp_batch(self.scripts[i])
+                    except Exception as e:
+                        logging.error(f"GIMP failed to render {self.out_files[i]}: {e}")
+                        failed.append(self.out_files[i])
+        finally:
+            # Only once all chunks ran, the inputs of every page live here
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        return failed
 
-    # Deleting file only if it exists
-    if os.path.exists(mask_file):
-        os.unlink(mask_file)
+
+def gimp_render(out_file, ctx: Context):
+    batch = GimpBatch()
+    batch.add(out_file, ctx)
+    if batch.run():
+        raise Exception("GIMP Execution error")
 
 
 def gimp_console_executable():
@@ -170,15 +234,18 @@ def gimp_console_executable():
     return executable
 
 
-def gimp_batch(script):
+def gimp_batch(*scripts):
     """
-    Run a gimp script in batch mode. Quit gimp after running the script and on errors. Raise an exception if there is a GIMP error.
+    Run gimp scripts in batch mode, in one GIMP instance. Quit gimp after running the scripts and on errors. Raise an exception if there is a GIMP error.
     """
     # logging.info("=== Running GIMP script:")
     # result =
 
+    args = [gimp_console_executable(), "-i"]
+    for script in scripts:
+        args += ["-b", script]
     result = subprocess.run(
-        [gimp_console_executable(), "-i", "-b", script, "-b", "(gimp-quit 0)"],
+        args + ["-b", "(gimp-quit 0)"],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         universal_newlines=True,
@@ -1,9 +1,20 @@
+import io
 import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from PIL import Image
 from abc import abstractmethod
-from .rendering.gimp_render import gimp_render
+from .rendering.gimp_render import GimpBatch
 
-from .utils import Context
+from .utils import Context, get_logger
+
+logger = get_logger('save')
+
+# Encoder settings from fastest to smallest output, 'balanced' keeps the PIL defaults
+SAVE_PRESETS = ['fast', 'balanced', 'small']
+DEFAULT_SAVE_PRESET = 'balanced'
 
 
 class FormatNotSupportedException(Exception):
@@ -20,15 +31,27 @@ def register_format(format_cls):
 
 class ExportFormat():
     SUPPORTED_FORMATS = []
+    # Results are only staged by `save` and written by `flush` at the end of the job
+    DEFERRED = False
+    # Save options per format and preset, formats missing a preset use 'balanced'
+    PRESETS: Dict[str, Dict[str, dict]] = {}
 
     # Subclasses will be auto registered
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         register_format(cls)
 
+    def options(self, fmt: str, ctx: Context) -> dict:
+        presets = self.PRESETS.get(fmt, {})
+        return dict(presets.get(ctx.save_preset or DEFAULT_SAVE_PRESET, presets.get(DEFAULT_SAVE_PRESET, {})))
+
     def save(self, result: Image.Image, dest: str, ctx: Context):
         self._save(result, dest, ctx)
 
+    def flush(self) -> List[str]:
+        """Finishes saves deferred to the end of the job, returns the destinations that failed."""
+        return []
+
     @abstractmethod
     def _save(self, result: Image.Image, dest: str, ctx: Context):
         pass
@@ -42,28 +65,178 @@ def save_result(result: Image.Image, dest: str, ctx: Context):
     format_handler: ExportFormat = OUTPUT_FORMATS[ext]
     format_handler.save(result, dest, ctx)
 
+def encode_result(result: Image.Image, fmt: str, ctx: Context) -> bytes:
+    """Encodes `result` in memory, for outputs that are not files of their own (e.g. archive pages)."""
+    format_handler = OUTPUT_FORMATS.get(fmt)
+    if not isinstance(format_handler, PILFormat):
+        raise FormatNotSupportedException(fmt)
+    return format_handler.encode(result, fmt, ctx)
+
+def is_deferred(dest: str) -> bool:
+    """Whether results saved to `dest` are only written by `flush_formats`."""
+    format_handler = OUTPUT_FORMATS.get(os.path.splitext(dest)[1][1:])
+    return format_handler is not None and format_handler.DEFERRED
+
+def flush_formats() -> List[str]:
+    """
+    Writes the results every format deferred, e.g. the GIMP pages of the job. Call once the job's
+    saves are done. Returns the destinations that failed to be written.
+    """
+    failed = []
+    for format_handler in {id(h): h for h in OUTPUT_FORMATS.values()}.values():
+        failed += format_handler.flush()
+    return failed
+
+
+# -- Encoding
+
+def _encode(result: Image.Image, pil_format: str, options: dict) -> bytes:
+    buf = io.BytesIO()
+    result.save(buf, format=pil_format, **options)
+    return buf.getvalue()
+
+def _write_file(dest: str, data: bytes):
+    # Written under a temporary name so that readers never see a partial file
+    tmp_path = f'{dest}.{threading.get_ident()}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, dest)
+
+
+class EncoderPool:
+    """
+    Runs PIL encoders on threads of their own. The zlib, libjpeg and libwebp encoders
+    release the GIL, so encoding scales across cores without the output writer needing
+    more I/O threads. Without threads the images are encoded on the calling thread.
+    """
+    def __init__(self, threads: int = 0):
+        self.threads = max(0, threads)
+        self._executor = None
+        if self.threads:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='encoder')
+
+    def encode(self, result: Image.Image, pil_format: str, options: dict) -> bytes:
+        if self._executor is not None:
+            try:
+                return self._executor.submit(_encode, result, pil_format, options).result()
+            except RuntimeError:
+                # The pool is shut down at interpreter exit before the output writer is flushed
+                pass
+        return _encode(result, pil_format, options)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_encoder_pool: Optional[EncoderPool] = None
+_encoder_pool_lock = threading.Lock()
+
+def get_encoder_pool(threads: int = None) -> EncoderPool:
+    """
+    Returns the process wide encoder pool, creating it on first use. Passing a different
+    `threads` value replaces the pool.
+    """
+    global _encoder_pool
+    with _encoder_pool_lock:
+        if _encoder_pool is not None and threads is not None and threads != _encoder_pool.threads:
+            _encoder_pool.close()
+            _encoder_pool = None
+        if _encoder_pool is None:
+            _encoder_pool = EncoderPool(threads or 0)
+        return _encoder_pool
+
+@atexit.register
+def _close_encoder_pool():
+    # Saves still queued after this are encoded on the calling thread
+    if _encoder_pool is not None:
+        _encoder_pool.close()
+
 
 # -- Format Implementations
 
-class ImageFormat(ExportFormat):
-    SUPPORTED_FORMATS = ['png', 'webp']
+class PILFormat(ExportFormat):
+    """Formats encoded by PIL, in the encoder pool."""
+    # PIL format names differing from the extension
+    PIL_FORMATS = {}
 
-    def _save(self, result: Image.Image, dest: str, ctx: Context):
-        result.save(dest)
+    def _prepare(self, result: Image.Image, ctx: Context) -> Image.Image:
+        return result
 
-class JPGFormat(ExportFormat):
-    SUPPORTED_FORMATS = ['jpg', 'jpeg']
+    def encode(self, result: Image.Image, fmt: str, ctx: Context) -> bytes:
+        pil_format = self.PIL_FORMATS.get(fmt, fmt.upper())
+        return get_encoder_pool().encode(self._prepare(result, ctx), pil_format, self.options(fmt, ctx))
 
     def _save(self, result: Image.Image, dest: str, ctx: Context):
-        result = result.convert('RGB')
-        # Certain versions of PIL only support JPEG but not JPG
-        result.save(dest, quality=ctx.save_quality, format='JPEG')
+        fmt = os.path.splitext(dest)[1][1:].lower()
+        _write_file(dest, self.encode(result, fmt, ctx))
+
+class ImageFormat(PILFormat):
+    SUPPORTED_FORMATS = ['png', 'webp']
+    PRESETS = {
+        # 'fast' is the fast lossless option, the zlib level matters far more than anything else
+        'png': {
+            'fast': {'compress_level': 1},
+            'balanced': {'compress_level': 6},
+            'small': {'optimize': True},
+        },
+        'webp': {
+            'fast': {'method': 0},
+            'balanced': {'method': 4},
+            'small': {'method': 6},
+        },
+    }
+
+class JPGFormat(PILFormat):
+    SUPPORTED_FORMATS = ['jpg', 'jpeg']
+    # Certain versions of PIL only support JPEG but not JPG
+    PIL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG'}
+    PRESETS = {
+        'jpg': {
+            'small': {'optimize': True, 'progressive': True},
+        },
+    }
+    PRESETS['jpeg'] = PRESETS['jpg']
+
+    def _prepare(self, result: Image.Image, ctx: Context) -> Image.Image:
+        return result.convert('RGB')
+
+    def options(self, fmt: str, ctx: Context) -> dict:
+        options = super().options(fmt, ctx)
+        if ctx.save_quality is not None:
+            options['quality'] = ctx.save_quality
+        return options
 
 class GIMPFormat(ExportFormat):
     SUPPORTED_FORMATS = ['xcf', 'psd', 'pdf']
+    DEFERRED = True
+
+    def __init__(self):
+        self._batch: Optional[GimpBatch] = None
+        self._lock = threading.Lock()
 
     def _save(self, result: Image.Image, dest: str, ctx: Context):
-        gimp_render(dest, ctx)
+        # Only the inputs are written now, all pages of the job are rendered by one GIMP instance in `flush`
+        with self._lock:
+            if self._batch is None:
+                self._batch = GimpBatch()
+            self._batch.add(dest, ctx)
+
+    def flush(self) -> List[str]:
+        with self._lock:
+            batch, self._batch = self._batch, None
+        if batch is None or not batch.scripts:
+            return []
+        logger.info(f'Rendering {len(batch.scripts)} page(s) with GIMP')
+        try:
+            failed = batch.run()
+        except Exception as e:
+            logger.error(f'Failed to render with GIMP: {e.__class__.__name__}: {e}')
+            failed = list(batch.out_files)
+        if failed:
+            logger.error(f'GIMP failed to render {len(failed)} of {len(batch.scripts)} page(s)')
+        return failed
 
 # class KraFormat(ExportFormat):
 #     SUPPORTED_FORMATS = ['kra']
@@ -73,4 +246,3 @@ class GIMPFormat(ExportFormat):
 
 # class SvgFormat(TranslationExportFormat):
 #     SUPPORTED_FORMATS = ['svg']
-
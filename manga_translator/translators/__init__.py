@@ -1,8 +1,13 @@
+from contextlib import nullcontext
 from typing import Optional, List
 
 import py3langid as langid
 
 from .common import *
+from .ratelimit import get_rate_limiter, get_rate_limit_metrics
+from .client_pool import get_client_pool, configure_client_pool, get_client_pool_stats
+from .packing import get_token_estimator, group_pages
+from .streaming import PartialResultSink, partial_results, suppress_partial_results
 from .baidu import BaiduTranslator
 from .deepseek import DeepseekTranslator
 # from .google import GoogleTranslator
@@ -89,6 +94,8 @@ async def prepare(chain: TranslatorChain):
 async def dispatch(chain: TranslatorChain, queries: List[str], translator_config: Optional[TranslatorConfig] = None, use_mtpe: bool = False, args:Optional[Context] = None, device: str = 'cpu') -> List[str]:
     if not queries:
         return queries
+    if translator_config:
+        configure_client_pool(translator_config)
 
     if chain.target_lang is not None:
         text_lang = ISO_639_1_TO_VALID_LANGUAGES.get(langid.classify('\n'.join(queries))[0])
@@ -104,25 +111,32 @@ async def dispatch(chain: TranslatorChain, queries: List[str], translator_config
                 pass
             if translator_config:
                 translator.parse_args(translator_config)
-            if key == "gemini_2stage" or key == "chatgpt_2stage":
-                queries = await translator.translate('auto', chain.langs[flag], queries, args)
-            else:
-                queries = await translator.translate('auto', chain.langs[flag], queries, use_mtpe)
-            await translator.unload(device)
+                translator.configure_rate_limit(translator_config)
+            # 链中间的译文不是最终结果，不上报部分结果
+            with suppress_partial_results() if flag < len(chain.chain) - 1 else nullcontext():
+                if key == "gemini_2stage" or key == "chatgpt_2stage":
+                    queries = await translator.translate('auto', chain.langs[flag], queries, args)
+                else:
+                    queries = await translator.translate('auto', chain.langs[flag], queries, use_mtpe)
+            # 在线翻译器无需卸载，保留其连接池中的连接供下次调用复用
+            if isinstance(translator, OfflineTranslator):
+                await translator.unload(device)
             flag+=1
         return queries
     if args is not None:
         args['translations'] = {}
-    for key, tgt_lang in chain.chain:
+    for i, (key, tgt_lang) in enumerate(chain.chain):
         translator = get_translator(key)
         if isinstance(translator, OfflineTranslator):
             await translator.load('auto', tgt_lang, device)
         if translator_config:
             translator.parse_args(translator_config)
-        if key == "gemini_2stage" or key == "chatgpt_2stage":
-            queries = await translator.translate('auto', tgt_lang, queries, args)
-        else:
-            queries = await translator.translate('auto', tgt_lang, queries, use_mtpe)
+            translator.configure_rate_limit(translator_config)
+        with suppress_partial_results() if i < len(chain.chain) - 1 else nullcontext():
+            if key == "gemini_2stage" or key == "chatgpt_2stage":
+                queries = await translator.translate('auto', tgt_lang, queries, args)
+            else:
+                queries = await translator.translate('auto', tgt_lang, queries, use_mtpe)
         if args is not None:
             args['translations'][tgt_lang] = queries
     return queries
@@ -163,6 +177,28 @@ async def dispatch_batch(chain: TranslatorChain, batch_queries: List[List[str]],
     
     return batch_results
 
+def pack_pages(chain: TranslatorChain, page_queries: List[List[str]], translator_config: Optional[TranslatorConfig] = None) -> List[List[int]]:
+    """
+    按翻译器的 token 预算把连续页面分组，同组页面的文本合并为尽量少的请求
+    Args:
+        chain: 翻译器链
+        page_queries: 每页的查询列表
+        translator_config: 翻译器配置
+    Returns:
+        页面索引分组，没有文本的页面不在任何分组中
+    """
+    single_pages = [[i] for i, queries in enumerate(page_queries) if queries]
+    # 翻译器链与需要逐页图像的多模态翻译器不跨页打包
+    if len(chain.chain) != 1 or chain.translators[0] in (Translator.chatgpt_2stage, Translator.gemini_2stage):
+        return single_pages
+    translator = get_translator(chain.translators[0])
+    # 只有按 token 预算打包请求的 LLM 翻译器才合并页面
+    if type(translator).pack_queries is CommonTranslator.pack_queries:
+        return single_pages
+    if translator_config:
+        translator.parse_args(translator_config)
+    return group_pages(page_queries, translator.pack_queries)
+
 LANGDETECT_MAP = {
     'zh-cn': 'CHS',
     'zh-tw': 'CHT',
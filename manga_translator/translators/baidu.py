@@ -5,10 +5,10 @@ import hashlib
 import urllib.parse
 import random
 import re
-import aiohttp
 
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import BAIDU_APP_ID, BAIDU_SECRET_KEY
+from .client_pool import get_client_pool
 
 # base api url
 BASE_URL = 'api.fanyi.baidu.com'
@@ -54,9 +54,9 @@ class BaiduTranslator(CommonTranslator):
             n_queries.extend(batch)
 
         url = self.get_url(from_lang, to_lang, '\n'.join(n_queries))
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://'+BASE_URL+url) as resp:
-                result = await resp.json()
+        session = get_client_pool().aiohttp_session('baidu')
+        async with session.get('https://'+BASE_URL+url) as resp:
+            result = await resp.json()
         result_list = []
         if "trans_result" not in result:
             raise InvalidServerResponse(f'Baidu returned invalid response: {result}\nAre the API keys set correctly?')
@@ -1,9 +1,8 @@
 
 # -*- coding: utf-8 -*-
-import aiohttp
-
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import CAIYUN_TOKEN
+from .client_pool import get_client_pool
 
 class CaiyunTranslator(CommonTranslator):
     _LANGUAGE_CODE_MAP = {
@@ -53,6 +52,6 @@ class CaiyunTranslator(CommonTranslator):
             "content-type": "application/json",
             "x-authorization": "token " + CAIYUN_TOKEN,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, json=data, headers=headers) as resp:
-                return await resp.json()
+        session = get_client_pool().aiohttp_session('caiyun')
+        async with session.post(self._API_URL, json=data, headers=headers) as resp:
+            return await resp.json()
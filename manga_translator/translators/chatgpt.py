@@ -3,12 +3,18 @@ import os
 import asyncio
 import time
 import string
+from types import SimpleNamespace
 from typing import List, Dict
 from rich.console import Console  
 from rich.panel import Panel
 from .. import manga_translator
 from .config_gpt import ConfigGPT
 from .common import CommonTranslator, MissingAPIKeyException, VALID_LANGUAGES
+from .ratelimit import estimate_tokens
+from .packing import TokenEstimator, LINE_TAG_TOKENS, get_token_estimator, pack_by_tokens
+from .client_pool import get_client_pool
+from .streaming import NumberedStreamParser, emit_partial_batch, partial_results_active, report_streamed_lines
+from ..utils import get_tracer
 from .keys import OPENAI_API_KEY, OPENAI_HTTP_PROXY, OPENAI_API_BASE, OPENAI_MODEL, OPENAI_GLOSSARY_PATH
 
 try:
@@ -17,6 +23,13 @@ except ImportError:
     openai = None
 
 
+def _tiktoken_counter():
+    import tiktoken
+    # 兼容 OpenAI 接口的其他模型 tiktoken 不认识（KeyError），改用经校准的估算
+    encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+    return lambda text: len(encoding.encode(text))
+
+
 class OpenAITranslator(ConfigGPT, CommonTranslator):
     _LANGUAGE_CODE_MAP = VALID_LANGUAGES
     
@@ -25,12 +38,14 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
 
     # ---- 关键参数 ----
     _MAX_REQUESTS_PER_MINUTE = 0
+    _RATE_LIMIT_PROVIDER = 'openai'  # 与 chatgpt_2stage 共用同一 API Key 的限流器
+    _RATE_LIMIT_PER_REQUEST = True   # 拆分批次会并发发送多个请求，逐个请求限流
     _TIMEOUT = 999                # 每次请求的超时时间
     _RETRY_ATTEMPTS = 2          # 对同一个批次的最大整体重试次数
     _TIMEOUT_RETRY_ATTEMPTS = 3  # 请求因超时被取消后，最大尝试次数
     _RATELIMIT_RETRY_ATTEMPTS = 3# 遇到 429 等限流时的最大尝试次数
     _MAX_SPLIT_ATTEMPTS = 3      # 递归拆分批次的最大层数
-    _MAX_TOKENS = 8192           # prompt+completion 的最大 token (可按模型类型调整)
+    _MAX_TOKENS = 8192           # prompt+completion 的最大 token (可按模型类型调整)，未设置 request_token_budget 时作为每个请求的 token 预算
 
     def __init__(self, check_openai_key=True):
         # ConfigGPT 的初始化
@@ -41,21 +56,17 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
         if not OPENAI_API_KEY and check_openai_key:
             raise MissingAPIKeyException('OPENAI_API_KEY environment variable required')
 
-        # 根据代理与基础URL等参数实例化 openai.AsyncOpenAI 客户端
-        client_args = {
-            "api_key": OPENAI_API_KEY,
-            "base_url": OPENAI_API_BASE
-        }
-        if OPENAI_HTTP_PROXY:
-            from httpx import AsyncClient
-            client_args["http_client"] = AsyncClient(proxies={
-                "all://*openai.com": f"http://{OPENAI_HTTP_PROXY}"
-            })
-
-        self.client = openai.AsyncOpenAI(**client_args)
+        # 根据代理与基础URL等参数获取 openai.AsyncOpenAI 客户端
+        # 底层 HTTP 连接来自进程级连接池，每页新建的翻译器实例也能复用 keep-alive 连接
+        proxy = None
+        if OPENAI_HTTP_PROXY and 'openai.com' in (OPENAI_API_BASE or 'api.openai.com'):
+            proxy = f"http://{OPENAI_HTTP_PROXY}"
+        self.client = get_client_pool().openai_client('openai', OPENAI_API_KEY, OPENAI_API_BASE, proxy)
         self.token_count = 0
         self.token_count_last = 0
         self._last_request_ts = 0
+        self._token_budget = 0
+        self._stream_responses = False
         
         # 初始化术语表相关属性
         self.dict_path = OPENAI_GLOSSARY_PATH
@@ -87,91 +98,79 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
     def parse_args(self, args: CommonTranslator):
         """如果你有外部参数要解析，可在此对 self.config 做更新"""
         self.config = args.chatgpt_config
+        self._token_budget = max(0, getattr(args, 'request_token_budget', 0) or 0)
+        self._stream_responses = bool(getattr(args, 'stream_translations', False))
+
+    @property
+    def token_estimator(self) -> TokenEstimator:
+        """按模型共享的 token 估算，有 tiktoken 时精确计数，否则按返回的 usage 校准"""
+        return get_token_estimator('openai/' + OPENAI_MODEL, _tiktoken_counter)
 
-    async def _ratelimit_sleep(self):
+    def pack_queries(self, queries: List[str], to_lang: str = None) -> List[List[int]]:
         """
-        在请求前先做一次简单的节流 (如果 _MAX_REQUESTS_PER_MINUTE > 0)。
-        针对并发请求进行优化。
+        按 token 预算把连续的 query 打包成请求：
+          - prompt（系统提示、上文、示例与各行）加预计输出不超过 request_token_budget（默认 _MAX_TOKENS）
+          - 预计输出不超过请求的 max_tokens（_MAX_TOKENS // 2）
         """
-        if self._MAX_REQUESTS_PER_MINUTE > 0:
-            now = time.time()
-            delay = 60.0 / self._MAX_REQUESTS_PER_MINUTE
-            elapsed = now - self._last_request_ts
-            
-            # 为并发请求添加额外的随机延迟，避免同时请求
-            # Add extra random delay for concurrent requests to avoid simultaneous requests
-            import random
-            concurrent_jitter = random.uniform(0.1, 0.5)  # 100-500ms的随机延迟
-            
-            total_delay = delay + concurrent_jitter
-            if elapsed < total_delay:
-                await asyncio.sleep(total_delay - elapsed)
-            self._last_request_ts = time.time()
+        estimator = self.token_estimator
+        overhead = estimator.count(self.chat_system_template) + estimator.count(self.prev_context)
+        if self.include_template:
+            overhead += estimator.count(self.prompt_template)
+        if to_lang:
+            overhead += sum(estimator.count(sample) for sample in self.get_chat_sample(to_lang) or [])
+        return pack_by_tokens(
+            [estimator.count(q) + LINE_TAG_TOKENS for q in queries],
+            max_output=self._MAX_TOKENS // 2,
+            budget=self._token_budget or self._MAX_TOKENS,
+            overhead=overhead,
+            output_ratio=estimator.output_ratio,
+        )
 
     def _assemble_prompts(self, from_lang: str, to_lang: str, queries: List[str]):
         """
         原脚本中用来把多个 query 组装到一个 Prompt。
-        同时可以做长度控制，如果过长就切分成多个 prompt。
-        这里演示一个简单的 chunk 逻辑：
-          - 根据字符长度 roughly 判断
-          - 也可以用更准确的 tokens 估算
+        按 token 预算（见 pack_queries）把连续的 query 打包，使每个请求尽量装满而不超出预算。
         """
 
         lang_name = self._LANGUAGE_CODE_MAP.get(to_lang, to_lang) if to_lang in self._LANGUAGE_CODE_MAP else to_lang
-        
-        MAX_CHAR_PER_PROMPT = self._MAX_TOKENS * 4  # 粗略: 1 token ~ 4 chars
-        chunk_queries = []
-        current_length = 0
-        batch = []
-
-        for q in queries:
-            # +10 给一些余量，比如加上 <|1|> 的标记等
-            if current_length + len(q) + 10 > MAX_CHAR_PER_PROMPT and batch:
-                # 输出当前 batch
-                chunk_queries.append(batch)
-                batch = []
-                current_length = 0
-            batch.append(q)
-            current_length += len(q) + 10
-        if batch:
-            chunk_queries.append(batch)
 
         # 逐个批次生成 prompt
-        for this_batch in chunk_queries:
+        for pack in self.pack_queries(queries, to_lang):
             prompt = ""
             if self.include_template:
                 prompt = self.prompt_template.format(to_lang=lang_name)
             # 加上分行内容
-            for i, query in enumerate(this_batch):
-                prompt += f"\n<|{i+1}|>{query}"
-            yield prompt.lstrip(), len(this_batch)
+            for i, query_idx in enumerate(pack):
+                prompt += f"\n<|{i+1}|>{queries[query_idx]}"
+            yield prompt.lstrip(), len(pack)
 
     async def _translate(self, from_lang: str, to_lang: str, queries: List[str]) -> List[str]:
         """
         核心翻译逻辑：
-            1. 把 queries 拆成多个 prompt 批次
-            2. 对每个批次调用 translate_batch，并将结果写回 translations
+            1. 把 queries 按 token 预算打包成多个 prompt 批次
+            2. 并发调用 translate_batch（并发数由限流器控制），并将结果写回 translations
         """
         translations = [''] * len(queries)
-        # 记录当前处理到 queries 列表的哪个位置
-        idx_offset = 0
 
-        # 分批处理
+        # 记录每个批次在 queries 列表中的位置
+        batches = []
+        idx_offset = 0
         for prompt, batch_size in self._assemble_prompts(from_lang, to_lang, queries):
-            # 实际要翻译的子列表
-            batch_queries = queries[idx_offset : idx_offset + batch_size]
             indices = list(range(idx_offset, idx_offset + batch_size))
+            batches.append((queries[idx_offset : idx_offset + batch_size], indices, prompt))
+            idx_offset += batch_size
 
-            # 执行翻译
-            success, partial_results = await self._translate_batch(
-                from_lang, to_lang, batch_queries, indices, prompt, split_level=0
-            )
-            # 将结果写入 translations
+        # 执行翻译
+        results = await asyncio.gather(*(
+            self._translate_batch(from_lang, to_lang, batch_queries, indices, prompt, split_level=0)
+            for batch_queries, indices, prompt in batches
+        ))
+
+        # 将结果写入 translations
+        for (_, indices, _), (success, partial_results) in zip(batches, results):
             for i, r in zip(indices, partial_results):
                 translations[i] = r
 
-            idx_offset += batch_size
-
         return translations
 
     async def _try_fallback_model(self, to_lang: str, prompt: str, batch_queries: List[str]) -> tuple[bool, List[str]]:
@@ -256,7 +255,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                 else:
                     self.logger.warning(f"Fallback model retry {attempt}/2 (request {attempt+1}/3) failed: {fb_err}")
                 if attempt < fallback_max_attempts:
-                    await asyncio.sleep(1)  # 重试前等待1秒
+                    await self._rate_limit_backoff(attempt + 1, fb_err)  # 重试前退避
                 else:
                     self.logger.error(f"All fallback model requests failed")
 
@@ -501,6 +500,9 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                 # Everything is normal, write to partial_results  
                 for i in range(len(batch_queries)):  
                     partial_results[i] = new_translations[i]  
+                # 通过校验的行即为最终结果，立即上报，流水线可以提前处理已完成的页面
+                # Validated lines are final, report them so the pipeline can start on finished pages
+                emit_partial_batch(batch_indices, partial_results)
 
                 # 成功  
                 # Success  
@@ -514,7 +516,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                     f"Batch translate attempt {attempt+1}/{max_attempts} failed with error: {str(e)}"  
                 )  
                 if attempt < max_attempts - 1:  
-                    await asyncio.sleep(1)  
+                    await self._rate_limit_backoff(attempt + 1, e)  
                 else:
                     self.logger.warning("Max attempts reached.")
                     # 尝试fallback模型
@@ -522,6 +524,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                     if success:
                         for i, result in enumerate(fallback_results):
                             partial_results[i] = result
+                        emit_partial_batch(batch_indices, partial_results)
                         self.logger.info("Fallback model succeeded — skipping split logic.")
                         return True, partial_results
 
@@ -531,6 +534,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
             if success:
                 for i, result in enumerate(fallback_results):
                     partial_results[i] = result
+                emit_partial_batch(batch_indices, partial_results)
                 self.logger.info("Fallback model succeeded — skipping split logic.")
                 return True, partial_results
 
@@ -594,6 +598,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
             # Keep all failed queries as original text  
             for i in range(len(batch_queries)):   
                 partial_results[i] = batch_queries[i]     
+            emit_partial_batch(batch_indices, partial_results)
                 
             return False, partial_results  
 
@@ -613,7 +618,6 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
         server_error_attempt = 0
 
         while True:
-            await self._ratelimit_sleep()
             started = time.time()
             req_task = asyncio.create_task(self._request_translation(to_lang, prompt))
 
@@ -635,13 +639,13 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                     # 如果正常完成了
                     return req_task.result()
 
-            except openai.RateLimitError:
-                # 限流 => 重试
+            except openai.RateLimitError as e:
+                # 限流 => 等待限流器的冷却时间（Retry-After）后重试
                 ratelimit_attempt += 1
                 if ratelimit_attempt > self._RATELIMIT_RETRY_ATTEMPTS:
                     raise
                 self.logger.warning(f"Hit RateLimit, retrying... (attempt={ratelimit_attempt})")
-                await asyncio.sleep(2)
+                await self._rate_limit_backoff(ratelimit_attempt, e)
 
             except openai.APIError as e:
                 # 服务器错误 => 重试
@@ -650,7 +654,7 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
                     self.logger.error("Server error, giving up after several attempts.")
                     raise
                 self.logger.warning(f"Server error: {str(e)}. Retrying... (attempt={server_error_attempt})")
-                await asyncio.sleep(1)
+                await self._rate_limit_backoff(server_error_attempt, e)
 
             except Exception as e:
                 self.logger.error(f"Unexpected error in _request_with_retry: {str(e)}")
@@ -716,19 +720,36 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
             self.print_boxed(prompt_text, border_color="cyan", title="GPT Prompt (verbose=False)") 
         
 
-        # 发起请求 / Initiate the request
-        response = await self.client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            max_tokens=self._MAX_TOKENS // 2,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            timeout=self._TIMEOUT
-        )
+        # 发起请求，max_tokens 也计入服务端的 TPM 限额 / Initiate the request, max_tokens counts towards the TPM limit as well
+        estimated_tokens = sum(estimate_tokens(m['content']) for m in messages) + self._MAX_TOKENS // 2
+        async with self.rate_limited(estimated_tokens) as slot:
+            # 流式请求仅在有接收方时使用，逐行上报进度 / Stream only when someone receives the progress
+            create = self._stream_chat_completion if self._stream_responses and partial_results_active() \
+                else self.client.chat.completions.create
+            response = await create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_tokens=self._MAX_TOKENS // 2,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                timeout=self._TIMEOUT
+            )
+            slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
 
         if not response.choices:
             raise ValueError("Empty response from OpenAI API")
 
+        # 用返回的 usage 校准本地 token 估算 / Calibrate the local token estimate with the reported usage
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            estimator = self.token_estimator
+            estimator.record(
+                sum(estimator.count(m['content']) for m in messages),
+                getattr(usage, 'prompt_tokens', 0) or 0,
+                estimator.count(prompt),
+                getattr(usage, 'completion_tokens', 0) or 0,
+            )
+
         raw_text = response.choices[0].message.content
 
         # 去除 <think>...</think> 标签及内容。由于某些中转api的模型的思考过程是被强制输出的，并不包含在reasoning_content中，需要额外过滤
@@ -780,11 +801,45 @@ class OpenAITranslator(ConfigGPT, CommonTranslator):
         else:
             self.token_count += response.usage.total_tokens
             self.token_count_last = response.usage.total_tokens
+            get_tracer().current().add(tokens=response.usage.total_tokens)
         
         response_text = cleaned_text
         self.print_boxed(response_text, border_color="green", title="GPT Response")          
         return cleaned_text
 
+    async def _stream_chat_completion(self, **kwargs):
+        """
+        流式请求 chat completion，每收到完整的一行就上报进度，返回与非流式请求相同结构的结果。
+        流式收到的行未经校验，只用于进度，最终结果仍由 _translate_batch 校验后上报。
+        Streams a chat completion, reporting each complete line as progress, and returns
+        it shaped like a non-streamed response. Streamed lines are not validated yet, the
+        final lines are still reported by _translate_batch.
+        """
+        stream = await self.client.chat.completions.create(
+            stream=True,
+            stream_options={'include_usage': True},
+            **kwargs
+        )
+        parser = NumberedStreamParser()
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            text = getattr(chunk.choices[0].delta, 'content', None)
+            if text:
+                parts.append(text)
+                report_streamed_lines(len(parser.feed(text)))
+        report_streamed_lines(len(parser.finish()))
+
+        choices = [SimpleNamespace(message=SimpleNamespace(content=''.join(parts)))] if parts else []
+        response = SimpleNamespace(choices=choices)
+        if usage is not None:
+            response.usage = usage
+        return response
+
     def _fix_prefix_spacing(self, text_to_fix):
         """修复前缀和翻译内容之间的空格问题"""
         lines = text_to_fix.strip().split('\n')
@@ -1,28 +1,16 @@
-import os, re, asyncio, base64, json
-from io import BytesIO
+import os, re, asyncio, json
 from typing import List
 from collections import Counter
 from loguru import logger
 from PIL import Image
 from manga_translator.utils import is_valuable_text, imwrite_unicode
 from .chatgpt import OpenAITranslator
-from ..utils import Context
+from .image_payload import ImagePayload, get_image_payload_cache
+from .streaming import suppress_partial_results
+from ..utils import Context, get_tracer
 from .keys import OPENAI_API_KEY, OPENAI_MODEL
 
 
-def encode_image(image):
-    max_dim = 1024
-    w, h = image.size
-    if image.mode == "P":
-        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
-    scale = max_dim / max(w, h)
-    new_w, new_h = int(w * scale), int(h * scale)
-    image = image.resize((new_w, new_h), Image.LANCZOS)
-    buf = BytesIO()
-    image.save(buf, format="JPEG")
-    return base64.b64encode(buf.getvalue()).decode('utf-8'), new_w, new_h
-
-
 class RefusalMessageError(Exception):
     """Raised when the LMM returns a refusal message instead of JSON."""
     pass
@@ -196,7 +184,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                 return True
         return False
 
-    async def _attempt_fallback_stage1(self, refine_prompt: str, base64_img: str, from_lang: str, queries: List[str]):
+    async def _attempt_fallback_stage1(self, refine_prompt: str, page_image: ImagePayload, from_lang: str, queries: List[str]):
         """统一的 Stage-1 fallback 逻辑，避免在多处重复代码。"""
         if not hasattr(self, "_fallback_model") or not self._fallback_model:
             self.logger.debug("No fallback model configured, keeping original texts.")
@@ -207,20 +195,21 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             self.logger.warning(
                 f"Trying fallback model '{self._fallback_model}' for Stage 1 OCR (attempt {fb_attempt+1}/{fallback_max_attempts})")
             try:
-                await self._ratelimit_sleep()
-                response_fb = await self.client.chat.completions.create(
-                    model=self._fallback_model,
-                    messages=[
-                        {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
-                        {"role": "user", "content": [
-                            {"type": "text", "text": refine_prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}}
-                        ]}
-                    ],
-                    temperature=self.refine_temperature,
-                    max_completion_tokens=self.max_tokens,
-                    response_format=self.REFINE_RESPONSE_SCHEMA,
-                )
+                async with self.rate_limited(self.max_tokens) as slot:
+                    response_fb = await self.client.chat.completions.create(
+                        model=self._fallback_model,
+                        messages=[
+                            {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
+                            {"role": "user", "content": [
+                                {"type": "text", "text": refine_prompt},
+                                page_image.content_part
+                            ]}
+                        ],
+                        temperature=self.refine_temperature,
+                        max_completion_tokens=self.max_tokens,
+                        response_format=self.REFINE_RESPONSE_SCHEMA,
+                    )
+                    slot.record_tokens(getattr(getattr(response_fb, 'usage', None), 'total_tokens', 0) or 0)
 
                 if response_fb and response_fb.choices and response_fb.choices[0].message.content:
                     raw_content_fb = response_fb.choices[0].message.content
@@ -238,13 +227,13 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                 self.logger.warning(
                     f"Fallback Stage1 OCR attempt {fb_attempt+1}/{fallback_max_attempts} failed: {fb_err}")
                 if fb_attempt < fallback_max_attempts - 1:
-                    await asyncio.sleep(1)
+                    await self._rate_limit_backoff(fb_attempt + 1, fb_err)
 
         # 所有回退尝试失败 / All fallback attempts failed
         self.logger.warning("All Stage 1 fallback attempts failed. Proceeding to Stage 2 with original texts.")
         return queries, list(range(len(queries)))
 
-    async def _attempt_batch_fallback_stage1(self, batch_refine_prompt: str, batch_base64_images: List[str],
+    async def _attempt_batch_fallback_stage1(self, batch_refine_prompt: str, batch_images: List[ImagePayload],
                                            from_lang: str, queries: List[str], query_to_image_mapping: List[tuple]):
         """批量 Stage-1 fallback 逻辑，在一个请求中处理多张图片。"""
         if not hasattr(self, "_fallback_model") or not self._fallback_model:
@@ -256,26 +245,22 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             self.logger.warning(
                 f"Trying batch fallback model '{self._fallback_model}' for Stage 1 OCR (attempt {fb_attempt+1}/{fallback_max_attempts})")
             try:
-                await self._ratelimit_sleep()
-
                 # Construct messages with multiple images for fallback
                 user_content = [{"type": "text", "text": batch_refine_prompt}]
-                for base64_img in batch_base64_images:
-                    user_content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
-                    })
+                user_content.extend(image.content_part for image in batch_images)
 
-                response_fb = await self.client.chat.completions.create(
-                    model=self._fallback_model,
-                    messages=[
-                        {"role": "system", "content": self._get_batch_refine_system_instruction(from_lang)},
-                        {"role": "user", "content": user_content}
-                    ],
-                    temperature=self.refine_temperature,
-                    max_completion_tokens=self.max_tokens,
-                    response_format=self.BATCH_REFINE_RESPONSE_SCHEMA,
-                )
+                async with self.rate_limited(self.max_tokens) as slot:
+                    response_fb = await self.client.chat.completions.create(
+                        model=self._fallback_model,
+                        messages=[
+                            {"role": "system", "content": self._get_batch_refine_system_instruction(from_lang)},
+                            {"role": "user", "content": user_content}
+                        ],
+                        temperature=self.refine_temperature,
+                        max_completion_tokens=self.max_tokens,
+                        response_format=self.BATCH_REFINE_RESPONSE_SCHEMA,
+                    )
+                    slot.record_tokens(getattr(getattr(response_fb, 'usage', None), 'total_tokens', 0) or 0)
 
                 if response_fb and response_fb.choices and response_fb.choices[0].message.content:
                     raw_content_fb = response_fb.choices[0].message.content
@@ -299,7 +284,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                 self.logger.warning(
                     f"Batch fallback Stage1 OCR attempt {fb_attempt+1}/{fallback_max_attempts} failed: {fb_err}")
                 if fb_attempt < fallback_max_attempts - 1:
-                    await asyncio.sleep(1)
+                    await self._rate_limit_backoff(fb_attempt + 1, fb_err)
 
         # 所有批量回退尝试失败
         self.logger.warning("All batch Stage 1 fallback attempts failed. Proceeding to Stage 2 with original texts.")
@@ -319,7 +304,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
         
         # 添加第二阶段翻译标志位和图片存储
         self._is_stage2_translation = False
-        self._stage2_image_base64 = None
+        self._stage2_image = None
         self._stage2_use_fallback = False  # 新增：Stage2回退模型激活标志
         
         # Check model configuration and warn once
@@ -331,6 +316,14 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                 self.logger.info(f"Using dual models - Stage 1: {self.stage1_model}, Stage 2: {self.stage2_model}")
             ChatGPT2StageTranslator._warned_about_model = True
 
+    async def _translate_reordered(self, from_lang: str, to_lang: str, reordered_texts: List[str]) -> List[str]:
+        """
+        第二阶段按重排后的顺序翻译，行号与调用方的 queries 不对应，不上报部分结果
+        Stage 2 translates in reading order, its line indices do not match the caller's queries
+        """
+        with suppress_partial_results():
+            return await super()._translate(from_lang, to_lang, reordered_texts)
+
     async def _translate(self, from_lang: str, to_lang: str, queries: List[str], ctx: Context = None) -> List[str]:
         """
         Override the base translate method to implement 2-stage translation
@@ -376,7 +369,9 @@ class ChatGPT2StageTranslator(OpenAITranslator):
 
             # Stage 1: OCR correction and text reordering
             self.logger.info(f"Stage 1: Correcting OCR errors and reordering text regions using {self.stage1_model}...")
-            base64_img, nw, nh = encode_image(rgb_img)
+            # 编码结果按页面缓存，重试、回退模型与第二阶段复用同一份数据 / The encoding is cached per page and reused by retries, fallbacks and stage 2
+            page_image = await get_image_payload_cache().aget(ctx.img_rgb)
+            nw, nh = page_image.width, page_image.height
             refine_prompt = self._get_refine_prompt(query_regions, w, h, nw, nh)
 
             # Log the JSON content being sent to OCR model
@@ -390,23 +385,22 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             response = None
             for retry_count in range(self.stage1_retry_count + 1): # +1 for the initial try
                 try:
-                    # RPM速率限制 - 防止429错误
-                    await self._ratelimit_sleep()
-                    
                     # Use structured output for reliable JSON formatting
-                    response = await self.client.chat.completions.create(
-                        model=self.stage1_model,  # Use specified Stage 1 model
-                        messages=[
-                            {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
-                            {"role": "user", "content": [
-                                {"type": "text", "text": refine_prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}}
-                            ]}
-                        ],
-                        temperature=self.refine_temperature,
-                        max_completion_tokens=self.max_tokens,
-                        response_format=self.REFINE_RESPONSE_SCHEMA,
-                    )
+                    async with self.rate_limited(self.max_tokens) as slot:
+                        response = await self.client.chat.completions.create(
+                            model=self.stage1_model,  # Use specified Stage 1 model
+                            messages=[
+                                {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
+                                {"role": "user", "content": [
+                                    {"type": "text", "text": refine_prompt},
+                                    page_image.content_part
+                                ]}
+                            ],
+                            temperature=self.refine_temperature,
+                            max_completion_tokens=self.max_tokens,
+                            response_format=self.REFINE_RESPONSE_SCHEMA,
+                        )
+                        slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
                     
                     if response and response.choices and response.choices[0].message.content:
                         raw_content = response.choices[0].message.content
@@ -426,7 +420,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                 except RefusalMessageError as e:
                     self.logger.warning(f"Stage 1 model refusal detected: {e}. Attempting fallback model (if configured).")
                     reordered_texts, original_position_mapping = await self._attempt_fallback_stage1(
-                        refine_prompt, base64_img, from_lang, queries)
+                        refine_prompt, page_image, from_lang, queries)
                     break # 不再重试主模型
 
                 # 其它异常：先重试，最终再尝试 fallback
@@ -434,13 +428,13 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                     if retry_count < self.stage1_retry_count:
                         self.logger.warning(
                             f"Stage 1 refinement failed (attempt {retry_count + 1}/{self.stage1_retry_count + 1}): {e}. Retrying...")
-                        await asyncio.sleep(2 ** retry_count)  # 指数退避
+                        await self._rate_limit_backoff(retry_count + 1, e)  # 指数退避，限流时遵循 Retry-After
                         continue  # 继续下一次循环
                     else:
                         self.logger.warning(
                             f"Stage 1 refinement failed (attempt {retry_count + 1}/{self.stage1_retry_count + 1}): {e}. All attempts failed.")
                         reordered_texts, original_position_mapping = await self._attempt_fallback_stage1(
-                            refine_prompt, base64_img, from_lang, queries)
+                            refine_prompt, page_image, from_lang, queries)
                         break  # 结束 retry 循环
             
             # Process refined output (remove unpaired symbols, etc.)
@@ -481,30 +475,30 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             
             # 设置第二阶段翻译标志位和图片数据 / Set stage 2 translation flags and image data
             self._is_stage2_translation = True
-            self._stage2_image_base64 = base64_img
+            self._stage2_image = page_image
 
             try:
                 # Use parent class translation logic with reordered texts
-                reordered_translations = await super()._translate(from_lang, to_lang, reordered_texts)
+                reordered_translations = await self._translate_reordered(from_lang, to_lang, reordered_texts)
             except Exception as e:
                 # Stage 2 翻译失败，清除标志位后重试，避免分割翻译时发送图片
                 self.logger.warning(f"Stage 2 translation failed: {e}. Clearing stage 2 flags and retrying with text-only split translation.")
                 self._is_stage2_translation = False
-                self._stage2_image_base64 = None
+                self._stage2_image = None
                 self._stage2_use_fallback = False
 
                 try:
                     # 重新尝试翻译，此时不会发送图片
-                    reordered_translations = await super()._translate(from_lang, to_lang, reordered_texts)
+                    reordered_translations = await self._translate_reordered(from_lang, to_lang, reordered_texts)
                 except Exception as retry_e:
                     # 如果重试也失败，恢复标志位并重新抛出异常
                     self._is_stage2_translation = True
-                    self._stage2_image_base64 = base64_img
+                    self._stage2_image = page_image
                     raise retry_e
             finally:
                 # 清除第二阶段翻译标志位和图片数据 / Clear stage 2 translation flags and image data
                 self._is_stage2_translation = False
-                self._stage2_image_base64 = None
+                self._stage2_image = None
                 self._stage2_use_fallback = False # 重置回退状态
             
             # Remap translations back to original positions
@@ -825,20 +819,16 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             if hasattr(self, '_stage2_batch_images') and self._stage2_batch_images:
                 # Batch Stage 2: Send text and multiple images
                 user_content = [{'type': 'text', 'text': prompt}]
-                for base64_img in self._stage2_batch_images:
-                    user_content.append({
-                        'type': 'image_url',
-                        'image_url': {'url': f'data:image/jpeg;base64,{base64_img}'}
-                    })
+                user_content.extend(image.content_part for image in self._stage2_batch_images)
                 user_message = {'role': 'user', 'content': user_content}
                 messages.append(user_message)
-            elif self._stage2_image_base64:
+            elif self._stage2_image:
                 # Single image Stage 2: Send text and single image
                 user_message = {
                     'role': 'user',
                     'content': [
                         {'type': 'text', 'text': prompt},
-                        {'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64,{self._stage2_image_base64}'}}
+                        self._stage2_image.content_part
                     ]
                 }
                 messages.append(user_message)
@@ -868,7 +858,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             if self._is_stage2_translation and self.stage2_send_image and not self._stage2_use_fallback:
                 if hasattr(self, '_stage2_batch_images') and self._stage2_batch_images:
                     prompt_text += f"\n[IMAGES: {len(self._stage2_batch_images)} manga pages sent with batch translation request]"
-                elif self._stage2_image_base64:
+                elif self._stage2_image:
                     prompt_text += "\n[IMAGE: Original manga page sent with translation request]"
             elif self._is_stage2_translation and (not self.stage2_send_image or self._stage2_use_fallback):
                 if self._stage2_use_fallback:
@@ -897,7 +887,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             if self._is_stage2_translation and self.stage2_send_image and not self._stage2_use_fallback:
                 if hasattr(self, '_stage2_batch_images') and self._stage2_batch_images:
                     prompt_text += f"\n[IMAGES: {len(self._stage2_batch_images)} manga pages sent with batch translation request]"
-                elif self._stage2_image_base64:
+                elif self._stage2_image:
                     prompt_text += "\n[IMAGE: Original manga page sent with translation request]"
             elif self._is_stage2_translation and (not self.stage2_send_image or self._stage2_use_fallback):
                 if self._stage2_use_fallback:
@@ -923,14 +913,16 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             # This branch is needed to avoid using a potentially uninitialized model_to_use
             model_to_use = OPENAI_MODEL
 
-        response = await self.client.chat.completions.create(
-            model=model_to_use,
-            messages=messages,
-            max_tokens=self._MAX_TOKENS // 2,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            timeout=self._TIMEOUT
-        )
+        async with self.rate_limited(self._MAX_TOKENS // 2) as slot:
+            response = await self.client.chat.completions.create(
+                model=model_to_use,
+                messages=messages,
+                max_tokens=self._MAX_TOKENS // 2,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                timeout=self._TIMEOUT
+            )
+            slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
 
         if not response.choices:
             raise ValueError("Empty response from OpenAI API")
@@ -990,6 +982,7 @@ class ChatGPT2StageTranslator(OpenAITranslator):
         else:
             self.token_count += response.usage.total_tokens
             self.token_count_last = response.usage.total_tokens
+            get_tracer().current().add(tokens=response.usage.total_tokens)
         
         response_text = cleaned_text
         self.print_boxed(response_text, border_color="green", title="GPT Response")          
@@ -1034,7 +1027,6 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             return final_translations
 
         # Perform 2-stage translation
-        await self._ratelimit_sleep()
         translations = await self._translate(from_lang, to_lang, filtered_queries, ctx)
 
         # Apply post-processing
@@ -1099,14 +1091,10 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             # Stage 1: Batch OCR correction and text reordering
             self.logger.info(f"Stage 1: Batch OCR correction for {len(batch_images)} images using {self.stage1_model}...")
 
-            # Encode all images
-            batch_base64_images = []
-            batch_dimensions = []
-            for rgb_img in batch_images:
-                w, h = rgb_img.size
-                base64_img, nw, nh = encode_image(rgb_img)
-                batch_base64_images.append(base64_img)
-                batch_dimensions.append((w, h, nw, nh))
+            # Encode all images (cached per page, split batches and retries reuse the encodings)
+            cache = get_image_payload_cache()
+            batch_payloads = await asyncio.gather(*(cache.aget(ctx.img_rgb) for ctx in batch_contexts))
+            batch_dimensions = [(p.source_width, p.source_height, p.width, p.height) for p in batch_payloads]
 
             # Create batch refine prompt
             batch_refine_prompt = self._get_batch_refine_prompt(batch_query_regions, batch_dimensions)
@@ -1122,26 +1110,22 @@ class ChatGPT2StageTranslator(OpenAITranslator):
             response = None
             for retry_count in range(self.stage1_retry_count + 1):
                 try:
-                    await self._ratelimit_sleep()
-
                     # Construct messages with multiple images
                     user_content = [{"type": "text", "text": batch_refine_prompt}]
-                    for base64_img in batch_base64_images:
-                        user_content.append({
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
-                        })
-
-                    response = await self.client.chat.completions.create(
-                        model=self.stage1_model,
-                        messages=[
-                            {"role": "system", "content": self._get_batch_refine_system_instruction(from_lang)},
-                            {"role": "user", "content": user_content}
-                        ],
-                        temperature=self.refine_temperature,
-                        max_completion_tokens=self.max_tokens,
-                        response_format=self.BATCH_REFINE_RESPONSE_SCHEMA,
-                    )
+                    user_content.extend(image.content_part for image in batch_payloads)
+
+                    async with self.rate_limited(self.max_tokens) as slot:
+                        response = await self.client.chat.completions.create(
+                            model=self.stage1_model,
+                            messages=[
+                                {"role": "system", "content": self._get_batch_refine_system_instruction(from_lang)},
+                                {"role": "user", "content": user_content}
+                            ],
+                            temperature=self.refine_temperature,
+                            max_completion_tokens=self.max_tokens,
+                            response_format=self.BATCH_REFINE_RESPONSE_SCHEMA,
+                        )
+                        slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
 
                     if response and response.choices and response.choices[0].message.content:
                         raw_content = response.choices[0].message.content
@@ -1179,20 +1163,20 @@ class ChatGPT2StageTranslator(OpenAITranslator):
                     self.logger.warning(f"Batch Stage 1 model refusal detected: {e}. Attempting batch fallback model (if configured).")
                     # Try batch fallback model
                     batch_reordered_texts, batch_position_mapping = await self._attempt_batch_fallback_stage1(
-                        batch_refine_prompt, batch_base64_images, from_lang, queries, query_to_image_mapping)
+                        batch_refine_prompt, batch_payloads, from_lang, queries, query_to_image_mapping)
                     break
 
                 except Exception as e:
                     if retry_count < self.stage1_retry_count:
                         self.logger.warning(f"Batch Stage 1 failed (attempt {retry_count + 1}/{self.stage1_retry_count + 1}): {e}. Retrying...")
-                        await asyncio.sleep(2 ** retry_count)
+                        await self._rate_limit_backoff(retry_count + 1, e)
                         continue
                     else:
                         self.logger.warning(f"Batch Stage 1 failed after all attempts: {e}. Attempting batch fallback model (if configured).")
 
                         # Try batch fallback model
                         batch_reordered_texts, batch_position_mapping = await self._attempt_batch_fallback_stage1(
-                            batch_refine_prompt, batch_base64_images, from_lang, queries, query_to_image_mapping)
+                            batch_refine_prompt, batch_payloads, from_lang, queries, query_to_image_mapping)
                         break
 
             # Process refined output
@@ -1203,11 +1187,11 @@ class ChatGPT2StageTranslator(OpenAITranslator):
 
             # Set batch stage 2 translation flags
             self._is_stage2_translation = True
-            self._stage2_batch_images = batch_base64_images
+            self._stage2_batch_images = batch_payloads
 
             try:
                 # Use parent class translation logic with reordered texts
-                batch_reordered_translations = await super()._translate(from_lang, to_lang, batch_reordered_texts)
+                batch_reordered_translations = await self._translate_reordered(from_lang, to_lang, batch_reordered_texts)
             except Exception as e:
                 # Batch Stage 2 翻译失败，清除标志位后重试，避免分割翻译时发送图片
                 self.logger.warning(f"Batch Stage 2 translation failed: {e}. Clearing stage 2 flags and retrying with text-only split translation.")
@@ -1217,11 +1201,11 @@ class ChatGPT2StageTranslator(OpenAITranslator):
 
                 try:
                     # 重新尝试翻译，此时不会发送图片
-                    batch_reordered_translations = await super()._translate(from_lang, to_lang, batch_reordered_texts)
+                    batch_reordered_translations = await self._translate_reordered(from_lang, to_lang, batch_reordered_texts)
                 except Exception as retry_e:
                     # 如果重试也失败，恢复标志位并重新抛出异常
                     self._is_stage2_translation = True
-                    self._stage2_batch_images = batch_base64_images
+                    self._stage2_batch_images = batch_payloads
                     raise retry_e
             finally:
                 # Clear batch stage 2 translation flags
@@ -0,0 +1,234 @@
+"""
+Process-wide HTTP client pool for the online translators.
+
+Translator instances are short lived (the ChatGPT translators are created per page,
+translator chains unload theirs after each call), so clients owned by an instance
+take their keep-alive connections with them and every page pays for new TCP and TLS
+handshakes. Instead translators take their HTTP clients from this pool, keyed on
+provider, endpoint and proxy:
+
+- httpx clients (used by the OpenAI and Groq SDKs) with a bounded keep-alive pool
+  and HTTP/2 when the `h2` package is installed
+- aiohttp sessions for the translators that talk to plain HTTP APIs
+- `shared()` for SDK objects that manage their own sessions (genai, deepl)
+
+Async clients are bound to the event loop they were created on, so they are pooled
+per loop. Settings apply to clients created after `configure()`.
+"""
+
+import asyncio
+import threading
+import importlib.util
+from typing import Any, Callable, Dict, Optional
+
+from ..utils.log import get_logger
+
+logger = get_logger('client_pool')
+
+_HAS_H2 = importlib.util.find_spec('h2') is not None
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class PoolStats:
+    """Request and connection counters of one provider."""
+    __slots__ = ('requests', 'connections', 'tls_handshakes', 'http2_requests')
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+
+    def as_dict(self) -> dict:
+        reused = max(0, self.requests - self.connections)
+        return {
+            'requests': self.requests,
+            'connections': self.connections,
+            'reused': reused,
+            'reuse_ratio': round(reused / self.requests, 3) if self.requests else 0.0,
+            'tls_handshakes': self.tls_handshakes,
+            'http2_requests': self.http2_requests,
+        }
+
+
+class ClientPool:
+    def __init__(self, pool_size: int = 16, keepalive: float = 90.0, http2: bool = True):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.http2 = http2
+        self._clients: Dict[tuple, tuple] = {}
+        self._stats: Dict[str, PoolStats] = {}
+        # Reentrant, client factories look up their stats while the pool is locked
+        self._lock = threading.RLock()
+
+    def configure(self, pool_size: int = 16, keepalive: float = 90.0, http2: bool = True):
+        self.pool_size = max(1, pool_size)
+        self.keepalive = max(0.0, keepalive)
+        self.http2 = http2
+
+    def stats(self, provider: str) -> PoolStats:
+        with self._lock:
+            if provider not in self._stats:
+                self._stats[provider] = PoolStats()
+            return self._stats[provider]
+
+    def _get(self, key: tuple, loop: Optional[asyncio.AbstractEventLoop], factory: Callable[[], Any]):
+        with self._lock:
+            entry = self._clients.get(key)
+            # Loop ids can be reused after a loop is closed, compare the loop itself
+            if entry is not None and entry[1] is loop and (loop is None or not loop.is_closed()):
+                return entry[0]
+            # Drop clients of closed loops, their connections can not be used anymore
+            for k in [k for k, (_, l) in self._clients.items() if l is not None and l.is_closed()]:
+                del self._clients[k]
+            client = factory()
+            self._clients[key] = (client, loop)
+            return client
+
+    # ---- httpx ----
+
+    def _httpx_trace(self, stats: PoolStats):
+        # httpcore reports connection setup through the `trace` request extension
+        def trace(event_name: str, info: dict):
+            if event_name == 'connection.connect_tcp.complete':
+                stats.connections += 1
+            elif event_name == 'connection.start_tls.complete':
+                stats.tls_handshakes += 1
+            elif event_name == 'http2.send_request_headers.started':
+                stats.http2_requests += 1
+
+        async def atrace(event_name: str, info: dict):
+            trace(event_name, info)
+        return trace, atrace
+
+    def httpx_client(self, provider: str, base_url: str = '', proxy: Optional[str] = None, sync: bool = False):
+        """
+        Returns the pooled `httpx.AsyncClient` (or `httpx.Client` with `sync`) for
+        `provider` at `base_url`, e.g. to pass as `http_client` to the OpenAI SDK.
+        """
+        import httpx
+        loop = None if sync else _running_loop()
+        key = ('httpx-sync' if sync else 'httpx', provider, base_url, proxy, id(loop))
+
+        def create():
+            stats = self.stats(provider)
+            trace, atrace = self._httpx_trace(stats)
+            http2 = self.http2 and _HAS_H2
+            kwargs = dict(
+                http2=http2,
+                proxy=proxy,
+                # Same timeouts as the OpenAI SDK uses for its own clients
+                timeout=httpx.Timeout(600, connect=10),
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                    keepalive_expiry=self.keepalive),
+            )
+            logger.debug(f'Creating HTTP client for {provider} {base_url} (http2={http2}, pool={self.pool_size})')
+            if sync:
+                def on_request(request):
+                    stats.requests += 1
+                    request.extensions['trace'] = trace
+                return httpx.Client(event_hooks={'request': [on_request]}, **kwargs)
+
+            async def on_request_async(request):
+                stats.requests += 1
+                request.extensions['trace'] = atrace
+            return httpx.AsyncClient(event_hooks={'request': [on_request_async]}, **kwargs)
+
+        return self._get(key, loop, create)
+
+    def openai_client(self, provider: str, api_key: str, base_url: Optional[str] = None, proxy: Optional[str] = None,
+                      sync: bool = False):
+        """OpenAI SDK client on top of the pooled httpx client of its endpoint."""
+        import openai
+        http_client = self.httpx_client(provider, base_url or '', proxy, sync)
+        client_cls = openai.OpenAI if sync else openai.AsyncOpenAI
+        return client_cls(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    # ---- aiohttp ----
+
+    def aiohttp_session(self, provider: str):
+        """Returns the pooled `aiohttp.ClientSession` of `provider`, must be called inside the event loop."""
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        key = ('aiohttp', provider, id(loop))
+
+        def create():
+            stats = self.stats(provider)
+            trace_config = aiohttp.TraceConfig()
+
+            async def on_request_start(session, ctx, params):
+                stats.requests += 1
+
+            async def on_connection_create_end(session, ctx, params):
+                stats.connections += 1
+
+            trace_config.on_request_start.append(on_request_start)
+            trace_config.on_connection_create_end.append(on_connection_create_end)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive)
+            return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+        session = self._get(key, loop, create)
+        if session.closed:
+            with self._lock:
+                self._clients.pop(key, None)
+            return self.aiohttp_session(provider)
+        return session
+
+    # ---- SDK objects ----
+
+    def shared(self, provider: str, key: str, factory: Callable[[], Any]):
+        """
+        Returns one `factory()` result per provider and key for SDKs that keep their own
+        session, e.g. `genai.Client` or `deepl.Translator`.
+        """
+        return self._get(('shared', provider, key), None, factory)
+
+    # ---- lifecycle ----
+
+    def get_stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {provider: stats.as_dict() for provider, stats in self._stats.items()}
+
+    async def aclose(self):
+        """Closes the clients created on the running loop and all sync clients."""
+        loop = _running_loop()
+        with self._lock:
+            entries = [(k, c) for k, (c, l) in self._clients.items() if l is None or l is loop]
+            for k, _ in entries:
+                del self._clients[k]
+        for key, client in entries:
+            try:
+                if key[0] == 'httpx':
+                    await client.aclose()
+                elif key[0] == 'aiohttp':
+                    await client.close()
+                elif hasattr(client, 'close'):
+                    client.close()
+            except Exception as e:
+                logger.debug(f'Failed to close pooled client {key[:2]}: {e}')
+
+
+_client_pool: Optional[ClientPool] = None
+_client_pool_lock = threading.Lock()
+
+def get_client_pool() -> ClientPool:
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is None:
+            _client_pool = ClientPool()
+        return _client_pool
+
+def configure_client_pool(config):
+    """Applies the connection pool options of a `TranslatorConfig` to clients created afterwards."""
+    get_client_pool().configure(config.http_pool_size, config.http_keepalive, config.http2)
+
+def get_client_pool_stats() -> Dict[str, dict]:
+    """Requests, new connections and reuse ratio per provider."""
+    return get_client_pool().get_stats()
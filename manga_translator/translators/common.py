@@ -1,10 +1,11 @@
 import re
-import time
 import asyncio
 from typing import List, Tuple
 from abc import abstractmethod
 
 from ..utils import InfererModule, ModelWrapper, repeating_sequence, is_valuable_text
+from .ratelimit import RateLimiter, RateLimitSlot, NULL_SLOT, DEFAULT_MAX_CONCURRENCY, get_rate_limiter
+from .streaming import PartialResultSink, partial_results, remapped_partial_results, suppress_partial_results, emit_partial
 
 try:
     import readline
@@ -112,13 +113,25 @@ class CommonTranslator(InfererModule):
     # Use with _is_translation_invalid and _modify_invalid_translation_query.
     _INVALID_REPEAT_COUNT = 0
 
-    # Will sleep for the rest of the minute if the request count is over this number.
+    # Requests and tokens per minute of the shared rate limiter (see ratelimit.py), unless
+    # overridden by the translator config. Values <= 0 disable the respective bucket.
     _MAX_REQUESTS_PER_MINUTE = -1
+    _MAX_TOKENS_PER_MINUTE = -1
+
+    # Whether requests go through the shared rate limiter, disabled for local translators.
+    _RATE_LIMITED = True
+    # Translators that send several requests per `_translate` call wrap each of them in
+    # `rate_limited()` themselves. Otherwise every `_translate` call counts as one request.
+    _RATE_LIMIT_PER_REQUEST = False
+    # Translators of the same provider and API key share one limiter. Defaults to the class name.
+    _RATE_LIMIT_PROVIDER = None
 
     def __init__(self):
         super().__init__()
         self.mtpe_adapter = MTPEAdapter()
         self._last_request_ts = 0
+        self._rate_limit_config = None
+        self._rate_limiter = None
 
     def supports_languages(self, from_lang: str, to_lang: str, fatal: bool = False) -> bool:
         supported_src_languages = ['auto'] + list(self._LANGUAGE_CODE_MAP)
@@ -163,12 +176,19 @@ class CommonTranslator(InfererModule):
         for i, query in enumerate(queries):
             if not is_valuable_text(query):
                 final_translations.append(queries[i])
+                emit_partial(i, queries[i])
             else:
                 final_translations.append(None)
                 query_indices.append(i)
 
         queries = [queries[i] for i in query_indices]
 
+        # Lines reported by _translate are final unless they are still repeated, reshaped or post edited
+        if self._INVALID_REPEAT_COUNT == 0 and to_lang != 'ARA' and not use_mtpe:
+            partials = lambda: remapped_partial_results(query_indices, lambda j, t: self._clean_translation_output(queries[j], t, to_lang))
+        else:
+            partials = suppress_partial_results
+
         translations = [''] * len(queries)
         untranslated_indices = list(range(len(queries)))
         for i in range(1 + self._INVALID_REPEAT_COUNT): # Repeat until all translations are considered valid
@@ -176,11 +196,13 @@ class CommonTranslator(InfererModule):
                 self.logger.warn(f'Repeating because of invalid translation. Attempt: {i+1}')
                 await asyncio.sleep(0.1)
 
-            # Sleep if speed is over the ratelimit
-            await self._ratelimit_sleep()
-
             # Translate
-            _translations = await self._translate(*self.parse_language_codes(from_lang, to_lang, fatal=True), queries)
+            with partials():
+                if self._RATE_LIMIT_PER_REQUEST:
+                    _translations = await self._translate(*self.parse_language_codes(from_lang, to_lang, fatal=True), queries)
+                else:
+                    async with self.rate_limited():
+                        _translations = await self._translate(*self.parse_language_codes(from_lang, to_lang, fatal=True), queries)
 
             # Extend returned translations list to have the same size as queries
             if len(_translations) < len(queries):
@@ -223,18 +245,106 @@ class CommonTranslator(InfererModule):
 
         return final_translations
 
+    async def translate_stream(self, from_lang: str, to_lang: str, queries: List[str], use_mtpe: bool = False):
+        """
+        Like `translate`, but yields (index, translation) pairs as soon as lines are final,
+        in the order they complete. Translators that do not report partial results yield
+        everything once `translate` returns.
+        """
+        queue = asyncio.Queue()
+        done = set()
+
+        def on_line(index: int, translation: str):
+            if index not in done:
+                done.add(index)
+                queue.put_nowait((index, translation))
+
+        async def run():
+            with partial_results(PartialResultSink(on_line)):
+                return await self.translate(from_lang, to_lang, queries, use_mtpe)
+
+        task = asyncio.create_task(run())
+        try:
+            while not task.done() or not queue.empty():
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait([get, task], return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield get.result()
+                else:
+                    get.cancel()
+            for index, translation in enumerate(task.result()):
+                if index not in done:
+                    done.add(index)
+                    yield index, translation
+        finally:
+            if not task.done():
+                task.cancel()
+
     @abstractmethod
     async def _translate(self, from_lang: str, to_lang: str, queries: List[str]) -> List[str]:
         pass
 
-    async def _ratelimit_sleep(self):
-        if self._MAX_REQUESTS_PER_MINUTE > 0:
-            now = time.time()
-            ratelimit_timeout = self._last_request_ts + 60 / self._MAX_REQUESTS_PER_MINUTE
-            if ratelimit_timeout > now:
-                self.logger.info(f'Ratelimit sleep: {(ratelimit_timeout-now):.2f}s')
-                await asyncio.sleep(ratelimit_timeout-now)
-            self._last_request_ts = time.time()
+    def configure_rate_limit(self, config):
+        """
+        Applies the rate limit options of a `TranslatorConfig`. Called by the dispatcher
+        after `parse_args`.
+        """
+        self._rate_limit_config = config
+        self._rate_limiter = None
+
+    def _rate_limit_key(self):
+        """API key the requests are accounted to, translators with separate keys get separate limits."""
+        return getattr(getattr(self, 'client', None), 'api_key', None)
+
+    def _rate_limiter_for(self, provider: str, api_key: str = None) -> RateLimiter:
+        """Shared limiter of `provider`, for translators that talk to more than one service."""
+        config = self._rate_limit_config
+        rpm = getattr(config, 'rate_limit_rpm', None)
+        tpm = getattr(config, 'rate_limit_tpm', None)
+        return get_rate_limiter(
+            provider,
+            api_key,
+            rpm=max(0, self._MAX_REQUESTS_PER_MINUTE if rpm is None else rpm),
+            tpm=max(0, self._MAX_TOKENS_PER_MINUTE if tpm is None else tpm),
+            max_concurrency=getattr(config, 'max_concurrent_requests', DEFAULT_MAX_CONCURRENCY),
+            adaptive=getattr(config, 'adaptive_concurrency', True),
+        )
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None:
+            self._rate_limiter = self._rate_limiter_for(self._RATE_LIMIT_PROVIDER or type(self).__name__, self._rate_limit_key())
+        return self._rate_limiter
+
+    def rate_limited(self, tokens: int = 0) -> RateLimitSlot:
+        """
+        Wraps one network request, e.g.
+        `async with self.rate_limited(tokens) as slot: ...; slot.record_tokens(usage)`.
+        Waits for the request/token buckets and a concurrency slot and reports
+        rate limit errors and latency back to the limiter.
+        """
+        if not self._RATE_LIMITED:
+            return NULL_SLOT
+        return self.rate_limiter.request(tokens)
+
+    async def _ratelimit_sleep(self, tokens: int = 0):
+        """Waits for the request/token buckets without taking a concurrency slot."""
+        if self._RATE_LIMITED:
+            await self.rate_limiter.acquire(tokens)
+
+    async def _rate_limit_backoff(self, attempt: int, error: Exception = None):
+        """Sleeps before retry `attempt` after `error`, honoring Retry-After and rate limit cooldowns."""
+        if self._RATE_LIMITED:
+            await self.rate_limiter.backoff(attempt, error)
+        else:
+            await asyncio.sleep(1)
+
+    def pack_queries(self, queries: List[str]) -> List[List[int]]:
+        """
+        Splits `queries` into the line indices sent together in one request. LLM translators
+        pack them up to their token budget (see `packing.py`), others take everything at once.
+        """
+        return [list(range(len(queries)))] if queries else []
 
     def _is_translation_invalid(self, query: str, trans: str) -> bool:
         if not trans and query:
@@ -302,6 +412,7 @@ class CommonTranslator(InfererModule):
 
 class OfflineTranslator(CommonTranslator, ModelWrapper):
     _MODEL_SUB_DIR = 'translators'
+    _RATE_LIMITED = False
 
     async def _translate(self, *args, **kwargs):
         return await self.infer(*args, **kwargs)
@@ -1,11 +1,10 @@
-import asyncio
 import json
 import re
 from abc import abstractmethod
-import time
 
 from .config_gpt import ConfigGPT, TextValue, TranslationList
 from .common import CommonTranslator, VALID_LANGUAGES
+from .packing import TokenEstimator, LINE_TAG_TOKENS, get_token_estimator, pack_by_tokens
 from typing import List, Dict
 
 
@@ -23,6 +22,8 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
             language names.  Assumes that GPT translators support all languages
         _MAX_TOKENS_IN (int): The maximum number of input tokens allowed
             per query. Defaults to half of `_MAX_TOKENS` if not specified.
+        _token_budget (int): Prompt plus expected completion tokens allowed
+            per request (`request_token_budget`), 0 for no combined limit.
 
     Abstract Methods
     ----------------
@@ -35,6 +36,7 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
     """
     
     _LANGUAGE_CODE_MAP=VALID_LANGUAGES # Assume that GPT translators support all languages
+    _RATE_LIMIT_PER_REQUEST = True # Batches are split into several concurrent requests
 
     def __init__(self, config_key: str):
         """
@@ -53,9 +55,11 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
             self._MAX_TOKENS_IN
         except:
             self._MAX_TOKENS_IN = self._MAX_TOKENS//2
+        self._token_budget = 0
 
     def parse_args(self, args: CommonTranslator):
         self.config = args.chatgpt_config
+        self._token_budget = max(0, getattr(args, 'request_token_budget', 0) or 0)
 
     @abstractmethod
     def count_tokens(self, text: str) -> int:
@@ -124,6 +128,36 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
         
         return self.count_tokens(text) <= self._MAX_TOKENS_IN
 
+    @property
+    def token_estimator(self) -> TokenEstimator:
+        """
+        Token estimate shared by all instances of this provider, counting with `count_tokens`.
+        Translators whose `count_tokens` is not local should override this.
+        """
+        return get_token_estimator(self._RATE_LIMIT_PROVIDER or type(self).__name__, lambda: self.count_tokens)
+
+    def pack_queries(self, queries: List[str], line_overhead: int = LINE_TAG_TOKENS) -> List[List[int]]:
+        """
+        Packs consecutive queries into requests, keeping each prompt within `_MAX_TOKENS_IN`,
+        the expected completion within `_MAX_TOKENS` and both together within the
+        configured token budget.
+
+        Args:
+            line_overhead: Tokens added per query by its id tag or JSON wrapper
+        """
+        estimator = self.token_estimator
+        overhead = estimator.count(self.chat_system_template)
+        if self.include_template:
+            overhead += estimator.count(self.prompt_template)
+        return pack_by_tokens(
+            [estimator.count(q) + line_overhead for q in queries],
+            max_input=self._MAX_TOKENS_IN,
+            max_output=self._MAX_TOKENS,
+            budget=self._token_budget,
+            overhead=overhead,
+            output_ratio=estimator.output_ratio,
+        )
+
 
     def supports_languages(self, from_lang: str, to_lang: str, fatal: bool = False) -> bool:
         self.to_lang=to_lang
@@ -169,10 +203,6 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
         Original script's method to assemble multiple queries into prompts.
         Handles length control by splitting long queries into multiple prompts.
         """
-        batch = []          # List [ <queries> ]
-        chunk_queries = []  # List [ List [ <queries> ] ] 
-        current_length = 0
-
         def _list2prompt(queryList=List[str]):
             prompt = ""
             if self.include_template:
@@ -185,44 +215,19 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
 
             return prompt            
 
-        # Test if batching is necessary
-        #   Chunking is likely only necessary in edge-cases 
-        #       (small token limit or huge amounts of text)
-        #   
-        #   Checking if it is required should reduce workload and minimize
-        #       repeated `count_token` queries (which is not always be done locally)
-        prompt=_list2prompt(queries)
-        if self.withinTokenLimit(prompt):
-            yield prompt, len(queries)
-        else:
-            # Buffer for ID tag prepended to each query. 
-            # Assume 1 token per char (worst case scenario)
-            # 
-            # - Use `len(queries)` to get max digit count
-            #   (i.e. 0-9 => 1, 10-99 => 2, 100-999 => 3, etc.)
-            IDTagBuffer=len(f"\n<|{len(queries)}|>")
+        # 按 token 预算把连续的 query 打包成尽量少的请求
+        # Pack consecutive queries into as few requests as the token budget allows
+        packs = self.pack_queries(queries)
+        if len(packs) == 1:
+            yield _list2prompt(queries), len(queries)
+            return
+
+        # 逐个批次生成 prompt
+        # Generate prompts batch by batch
+        for pack in packs:
+            prompt = _list2prompt([queries[i] for i in pack])
             
-            for q in queries:
-                qTokens=self.count_tokens(q) + IDTagBuffer
-
-                if batch and ( (current_length + qTokens) > self._MAX_TOKENS_IN):
-                    # 输出当前 batch
-                    # Output current batch
-                    chunk_queries.append(batch)
-                    batch = []
-                    current_length = 0
-                
-                batch.append(q)
-                current_length += qTokens
-            if batch:
-                chunk_queries.append(batch)
-
-            # 逐个批次生成 prompt
-            # Generate prompts batch by batch
-            for this_batch in chunk_queries:
-                prompt = _list2prompt(this_batch)
-                
-                yield prompt.lstrip(), len(this_batch)
+            yield prompt.lstrip(), len(pack)
     
     def _assemble_request(self, to_lang: str, prompt: str) -> Dict:
         messages = [{'role': 'system', 'content': self.chat_system_template.format(to_lang=to_lang)}]
@@ -262,20 +267,11 @@ class CommonGPTTranslator(ConfigGPT, CommonTranslator):
         
         return new_translations
 
-    async def _ratelimit_sleep(self):
-        """
-        在请求前先做一次简单的节流 (如果 _MAX_REQUESTS_PER_MINUTE > 0)。
-        Simple rate limiting before requests (if _MAX_REQUESTS_PER_MINUTE > 0).
-        """
-        if self._MAX_REQUESTS_PER_MINUTE > 0:
-            now = time.time()
-            delay = 60.0 / self._MAX_REQUESTS_PER_MINUTE
-            elapsed = now - self._last_request_ts
-            if elapsed < delay:
-                await asyncio.sleep(delay - elapsed)
-            self._last_request_ts = time.time()
 
 
+# Tokens of the JSON wrapper of one query in JSON mode
+JSON_ITEM_TOKENS = 12
+
 
 class _CommonGPTTranslator_JSON:
     import pprint
@@ -316,47 +312,14 @@ class _CommonGPTTranslator_JSON:
         Original script's method to assemble multiple queries into prompts.
         Handles length control by splitting long queries into multiple prompts.
         """
-        batch = []          # List [ <queries> ]
-        chunk_queries = []  # List [ List [ <queries> ] ] 
-        input_ID = 0
-        
-        # Test if batching is necessary
-        #   Chunking is likely only necessary in edge-cases 
-        #       (small token limit or huge amounts of text)
-        #
-        #   Checking if it is required should reduce workload and minimize
-        #       repeated `count_token` queries (which is not always be done locally)
-        testFull=self._list2json(queries)
-        if self.translator.withinTokenLimit(testFull.model_dump_json()):
-            yield testFull.model_dump_json(), len(testFull.TextList)
-        else:
-            for input_text in queries:
-                # temp list, to check if it exceeds token limit:
-                temp_list = batch + [TextValue(ID=input_ID, text=input_text)]
-                temp_json = TranslationList(TextList=temp_list).model_dump_json()
-
-                if self.translator.withinTokenLimit(temp_json):
-                    # Commit value to current batch
-                    batch = temp_list
-                    input_ID += 1
-                else:
-                    # If there are values in the batch, add batch to chunk list
-                    if batch:
-                        chunk_queries.append(TranslationList(TextList=batch))
-
-                    # Start new chunk with current item (even if it exceeds limit)
-                    batch = [TextValue(ID=0, text=input_text)]
-                    
-                    # Reset ID counter for new chunk
-                    input_ID = 0
-        
-            if batch:
-                chunk_queries.append(TranslationList(TextList=batch))
+        # 按 token 预算打包，每个 query 额外计入 JSON 包装 `{"ID": n, "text": ""}` 的开销
+        # Pack by token budget, counting the JSON wrapper `{"ID": n, "text": ""}` of every query
+        for pack in self.translator.pack_queries(queries, line_overhead=JSON_ITEM_TOKENS):
+            this_batch = self._list2json([queries[i] for i in pack])
 
             # 逐个批次生成 JSON
             # Generate JSON batch by batch
-            for this_batch in chunk_queries:
-                yield this_batch.model_dump_json(), len(this_batch.TextList)
+            yield this_batch.model_dump_json(), len(this_batch.TextList)
 
     def _assemble_request(self, to_lang: str, prompt: str, response_format=True) -> Dict:
         messages = [{'role': 'system', 'content': self.translator.chat_system_template.format(to_lang=to_lang)}]
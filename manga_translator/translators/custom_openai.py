@@ -11,12 +11,16 @@ import asyncio
 import time
 from typing import List
 from .common import CommonTranslator, VALID_LANGUAGES
+from .ratelimit import estimate_tokens
+from .client_pool import get_client_pool
+from ..utils import get_tracer
 from .keys import CUSTOM_OPENAI_API_KEY, CUSTOM_OPENAI_API_BASE, CUSTOM_OPENAI_MODEL, CUSTOM_OPENAI_MODEL_CONF
 
 
 class CustomOpenAiTranslator(ConfigGPT, CommonTranslator):
     _INVALID_REPEAT_COUNT = 2  # 如果检测到"无效"翻译，最多重复 2 次
     _MAX_REQUESTS_PER_MINUTE = 40  # 每分钟最大请求次数
+    _RATE_LIMIT_PER_REQUEST = True  # 每个 prompt 单独限流
     _TIMEOUT = 40  # 在重试之前等待服务器响应的时间（秒）
     _RETRY_ATTEMPTS = 3  # 在放弃之前重试错误请求的次数
     _TIMEOUT_RETRY_ATTEMPTS = 3  # 在放弃之前重试超时请求的次数
@@ -41,8 +45,11 @@ class CustomOpenAiTranslator(ConfigGPT, CommonTranslator):
         ConfigGPT.__init__(self, config_key=_CONFIG_KEY)
         self.model = model
         CommonTranslator.__init__(self)
-        self.client = openai.AsyncOpenAI(api_key=api_key or CUSTOM_OPENAI_API_KEY or "ollama") # required, but unused for ollama
-        self.client.base_url = api_base or CUSTOM_OPENAI_API_BASE
+        self.client = get_client_pool().openai_client(
+            'custom_openai',
+            api_key or CUSTOM_OPENAI_API_KEY or "ollama",  # required, but unused for ollama
+            api_base or CUSTOM_OPENAI_API_BASE,
+        )
         self.token_count = 0
         self.token_count_last = 0
 
@@ -145,21 +152,21 @@ class CustomOpenAiTranslator(ConfigGPT, CommonTranslator):
                 try:
                     response = await request_task
                     break
-                except openai.RateLimitError:  # Server returned ratelimit response
+                except openai.RateLimitError as e:  # Server returned ratelimit response
                     ratelimit_attempt += 1
                     if ratelimit_attempt >= self._RATELIMIT_RETRY_ATTEMPTS:
                         raise
                     self.logger.warning(
                         f'Restarting request due to ratelimiting by Ollama servers. Attempt: {ratelimit_attempt}')
-                    await asyncio.sleep(2)
-                except openai.APIError:  # Server returned 500 error (probably server load)
+                    await self._rate_limit_backoff(ratelimit_attempt, e)
+                except openai.APIError as e:  # Server returned 500 error (probably server load)
                     server_error_attempt += 1
                     if server_error_attempt >= self._RETRY_ATTEMPTS:
                         self.logger.error(
                             'Ollama encountered a server error, possibly due to high server load. Use a different translator or try again later.')
                         raise
                     self.logger.warning(f'Restarting request due to a server error. Attempt: {server_error_attempt}')
-                    await asyncio.sleep(1)
+                    await self._rate_limit_backoff(server_error_attempt, e)
 
             # self.logger.debug('-- GPT Response --\n' + response)
             
@@ -221,13 +228,16 @@ class CustomOpenAiTranslator(ConfigGPT, CommonTranslator):
 
         messages.append({'role': 'user', 'content': prompt})
 
-        response = await self.client.chat.completions.create(
-            model=self.model or CUSTOM_OPENAI_MODEL,
-            messages=messages,
-            max_tokens=self._MAX_TOKENS // 2,
-            temperature=self.temperature,
-            top_p=self.top_p,
-        )
+        estimated_tokens = sum(estimate_tokens(m['content']) for m in messages) + self._MAX_TOKENS // 2
+        async with self.rate_limited(estimated_tokens) as slot:
+            response = await self.client.chat.completions.create(
+                model=self.model or CUSTOM_OPENAI_MODEL,
+                messages=messages,
+                max_tokens=self._MAX_TOKENS // 2,
+                temperature=self.temperature,
+                top_p=self.top_p,
+            )
+            slot.record_tokens(response.usage.total_tokens)
 
         self.logger.debug('\n-- GPT Response (raw) --')
         self.logger.debug(response.choices[0].message.content)
@@ -236,5 +246,6 @@ class CustomOpenAiTranslator(ConfigGPT, CommonTranslator):
 
         self.token_count += response.usage.total_tokens
         self.token_count_last = response.usage.total_tokens
+        get_tracer().current().add(tokens=response.usage.total_tokens)
 
         return response.choices[0].message.content
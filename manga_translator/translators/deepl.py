@@ -2,6 +2,7 @@ import deepl
 
 from .common import CommonTranslator, MissingAPIKeyException
 from .keys import DEEPL_AUTH_KEY
+from .client_pool import get_client_pool
 
 class DeeplTranslator(CommonTranslator):
     _LANGUAGE_CODE_MAP = {
@@ -46,7 +47,7 @@ class DeeplTranslator(CommonTranslator):
         super().__init__()
         if not DEEPL_AUTH_KEY:
             raise MissingAPIKeyException('Please set the DEEPL_AUTH_KEY environment variable before using the deepl translator.')
-        self.translator = deepl.Translator(DEEPL_AUTH_KEY)
+        self.translator = get_client_pool().shared('deepl', DEEPL_AUTH_KEY, lambda: deepl.Translator(DEEPL_AUTH_KEY))
 
     async def _translate(self, from_lang, to_lang, queries):
         return self.translator.translate_text('\n'.join(queries), target_lang = to_lang).text.split('\n')
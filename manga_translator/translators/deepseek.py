@@ -11,6 +11,10 @@ import time
 from typing import List
 from .common import MissingAPIKeyException
 from .common_gpt import CommonGPTTranslator
+from .ratelimit import estimate_tokens
+from .client_pool import get_client_pool
+from .streaming import emit_partial_batch
+from ..utils import get_tracer
 from .keys import DEEPSEEK_API_KEY, DEEPSEEK_API_BASE, DEEPSEEK_MODEL
 from .tokenizers.token_counters import deepseekTokenCounter
 
@@ -18,6 +22,7 @@ from .tokenizers.token_counters import deepseekTokenCounter
 class DeepseekTranslator(CommonGPTTranslator):
     _INVALID_REPEAT_COUNT = 0  # 现在这个参数没意义了
     _MAX_REQUESTS_PER_MINUTE = 9999  # 无RPM限制
+    _RATE_LIMIT_PROVIDER = 'deepseek'
     _TIMEOUT = 40  # 在重试之前等待服务器响应的时间（秒）
     _RETRY_ATTEMPTS = 3  # 在放弃之前重试错误请求的次数
     _TIMEOUT_RETRY_ATTEMPTS = 3  # 在放弃之前重试超时请求的次数
@@ -53,11 +58,9 @@ class DeepseekTranslator(CommonGPTTranslator):
         # Initialize the token counter
         self.tokenizer = deepseekTokenCounter()
 
-        self.client = openai.AsyncOpenAI(api_key=openai.api_key or DEEPSEEK_API_KEY)
+        self.client = get_client_pool().openai_client('deepseek', openai.api_key or DEEPSEEK_API_KEY, DEEPSEEK_API_BASE)
         if not self.client.api_key and check_openai_key:
             raise MissingAPIKeyException('DEEPSEEK_API_KEY environment variable required')
-            
-        self.client.base_url = DEEPSEEK_API_BASE
         self.token_count = 0
         self.token_count_last = 0
         self.config = None
@@ -177,20 +180,21 @@ class DeepseekTranslator(CommonGPTTranslator):
                     # Store the translations in the correct indices  
                     for idx, translation in zip(prompt_query_indices, new_translations):  
                         translations[idx] = translation  
+                    emit_partial_batch(prompt_query_indices, new_translations)
 
                     # Log progress  
                     self.logger.info(f'Batch translated: {len([t for t in translations if t])}/{len(queries)} completed.')  
                     self.logger.debug(f'Completed translations: {[t if t else queries[i] for i, t in enumerate(translations)]}')        
                     return True  # Successfully translated this batch  
                     
-                except openai.APIError:  
+                except openai.APIError as e:  
                     server_error_attempt += 1
                     if server_error_attempt >= self._RETRY_ATTEMPTS:
                         self.logger.error(
                             'Deepseek encountered a server error, possibly due to high server load. Use a different translator or try again later.')
                         raise
                     self.logger.warning(f'Restarting request due to a server error. Attempt: {server_error_attempt}')
-                    await asyncio.sleep(1)
+                    await self._rate_limit_backoff(server_error_attempt, e)
                 except Exception as e:  
                     self.logger.error(f'Error during translation attempt: {e}')  
                     if attempt == RETRY_ATTEMPTS - 1:  
@@ -221,9 +225,12 @@ class DeepseekTranslator(CommonGPTTranslator):
                 return False  # Indicate failure for this batch   
 
         # Begin translation process  
-        prompt_queries = queries  
-        prompt_query_indices = list(range(len(queries)))  
-        await translate_batch(prompt_queries, prompt_query_indices)  
+        # 按 token 预算打包后并发发送，并发数由限流器控制
+        # Send the packed requests concurrently, the rate limiter bounds the concurrency
+        await asyncio.gather(*(
+            translate_batch([queries[i] for i in pack], pack)
+            for pack in self.pack_queries(queries)
+        ))
 
         self.logger.debug(translations)  
         if self.token_count_last:  
@@ -252,7 +259,9 @@ class DeepseekTranslator(CommonGPTTranslator):
             'top_p': self.top_p,
         }
         try:
-            response = await self.client.beta.chat.completions.parse(**kwargs)
+            async with self.rate_limited(estimate_tokens(system_message + prompt) + self._MAX_TOKENS) as slot:
+                response = await self.client.beta.chat.completions.parse(**kwargs)
+                slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
             
             # 添加错误处理和日志
             if not hasattr(response, 'usage') or not hasattr(response.usage, 'total_tokens'):
@@ -261,6 +270,10 @@ class DeepseekTranslator(CommonGPTTranslator):
             else:
                 self.token_count += response.usage.total_tokens
                 self.token_count_last = response.usage.total_tokens
+                get_tracer().current().add(tokens=response.usage.total_tokens)
+                # 本地 tokenizer 计数准确，只校准预计输出长度
+                # The local tokenizer is exact, only the expected completion size is calibrated
+                self.token_estimator.record(0, 0, self.count_tokens(prompt), getattr(response.usage, 'completion_tokens', 0) or 0)
             
             # 获取响应文本
             # Get the response text
@@ -3,10 +3,15 @@ from google import genai
 from google.genai import types
 
 import asyncio
-from typing import List
+from types import SimpleNamespace
+from typing import List, Optional, Sequence
 from .common import MissingAPIKeyException, InvalidServerResponse
-from .keys import GEMINI_API_KEY, GEMINI_MODEL
+from .keys import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_API_BASE
 from .common_gpt import CommonGPTTranslator, _CommonGPTTranslator_JSON
+from .ratelimit import estimate_tokens
+from .packing import TokenEstimator
+from .gemini_session import GeminiSession, get_gemini_session
+from .streaming import NumberedStreamParser, JSONStreamParser, emit_partial_batch, partial_results_active, report_streamed_lines
 
 
 # Text Formatting:
@@ -19,6 +24,7 @@ NRML='\033[0m' # Revert to Normal formatting
 class GeminiTranslator(CommonGPTTranslator):
     _INVALID_REPEAT_COUNT = 0  # 现在这个参数没意义了
     _MAX_REQUESTS_PER_MINUTE = 9999  # 无RPM限制
+    _RATE_LIMIT_PROVIDER = 'gemini'
     _TIMEOUT = 40  # 在重试之前等待服务器响应的时间（秒）
     _RETRY_ATTEMPTS = 3  # 在放弃之前重试错误请求的次数
     _TIMEOUT_RETRY_ATTEMPTS = 3  # 在放弃之前重试超时请求的次数
@@ -97,11 +103,8 @@ class GeminiTranslator(CommonGPTTranslator):
 
         # By default: Do not assume Context Cache support
         self._canUseCache = False
-        self.cached_content = None
-        self.templateCache = None
-
-        # Dict for storing values to print to logger
-        self.cachedVals={None}
+        self._verify_tokens = False
+        self._stream_responses = False
 
         if not GEMINI_API_KEY:
             raise MissingAPIKeyException(
@@ -109,10 +112,13 @@ class GeminiTranslator(CommonGPTTranslator):
                         'before using the Gemini translator.'
                     )
 
-        self.client = genai.Client(api_key=GEMINI_API_KEY)
+        # 客户端、模型列表、token 估算与上下文缓存由同一 API key 与模型的所有实例共享
+        # Client, model list, token estimate and context caches are shared by all instances of the same key and model
+        self.session: GeminiSession = get_gemini_session(GEMINI_API_KEY, GEMINI_MODEL, GEMINI_API_BASE)
+        self.client = self.session.client
 
         try:
-            model_list=list(self.client.models.list())
+            model_list=self.session.list_models()
         except genai.errors.APIError as genai_err:
             raise InvalidServerResponse(
                         'GEMINI_API_KEY was found, but the API failed to connect.\n.' +
@@ -208,41 +214,25 @@ class GeminiTranslator(CommonGPTTranslator):
         self.token_count_last = 0 
         self.config = None
 
-    @property
-    def useCache(self) -> bool:
+    async def _context_cache(self, display_name: str, system_instruction: str, samples: Sequence[str] = None) -> Optional[str]:
         """
-        Whether or not to use Context Caching.
-
-        Gemini 2.0 and later models appear to have a minimum token requirement for context caching.
-        If the model supports caching: attempt to use caching.
-        If caching fails: The user is informed and caching is disabled.
+        Name of the shared Context Cache holding the `System Prompt` and `Chat Samples`,
+        or None if the model or the content does not support caching.
 
-
-        Returns:
-            bool: True if context caching is supported & cache was successfully created
-                  False otherwise.
+        The session creates the cache once for all concurrent requests and extends it
+        in the background before it expires. If creating it fails, caching is disabled
+        for this content and the user is informed.
         """
-
-        if self._canUseCache:
-            try:
-                if self._needRecache:
-                    self._createContext(to_lang=self.to_lang)
-                
-                return True
-            
-            except Exception as e:
-                self.logger.warning(
-                    f"\nContext Cache is supported on this model, but the cache could not be created.\n"
-                    f"The following error was encountered when attempting to create Context Cache:\n{e}\n\n"
-                    f"The most likely cause is that context contents (`System Prompt` + `Chat Samples`) does not the meet the minimum token length for the model.\n"
-                    "Context Caching will be disabled. If you wish to use caching: Try using Gemini 1.5 or increase `System Prompt` and/or `Chat Sample` size."
-                )
-                self._canUseCache = False
-
-        return False
+        if not self._canUseCache:
+            return None
+        return await self.session.cached_content(display_name, system_instruction, samples,
+                                                 ttl=self._CACHE_TTL, refresh_before=self._CACHE_TTL_BUFFER,
+                                                 verify=self._verify_tokens)
 
     def parse_args(self, args: CommonGPTTranslator):
         super().parse_args(args)
+        self._verify_tokens = bool(getattr(args, 'verify_token_counts', False))
+        self._stream_responses = bool(getattr(args, 'stream_translations', False))
         
         # Initialize mode-specific components AFTER config is loaded
         if self.json_mode:
@@ -254,7 +244,6 @@ class GeminiTranslator(CommonGPTTranslator):
         """Activate JSON-specific behavior"""
         self._json_funcs = _GeminiTranslator_json(self)
 
-        self._createContext = self._json_funcs._createContext
         self._request_translation = self._json_funcs._request_translation
         self._assemble_prompts = self._json_funcs._assemble_prompts
         self._parse_response = self._json_funcs._parse_response
@@ -264,57 +253,51 @@ class GeminiTranslator(CommonGPTTranslator):
         self._assemble_prompts = super()._assemble_prompts
 
 
-    def count_tokens(self, text: str) -> int:
-        # Uses the synchronous call (`client`) instead of asynchronous (`client.aio`)
-        #   for compatibility with `common_gpt` 's `assemble_prompt`
-        return self.client.models.count_tokens(model=GEMINI_MODEL, contents=text).total_tokens
-    
-    def _createContext(self, to_lang: str): 
-        chatSamples=None
-        sysTemplate=self.chat_system_template.format(to_lang=to_lang)
-        
-        # Store cached values for printing to logger:
-        self.cachedVals={'System Prompt (Cached)': sysTemplate}
+    def _rate_limit_key(self):
+        return GEMINI_API_KEY
 
-        # 如果需要先给出示例对话
-        # Add chat samples if available
-        lang_chat_samples = self.get_chat_sample(to_lang)
-        if lang_chat_samples:
-            chatSamples=[
-                types.Content(role='user',  parts=[types.Part.from_text(text=lang_chat_samples[0])]),
-                types.Content(role='model', parts=[types.Part.from_text(text=lang_chat_samples[1])]),
-            ]
-            self.cachedVals['Sample (Cached): User'] = lang_chat_samples[0]
-            self.cachedVals['Sample (Cached): Model'] = lang_chat_samples[1]
-
-        self.templateCache = self.client.caches.create(model=GEMINI_MODEL,
-                                                        config=types.CreateCachedContentConfig(
-                                                            contents=chatSamples,
-                                                            system_instruction=sysTemplate,
-                                                            display_name='TranslationCache',
-                                                            ttl=f'{self._CACHE_TTL}s',
-                                                        ),
-                                                    )
-        
-    def _needRecache(self) -> bool:
-        if self.templateCache is None:
-            return True
-
-        # expire_time (as seconds) - now (as seconds)
-        delta = (
-                    # Get expire_time as unix timestamp
-                    self.templateCache.expire_time.timestamp()
-                    -
-                    # Access `datetime.datetime` library through through the variable. 
-                    # Get current time as unixtimestamp
-                    self.templateCache.expire_time.now().timestamp()
-            )
-        
-        # If cache expire_time is less than 5 minutes (300 seconds) in the future: return True
-        return delta < self._CACHE_TTL_BUFFER
+    async def _generate_content(self, messages, config: types.GenerateContentConfig, parser_cls):
+        """
+        `generate_content`, streamed while partial results are received: completed lines
+        (parsed with `parser_cls`) are reported as progress as they arrive. Returns an
+        object with the `text` and `usage_metadata` of the whole response either way.
+        """
+        if not (self._stream_responses and partial_results_active()):
+            return await self.client.aio.models.generate_content(model=GEMINI_MODEL, contents=messages, config=config)
+
+        parser = parser_cls()
+        parts = []
+        usage = None
+        async for chunk in await self.client.aio.models.generate_content_stream(model=GEMINI_MODEL,
+                                                                                contents=messages,
+                                                                                config=config):
+            if getattr(chunk, 'usage_metadata', None) is not None:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                parts.append(chunk.text)
+                report_streamed_lines(len(parser.feed(chunk.text)))
+        report_streamed_lines(len(parser.finish()))
+
+        response = SimpleNamespace(text=''.join(parts))
+        if usage is not None:
+            response.usage_metadata = usage
+        return response
+
+    @property
+    def token_estimator(self) -> TokenEstimator:
+        # No local Gemini tokenizer: use the heuristic, calibrated with `usage_metadata`
+        return self.session.estimator
 
+    def count_tokens(self, text: str) -> int:
+        # Estimated locally instead of calling `client.models.count_tokens`, which would
+        #   block the event loop with a network round-trip for every prompt assembled.
+        #   With `verify_token_counts` the estimate is checked once per session, see `_translate`
+        return self.session.count_tokens(text)
+    
     async def _translate(self, from_lang: str, to_lang: str, queries: List[str]) -> List[str]:  
-        self.to_lang=to_lang # Export `to_lang`
+        if self._verify_tokens:
+            # 首次打包前异步校验一次本地 token 估算 / Verify the local estimate once before the first packing
+            await self.session.calibrate('\n'.join(queries))
         translations = [''] * len(queries)  
         self.logger.debug(f'Temperature: {self.temperature}, TopP: {self.top_p}')  
         MAX_SPLIT_ATTEMPTS = 5  # Default max split attempts  
@@ -365,20 +348,20 @@ class GeminiTranslator(CommonGPTTranslator):
                     # Store the translations in the correct indices  
                     for idx, translation in zip(prompt_query_indices, new_translations):  
                         translations[idx] = translation  
+                    emit_partial_batch(prompt_query_indices, new_translations)
 
                     # Log progress  
                     self.logger.info(f'Batch translated: {len([t for t in translations if t])}/{len(queries)} completed.')  
                     self.logger.debug(f'Completed translations: {[t if t else queries[i] for i, t in enumerate(translations)]}')        
                     return True  # Successfully translated this batch  
                     
-                except genai.errors.APIError:  
-                    server_error_attempt += 1
-                    if server_error_attempt >= self._RETRY_ATTEMPTS:
+                except genai.errors.APIError as e:  
+                    if attempt + 1 >= self._RETRY_ATTEMPTS:
                         self.logger.error(
                             'Gemini encountered a server error, possibly due to high server load. Use a different translator or try again later.')
                         raise
-                    self.logger.warning(f'Restarting request due to a server error. Attempt: {server_error_attempt}')
-                    await asyncio.sleep(1)
+                    self.logger.warning(f'Restarting request due to a server error. Attempt: {attempt + 1}')
+                    await self._rate_limit_backoff(attempt + 1, e)
                 except Exception as e:  
                     self.logger.error(f'Error during translation attempt: {e}')  
                     if attempt == RETRY_ATTEMPTS - 1:  
@@ -409,9 +392,12 @@ class GeminiTranslator(CommonGPTTranslator):
                 return False  # Indicate failure for this batch   
 
         # Begin translation process  
-        prompt_queries = queries  
-        prompt_query_indices = list(range(len(queries)))  
-        await translate_batch(prompt_queries, prompt_query_indices)  
+        # 按 token 预算打包后并发发送，并发数由限流器控制
+        # Send the packed requests concurrently, the rate limiter bounds the concurrency
+        await asyncio.gather(*(
+            translate_batch([queries[i] for i in pack], pack)
+            for pack in self.pack_queries(queries)
+        ))
 
         self.logger.debug(translations)  
         if self.token_count_last:  
@@ -432,19 +418,25 @@ class GeminiTranslator(CommonGPTTranslator):
         
         messages=[]
 
+        sysTemplate = self.chat_system_template.format(to_lang=to_lang)
+        # 如果需要先给出示例对话
+        # Add chat samples if available
+        lang_chat_samples = self.get_chat_sample(to_lang)
+
         # Store values to be printed to logger
         loggerVals={}
-        if self.useCache:
-            config_kwargs['cached_content'] = self.templateCache.name
-            
-            loggerVals = self.cachedVals.copy()
+        cache_name = await self._context_cache('TranslationCache', sysTemplate, lang_chat_samples)
+        if cache_name:
+            config_kwargs['cached_content'] = cache_name
+
+            loggerVals = {'System Prompt (Cached)': sysTemplate}
+            if lang_chat_samples:
+                loggerVals['Sample (Cached): User'] = lang_chat_samples[0]
+                loggerVals['Sample (Cached): Model'] = lang_chat_samples[1]
         else:
-            config_kwargs['system_instruction'] = self.chat_system_template.format(to_lang=to_lang)
+            config_kwargs['system_instruction'] = sysTemplate
             loggerVals = {'System Prompt': config_kwargs['system_instruction']}
 
-            # 如果需要先给出示例对话
-            # Add chat samples if available
-            lang_chat_samples = self.get_chat_sample(to_lang)
             if lang_chat_samples:
                 messages=[
                     types.Content(role='user',  parts=[types.Part.from_text(text=lang_chat_samples[0])]),
@@ -463,13 +455,10 @@ class GeminiTranslator(CommonGPTTranslator):
                             '\n------------'
                         )
 
-        response = await self.client.aio.models.generate_content(
-                                                model=GEMINI_MODEL,
-                                                contents=messages,
-                                                config=types.GenerateContentConfig(
-                                                            **config_kwargs
-                                                        )
-                                            )
+        async with self.rate_limited(estimate_tokens('\n'.join(str(v) for v in loggerVals.values()))) as slot:
+            response = await self._generate_content(messages, types.GenerateContentConfig(**config_kwargs),
+                                                    NumberedStreamParser)
+            slot.record_tokens(getattr(getattr(response, 'usage_metadata', None), 'total_token_count', 0) or 0)
 
         try:
             if not hasattr(response, 'usage_metadata'):
@@ -478,6 +467,12 @@ class GeminiTranslator(CommonGPTTranslator):
             else:
                 self.token_count += response.usage_metadata.prompt_token_count
                 self.token_count_last = response.usage_metadata.total_token_count
+                self.token_estimator.record(
+                    self.token_estimator.count('\n'.join(str(v) for v in loggerVals.values())),
+                    response.usage_metadata.prompt_token_count or 0,
+                    self.token_estimator.count(prompt),
+                    response.usage_metadata.candidates_token_count or 0,
+                )
             
             self.logger.debug(f'-- GPT Response --\n' + response.text)
 
@@ -500,34 +495,6 @@ class _GeminiTranslator_json (_CommonGPTTranslator_JSON):
         # For conveniance: Simplify logger calls:
         self.logger = self.translator.logger 
 
-    def _createContext(self, to_lang: str):
-        JSON_Samples=[]
-        sysTemplate=self.translator.chat_system_template.format(to_lang=to_lang)
-
-        # Store cached values for printing to logger:
-        self.cachedVals={'System Prompt (Cached)': sysTemplate}
-
-        # 如果需要先给出示例对话
-        # Add chat samples if available
-        lang_JSON_samples = self.translator.get_json_sample(to_lang)
-        if lang_JSON_samples:
-            JSON_Samples=[
-                types.Content(role='user',  parts=[types.Part.from_text(text=lang_JSON_samples[0].model_dump_json())]),
-                types.Content(role='model', parts=[types.Part.from_text(text=lang_JSON_samples[1].model_dump_json())]),
-            ]
-
-            self.cachedVals['Sample (Cached): User'] = self.ppJSON(lang_JSON_samples[0].model_dump_json())
-            self.cachedVals['Sample (Cached): Model'] = self.ppJSON(lang_JSON_samples[1].model_dump_json())
-
-        self.templateCache = self.translator.client.caches.create(model=GEMINI_MODEL,
-                                                                    config=types.CreateCachedContentConfig(
-                                                                        contents=JSON_Samples,
-                                                                        system_instruction=sysTemplate,
-                                                                        display_name='TranslationCache_JSON',
-                                                                        ttl=f'{self.translator._CACHE_TTL}s',
-                                                                        ),
-                                                                    )
-
     async def _request_translation(self, to_lang: str, prompt: str) -> str:
         config_kwargs = {
                             'safety_settings': self.translator.safety_settings,
@@ -539,16 +506,23 @@ class _GeminiTranslator_json (_CommonGPTTranslator_JSON):
 
         messages=[]
 
+        sysTemplate = self.translator.chat_system_template.format(to_lang=to_lang)
+        lang_JSON_samples = self.translator.get_json_sample(to_lang)
+        JSON_samples = [s.model_dump_json() for s in lang_JSON_samples[:2]] if lang_JSON_samples else None
+
         # Store values to be printed to logger
         loggerVals={}
-        if self.translator.useCache:
-            config_kwargs['cached_content'] = self.templateCache.name
-            loggerVals = self.cachedVals
+        cache_name = await self.translator._context_cache('TranslationCache_JSON', sysTemplate, JSON_samples)
+        if cache_name:
+            config_kwargs['cached_content'] = cache_name
+            loggerVals = {'System Prompt (Cached)': sysTemplate}
+            if JSON_samples:
+                loggerVals['Sample (Cached): User'] = self.ppJSON(JSON_samples[0])
+                loggerVals['Sample (Cached): Model'] = self.ppJSON(JSON_samples[1])
         else:
-            config_kwargs['system_instruction'] = self.translator.chat_system_template.format(to_lang=to_lang)
+            config_kwargs['system_instruction'] = sysTemplate
             loggerVals={'System Prompt': config_kwargs['system_instruction']}
 
-            lang_JSON_samples = self.translator.get_json_sample(to_lang)
             if lang_JSON_samples:
                 messages=[
                     types.Content(role='user',  parts=[types.Part.from_text(text=lang_JSON_samples[0].model_dump_json())]),
@@ -567,12 +541,10 @@ class _GeminiTranslator_json (_CommonGPTTranslator_JSON):
                             '\n------------'
                         )
         
-        response = await self.translator.client.aio.models.generate_content(model=GEMINI_MODEL,
-                                                                            contents=messages,
-                                                                            config=types.GenerateContentConfig(
-                                                                                **config_kwargs
-                                                                            )
-                                                                        )
+        async with self.translator.rate_limited(estimate_tokens('\n'.join(str(v) for v in loggerVals.values()))) as slot:
+            response = await self.translator._generate_content(messages, types.GenerateContentConfig(**config_kwargs),
+                                                               JSONStreamParser)
+            slot.record_tokens(getattr(getattr(response, 'usage_metadata', None), 'total_token_count', 0) or 0)
 
         try:
             if not hasattr(response, 'usage_metadata'):
@@ -581,6 +553,12 @@ class _GeminiTranslator_json (_CommonGPTTranslator_JSON):
             else:
                 self.translator.token_count += response.usage_metadata.prompt_token_count
                 self.translator.token_count_last = response.usage_metadata.total_token_count
+                self.translator.token_estimator.record(
+                    self.translator.token_estimator.count('\n'.join(str(v) for v in loggerVals.values())),
+                    response.usage_metadata.prompt_token_count or 0,
+                    self.translator.token_estimator.count(prompt),
+                    response.usage_metadata.candidates_token_count or 0,
+                )
 
             self.logger.debug(  '-- GPT Response --\n' + 
                                 self.ppJSON(response.text) + 
@@ -1,28 +1,15 @@
-import os, re, asyncio, base64
-from io import BytesIO
-from typing import List
+import os, re, asyncio
+from typing import List, Optional
 from collections import Counter
 from pydantic import BaseModel, Field
 from loguru import logger
-from openai import OpenAI
-from PIL import Image
 from manga_translator.utils import is_valuable_text
 from .common import CommonTranslator
+from .client_pool import get_client_pool
+from .image_payload import get_image_payload_cache
+from .gemini_session import get_gemini_session
 from ..utils import Context
-from .keys import GEMINI_API_KEY, GEMINI_MODEL, TOGETHER_API_KEY, TOGETHER_VL_MODEL
-
-
-def encode_image(image):
-    max_dim = 1024
-    w, h = image.size
-    if image.mode == "P":
-        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
-    scale = max_dim / max(w, h)
-    new_w, new_h = int(w * scale), int(h * scale)
-    image = image.resize((new_w, new_h), Image.LANCZOS)
-    buf = BytesIO()
-    image.save(buf, format="JPEG")
-    return base64.b64encode(buf.getvalue()).decode('utf-8'), new_w, new_h
+from .keys import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_API_BASE, TOGETHER_API_KEY, TOGETHER_VL_MODEL
 
 
 class TextBoundingBox(BaseModel):
@@ -58,6 +45,8 @@ class Gemini2StageTranslator(CommonTranslator):
     }
     _INVALID_REPEAT_COUNT = 0
     _MAX_REQUESTS_PER_MINUTE = -1
+    _RATE_LIMIT_PROVIDER = 'gemini'  # 第二阶段（翻译）与 gemini 翻译器共用限流器，第一阶段使用 together 的限流器
+    _RATE_LIMIT_PER_REQUEST = True
     _LANG_PATTERNS = [
         ('JPN', r'[\u3040-\u309f\u30a0-\u30ff]'),
         ('KOR', r'[\uac00-\ud7af\u1100-\u11ff]'),
@@ -73,12 +62,20 @@ class Gemini2StageTranslator(CommonTranslator):
 
     def __init__(self, max_tokens = 16000, refine_temperature = 0.0, translate_temperature = 0.1):
         super().__init__()
-        self.client = OpenAI(api_key=TOGETHER_API_KEY, base_url="https://api.together.xyz/v1")
-        self.client2 = OpenAI(api_key=GEMINI_API_KEY, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
+        pool = get_client_pool()
+        self.client = pool.openai_client('together', TOGETHER_API_KEY, "https://api.together.xyz/v1", sync=True)
+        self.client2 = pool.openai_client('gemini', GEMINI_API_KEY, (GEMINI_API_BASE or "https://generativelanguage.googleapis.com") + "/v1beta/openai/", sync=True)
         self.refine_model, self.translate_model = TOGETHER_VL_MODEL, GEMINI_MODEL
         self.max_tokens = max_tokens
         self.refine_temperature, self.translate_temperature = refine_temperature, translate_temperature
         self.refine_response_schema, self.translate_response_schema = TextBoundingBoxes, TranslatedTexts
+        # Token estimate and context cache of the translation stage are shared with the gemini translator
+        self.session = get_gemini_session(GEMINI_API_KEY, GEMINI_MODEL, GEMINI_API_BASE)
+        self._verify_tokens = False
+
+    def parse_args(self, args):
+        super().parse_args(args)
+        self._verify_tokens = bool(getattr(args, 'verify_token_counts', False))
 
     def supports_languages(self, from_lang: str, to_lang: str, fatal: bool = False) -> bool:
         supported_src = ['auto'] + list(self._LANGUAGE_CODE_MAP.keys())
@@ -120,7 +117,6 @@ class Gemini2StageTranslator(CommonTranslator):
                 self.logger.warn(f'Repeating because of invalid translation. Attempt: {i + 1}')
                 await asyncio.sleep(0.1)
 
-            await self._ratelimit_sleep()
             _translations = await self._translate(from_lang, to_lang, query_indices, ctx)
 
             _translations += [''] * (len(queries) - len(_translations))
@@ -155,46 +151,72 @@ class Gemini2StageTranslator(CommonTranslator):
 
         return final_translations
 
+    def _rate_limit_key(self):
+        return GEMINI_API_KEY
+
+    async def _translate_cache(self, system_instruction: str) -> Optional[str]:
+        """Context cache of the stage 2 system instruction, None if the model or the prompt can not be cached."""
+        if not await self.session.supports_cache():
+            return None
+        return await self.session.cached_content('TranslationCache_2Stage', system_instruction,
+                                                 verify=self._verify_tokens)
+
     async def _translate(self, from_lang: str, to_lang: str, query_indices: List[int], ctx: Context) -> List[str]:
         return await self._translate_2stage(from_lang, to_lang, query_indices, ctx)
 
     async def _translate_2stage(self, from_lang: str, to_lang: str, query_indices: List[int], ctx: Context) -> List[
         str]:
-        rgb_img = Image.fromarray(ctx.img_rgb)
-        w, h = rgb_img.size
         query_regions = [ctx.text_regions[i] for i in query_indices]
 
-        base64_img, nw, nh = encode_image(rgb_img)
+        # Repeated attempts on the same page reuse the cached encoding
+        page_image = await get_image_payload_cache().aget(ctx.img_rgb)
+        w, h, nw, nh = page_image.source_width, page_image.source_height, page_image.width, page_image.height
         refine_prompt = self.get_prompt(query_regions, w, h, nw, nh)
 
-        response = self.client.beta.chat.completions.parse(
-            model=self.refine_model,
-            messages=[
-                {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
-                {"role": "user", "content": [
-                    {"type": "text", "text": refine_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}}
-                ]}
-            ],
-            temperature=self.refine_temperature,
-            max_completion_tokens=self.max_tokens,
-            response_format=self.refine_response_schema,
-        ).choices[0].message.parsed
+        # The clients are synchronous, run the requests off the event loop so other pages keep going
+        async with self._rate_limiter_for('together', TOGETHER_API_KEY).request(self.max_tokens):
+            response = (await asyncio.to_thread(
+                self.client.beta.chat.completions.parse,
+                model=self.refine_model,
+                messages=[
+                    {"role": "system", "content": self._get_refine_system_instruction(from_lang)},
+                    {"role": "user", "content": [
+                        {"type": "text", "text": refine_prompt},
+                        page_image.content_part
+                    ]}
+                ],
+                temperature=self.refine_temperature,
+                max_completion_tokens=self.max_tokens,
+                response_format=self.refine_response_schema,
+            )).choices[0].message.parsed
 
         refine_sentences = self.process_refine_output([r.corrected_text.replace("\n", " ") for r in response.bboxes])
         translate_prompt = self.get_prompt(query_regions, w, h, nw, nh, only_text=True, texts=refine_sentences)
 
-        response = self.client2.beta.chat.completions.parse(
-            model=self.translate_model,
-            messages=[
-                {"role": "system", "content": self.get_translate_system_instruction(from_lang, to_lang)},
-                {"role": "user", "content": [{"type": "text", "text": translate_prompt}]}
-            ],
-            temperature=self.translate_temperature,
-            max_completion_tokens=self.max_tokens,
-            response_format=self.translate_response_schema,
-            reasoning_effort='none',
-        ).choices[0].message.parsed
+        system_instruction = self.get_translate_system_instruction(from_lang, to_lang)
+        messages = [{"role": "user", "content": [{"type": "text", "text": translate_prompt}]}]
+        extra_kwargs = {}
+        cache_name = await self._translate_cache(system_instruction)
+        if cache_name:
+            # Cached contents are passed through the Gemini specific options of the OpenAI compatible endpoint
+            extra_kwargs['extra_body'] = {'extra_body': {'google': {'cached_content': cache_name}}}
+        else:
+            messages.insert(0, {"role": "system", "content": system_instruction})
+
+        # Reserve the estimated usage instead of `max_tokens`, the limiter would otherwise throttle far below the TPM limit
+        prompt_tokens = self.session.count_tokens(translate_prompt)
+        tokens = self.session.count_tokens(system_instruction) + prompt_tokens + self.session.estimator.completion(prompt_tokens)
+        async with self.rate_limited(min(tokens, self.max_tokens)):
+            response = (await asyncio.to_thread(
+                self.client2.beta.chat.completions.parse,
+                model=self.translate_model,
+                messages=messages,
+                temperature=self.translate_temperature,
+                max_completion_tokens=self.max_tokens,
+                response_format=self.translate_response_schema,
+                reasoning_effort='none',
+                **extra_kwargs,
+            )).choices[0].message.parsed
         return [r.translated_text.replace("\n", " ") for r in response.translated_texts]
 
     def process_refine_output(self, refine_output: List[str]) -> List[str]:
@@ -0,0 +1,272 @@
+"""
+Gemini sessions shared by the Gemini translator instances.
+
+Translator instances are created per page, so state that belongs to the API key and
+model rather than to one request lives here, keyed on endpoint, API key and model:
+
+- the model list, fetched once instead of on every translator construction
+- token counts: estimated locally (`packing.TokenEstimator`), optionally verified
+  with `count_tokens` asynchronously to calibrate the estimate
+- context caches: one cache per system prompt and samples, shared by concurrent
+  requests. A missing cache is created once while concurrent requests wait for it,
+  caches close to expiry are extended in the background so requests never stall on
+  recreation, and a cache that can not be created disables caching for that prompt
+  instead of failing every request again.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence
+
+from google import genai
+from google.genai import types
+
+from .client_pool import get_client_pool
+from .packing import TokenEstimator, get_token_estimator
+from ..utils.log import get_logger
+
+logger = get_logger('gemini_session')
+
+# Smallest context cache size accepted by any Gemini model, prompts clearly below it
+# are not sent to `caches.create`
+MIN_CACHE_TOKENS = 1024
+
+# A cache is not used anymore when it expires within this many seconds
+_EXPIRY_MARGIN = 30
+
+
+class _ContextCache:
+    __slots__ = ('name', 'expires_at', 'pending', 'refreshing', 'disabled')
+
+    def __init__(self):
+        self.name: Optional[str] = None
+        self.expires_at = 0.0
+        self.pending: Optional[Future] = None
+        self.refreshing = False
+        self.disabled = False
+
+
+def _expiry(cache, ttl: int) -> float:
+    expire_time = getattr(cache, 'expire_time', None)
+    if expire_time is not None:
+        try:
+            return expire_time.timestamp()
+        except Exception:
+            pass
+    return time.time() + ttl
+
+
+class GeminiSession:
+    def __init__(self, api_key: str, model: str, base_url: str = ''):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self._models: Optional[list] = None
+        self._cache_supported: Optional[bool] = None
+        self._caches: Dict[str, _ContextCache] = {}
+        self._tasks = set()
+        self._calibrated = False
+        self._lock = threading.Lock()
+        self.stats = {'cache_hits': 0, 'cache_creations': 0, 'cache_refreshes': 0, 'cache_failures': 0,
+                      'token_verifications': 0}
+
+    @property
+    def client(self) -> genai.Client:
+        # genai.Client keeps its own HTTP sessions, share one per endpoint and API key
+        http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+        return get_client_pool().shared('gemini', f'{self.base_url}|{self.api_key}',
+                                        lambda: genai.Client(api_key=self.api_key, http_options=http_options))
+
+    @property
+    def estimator(self) -> TokenEstimator:
+        # No local Gemini tokenizer: the heuristic, calibrated with reported usage
+        return get_token_estimator('gemini')
+
+    # ---- models ----
+
+    def list_models(self) -> list:
+        """Model list of the API key, fetched on first use."""
+        if self._models is None:
+            self._models = list(self.client.models.list())
+        return self._models
+
+    async def alist_models(self) -> list:
+        if self._models is None:
+            self._models = [m async for m in await self.client.aio.models.list()]
+        return self._models
+
+    def model_info(self, models: List = None):
+        for m in models if models is not None else self.list_models():
+            if m.name.lstrip('models/') == self.model:
+                return m
+        return None
+
+    async def supports_cache(self) -> bool:
+        """Whether the model supports context caching, checked once per session."""
+        if self._cache_supported is None:
+            try:
+                info = self.model_info(await self.alist_models())
+                self._cache_supported = info is not None and 'createCachedContent' in (info.supported_actions or [])
+            except Exception as e:
+                logger.debug(f'Could not list the Gemini models, context caching disabled: {e}')
+                self._cache_supported = False
+        return self._cache_supported
+
+    # ---- tokens ----
+
+    def count_tokens(self, text: str) -> int:
+        return self.estimator.count(text)
+
+    async def verify_tokens(self, text: str) -> int:
+        """
+        Counts `text` with the `count_tokens` API and calibrates the local estimate with it.
+        Returns the local estimate if the request fails.
+        """
+        estimated = self.estimator.count(text)
+        if not text:
+            return estimated
+        try:
+            response = await self.client.aio.models.count_tokens(model=self.model, contents=text)
+        except Exception as e:
+            logger.debug(f'Token count verification failed: {e}')
+            return estimated
+        self.stats['token_verifications'] += 1
+        total = response.total_tokens or 0
+        self.estimator.record(estimated, total)
+        return total or estimated
+
+    async def calibrate(self, text: str):
+        """Verifies the token estimate once per session, before any usage was reported."""
+        if self._calibrated or self.estimator.samples > 0:
+            return
+        self._calibrated = True
+        await self.verify_tokens(text)
+
+    # ---- context caches ----
+
+    async def cached_content(self, display_name: str, system_instruction: str, samples: Sequence[str] = None,
+                             ttl: int = 3600, refresh_before: int = 300, verify: bool = False) -> Optional[str]:
+        """
+        Returns the name of the context cache holding `system_instruction` and the
+        `samples` (user, model) turns, creating it if needed. Returns None if the
+        content can not be cached.
+
+        Args:
+            ttl: Lifetime of the cache in seconds
+            refresh_before: Extend the cache in the background once it expires within this many seconds
+            verify: Check prompts near the minimum cache size with `count_tokens`
+                instead of relying on the local estimate
+        """
+        samples = list(samples or [])[:2]
+        key = hashlib.sha1('\x00'.join([display_name, system_instruction, *samples]).encode('utf-8')).hexdigest()
+
+        with self._lock:
+            entry = self._caches.setdefault(key, _ContextCache())
+            if entry.disabled:
+                return None
+            now = time.time()
+            if entry.name and now < entry.expires_at - _EXPIRY_MARGIN:
+                self.stats['cache_hits'] += 1
+                if now >= entry.expires_at - refresh_before and not entry.refreshing:
+                    entry.refreshing = True
+                    self._spawn(self._refresh(entry, display_name, system_instruction, samples, ttl))
+                return entry.name
+            pending = entry.pending
+            if pending is None:
+                entry.pending = future = Future()
+
+        if pending is not None:
+            # Another request is already creating the cache
+            return await asyncio.wrap_future(pending)
+
+        name = None
+        try:
+            name = await self._create(entry, display_name, system_instruction, samples, ttl, verify)
+        finally:
+            with self._lock:
+                entry.pending = None
+            future.set_result(name)
+        return name
+
+    async def _create(self, entry: _ContextCache, display_name: str, system_instruction: str, samples: List[str],
+                      ttl: int, verify: bool) -> Optional[str]:
+        text = '\n'.join([system_instruction, *samples])
+        tokens = self.estimator.count(text)
+        if tokens < MIN_CACHE_TOKENS and verify and tokens * 2 >= MIN_CACHE_TOKENS:
+            tokens = await self.verify_tokens(text)
+        if tokens * (1 if verify else 2) < MIN_CACHE_TOKENS:
+            logger.debug(f'{display_name}: about {tokens} tokens, too small for a context cache')
+            entry.disabled = True
+            return None
+
+        contents = None
+        if len(samples) == 2:
+            contents = [
+                types.Content(role='user', parts=[types.Part.from_text(text=samples[0])]),
+                types.Content(role='model', parts=[types.Part.from_text(text=samples[1])]),
+            ]
+        try:
+            cache = await self.client.aio.caches.create(model=self.model,
+                                                        config=types.CreateCachedContentConfig(
+                                                            contents=contents,
+                                                            system_instruction=system_instruction,
+                                                            display_name=display_name,
+                                                            ttl=f'{ttl}s',
+                                                        ))
+        except Exception as e:
+            self.stats['cache_failures'] += 1
+            entry.disabled = True
+            logger.warning(
+                f"\nContext Cache is supported on this model, but the cache could not be created.\n"
+                f"The following error was encountered when attempting to create Context Cache:\n{e}\n\n"
+                f"The most likely cause is that context contents (`System Prompt` + `Chat Samples`) does not the meet the minimum token length for the model.\n"
+                "Context Caching will be disabled. If you wish to use caching: Try using Gemini 1.5 or increase `System Prompt` and/or `Chat Sample` size."
+            )
+            return None
+
+        self.stats['cache_creations'] += 1
+        with self._lock:
+            entry.name = cache.name
+            entry.expires_at = _expiry(cache, ttl)
+        logger.debug(f'Created context cache {cache.name} ({display_name})')
+        return cache.name
+
+    async def _refresh(self, entry: _ContextCache, display_name: str, system_instruction: str, samples: List[str],
+                       ttl: int):
+        try:
+            try:
+                cache = await self.client.aio.caches.update(name=entry.name,
+                                                            config=types.UpdateCachedContentConfig(ttl=f'{ttl}s'))
+                with self._lock:
+                    entry.expires_at = _expiry(cache, ttl)
+                self.stats['cache_refreshes'] += 1
+                logger.debug(f'Extended context cache {entry.name}')
+            except Exception as e:
+                # The cache may have been deleted, create a new one while the old one is still usable
+                logger.debug(f'Could not extend context cache {entry.name}, recreating it: {e}')
+                await self._create(entry, display_name, system_instruction, samples, ttl, verify=False)
+        finally:
+            entry.refreshing = False
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, caches=sum(1 for e in self._caches.values() if e.name))
+
+
+_sessions: Dict[tuple, GeminiSession] = {}
+_sessions_lock = threading.Lock()
+
+def get_gemini_session(api_key: str, model: str, base_url: str = '') -> GeminiSession:
+    key = (base_url, api_key, model)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = GeminiSession(api_key, model, base_url)
+        return _sessions[key]
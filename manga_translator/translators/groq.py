@@ -3,6 +3,8 @@ import os
 from typing import List
 
 from .common import CommonTranslator, MissingAPIKeyException
+from .ratelimit import estimate_tokens
+from .client_pool import get_client_pool
 from .keys import GROQ_API_KEY, GROQ_MODEL
 
 class GroqTranslator(CommonTranslator):
@@ -18,6 +20,8 @@ class GroqTranslator(CommonTranslator):
 
     # API rate limiting and retry settings
     _MAX_REQUESTS_PER_MINUTE = 200
+    _RATE_LIMIT_PROVIDER = 'groq'
+    _RATE_LIMIT_PER_REQUEST = True  # One request per query
     _TIMEOUT = 40
     _RETRY_ATTEMPTS = 5
     _MAX_TOKENS = 8192
@@ -48,7 +52,8 @@ class GroqTranslator(CommonTranslator):
 
     def __init__(self, check_groq_key=True):
         super().__init__()
-        self.client = groq.AsyncGroq(api_key=GROQ_API_KEY)
+        self.client = groq.AsyncGroq(api_key=GROQ_API_KEY,
+                                     http_client=get_client_pool().httpx_client('groq', 'https://api.groq.com'))
         if not self.client.api_key and check_groq_key:
             raise MissingAPIKeyException('Please set the GROQ_API_KEY environment variable before using the Groq translator.')
         self.token_count = 0
@@ -123,14 +128,17 @@ class GroqTranslator(CommonTranslator):
         sanity = [{'role': 'system', 'content': self.chat_system_template.replace('{to_lang}', to_lang)}]
         
         # Make the API call
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=sanity + self.messages,
-            max_tokens=self._MAX_TOKENS // 2,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            stop=["'}"]
-        )
+        estimated_tokens = sum(estimate_tokens(m['content']) for m in sanity + self.messages) + self._MAX_TOKENS // 2
+        async with self.rate_limited(estimated_tokens) as slot:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=sanity + self.messages,
+                max_tokens=self._MAX_TOKENS // 2,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                stop=["'}"]
+            )
+            slot.record_tokens(response.usage.total_tokens)
         
         # Update token counts
         self.token_count += response.usage.total_tokens
@@ -0,0 +1,197 @@
+"""
+Shared page image encodings for the multimodal translators.
+
+Vision requests send the page as a downscaled, base64 encoded JPEG. Resizing with
+LANCZOS and encoding a full page takes far longer than building the rest of the
+request, and the two stage translators send the same page again for every retry,
+fallback model, split batch and for stage 2. The cache keeps one encoding per
+(image content, max dimension, JPEG quality):
+
+- `ImagePayloadCache.aget` hashes and encodes off the event loop, concurrent
+  requests for the same page wait for one encoding
+- `ImagePayload` keeps the data URL and the OpenAI style content part, so
+  requests reuse them instead of formatting the base64 string again
+- least recently used entries are dropped once the encodings exceed the byte budget
+"""
+
+import asyncio
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from ..utils.log import get_logger
+
+logger = get_logger('image_payload')
+
+DEFAULT_MAX_DIM = 1024
+DEFAULT_QUALITY = 75
+
+
+class ImagePayload:
+    """One encoded page, `base64` holds the JPEG data."""
+    __slots__ = ('base64', 'width', 'height', 'source_width', 'source_height', '_data_url', '_content_part')
+
+    mime_type = 'image/jpeg'
+
+    def __init__(self, base64: str, width: int, height: int, source_width: int, source_height: int):
+        self.base64 = base64
+        self.width = width
+        self.height = height
+        self.source_width = source_width
+        self.source_height = source_height
+        self._data_url = None
+        self._content_part = None
+
+    @property
+    def data_url(self) -> str:
+        if self._data_url is None:
+            self._data_url = f'data:{self.mime_type};base64,{self.base64}'
+        return self._data_url
+
+    @property
+    def content_part(self) -> dict:
+        """`image_url` content part for OpenAI compatible chat messages."""
+        if self._content_part is None:
+            self._content_part = {'type': 'image_url', 'image_url': {'url': self.data_url}}
+        return self._content_part
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.base64)
+
+    def __repr__(self):
+        # Keep the base64 data out of logs
+        return f'ImagePayload({self.width}x{self.height}, {self.nbytes} bytes)'
+
+
+def _image_digest(image: Union[np.ndarray, Image.Image]) -> str:
+    if isinstance(image, Image.Image):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{image.mode}{image.size}'.encode())
+        h.update(image.tobytes())
+        return h.hexdigest()
+    image = np.ascontiguousarray(image)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{image.dtype}{image.shape}'.encode())
+    h.update(image.data)
+    return h.hexdigest()
+
+
+def _encode(image: Union[np.ndarray, Image.Image], max_dim: int, quality: int) -> ImagePayload:
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    w, h = image.size
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if image.mode not in ('RGB', 'L'):
+        # JPEG has no alpha channel
+        image = image.convert('RGB')
+    scale = max_dim / max(w, h)
+    new_w, new_h = int(w * scale), int(h * scale)
+    image = image.resize((new_w, new_h), Image.LANCZOS)
+    buf = BytesIO()
+    image.save(buf, format='JPEG', quality=quality)
+    return ImagePayload(base64.b64encode(buf.getvalue()).decode('utf-8'), new_w, new_h, w, h)
+
+
+class ImagePayloadCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[tuple, ImagePayload]' = OrderedDict()
+        self._pending: Dict[tuple, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image: Union[np.ndarray, Image.Image], max_dim: int = DEFAULT_MAX_DIM,
+            quality: int = DEFAULT_QUALITY) -> ImagePayload:
+        """Returns the encoding of `image`, encoding it on the calling thread if it is not cached."""
+        key = (_image_digest(image), max_dim, quality)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                self._pending[key] = future = Future()
+            else:
+                self.hits += 1
+        if pending is not None:
+            # Another request is encoding the same page
+            return pending.result()
+
+        try:
+            payload = _encode(image, max_dim, quality)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._store(key, payload)
+        future.set_result(payload)
+        return payload
+
+    async def aget(self, image: Union[np.ndarray, Image.Image], max_dim: int = DEFAULT_MAX_DIM,
+                   quality: int = DEFAULT_QUALITY) -> ImagePayload:
+        """Like `get`, hashing and encoding on the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, image, max_dim, quality)
+
+    def _store(self, key: tuple, payload: ImagePayload):
+        if payload.nbytes > self.max_bytes:
+            return
+        self._entries[key] = payload
+        self._bytes += payload.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def configure(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max(0, max_bytes)
+            while self._entries and self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_image_payload_cache: Optional[ImagePayloadCache] = None
+_image_payload_cache_lock = threading.Lock()
+
+def get_image_payload_cache() -> ImagePayloadCache:
+    global _image_payload_cache
+    with _image_payload_cache_lock:
+        if _image_payload_cache is None:
+            _image_payload_cache = ImagePayloadCache()
+        return _image_payload_cache
+
+def encode_image(image: Union[np.ndarray, Image.Image], max_dim: int = DEFAULT_MAX_DIM,
+                 quality: int = DEFAULT_QUALITY) -> Tuple[str, int, int]:
+    """Cached encoding of `image` as (base64 JPEG, width, height)."""
+    payload = get_image_payload_cache().get(image, max_dim, quality)
+    return payload.base64, payload.width, payload.height
@@ -32,6 +32,7 @@ CAIYUN_TOKEN = os.getenv('CAIYUN_TOKEN', '') # 彩云小译API访问令牌
 # Gemini
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash-002')
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', '') # 留空使用官方地址，例如本地模拟服务 http://127.0.0.1:8765
 
 # deepseek
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', '')
@@ -3,7 +3,8 @@ from typing import List
 from .common import CommonTranslator
 
 class OriginalTranslator(CommonTranslator):
-    
+    _RATE_LIMITED = False
+
     def supports_languages(self, from_lang: str, to_lang: str, fatal: bool = False) -> bool:
         return True
 
@@ -0,0 +1,179 @@
+"""
+Token-budget request packing for the LLM translators.
+
+Every LLM request pays for the system prompt, few-shot samples and context again,
+so sending a few lines per request wastes most of the budget on overhead. The
+packer estimates prompt and completion tokens locally and fills each request with
+consecutive lines up to the configured limits:
+
+- `TokenEstimator` counts with an exact tokenizer when one is available and
+  otherwise with the `estimate_tokens` heuristic, scaled by a factor calibrated
+  against the usage the service reports. The expected completion size is
+  calibrated the same way.
+- `pack_by_tokens` splits a list of line costs into contiguous requests.
+- `group_pages` turns the requests of several pages into groups of whole pages,
+  so lines of consecutive pages share one request in batch mode.
+
+Lines are never reordered, numbered prompts and context stay in reading order.
+"""
+
+import math
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .ratelimit import estimate_tokens
+from ..utils.log import get_logger
+
+logger = get_logger('packing')
+
+# Tokens added per line by the `<|n|>` id tag and the line break
+LINE_TAG_TOKENS = 4
+
+
+class TokenEstimator:
+    """
+    Local token estimate of one provider, calibrated against reported usage.
+
+    Calibration uses an exponential moving average so a single unusual response
+    (e.g. a refusal) does not throw off the estimate.
+    """
+
+    def __init__(self, counter: Callable[[str], int] = None, output_ratio: float = 1.5, alpha: float = 0.2):
+        self._counter = counter
+        self.scale = 1.0
+        self.output_ratio = output_ratio
+        self.alpha = alpha
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exact(self) -> bool:
+        return self._counter is not None
+
+    def count(self, text: str) -> int:
+        """Estimated prompt tokens of `text`."""
+        if not text:
+            return 0
+        if self._counter is not None:
+            return self._counter(text)
+        return int(math.ceil(estimate_tokens(text) * self.scale))
+
+    def completion(self, tokens: int) -> int:
+        """Expected completion tokens for `tokens` tokens of source lines."""
+        return int(math.ceil(tokens * self.output_ratio))
+
+    def record(self, estimated_prompt: int, prompt_tokens: int, estimated_input: int = 0, completion_tokens: int = 0):
+        """
+        Calibrates the estimate with the usage of one response.
+
+        Args:
+            estimated_prompt: `count()` of everything sent in the request
+            prompt_tokens: prompt tokens reported by the service
+            estimated_input: `count()` of the source lines in the request
+            completion_tokens: completion tokens reported by the service
+        """
+        with self._lock:
+            if not self.exact and estimated_prompt > 0 and prompt_tokens > 0:
+                ratio = prompt_tokens / (estimated_prompt / self.scale)
+                self.scale = min(4.0, max(0.25, (1 - self.alpha) * self.scale + self.alpha * ratio))
+            if estimated_input > 0 and completion_tokens > 0:
+                ratio = completion_tokens / estimated_input
+                self.output_ratio = min(8.0, max(0.2, (1 - self.alpha) * self.output_ratio + self.alpha * ratio))
+            self.samples += 1
+
+
+def pack_by_tokens(costs: List[int], max_input: int = 0, max_output: int = 0, budget: int = 0,
+                   overhead: int = 0, output_ratio: float = 1.0) -> List[List[int]]:
+    """
+    Splits lines into requests of consecutive lines.
+
+    A request is closed before a line that would make it exceed any of the limits:
+    `overhead` plus the line costs above `max_input`, the expected completion
+    (`output_ratio` times the line costs) above `max_output`, or prompt plus
+    completion above `budget`. Limits <= 0 are ignored. A single line above the
+    limits is sent on its own.
+
+    Returns:
+        Lists of line indices, one per request
+    """
+    packs = []
+    pack = []
+    tokens = 0
+    for i, cost in enumerate(costs):
+        total = tokens + cost
+        output = int(math.ceil(total * output_ratio))
+        too_large = (
+            (max_input > 0 and overhead + total > max_input)
+            or (max_output > 0 and output > max_output)
+            or (budget > 0 and overhead + total + output > budget)
+        )
+        if pack and too_large:
+            packs.append(pack)
+            pack = []
+            total = cost
+        pack.append(i)
+        tokens = total
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def group_pages(page_queries: List[List[str]], pack: Callable[[List[str]], List[List[int]]]) -> List[List[int]]:
+    """
+    Groups consecutive pages whose lines are sent in the same request.
+
+    `pack` is the translator's `pack_queries`. Each page joins the request its
+    first line was packed into, so a group may slightly exceed one request, the
+    translator then splits it again. Pages without lines are left out.
+
+    Returns:
+        Lists of page indices, one per group
+    """
+    queries = []
+    first_line = {}
+    for page_idx, page in enumerate(page_queries):
+        if page:
+            first_line[page_idx] = len(queries)
+            queries.extend(page)
+    if not queries:
+        return []
+
+    pack_of_line = {}
+    for pack_idx, indices in enumerate(pack(queries)):
+        for i in indices:
+            pack_of_line[i] = pack_idx
+
+    groups = []
+    last_pack = None
+    for page_idx, line in first_line.items():
+        pack_idx = pack_of_line.get(line)
+        if groups and pack_idx == last_pack:
+            groups[-1].append(page_idx)
+        else:
+            groups.append([page_idx])
+        last_pack = pack_idx
+    return groups
+
+
+_estimators: Dict[str, TokenEstimator] = {}
+_estimators_lock = threading.Lock()
+
+def get_token_estimator(provider: str, counter: Optional[Callable[[], Callable[[str], int]]] = None) -> TokenEstimator:
+    """
+    Returns the shared estimator of `provider`. Translator instances are short lived,
+    sharing the estimator keeps its calibration.
+
+    Args:
+        counter: Returns an exact token counting function, called once when the
+            estimator is created. Failures fall back to the calibrated heuristic.
+    """
+    with _estimators_lock:
+        if provider not in _estimators:
+            count = None
+            if counter is not None:
+                try:
+                    count = counter()
+                except Exception as e:
+                    logger.debug(f'No tokenizer for {provider}, using the calibrated estimate: {e}')
+            _estimators[provider] = TokenEstimator(count)
+        return _estimators[provider]
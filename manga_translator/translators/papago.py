@@ -3,12 +3,12 @@
 from functools import cached_property
 import uuid
 import hmac, base64
-import aiohttp
 import time
 import requests
 import re
 
 from .common import CommonTranslator, InvalidServerResponse
+from .client_pool import get_client_pool
 
 class PapagoTranslator(CommonTranslator):
     _LANGUAGE_CODE_MAP = {
@@ -60,6 +60,6 @@ class PapagoTranslator(CommonTranslator):
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "Timestamp": str(timestamp),
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, data=data, headers=headers) as resp:
-                return await resp.json()
+        session = get_client_pool().aiohttp_session('papago')
+        async with session.post(self._API_URL, data=data, headers=headers) as resp:
+            return await resp.json()
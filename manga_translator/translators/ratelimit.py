@@ -0,0 +1,423 @@
+"""
+Rate limiting shared by all online translators.
+
+Every provider (and API key) gets one `RateLimiter` holding a request bucket, a
+token bucket and an adaptive concurrency limit. Translator instances for the same
+provider and key share it, so requests from concurrently processed pages, chained
+translators and the two-stage translators are paced together instead of each
+instance sleeping on its own.
+
+- Token buckets refill continuously from the configured requests/tokens per minute.
+  Acquiring reserves capacity up front and may run the bucket into debt, callers
+  then wait until the debt is paid back, which keeps waiters in FIFO order.
+- The concurrency limit follows AIMD: it grows by 1/limit for every fast successful
+  request, halves on a 429 and shrinks slightly when the latency rises well above
+  the observed baseline.
+- A 429 starts a cooldown for the whole limiter, taken from the Retry-After header
+  when the server sends one.
+"""
+
+import re
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from ..utils import get_tracer
+from ..utils.log import get_logger
+
+logger = get_logger('ratelimit')
+
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate used for the token bucket: CJK characters count as
+    one token each, everything else as a quarter token per character.
+    """
+    if not text:
+        return 0
+    cjk = len(re.findall(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for attr in ('status_code', 'status', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    return value if isinstance(value, int) else None
+
+def is_rate_limit_error(error: Optional[BaseException]) -> bool:
+    """Whether `error` is a 429 / quota exhausted response of any of the supported SDKs."""
+    if error is None:
+        return False
+    if _status_code(error) == 429:
+        return True
+    if type(error).__name__ in ('RateLimitError', 'TooManyRequests', 'ResourceExhausted'):
+        return True
+    return 'RESOURCE_EXHAUSTED' in str(error)
+
+def retry_after_seconds(error: Optional[BaseException]) -> Optional[float]:
+    """
+    Extracts the server requested delay from `error`: the `retry-after-ms` and
+    `Retry-After` headers (seconds or HTTP date) or the `retryDelay` of Google APIs.
+    """
+    if error is None:
+        return None
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+    if headers:
+        try:
+            value = headers.get('retry-after-ms')
+            if value:
+                return max(0.0, float(value) / 1000)
+            value = headers.get('retry-after')
+            if value:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError, AttributeError):
+            pass
+    match = re.search(r'retry_?delay[\'"]?\s*[:=]\s*[\'"]?(\d+(?:\.\d+)?)s', str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket. `rate_per_minute <= 0` disables it.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = 0.0
+        self.level = 0.0
+        self._updated = time.monotonic()
+        self.configure(rate_per_minute, capacity)
+
+    def configure(self, rate_per_minute: float, capacity: Optional[float] = None):
+        was_enabled = self.enabled
+        if was_enabled:
+            self._refill(time.monotonic())
+        self.rate = max(0.0, rate_per_minute) / 60
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute)
+        # A newly enabled bucket starts full, a changed one keeps its debt
+        self.level = min(self.level, self.capacity) if was_enabled else self.capacity
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` from the bucket and returns how long the caller has to wait for it."""
+        if not self.enabled or amount <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float):
+        """Returns (or with a negative amount additionally takes) capacity, e.g. to correct a token estimate."""
+        if not self.enabled:
+            return
+        self._refill(time.monotonic())
+        self.level = min(self.capacity, self.level + amount)
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight. Waiters may live on different event
+    loops (the desktop UI runs translators on several), so state is guarded by a
+    thread lock and waiters are woken thread-safely.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, adaptive: bool = True, latency_factor: float = 2.0):
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.latency_baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.configure(max_limit, adaptive)
+
+    def configure(self, max_limit: int, adaptive: bool):
+        self.max_limit = max(self.min_limit, max_limit)
+        self.adaptive = adaptive
+        # Adaptive limits start in the middle and probe upwards
+        self.limit = float(max(self.min_limit, self.max_limit // 2) if adaptive else self.max_limit)
+        with self._lock:
+            self._wake_all()
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def _wake_all(self):
+        while self._waiters:
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The waiter's loop has been closed
+                pass
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                if self.in_flight < self.current_limit:
+                    self.in_flight += 1
+                    return
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def release(self):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._wake_all()
+
+    def on_success(self, latency: float, started: float):
+        if not self.adaptive:
+            return
+        with self._lock:
+            baseline = self.latency_baseline
+            if baseline is not None and latency > baseline * self.latency_factor and latency - baseline > 1.0:
+                # Latency well above the baseline means the server starts queueing
+                self._decrease(0.9, started)
+                return
+            self.latency_baseline = latency if baseline is None else baseline * 0.9 + latency * 0.1
+            if self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self._wake_all()
+
+    def on_rate_limited(self, started: float):
+        if self.adaptive:
+            with self._lock:
+                self._decrease(0.5, started)
+
+    def _decrease(self, factor: float, started: float):
+        # Requests that were already in flight when the limit was lowered report the same
+        # congestion, only the first of them reduces the limit (once per window like TCP)
+        if started < self._last_decrease:
+            return
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self._last_decrease = time.monotonic()
+
+
+class _NullSlot:
+    """Returned for translators that are not rate limited."""
+
+    def record_tokens(self, tokens: int):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SLOT = _NullSlot()
+
+
+class RateLimitSlot:
+    """
+    One request through a `RateLimiter`, used as `async with limiter.request(tokens) as slot`.
+    Waits for the buckets and a concurrency slot on enter and reports the outcome on exit.
+    """
+
+    def __init__(self, limiter: 'RateLimiter', tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.started = 0.0
+
+    def record_tokens(self, tokens: int):
+        """Corrects the token bucket with the usage reported by the server."""
+        if tokens:
+            self.limiter._record_tokens(self.tokens, tokens)
+            self.tokens = tokens
+
+    async def __aenter__(self):
+        requested = time.monotonic()
+        await self.limiter.concurrency.acquire()
+        try:
+            await self.limiter.acquire(self.tokens)
+        except BaseException:
+            self.limiter.concurrency.release()
+            raise
+        self.started = time.monotonic()
+        self.limiter._record_start(self.started - requested, self.tokens)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.concurrency.release()
+        self.limiter._record_result(exc, self.started, time.monotonic() - self.started)
+        return False
+
+
+class RateLimiter:
+    """
+    Request and token buckets, cooldown and adaptive concurrency of one provider/key.
+    `rpm` and `tpm` of 0 disable the respective bucket.
+    """
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 adaptive: bool = True):
+        self.name = name
+        self.requests = TokenBucket(0)
+        self.tokens = TokenBucket(0)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, adaptive=adaptive)
+        self._cooldown_until = 0.0
+        self._consecutive_rate_limits = 0
+        self._config = None
+        self._stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'tokens': 0, 'wait_time': 0.0, 'latency_total': 0.0}
+        self.configure(rpm, tpm, max_concurrency, adaptive)
+
+    def configure(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, adaptive: bool = True):
+        config = (rpm, tpm, max_concurrency, adaptive)
+        if config == self._config:
+            return
+        self._config = config
+        # Allow bursts of a few seconds worth of requests, providers count tokens per minute
+        self.requests.configure(rpm, max(1.0, rpm / 10))
+        self.tokens.configure(tpm)
+        self.concurrency.configure(max_concurrency, adaptive)
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """
+        Waits until a request with `tokens` estimated tokens may be sent, without taking a
+        concurrency slot. Returns the time waited.
+        """
+        started = time.monotonic()
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # A 429 may have started a cooldown while we were waiting
+        while True:
+            remaining = self._cooldown_until - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        waited = time.monotonic() - started
+        if waited > 0.01:
+            logger.debug(f'{self.name}: rate limit wait {waited:.2f}s')
+        return waited
+
+    def request(self, tokens: int = 0) -> RateLimitSlot:
+        return RateLimitSlot(self, tokens)
+
+    async def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """
+        Sleeps before retry number `attempt` (starting at 1) after `error`.
+        Rate limit errors already started a cooldown that the next acquire waits for,
+        so they only get a little jitter. Other errors back off exponentially with full
+        jitter unless the server asked for a specific delay.
+        """
+        if is_rate_limit_error(error):
+            if time.monotonic() >= self._cooldown_until:
+                self._start_cooldown(error)
+            delay = random.uniform(0, 0.5)
+        else:
+            delay = retry_after_seconds(error)
+            if delay is None:
+                delay = random.uniform(0, min(30.0, 2.0 ** max(0, attempt - 1)))
+        await asyncio.sleep(delay)
+        return delay
+
+    def _start_cooldown(self, error: Optional[BaseException]) -> float:
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(60.0, 2.0 ** self._consecutive_rate_limits)
+        self._consecutive_rate_limits += 1
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def _record_start(self, waited: float, tokens: int):
+        self._stats['wait_time'] += waited
+        self._stats['tokens'] += tokens
+        if waited > 0.01:
+            get_tracer().current().add(ratelimit_wait=waited)
+
+    def _record_tokens(self, estimated: int, actual: int):
+        self.tokens.refund(estimated - actual)
+        self._stats['tokens'] += actual - estimated
+
+    def _record_result(self, error: Optional[BaseException], started: float, latency: float):
+        self._stats['requests'] += 1
+        self._stats['latency_total'] += latency
+        if error is None:
+            self._consecutive_rate_limits = 0
+            self.concurrency.on_success(latency, started)
+        elif is_rate_limit_error(error):
+            self._stats['rate_limited'] += 1
+            self.concurrency.on_rate_limited(started)
+            delay = self._start_cooldown(error)
+            logger.warning(f'{self.name}: rate limited, pausing requests for {delay:.1f}s '
+                           f'(concurrency limit {self.concurrency.current_limit})')
+        elif not isinstance(error, asyncio.CancelledError):
+            self._stats['errors'] += 1
+
+    def metrics(self) -> dict:
+        stats = self._stats
+        return {
+            'requests': stats['requests'],
+            'rate_limited': stats['rate_limited'],
+            'errors': stats['errors'],
+            'tokens': stats['tokens'],
+            'wait_time': round(stats['wait_time'], 3),
+            'avg_latency': round(stats['latency_total'] / stats['requests'], 3) if stats['requests'] else 0.0,
+            'in_flight': self.concurrency.in_flight,
+            'concurrency_limit': self.concurrency.current_limit,
+            'max_concurrency': self.concurrency.max_limit,
+            'cooldown': round(max(0.0, self._cooldown_until - time.monotonic()), 3),
+            'rpm': self._config[0],
+            'tpm': self._config[1],
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str, api_key: Optional[str] = None, rpm: int = 0, tpm: int = 0,
+                     max_concurrency: int = DEFAULT_MAX_CONCURRENCY, adaptive: bool = True) -> RateLimiter:
+    """
+    Returns the limiter shared by all translators of `provider` using `api_key`,
+    updated to the given limits.
+    """
+    key = provider
+    if api_key:
+        # Only a short hash of the key ends up in logs and metrics
+        key += ':' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(key, rpm, tpm, max_concurrency, adaptive)
+        else:
+            limiter.configure(rpm, tpm, max_concurrency, adaptive)
+        return limiter
+
+def get_rate_limit_metrics() -> Dict[str, dict]:
+    """Live metrics of all limiters, keyed by provider (and API key hash)."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.metrics() for limiter in limiters}
@@ -10,6 +10,8 @@ import asyncio
 from typing import List, Dict, Callable, Tuple
 
 from .common import CommonTranslator
+from .ratelimit import estimate_tokens
+from .client_pool import get_client_pool
 from .keys import SAKURA_API_BASE, SAKURA_VERSION, SAKURA_DICT_PATH
 
 import logging
@@ -207,6 +209,8 @@ class SakuraTranslator(CommonTranslator):
     _TIMEOUT_RETRY_ATTEMPTS = 3  # 请求超时时的重试次数
     _RATELIMIT_RETRY_ATTEMPTS = 3  # 请求被限速时的重试次数
     _REPEAT_DETECT_THRESHOLD = 20  # 重复检测的阈值
+    _RATE_LIMIT_PROVIDER = 'sakura'
+    _RATE_LIMIT_PER_REQUEST = True  # 质量检查会逐行重试，逐个请求限流
 
     _CHAT_SYSTEM_TEMPLATE_009 = (
         '你是一个轻小说翻译模型，可以流畅通顺地以日本轻小说的风格将日文翻译成简体中文，并联系上下文正确使用人称代词，不擅自添加原文中没有的代词。'
@@ -222,12 +226,8 @@ class SakuraTranslator(CommonTranslator):
 
     def __init__(self):
         super().__init__()
-        self.client = openai.AsyncOpenAI(api_key = openai.api_key or 'empty')
-        if "/v1" not in SAKURA_API_BASE:
-            self.client.base_url = SAKURA_API_BASE + "/v1"
-        else:
-            self.client.base_url = SAKURA_API_BASE
-        self.client.api_key = "sk-114514"
+        base_url = SAKURA_API_BASE if "/v1" in SAKURA_API_BASE else SAKURA_API_BASE + "/v1"
+        self.client = get_client_pool().openai_client('sakura', "sk-114514", base_url)
         self.temperature = 0.3
         self.top_p = 0.3
         self.frequency_penalty = 0.1
@@ -486,18 +486,19 @@ class SakuraTranslator(CommonTranslator):
                 if timeout_attempt >= self._TIMEOUT_RETRY_ATTEMPTS:
                     raise Exception('Sakura超时。')
                 self.logger.warning(f'Sakura因超时而进行重试。尝试次数： {timeout_attempt}')
-            except openai.RateLimitError:
+            except openai.RateLimitError as e:
                 ratelimit_attempt += 1
                 if ratelimit_attempt >= self._RATELIMIT_RETRY_ATTEMPTS:
                     raise
                 self.logger.warning(f'Sakura因被限速而进行重试。尝试次数： {ratelimit_attempt}')
-                await asyncio.sleep(2)
+                await self._rate_limit_backoff(ratelimit_attempt, e)
             except (openai.APIError, openai.APIConnectionError) as e:
                 server_error_attempt += 1
                 if server_error_attempt >= self._RETRY_ATTEMPTS:
                     self.logger.error(f'Sakura API请求失败。错误信息： {e}')
                     return prompt
                 self.logger.warning(f'Sakura因服务器错误而进行重试。尝试次数： {server_error_attempt}，错误信息： {e}')
+                await self._rate_limit_backoff(server_error_attempt, e)
 
         return response
 
@@ -541,16 +542,19 @@ class SakuraTranslator(CommonTranslator):
                     "content": f"根据以下术语表：\n{gpt_dict_raw_text}\n将下面的日文文本根据上述术语表的对应关系和注释翻译成中文：{raw_text}"
                 }
             ]
-        response = await self.client.chat.completions.create(
-            model="sukinishiro",
-            messages=messages,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            max_tokens=max_token_num,
-            frequency_penalty=self.frequency_penalty,
-            seed=-1,
-            extra_query=extra_query,
-        )
+        estimated_tokens = sum(estimate_tokens(m['content']) for m in messages) + max_token_num
+        async with self.rate_limited(estimated_tokens) as slot:
+            response = await self.client.chat.completions.create(
+                model="sukinishiro",
+                messages=messages,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                max_tokens=max_token_num,
+                frequency_penalty=self.frequency_penalty,
+                seed=-1,
+                extra_query=extra_query,
+            )
+            slot.record_tokens(getattr(getattr(response, 'usage', None), 'total_tokens', 0) or 0)
         # 提取并返回响应文本
         for choice in response.choices:
             if 'text' in choice:
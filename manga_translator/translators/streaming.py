@@ -0,0 +1,240 @@
+"""
+Partial translation results.
+
+Translators report lines as soon as they are final instead of only returning the
+whole list at the end, so the pipeline can report progress and post-process pages
+whose lines are complete while the rest of the batch is still being translated.
+
+The receiver is installed with `partial_results(sink)` around a translation call
+(`nested_partial_results` to keep the enclosing receiver as well) and is local to
+the running task (a context variable), so concurrent translations sharing one
+translator instance do not mix up their lines. Translators call:
+
+- `emit_partial(index, translation)` for a line that will not change anymore,
+  `index` being the position in the `queries` passed to `_translate`
+- `report_streamed_lines(count)` for lines parsed from a response that is still
+  streaming; these are not final, the response may still fail validation
+
+`NumberedStreamParser` and `JSONStreamParser` parse the `<|n|>` and JSON list
+response formats incrementally while they stream.
+"""
+
+import json
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from ..utils.log import get_logger
+
+logger = get_logger('streaming')
+
+
+class PartialResultSink:
+    """
+    Receives partial results, both callbacks may be None. With a `parent`, results are
+    passed on to it as well, with the same line indices.
+    """
+
+    def __init__(self, on_line: Callable[[int, str], None] = None, on_streamed: Callable[[int], None] = None,
+                 parent: 'PartialResultSink' = None):
+        self.on_line = on_line
+        self.on_streamed = on_streamed
+        self.parent = parent
+
+    def line(self, index: int, translation: str):
+        if self.on_line is not None:
+            self.on_line(index, translation)
+        if self.parent is not None:
+            self.parent.line(index, translation)
+
+    def streamed(self, count: int):
+        if self.on_streamed is not None:
+            self.on_streamed(count)
+        if self.parent is not None:
+            self.parent.streamed(count)
+
+
+class _RemappedSink(PartialResultSink):
+    """Maps the line indices of a subset of queries back to the full list."""
+
+    def __init__(self, parent: PartialResultSink, indices: List[int], transform: Callable[[int, str], str] = None):
+        super().__init__(parent=parent)
+        self.indices = indices
+        self.transform = transform
+
+    def line(self, index: int, translation: str):
+        if 0 <= index < len(self.indices):
+            if self.transform is not None:
+                translation = self.transform(index, translation)
+            self.parent.line(self.indices[index], translation)
+
+
+_partial_sink: ContextVar[Optional[PartialResultSink]] = ContextVar('partial_sink', default=None)
+
+
+@contextmanager
+def partial_results(sink: Optional[PartialResultSink]):
+    """Sends the partial results of translations inside the block to `sink`."""
+    token = _partial_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _partial_sink.reset(token)
+
+
+def nested_partial_results(on_line: Callable[[int, str], None] = None, on_streamed: Callable[[int], None] = None):
+    """Like `partial_results`, results are also passed on to the enclosing receiver, if any."""
+    return partial_results(PartialResultSink(on_line, on_streamed, parent=_partial_sink.get()))
+
+
+@contextmanager
+def remapped_partial_results(indices: List[int], transform: Callable[[int, str], str] = None):
+    """
+    Inside the block, line `i` is reported as line `indices[i]` of the enclosing
+    receiver, after `transform(i, translation)`. Does nothing without a receiver.
+    """
+    parent = _partial_sink.get()
+    with partial_results(_RemappedSink(parent, indices, transform) if parent is not None else None):
+        yield
+
+
+def suppress_partial_results():
+    """For translations whose lines do not map to the caller's queries, e.g. reordered texts."""
+    return partial_results(None)
+
+
+def partial_results_active() -> bool:
+    return _partial_sink.get() is not None
+
+
+def emit_partial(index: int, translation: str):
+    sink = _partial_sink.get()
+    if sink is None:
+        return
+    try:
+        sink.line(index, translation)
+    except Exception as e:
+        logger.debug(f'Partial result receiver failed: {e}')
+
+
+def emit_partial_batch(indices: List[int], translations: List[str]):
+    if _partial_sink.get() is None:
+        return
+    for index, translation in zip(indices, translations):
+        emit_partial(index, translation)
+
+
+def report_streamed_lines(count: int):
+    sink = _partial_sink.get()
+    if sink is None or count <= 0:
+        return
+    try:
+        sink.streamed(count)
+    except Exception as e:
+        logger.debug(f'Partial result receiver failed: {e}')
+
+
+class NumberedStreamParser:
+    """
+    Incremental parser for `<|n|>translation` responses.
+
+    A line is complete once the tag of the next line arrives, the last line once
+    the response ends (`finish`). Tags split across chunks are only matched when
+    complete, so partial tags never end up in a line.
+    """
+    _TAG = re.compile(r'<\|(\d+)\|>')
+
+    def __init__(self):
+        self._buffer = ''
+        self._current: Optional[Tuple[int, int]] = None  # (id, start of its text in the buffer)
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> List[Tuple[int, str]]:
+        self._buffer += chunk
+        lines = []
+        for match in self._TAG.finditer(self._buffer, self._scan_from):
+            if self._current is not None:
+                line_id, start = self._current
+                lines.append((line_id, self._buffer[start:match.start()].strip()))
+            self._current = (int(match.group(1)), match.end())
+            self._scan_from = match.end()
+        # Drop consumed text, keep the current line and a possibly incomplete tag
+        if self._current is not None:
+            start = self._current[1]
+            self._buffer = self._buffer[start:]
+            self._scan_from -= start
+            self._current = (self._current[0], 0)
+        return lines
+
+    def finish(self) -> List[Tuple[int, str]]:
+        if self._current is None:
+            return []
+        line_id, start = self._current
+        self._current = None
+        return [(line_id, self._buffer[start:].strip())]
+
+
+class JSONStreamParser:
+    """
+    Incremental parser returning the objects of a JSON array as they complete,
+    e.g. the `{"ID": .., "text": ..}` items of a streamed `TranslationList`.
+
+    Only tracks strings and nesting, each completed item is decoded with `json`.
+    Malformed items are skipped, the full response is still validated afterwards.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item_start = -1
+        self._item_depth = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._buffer += chunk
+        items = []
+        buffer = self._buffer
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if char == '{' and self._stack and self._stack[-1] == '[' and self._item_start < 0:
+                    self._item_start = pos
+                    self._item_depth = len(self._stack)
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if char == '}' and self._item_start >= 0 and len(self._stack) == self._item_depth:
+                    try:
+                        item = json.loads(buffer[self._item_start:pos + 1])
+                        if isinstance(item, dict):
+                            items.append(item)
+                    except ValueError:
+                        pass
+                    self._item_start = -1
+        self._pos = len(buffer)
+        # Drop text before the current item, nothing before it is needed anymore
+        cut = self._item_start if self._item_start >= 0 else self._pos
+        if cut > 0:
+            self._buffer = buffer[cut:]
+            self._pos -= cut
+            if self._item_start >= 0:
+                self._item_start -= cut
+        return items
+
+    def finish(self) -> List[dict]:
+        # Items are complete when their closing brace arrives, nothing is left over
+        return []
@@ -3,11 +3,11 @@
 import uuid
 import hashlib
 import time
-import aiohttp
 import time
 
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import YOUDAO_APP_KEY, YOUDAO_SECRET_KEY
+from .client_pool import get_client_pool
 
 def sha256_encode(signStr):
     hash_algorithm = hashlib.sha256()
@@ -76,6 +76,6 @@ class YoudaoTranslator(CommonTranslator):
 
     async def _do_request(self, data):
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, data=data, headers=headers) as resp:
-                return await resp.json()
+        session = get_client_pool().aiohttp_session('youdao')
+        async with session.post(self._API_URL, data=data, headers=headers) as resp:
+            return await resp.json()
@@ -1,7 +1,7 @@
 from typing import List
 from PIL import Image
 
-from .common import CommonUpscaler, OfflineUpscaler
+from .common import CommonUpscaler, OfflineUpscaler, TiledUpscaler, ExecutableUpscaler
 from .waifu2x import Waifu2xUpscaler
 from .esrgan import ESRGANUpscaler
 from .esrgan_pytorch import ESRGANUpscalerPytorch
@@ -27,12 +27,14 @@ async def prepare(upscaler_key: Upscaler):
     if isinstance(upscaler, OfflineUpscaler):
         await upscaler.download()
 
-async def dispatch(upscaler_key: Upscaler, image_batch: List[Image.Image], upscale_ratio: int, device: str = 'cpu') -> List[Image.Image]:
+async def dispatch(upscaler_key: Upscaler, image_batch: List[Image.Image], upscale_ratio: int, device: str = 'cpu',
+                   tile_size: int = 0, tile_overlap: int = 16, tile_batch_size: int = 4, memory_budget_mb: int = 0) -> List[Image.Image]:
     if upscale_ratio == 1:
         return image_batch
     upscaler = get_upscaler(upscaler_key)
     if isinstance(upscaler, OfflineUpscaler):
         await upscaler.load(device)
+    upscaler.set_tiling(tile_size, tile_overlap, tile_batch_size, memory_budget_mb)
     return await upscaler.upscale(image_batch, upscale_ratio)
 
 async def unload(upscaler_key: Upscaler):
@@ -1,12 +1,31 @@
+import os
+import asyncio
+import shutil
+import tempfile
+import numpy as np
 from PIL import Image
 from typing import List
 from abc import abstractmethod
 
+from .tiling import choose_tile_size, get_memory_budget, tiled_upscale
 from ..utils import InfererModule, ModelWrapper
 
 class CommonUpscaler(InfererModule):
     _VALID_UPSCALE_RATIOS = []
 
+    # Tiling options, 0 means "choose automatically"
+    tile_size = 0
+    tile_overlap = 16
+    tile_batch_size = 4
+    memory_budget_mb = 0
+
+    def set_tiling(self, tile_size: int = 0, tile_overlap: int = 16, tile_batch_size: int = 4, memory_budget_mb: int = 0):
+        """Configures how images are split into tiles. Upscalers without tiling support ignore it."""
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_batch_size = max(1, tile_batch_size)
+        self.memory_budget_mb = memory_budget_mb
+
     async def upscale(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
         if upscale_ratio == 1:
             return image_batch
@@ -55,3 +74,93 @@ class OfflineUpscaler(CommonUpscaler, ModelWrapper):
             The list of upscaled images.
         """
         pass
+
+
+class TiledUpscaler(OfflineUpscaler):
+    """
+    Base class for upscalers that run a torch model in-process. Images are split into
+    overlapping tiles which are upscaled in batches and blended back with feathered seams,
+    so peak memory is bounded by the tile size instead of the page size.
+    """
+    # Approximate activation memory per input pixel of a single forward pass
+    _TILE_BYTES_PER_PIXEL = 32 * 1024
+    # Tile sides have to be divisible by this (e.g. because of pixel unshuffling)
+    _TILE_MULTIPLE = 8
+
+    device = 'cpu'
+
+    def _get_tile_size(self) -> int:
+        if self.tile_size > 0:
+            return max(self._TILE_MULTIPLE, self.tile_size // self._TILE_MULTIPLE * self._TILE_MULTIPLE)
+        budget = get_memory_budget(self.device, self.memory_budget_mb)
+        return choose_tile_size(self._TILE_BYTES_PER_PIXEL, budget, self.tile_batch_size, self.tile_overlap, self._TILE_MULTIPLE)
+
+    def _to_model_input(self, image: Image.Image) -> np.ndarray:
+        """Converts a PIL image to the (h, w, c) uint8 array tiles are cut from, tiles are scaled to [0, 1] for `_forward`."""
+        return np.asarray(image.convert('RGB'))
+
+    def _from_model_output(self, output: np.ndarray) -> Image.Image:
+        return Image.fromarray(output)
+
+    def _upscale_image(self, image: Image.Image) -> Image.Image:
+        tile_size = self._get_tile_size()
+        output = tiled_upscale(self._forward, self._to_model_input(image), tile_size, self.tile_overlap,
+                               self.tile_batch_size, self.device)
+        return self._from_model_output(output)
+
+    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
+        return [self._upscale_image(image) for image in image_batch]
+
+    @abstractmethod
+    def _forward(self, batch):
+        """
+        Runs the model on a `(b, c, h, w)` float tensor in [0, 1] and returns the upscaled batch.
+        """
+        pass
+
+class ExecutableUpscaler(OfflineUpscaler):
+    """
+    Base class for upscalers that shell out to an external executable. The executables only
+    accept file paths, so images are passed through a memory backed directory where available.
+    """
+
+    @staticmethod
+    def _get_pipe_directory() -> str:
+        # /dev/shm is a tmpfs on linux, so the round trip never touches the disk
+        shm = '/dev/shm'
+        if os.path.isdir(shm) and os.access(shm, os.W_OK):
+            return tempfile.mkdtemp(dir=shm)
+        return tempfile.mkdtemp()
+
+    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
+        in_dir = self._get_pipe_directory()
+        out_dir = self._get_pipe_directory()
+        try:
+            for i, image in enumerate(image_batch):
+                # Lowest compression level, the files only live for the duration of the call
+                image.save(os.path.join(in_dir, f'{i}.png'), compress_level=1)
+
+            try:
+                await asyncio.to_thread(self._run_executable, in_dir, out_dir, upscale_ratio)
+            except Exception:
+                # Maybe throw exception instead
+                self.logger.warn(f'Process returned non-zero exit status. Skipping upscaling.')
+                return image_batch
+
+            output_batch = []
+            for i, image in enumerate(image_batch):
+                img_path = os.path.join(out_dir, f'{i}.png')
+                if os.path.exists(img_path):
+                    img = Image.open(img_path)
+                    img.load()
+                    output_batch.append(img)
+                else:
+                    output_batch.append(image)
+            return output_batch
+        finally:
+            shutil.rmtree(in_dir, ignore_errors=True)
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    @abstractmethod
+    def _run_executable(self, image_directory: str, output_directory: str, upscale_ratio: float):
+        pass
@@ -1,14 +1,10 @@
 import os
 import re
 import subprocess
-import tempfile
-import shutil
 import tqdm
 from sys import platform
-from typing import List
-from PIL import Image
 
-from .common import OfflineUpscaler
+from .common import ExecutableUpscaler
 
 if platform == 'win32':
     esrgan_base_folder = 'esrgan-win/'
@@ -54,7 +50,7 @@ else:
     }
 
 # https://github.com/xinntao/Real-ESRGAN
-class ESRGANUpscaler(OfflineUpscaler):
+class ESRGANUpscaler(ExecutableUpscaler):
     _MODEL_MAPPING = model_mapping
     _VALID_UPSCALE_RATIOS = [2, 3, 4]
 
@@ -64,33 +60,8 @@ class ESRGANUpscaler(OfflineUpscaler):
     async def _unload(self):
         pass
 
-    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
-        # Has to cache images because chosen upscaler doesn't support piping
-        in_dir = tempfile.mkdtemp()
-        out_dir = tempfile.mkdtemp()
-        for i, image in enumerate(image_batch):
-            image.save(os.path.join(in_dir, f'{i}.png'))
-
-        try:
-            self._run_esrgan_executable(in_dir, out_dir, upscale_ratio, 0)
-        except Exception:
-            # Maybe throw exception instead
-            self.logger.warn(f'Process returned non-zero exit status. Skipping upscaling.')
-            return image_batch
-
-        output_batch = []
-        for i, image in enumerate(image_batch):
-            img_path = os.path.join(out_dir, f'{i}.png')
-            if os.path.exists(img_path):
-                img = Image.open(img_path)
-                img.load()
-                output_batch.append(img)
-            else:
-                output_batch.append(image)
-
-        shutil.rmtree(in_dir)
-        shutil.rmtree(out_dir)
-        return output_batch
+    def _run_executable(self, image_directory: str, output_directory: str, upscale_ratio: float):
+        self._run_esrgan_executable(image_directory, output_directory, upscale_ratio, 0)
 
     def _run_esrgan_executable(self, image_directory: str, output_directory: str, upscale_ratio: float, denoise_level: int):
         cmds = [
@@ -100,6 +71,8 @@ class ESRGANUpscaler(OfflineUpscaler):
             '-m', self._get_file_path(os.path.join(esrgan_base_folder, 'models')),
             '-s', str(upscale_ratio),
         ]
+        if self.tile_size > 0:
+            cmds += ['-t', str(self.tile_size)]
         process = subprocess.Popen(cmds, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         with tqdm.tqdm(desc='[esgran]', total=100) as bar:
             last_progress = 0
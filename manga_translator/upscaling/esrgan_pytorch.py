@@ -3,7 +3,6 @@ import re
 import subprocess
 import tempfile
 import shutil
-import einops
 import tqdm
 from sys import platform
 from typing import List
@@ -17,9 +16,8 @@ import functools
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import numpy as np
 
-from .common import OfflineUpscaler
+from .common import TiledUpscaler
 
 ####################
 # RRDBNet Generator
@@ -509,7 +507,7 @@ def infer_params(state_dict):
 
 
 # https://github.com/xinntao/Real-ESRGAN
-class ESRGANUpscalerPytorch(OfflineUpscaler):
+class ESRGANUpscalerPytorch(TiledUpscaler):
     _MODEL_MAPPING = {
         '4x-UltraSharp': {
             'url': 'https://github.com/zyddnys/manga-image-translator/releases/download/beta-0.3/4xESRGAN.pth',
@@ -517,6 +515,9 @@ class ESRGANUpscalerPytorch(OfflineUpscaler):
         },
     }
     _VALID_UPSCALE_RATIOS = [2, 3, 4]
+    # RRDB blocks keep nf + 4 * gc channels at input resolution and the upsampling convolutions
+    # nf channels at 2x and 4x resolution (float32), times 3 as headroom for intermediate buffers
+    _TILE_BYTES_PER_PIXEL = 4 * (192 + 64 * 4 + 64 * 16) * 3
 
     async def _load(self, device: str):
         super().__init__()
@@ -534,19 +535,16 @@ class ESRGANUpscalerPytorch(OfflineUpscaler):
     async def _unload(self):
         pass
 
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        # The model was trained on BGR input
+        return self.model(batch.flip(1)).flip(1)
+
     async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
         assert upscale_ratio <= 4
         ratio = upscale_ratio / 4
-        if image_batch :
-            batch = torch.cat([einops.rearrange(torch.from_numpy(np.array(img.convert('RGB'))[:,:,::-1].copy()).float() / 255.0, 'h w c -> 1 c h w') for img in image_batch], dim = 0).to(self.device)
-            with torch.no_grad() :
-                ret = self.model(batch)
-            ret: torch.Tensor
-            ret: List[Image.Image] = [Image.fromarray((einops.rearrange(img.clip(0, 1), 'c h w -> h w c').cpu().numpy()[:,:,::-1].copy() * 255.0).astype(np.uint8)) for img in ret]
-            ret = [img.resize(size = (int(round(img.size[0] * ratio)), int(round(img.size[1] * ratio))), resample = Image.Resampling.BILINEAR) for img in ret]
-            return ret
-        else :
-            return []
+        ret = await super()._infer(image_batch, upscale_ratio)
+        ret = [img.resize(size = (int(round(img.size[0] * ratio)), int(round(img.size[1] * ratio))), resample = Image.Resampling.BILINEAR) for img in ret]
+        return ret
 
 def test() :
     sd = torch.load('../../models/upscaling/esrgan-pytorch/4xESRGAN.pth')
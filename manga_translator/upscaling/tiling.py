@@ -0,0 +1,135 @@
+import math
+from typing import Callable, Iterator, List, Tuple
+
+import numpy as np
+import torch
+
+# Fraction of the free device memory (or available RAM on cpu/mps) a tiled forward pass may use
+DEFAULT_MEMORY_FRACTION = 0.5
+MIN_TILE_SIZE = 64
+MAX_TILE_SIZE = 1024
+
+
+def get_memory_budget(device: str, memory_budget_mb: int = 0) -> int:
+    """
+    Returns the number of bytes a single forward pass is allowed to use on `device`.
+    An explicit `memory_budget_mb` takes precedence over the automatic estimate.
+    """
+    if memory_budget_mb and memory_budget_mb > 0:
+        return memory_budget_mb * 1024 * 1024
+    if device.startswith('cuda') and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return int(free * DEFAULT_MEMORY_FRACTION)
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available * DEFAULT_MEMORY_FRACTION)
+    except ImportError:
+        return 2 * 1024 ** 3
+
+
+def choose_tile_size(bytes_per_pixel: int, memory_budget: int, batch_size: int = 1, overlap: int = 0, multiple: int = 8) -> int:
+    """
+    Picks the largest square tile whose activations for a batch of `batch_size` tiles
+    fit into `memory_budget`. The result excludes the overlap and is a multiple of `multiple`.
+    """
+    side = int(math.sqrt(memory_budget / max(1, bytes_per_pixel * batch_size))) - 2 * overlap
+    side = side // multiple * multiple
+    return max(MIN_TILE_SIZE, min(MAX_TILE_SIZE, side))
+
+
+def _tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def iter_tiles(h: int, w: int, tile_size: int, overlap: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Yields `(y, x, tile_h, tile_w)` for equally sized tiles covering an `h`x`w` image, where
+    neighbouring tiles share at least `overlap` pixels. Equal sizes allow tiles to be batched.
+    """
+    tile_h, tile_w = min(tile_size, h), min(tile_size, w)
+    for y in _tile_starts(h, tile_h, overlap):
+        for x in _tile_starts(w, tile_w, overlap):
+            yield y, x, tile_h, tile_w
+
+
+def _ramp(length: int, feather: int, fade_in: bool, fade_out: bool) -> np.ndarray:
+    ramp = np.ones(length, dtype=np.float32)
+    feather = min(feather, length // 2)
+    if feather > 0:
+        # Strictly positive so that every output pixel receives some weight
+        edge = (np.arange(feather, dtype=np.float32) + 0.5) / feather
+        if fade_in:
+            ramp[:feather] = edge
+        if fade_out:
+            ramp[-feather:] = edge[::-1]
+    return ramp
+
+
+def feather_weights(tile_h: int, tile_w: int, feather: int, top: bool, left: bool, bottom: bool, right: bool) -> np.ndarray:
+    """
+    Returns a `(tile_h, tile_w, 1)` blending mask that linearly fades out over `feather`
+    pixels on the edges that border another tile. Edges on the image border stay at 1.
+    """
+    wy = _ramp(tile_h, feather, top, bottom)
+    wx = _ramp(tile_w, feather, left, right)
+    return np.outer(wy, wx)[:, :, None]
+
+
+def _to_uint8(pixels: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    return (pixels / np.maximum(weights, 1e-6) * 255.0).round().astype(np.uint8)
+
+
+def tiled_upscale(forward: Callable[[torch.Tensor], torch.Tensor], image: np.ndarray, tile_size: int, overlap: int,
+                  batch_size: int, device: str) -> np.ndarray:
+    """
+    Upscales an `(h, w, c)` uint8 image by running `forward` on batches of overlapping tiles
+    and blending the results with feathered seams. The scale is taken from the model output.
+
+    Tiles are blended in a float strip one tile high spanning the output width. Once the
+    tiles of the next row start, the rows above them are final and are written to the
+    uint8 output, so only the output itself is allocated at full resolution.
+    """
+    h, w = image.shape[:2]
+    tiles = list(iter_tiles(h, w, tile_size, overlap))
+    output = None
+    strip = None
+    strip_weights = None
+    # Output row of the first strip row
+    strip_top = 0
+    scale = 1
+
+    for i in range(0, len(tiles), batch_size):
+        chunk = tiles[i:i + batch_size]
+        batch = np.stack([image[y:y+th, x:x+tw] for y, x, th, tw in chunk]).astype(np.float32) / 255.0
+        batch = torch.from_numpy(batch).permute(0, 3, 1, 2).contiguous().to(device)
+        with torch.no_grad():
+            result = forward(batch).clamp_(0, 1).permute(0, 2, 3, 1).float().cpu().numpy()
+
+        if output is None:
+            scale = result.shape[1] // chunk[0][2]
+            strip_h = chunk[0][2] * scale
+            output = np.empty((h * scale, w * scale, result.shape[3]), dtype=np.uint8)
+            strip = np.zeros((strip_h, w * scale, result.shape[3]), dtype=np.float32)
+            strip_weights = np.zeros((strip_h, w * scale, 1), dtype=np.float32)
+
+        for (y, x, th, tw), tile in zip(chunk, result):
+            ys, xs = y * scale, x * scale
+            if ys > strip_top:
+                # First tile of the next row, no later tile reaches above it
+                done = ys - strip_top
+                output[strip_top:ys] = _to_uint8(strip[:done], strip_weights[:done])
+                strip[:-done], strip_weights[:-done] = strip[done:], strip_weights[done:]
+                strip[-done:], strip_weights[-done:] = 0, 0
+                strip_top = ys
+            weight = feather_weights(th * scale, tw * scale, overlap * scale,
+                                     top=y > 0, left=x > 0, bottom=y + th < h, right=x + tw < w)
+            strip[:th*scale, xs:xs+tw*scale] += tile * weight
+            strip_weights[:th*scale, xs:xs+tw*scale] += weight
+
+    output[strip_top:] = _to_uint8(strip, strip_weights)
+    return output
@@ -1,12 +1,9 @@
 import os
 import subprocess
-import tempfile
 from sys import platform
-from typing import List
-from PIL import Image
 import shutil
 
-from .common import OfflineUpscaler
+from .common import ExecutableUpscaler
 
 if platform == 'win32':
     waifu2x_base_folder = 'waifu2x-win'
@@ -49,7 +46,7 @@ else:
     }
 
 # https://github.com/nihui/waifu2x-ncnn-vulkan
-class Waifu2xUpscaler(OfflineUpscaler): # ~2GB of vram
+class Waifu2xUpscaler(ExecutableUpscaler): # ~2GB of vram
     _MODEL_MAPPING = model_mapping
     _VALID_UPSCALE_RATIOS = [2, 4, 8, 16, 32]
 
@@ -65,33 +62,8 @@ class Waifu2xUpscaler(OfflineUpscaler): # ~2GB of vram
     async def _unload(self):
         pass
 
-    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
-        # Has to cache images because chosen upscaler doesn't support piping
-        in_dir = tempfile.mkdtemp()
-        out_dir = tempfile.mkdtemp()
-        for i, image in enumerate(image_batch):
-            image.save(os.path.join(in_dir, f'{i}.png'))
-
-        try:
-            self._run_waifu2x_executable(in_dir, out_dir, upscale_ratio, 0)
-        except Exception:
-            # Maybe throw exception instead
-            self.logger.warn(f'Process returned non-zero exit status. Skipping upscaling.')
-            return image_batch
-
-        output_batch = []
-        for i, image in enumerate(image_batch):
-            img_path = os.path.join(out_dir, f'{i}.png')
-            if os.path.exists(img_path):
-                img = Image.open(img_path)
-                img.load()
-                output_batch.append(img)
-            else:
-                output_batch.append(image)
-
-        shutil.rmtree(in_dir)
-        shutil.rmtree(out_dir)
-        return output_batch
+    def _run_executable(self, image_directory: str, output_directory: str, upscale_ratio: float):
+        self._run_waifu2x_executable(image_directory, output_directory, upscale_ratio, 0)
 
     def _run_waifu2x_executable(self, image_directory: str, output_directory: str, upscale_ratio: float, denoise_level: int):
         cmds = [
@@ -102,4 +74,6 @@ class Waifu2xUpscaler(OfflineUpscaler): # ~2GB of vram
             '-s', str(upscale_ratio),
             '-n', str(denoise_level),
         ]
+        if self.tile_size > 0:
+            cmds += ['-t', str(self.tile_size)]
         subprocess.check_call(cmds)
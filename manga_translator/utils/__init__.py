@@ -5,3 +5,6 @@ from .textblock import *
 from .inference import *
 from .threading import *
 from .bubble import is_ignore
+from .writer import OutputWriter, get_output_writer
+from .archive import ArchiveReader, ArchiveWriter, is_archive, open_archive
+from .tracing import Tracer, get_tracer, trace_stage
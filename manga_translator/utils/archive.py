@@ -0,0 +1,225 @@
+"""
+Comic archives (cbz/zip, cbr/rar) and PDFs as input and output of the local mode.
+
+Pages are read straight from the archive in natural sort order and results are
+written straight into a zip archive, nothing is extracted to disk. Entries keep
+their path inside the archive, so volumes with chapter folders keep them.
+
+Reading rar archives needs `rarfile` (and an unrar tool), reading PDFs needs
+`PyMuPDF`. PDF pages made of a single full page image yield that image as is,
+other pages are rendered.
+"""
+
+import io
+import os
+import threading
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+from .generic import natural_sort
+from .log import get_logger
+
+logger = get_logger('archive')
+
+ZIP_EXTENSIONS = ['.cbz', '.zip']
+RAR_EXTENSIONS = ['.cbr', '.rar']
+PDF_EXTENSIONS = ['.pdf']
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + RAR_EXTENSIONS + PDF_EXTENSIONS
+# Results are always written as zip, the format every comic reader supports
+OUTPUT_ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tif', '.tiff', '.avif']
+
+# Resolution of rendered PDF pages
+PDF_RENDER_DPI = 300
+# Extension of the image PyMuPDF extracts for a PDF stream filter, streams of other
+# filters (e.g. JPXDecode, CCITTFaxDecode) are rendered
+PDF_IMAGE_FILTERS = {'DCTDecode': 'jpg', 'FlateDecode': 'png'}
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def _is_page(name: str) -> bool:
+    # Skip folders and the metadata macOS adds to zips
+    if name.endswith('/') or name.startswith('__MACOSX/') or os.path.basename(name).startswith('._'):
+        return False
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+class ArchiveReader(ABC):
+    """Pages of an archive, `names` are in natural sort order."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.names: List[str] = []
+
+    @abstractmethod
+    def read(self, name: str) -> bytes:
+        pass
+
+    def open_image(self, name: str) -> Image.Image:
+        image = Image.open(io.BytesIO(self.read(name)))
+        image.load()
+        return image
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ZipArchiveReader(ArchiveReader):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = zipfile.ZipFile(path)
+        self.names = natural_sort([name for name in self._file.namelist() if _is_page(name)])
+
+    def read(self, name: str) -> bytes:
+        return self._file.read(name)
+
+    def close(self):
+        self._file.close()
+
+
+class RarArchiveReader(ArchiveReader):
+    def __init__(self, path: str):
+        super().__init__(path)
+        try:
+            import rarfile
+        except ImportError:
+            raise ImportError('Reading rar archives requires rarfile: pip install rarfile')
+        self._file = rarfile.RarFile(path)
+        self.names = natural_sort([name for name in self._file.namelist() if _is_page(name)])
+
+    def read(self, name: str) -> bytes:
+        return self._file.read(name)
+
+    def close(self):
+        self._file.close()
+
+
+class PdfArchiveReader(ArchiveReader):
+    def __init__(self, path: str):
+        super().__init__(path)
+        try:
+            import fitz
+        except ImportError:
+            raise ImportError('Reading PDFs requires PyMuPDF: pip install pymupdf')
+        self._doc = fitz.open(path)
+        # Page name -> (page index, xref of its full page image or 0 to render the page)
+        self._pages: Dict[str, Tuple[int, int]] = {}
+        digits = len(str(self._doc.page_count))
+        for i, page in enumerate(self._doc):
+            xref, ext = self._page_image(page)
+            name = f'{i + 1:0{digits}d}.{ext}'
+            self._pages[name] = (i, xref)
+            self.names.append(name)
+
+    def _page_image(self, page) -> Tuple[int, str]:
+        images = page.get_images(full=True)
+        # The stored image of a rotated page is not what the page shows
+        if len(images) == 1 and page.rotation == 0:
+            xref, smask, *_, stream_filter, _ = images[0]
+            ext = PDF_IMAGE_FILTERS.get(stream_filter)
+            # Scanned volumes have one image covering the page, take it without resampling.
+            # Images with a soft mask would lose it, those are rendered.
+            if ext and not smask:
+                rects = page.get_image_rects(xref)
+                if rects and rects[0].get_area() >= 0.9 * page.rect.get_area():
+                    return xref, ext
+        return 0, 'png'
+
+    def read(self, name: str) -> bytes:
+        index, xref = self._pages[name]
+        if xref:
+            return self._doc.extract_image(xref)['image']
+        return self._doc[index].get_pixmap(dpi=PDF_RENDER_DPI).tobytes('png')
+
+    def close(self):
+        self._doc.close()
+
+
+def open_archive(path: str) -> ArchiveReader:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ZIP_EXTENSIONS:
+        return ZipArchiveReader(path)
+    if ext in RAR_EXTENSIONS:
+        return RarArchiveReader(path)
+    if ext in PDF_EXTENSIONS:
+        return PdfArchiveReader(path)
+    raise ValueError(f'Unsupported archive format: {ext}')
+
+
+class ArchiveWriter:
+    """
+    Writes pages into a zip archive as they finish, from any thread. The archive is
+    written to a temporary name and moved into place on `close`, which also keeps the
+    pages written so far if the job fails. Pages of an existing archive at `path` can
+    be carried over with `keep_existing`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f'{path}.part'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Images are compressed already, deflating them again costs time for nothing
+        self._file = zipfile.ZipFile(self.tmp_path, 'w', compression=zipfile.ZIP_STORED)
+        self._lock = threading.Lock()
+        self._names = set()
+        self.pages_written = 0
+        self.bytes_written = 0
+
+    @staticmethod
+    def existing_names(path: str) -> List[str]:
+        if not os.path.isfile(path):
+            return []
+        try:
+            with zipfile.ZipFile(path) as f:
+                return f.namelist()
+        except zipfile.BadZipFile:
+            logger.warning(f'Ignoring damaged archive: "{path}"')
+            return []
+
+    def keep_existing(self, names: List[str]):
+        """Copies the entries `names` of the archive currently at `path`."""
+        if not names:
+            return
+        with zipfile.ZipFile(self.path) as f:
+            for name in names:
+                self.write(name, f.read(name))
+
+    def write(self, name: str, data: bytes):
+        with self._lock:
+            if name in self._names:
+                logger.warning(f'Duplicate archive entry: "{name}"')
+            self._names.add(name)
+            self._file.writestr(name, data)
+            self.pages_written += 1
+            self.bytes_written += len(data)
+
+    def write_image(self, name: str, image: Image.Image, **save_kwargs):
+        """Encodes `image` in the format of the entry's extension."""
+        ext = os.path.splitext(name)[1].lower()
+        fmt = save_kwargs.pop('format', None) or Image.registered_extensions().get(ext, 'PNG')
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buf = io.BytesIO()
+        image.save(buf, format=fmt, **save_kwargs)
+        self.write(name, buf.getvalue())
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        os.replace(self.tmp_path, self.path)
@@ -8,6 +8,8 @@ import tqdm
 import requests
 import sys
 import hashlib
+import threading
+from collections import OrderedDict
 import re
 import einops
 import unicodedata
@@ -314,6 +316,32 @@ def resize_keep_aspect(img, size):
     new_height = round(img.shape[0] * ratio)
     return cv2.resize(img, (new_width, new_height), interpolation = cv2.INTER_LINEAR_EXACT)
 
+_bilateral_cache = OrderedDict()
+_bilateral_cache_lock = threading.Lock()
+BILATERAL_CACHE_SIZE = 2
+
+def bilateral_filter_cached(img: np.ndarray, d: int = 17, sigma_color: float = 80, sigma_space: float = 80, compute: bool = True) -> Optional[np.ndarray]:
+    """
+    `cv2.bilateralFilter` with a small cache keyed by image content, so that stages
+    filtering the same page (detection, mask refinement) only pay for it once.
+    With `compute=False` only a cached result is returned, or None.
+    """
+    img = np.ascontiguousarray(img)
+    key = (hashlib.blake2b(img.data, digest_size=16).hexdigest(), img.shape, d, sigma_color, sigma_space)
+    with _bilateral_cache_lock:
+        if key in _bilateral_cache:
+            _bilateral_cache.move_to_end(key)
+            return _bilateral_cache[key]
+    if not compute:
+        return None
+    filtered = cv2.bilateralFilter(img, d, sigma_color, sigma_space)
+    filtered.flags.writeable = False
+    with _bilateral_cache_lock:
+        _bilateral_cache[key] = filtered
+        while len(_bilateral_cache) > BILATERAL_CACHE_SIZE:
+            _bilateral_cache.popitem(last=False)
+    return filtered
+
 def image_resize(image, width = None, height = None, inter = cv2.INTER_AREA):
     # initialize the dimensions of the image to be resized and
     # grab the image size
@@ -966,6 +994,15 @@ def square_pad_resize(img: np.ndarray, tgt_size: int):
 
     return img, down_scale_ratio, pad_h, pad_w
 
+def det_requires_rearrange(img: np.ndarray, tgt_size: int = 1280) -> bool:
+    '''
+    Whether `det_rearrange_forward` splits `img` into square patches.
+    '''
+    h, w = img.shape[:2]
+    if h < w:
+        h, w = w, h
+    return h / tgt_size > 2.5 and h / w > 3
+
 def det_rearrange_forward(
     img: np.ndarray, 
     dbnet_batch_forward: Callable[[np.ndarray, str], Tuple[np.ndarray, np.ndarray]], 
@@ -1036,12 +1073,8 @@ def det_rearrange_forward(
         transpose = True
         h, w = img.shape[1], img.shape[0]
 
-    asp_ratio = h / w
-    down_scale_ratio = h / tgt_size
-
     # rearrange condition
-    require_rearrange = down_scale_ratio > 2.5 and asp_ratio > 3
-    if not require_rearrange:
+    if not det_requires_rearrange(img, tgt_size):
         return None, None
 
     if verbose:
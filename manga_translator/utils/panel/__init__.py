@@ -1,24 +1,64 @@
 from .kumikolib import Kumiko
-import tempfile, cv2, os
-from ..generic import imwrite_unicode
+from collections import OrderedDict
+import hashlib, threading
+import cv2
+import numpy as np
 
-def get_panels_from_array(img_rgb, rtl=True, logger=None):
+# Panels are detected on a copy downscaled to this longest side, panel borders survive INTER_AREA
+# well and Kumiko's thresholds are relative to the page size.
+PANEL_WORKING_SIZE = 1600
+PANEL_CACHE_SIZE = 64
 
-    tmp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-    path = tmp.name
-    tmp.close()  
+_panel_cache = OrderedDict()
+_panel_cache_lock = threading.Lock()
 
-    # Always use the unicode-safe writer.
-    # If no logger is passed, create a default one.
-    if not logger:
-        import logging
-        logger = logging.getLogger(__name__)
-    imwrite_unicode(path, img_rgb, logger)
+def _to_working_resolution(img: np.ndarray, working_size: int):
+    h, w = img.shape[:2]
+    scale = working_size / max(h, w) if working_size and working_size > 0 else 1
+    if scale >= 1:
+        return np.ascontiguousarray(img), 1
+    small = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return small, scale
+
+def clear_panel_cache():
+    with _panel_cache_lock:
+        _panel_cache.clear()
+
+def get_panels_from_array(img_rgb, rtl=True, logger=None, working_size=PANEL_WORKING_SIZE):
+    """
+    Returns the panels of a page as `[x, y, w, h]` lists in Kumiko's reading order.
+    Detection runs on the in-memory array at a reduced working resolution and the
+    result is cached per image content, so repeated calls for the same page are free.
+    """
+    h, w = img_rgb.shape[:2]
+    small, scale = _to_working_resolution(img_rgb, working_size)
+    digest = hashlib.blake2b(small.data, digest_size=16).hexdigest()
+    key = (digest, h, w, bool(rtl), working_size)
+
+    with _panel_cache_lock:
+        if key in _panel_cache:
+            _panel_cache.move_to_end(key)
+            return [list(p) for p in _panel_cache[key]]
 
     k = Kumiko({'rtl': rtl})
-    k.parse_image(path)
+    k.parse_array(small)
     infos = k.get_infos()
+    panels = infos[0]['panels']
+
+    if scale != 1:
+        panels = [
+            [
+                int(round(x / scale)),
+                int(round(y / scale)),
+                min(int(round(pw / scale)), w),
+                min(int(round(ph / scale)), h),
+            ]
+            for x, y, pw, ph in panels
+        ]
 
-    os.unlink(path)
+    with _panel_cache_lock:
+        _panel_cache[key] = tuple(tuple(p) for p in panels)
+        while len(_panel_cache) > PANEL_CACHE_SIZE:
+            _panel_cache.popitem(last=False)
 
-    return infos[0]['panels']
\ No newline at end of file
+    return [list(p) for p in panels]
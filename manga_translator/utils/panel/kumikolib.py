@@ -101,6 +101,17 @@ class Kumiko:
 			)
 		)
 
+	def parse_array(self, img, name = None):
+		self.page_list.append(
+			Page(
+				name,
+				numbering = "rtl" if self.options['rtl'] else "ltr",
+				min_panel_size_ratio = self.options['min_panel_size_ratio'],
+				panel_expansion = self.panel_expansion,
+				img = img,
+			)
+		)
+
 	def get_infos(self):
 		return list(map(lambda p: p.get_infos(), self.page_list))
 
@@ -23,7 +23,7 @@ class Page:
 		actual_gutters = self.actual_gutters()
 
 		return {
-			'filename': self.url if self.url else os.path.basename(self.filename),
+			'filename': self.url if self.url else os.path.basename(self.filename or ''),
 			'size': self.img_size,
 			'numbering': self.numbering,
 			'gutters': [actual_gutters['x'], actual_gutters['y']],
@@ -39,7 +39,8 @@ class Page:
 		debug = False,
 		url = None,
 		min_panel_size_ratio = None,
-		panel_expansion = True
+		panel_expansion = True,
+		img = None
 	):
 		self.filename = filename
 		self.panels = []
@@ -48,10 +49,14 @@ class Page:
 		self.processing_time = None
 		t1 = time.time_ns()
 
-		with open(filename, 'rb') as f:
-			chunk = f.read()
-		nparr = np.frombuffer(chunk, np.uint8)
-		self.img = cv.imdecode(nparr, cv.IMREAD_COLOR)
+		if img is not None:
+			# In-memory image, skips the encode/decode round trip through a file
+			self.img = img if img.ndim == 3 else cv.cvtColor(img, cv.COLOR_GRAY2BGR)
+		else:
+			with open(filename, 'rb') as f:
+				chunk = f.read()
+			nparr = np.frombuffer(chunk, np.uint8)
+			self.img = cv.imdecode(nparr, cv.IMREAD_COLOR)
 		if not isinstance(self.img, np.ndarray) or self.img.size == 0:
 			raise NotAnImageException(f"File {filename} is not an image")
 
@@ -70,7 +75,7 @@ class Page:
 
 		# get license for this file
 		self.license = None
-		if os.path.isfile(filename + '.license'):
+		if filename and os.path.isfile(filename + '.license'):
 			with open(filename + '.license', encoding = "utf8") as fh:
 				try:
 					self.license = json.load(fh)
@@ -580,11 +580,20 @@ def _sort_panels_fill(panels: List[Tuple[int, int, int, int]], right_to_left: bo
     return ordered
 
 
+def get_sorted_panels(img: np.ndarray, right_to_left: bool = True) -> List[Tuple[int, int, int, int]]:
+    """Detects the panels of a page and returns them as [x1, y1, x2, y2] in reading order."""
+    panels_raw = get_panels_from_array(img, rtl=right_to_left)
+    # Convert to [x1, y1, x2, y2]
+    panels = [(x, y, x + w, y + h) for x, y, w, h in panels_raw]
+    # Use the customised sorter that keeps vertically stacked panels together.
+    return _sort_panels_fill(panels, right_to_left)
+
 def sort_regions(
     regions: List[TextBlock],
     right_to_left: bool = True,
     img: np.ndarray = None,
-    force_simple_sort: bool = False
+    force_simple_sort: bool = False,
+    panels: List[Tuple[int, int, int, int]] = None
 ) -> List[TextBlock]:
     
     if not regions:
@@ -595,15 +604,12 @@ def sort_regions(
         return _simple_sort(regions, right_to_left)
 
     # 1. Panel detection + sorting within panels
-    if img is not None:
+    if img is not None or panels is not None:
         from ..utils import get_logger
         logger = get_logger('textblock')
         try:
-            panels_raw = get_panels_from_array(img, rtl=right_to_left, logger=logger)
-            # Convert to [x1, y1, x2, y2]
-            panels = [(x, y, x + w, y + h) for x, y, w, h in panels_raw]
-            # Use the customised sorter that keeps vertically stacked panels together.
-            panels = _sort_panels_fill(panels, right_to_left)
+            if panels is None:
+                panels = get_sorted_panels(img, right_to_left)
 
             # Assign panel_index to each region
             for r in regions:
@@ -692,17 +698,15 @@ def sort_regions(
     return sorted_regions
 
 
-def visualize_textblocks(canvas: np.ndarray, blk_list: List[TextBlock], show_panels: bool = False, img_rgb: np.ndarray = None, right_to_left: bool = True):
+def visualize_textblocks(canvas: np.ndarray, blk_list: List[TextBlock], show_panels: bool = False, img_rgb: np.ndarray = None, right_to_left: bool = True,
+                         panels: List[Tuple[int, int, int, int]] = None):
     lw = max(round(sum(canvas.shape) / 2 * 0.003), 2)  # line width
     
     # Panel detection and drawing
-    panels = None
-    if show_panels and img_rgb is not None:
+    if show_panels and (panels is not None or img_rgb is not None):
         try:
-            panels_raw = get_panels_from_array(img_rgb, rtl=right_to_left)
-            panels = [(x, y, x + w, y + h) for x, y, w, h in panels_raw]
-            # Use the customised sorter that keeps vertically stacked panels together.
-            panels = _sort_panels_fill(panels, right_to_left)
+            if panels is None:
+                panels = get_sorted_panels(img_rgb, right_to_left)
             
             # Draw panel boxes and order
             for panel_idx, (x1, y1, x2, y2) in enumerate(panels):
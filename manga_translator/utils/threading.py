@@ -1,4 +1,8 @@
 import asyncio
+import itertools
+import threading
+import time
+from typing import Dict, Hashable, List
 
 class PriorityLock:
     """
@@ -104,3 +108,134 @@ class Throttler:
             self.pending_call = None
             if self.pending_task:
                 return await self.pending_task
+
+class PriorityScheduler:
+    """
+    Admits jobs to named stages, each running at most `limits[stage]` jobs at once.
+
+    Waiting jobs are admitted by priority, lower values first. With `aging` a job's
+    priority decreases by that amount per second it waits, so low priority jobs are
+    not starved by a steady stream of higher priority ones. Waiting jobs can be
+    cancelled, their place is simply dropped.
+
+    Unlike `PriorityLock`, the scheduler may be shared by several event loops
+    (e.g. a network loop and the pipeline loop): waiters are woken on their own loop.
+
+    Example usage:
+
+    scheduler = PriorityScheduler({'download': 4, 'gpu': 1}, aging=1.0)
+
+    async with scheduler.stage('gpu', priority, key=task_id) as slot:
+        slot.release()      # let another job use the stage while this one waits on I/O
+        ...
+        await slot.acquire()
+    """
+    class _Waiter:
+        __slots__ = ('priority', 'key', 'enqueued', 'seq', 'loop', 'future')
+
+        def __init__(self, priority: float, key: Hashable, seq: int, loop: asyncio.AbstractEventLoop):
+            self.priority = priority
+            self.key = key
+            self.enqueued = time.monotonic()
+            self.seq = seq
+            self.loop = loop
+            self.future = loop.create_future()
+
+    class Slot:
+        """A job's place in a stage, can be released and acquired again while the job runs."""
+        def __init__(self, scheduler: 'PriorityScheduler', stage: str, priority: float, key: Hashable = None):
+            self.scheduler = scheduler
+            self.stage = stage
+            self.priority = priority
+            self.key = key
+            self.held = False
+
+        async def acquire(self, priority: float = None):
+            await self.scheduler.acquire(self.stage, self.priority if priority is None else priority, self.key)
+            self.held = True
+
+        def release(self):
+            if self.held:
+                self.held = False
+                self.scheduler.release(self.stage)
+
+        async def __aenter__(self):
+            await self.acquire()
+            return self
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+            self.release()
+
+    def __init__(self, limits: Dict[str, int], aging: float = 0.0):
+        self.limits = {stage: max(1, limit) for stage, limit in limits.items()}
+        self.aging = aging
+        self._running = {stage: 0 for stage in limits}
+        self._waiting: Dict[str, List[PriorityScheduler._Waiter]] = {stage: [] for stage in limits}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {stage: {'admitted': 0, 'cancelled': 0, 'wait_time': 0.0} for stage in limits}
+
+    def stage(self, stage: str, priority: float, key: Hashable = None) -> 'PriorityScheduler.Slot':
+        return self.Slot(self, stage, priority, key)
+
+    def _effective_priority(self, waiter: '_Waiter', now: float):
+        return waiter.priority - self.aging * (now - waiter.enqueued), waiter.seq
+
+    async def acquire(self, stage: str, priority: float, key: Hashable = None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._running[stage] < self.limits[stage] and not self._waiting[stage]:
+                self._running[stage] += 1
+                self.stats[stage]['admitted'] += 1
+                return
+            waiter = self._Waiter(priority, key, next(self._seq), loop)
+            self._waiting[stage].append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiting[stage]:
+                    self._waiting[stage].remove(waiter)
+                    self.stats[stage]['cancelled'] += 1
+                    raise
+            # Admitted while being cancelled, pass the place on
+            self.release(stage)
+            raise
+
+    def release(self, stage: str):
+        with self._lock:
+            self._running[stage] -= 1
+            now = time.monotonic()
+            while self._waiting[stage] and self._running[stage] < self.limits[stage]:
+                waiter = min(self._waiting[stage], key=lambda w: self._effective_priority(w, now))
+                self._waiting[stage].remove(waiter)
+                self._running[stage] += 1
+                self.stats[stage]['admitted'] += 1
+                self.stats[stage]['wait_time'] += now - waiter.enqueued
+                waiter.loop.call_soon_threadsafe(self._wake, waiter.future)
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    def queue(self, stage: str) -> List[Hashable]:
+        """Keys of the jobs waiting for `stage`, in the order they would be admitted now."""
+        now = time.monotonic()
+        with self._lock:
+            waiting = sorted(self._waiting[stage], key=lambda w: self._effective_priority(w, now))
+        return [w.key for w in waiting]
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                stage: {
+                    'limit': self.limits[stage],
+                    'running': self._running[stage],
+                    'waiting': len(self._waiting[stage]),
+                    'oldest_wait': max((now - w.enqueued for w in self._waiting[stage]), default=0.0),
+                    **self.stats[stage],
+                }
+                for stage in self.limits
+            }
@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import functools
+import itertools
+import threading
+import contextvars
+from typing import Callable, Dict, List, Optional
+
+from .log import get_logger
+
+logger = get_logger('tracing')
+
+# Stack of spans that are open in the current task. asyncio tasks copy the context on
+# creation, so spans of pages processed concurrently nest independently.
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('trace_span', default=None)
+
+
+_process = None
+
+def _get_rss() -> int:
+    global _process
+    try:
+        if _process is None:
+            import psutil
+            _process = psutil.Process()
+        return _process.memory_info().rss
+    except Exception:
+        return 0
+
+def _get_vram() -> int:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.memory_allocated()
+    except Exception:
+        pass
+    return 0
+
+def _get_vram_peak() -> int:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.max_memory_allocated()
+    except Exception:
+        pass
+    return 0
+
+def _reset_vram_peak():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+    except Exception:
+        pass
+
+
+class Span:
+    """
+    A timed section of work. Records wall and CPU time, RSS and VRAM deltas and arbitrary
+    attributes such as input sizes (pixels, regions, characters, tokens).
+
+    The CPU time is that of the thread running the span, i.e. the event loop for pipeline
+    stages. It excludes work handed to executor threads and includes other tasks the loop
+    ran in between. RSS is sampled at the start and end of the span only, so `rss_end`
+    misses peaks in between. The CUDA peak counter is process wide and only reset while
+    no other top level span is open, so `vram_peak` is exact for spans that ran alone and
+    an upper bound for spans that overlapped others (e.g. concurrent pages).
+    """
+    __slots__ = ('tracer', 'name', 'category', 'attrs', 'parent', 'track', 'start', 'end', 'thread',
+                 'cpu_start', 'cpu_time', 'rss_start', 'rss_delta', 'rss_end', 'vram_start', 'vram_delta', 'vram_peak', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.parent = None
+        self.track = 0
+        self.end = None
+        self.cpu_time = 0.0
+        self.rss_delta = 0
+        self.rss_end = 0
+        self.vram_delta = 0
+        self.vram_peak = 0
+
+    def set(self, **attrs):
+        """Sets attributes, e.g. `span.set(regions=len(regions))`."""
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        """Adds to numeric attributes, e.g. `span.add(tokens=usage.total_tokens)`."""
+        for k, v in counters.items():
+            self.attrs[k] = self.attrs.get(k, 0) + v
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        # Top level spans (pages, batches) get their own track in the timeline
+        self.track = self.parent.track if self.parent else self.tracer._next_track()
+        if self.parent is None:
+            self.tracer._enter_root()
+        self._token = _current_span.set(self)
+        self.rss_start = _get_rss()
+        self.vram_start = _get_vram()
+        self.thread = threading.get_ident()
+        self.cpu_start = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end = time.perf_counter()
+        # Thread CPU clocks are not comparable across threads
+        self.cpu_time = time.thread_time() - self.cpu_start if threading.get_ident() == self.thread else 0.0
+        self.rss_end = _get_rss()
+        self.rss_delta = self.rss_end - self.rss_start
+        self.vram_delta = _get_vram() - self.vram_start
+        self.vram_peak = _get_vram_peak()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _current_span.reset(self._token)
+        if self.parent is None:
+            self.tracer._exit_root()
+        self.tracer._record(self)
+        return False
+
+
+class _NullSpan:
+    """Returned while tracing is disabled, every operation is a no-op."""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collects nested spans for every pipeline stage and model call and exports them as a
+    Chrome trace (chrome://tracing, https://ui.perfetto.dev) and as a summary table.
+
+    While disabled `span()` returns a shared no-op object, so instrumentation costs a
+    single attribute check. Spans are kept until `reset()`, the local mode exports and
+    resets them at the end of every job. The ws and shared modes never export a trace
+    and leave tracing disabled.
+
+    Example usage:
+
+    tracer = get_tracer()
+    tracer.enable()
+    with tracer.span('detection', 'stage', pixels=h * w) as span:
+        ...
+        span.set(regions=len(textlines))
+    tracer.export_chrome_trace('trace.json')
+    print(tracer.summary_table())
+    """
+    def __init__(self):
+        self.enabled = False
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._tracks = itertools.count(1)
+        self._origin = time.perf_counter()
+        # Top level spans currently open
+        self._open_roots = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._spans = []
+            self._tracks = itertools.count(1)
+            self._origin = time.perf_counter()
+
+    def _next_track(self) -> int:
+        return next(self._tracks)
+
+    def _enter_root(self):
+        with self._lock:
+            # Resetting while another top level span is open would lose its peak
+            if self._open_roots == 0:
+                _reset_vram_peak()
+            self._open_roots += 1
+
+    def _exit_root(self):
+        with self._lock:
+            self._open_roots -= 1
+
+    def _record(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def span(self, name: str, category: str = 'stage', **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, attrs)
+
+    def current(self):
+        """Returns the innermost open span of the current task, to attach attributes from deeper code."""
+        if not self.enabled:
+            return NULL_SPAN
+        return _current_span.get() or NULL_SPAN
+
+    @property
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def to_chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            args = {
+                'thread_cpu_ms': round(s.cpu_time * 1000, 3),
+                'rss_delta_mb': round(s.rss_delta / 2**20, 2),
+                'rss_end_mb': round(s.rss_end / 2**20, 2),
+                'vram_delta_mb': round(s.vram_delta / 2**20, 2),
+                'vram_peak_mb': round(s.vram_peak / 2**20, 2),
+            }
+            args.update({k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in s.attrs.items()})
+            events.append({
+                'name': s.name,
+                'cat': s.category,
+                'ph': 'X',
+                'ts': round((s.start - self._origin) * 1e6, 1),
+                'dur': round(s.duration * 1e6, 1),
+                'pid': pid,
+                'tid': s.track,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summarize(self) -> Dict[str, dict]:
+        summary = {}
+        for s in self.spans:
+            key = f'{s.category}:{s.name}'
+            entry = summary.setdefault(key, {
+                'name': s.name, 'category': s.category, 'count': 0, 'wall': 0.0, 'max_wall': 0.0,
+                'cpu': 0.0, 'rss_delta': 0, 'vram_peak': 0, 'totals': {},
+            })
+            entry['count'] += 1
+            entry['wall'] += s.duration
+            entry['max_wall'] = max(entry['max_wall'], s.duration)
+            entry['cpu'] += s.cpu_time
+            entry['rss_delta'] = max(entry['rss_delta'], s.rss_delta)
+            entry['vram_peak'] = max(entry['vram_peak'], s.vram_peak)
+            for k in ('pixels', 'regions', 'chars', 'tokens'):
+                v = s.attrs.get(k)
+                if isinstance(v, (int, float)):
+                    entry['totals'][k] = entry['totals'].get(k, 0) + v
+        return summary
+
+    def summary_table(self) -> str:
+        rows = sorted(self.summarize().values(), key=lambda e: e['wall'], reverse=True)
+        header = f'{"span":<28} {"count":>6} {"wall s":>9} {"mean ms":>9} {"max ms":>9} {"tcpu s":>8} {"rss+ MB":>8} {"vram MB":>8}  inputs'
+        lines = [header, '-' * len(header)]
+        for e in rows:
+            inputs = ', '.join(f'{k}={v:g}' for k, v in e['totals'].items())
+            lines.append(
+                f'{e["category"] + ":" + e["name"]:<28.28} {e["count"]:>6} {e["wall"]:>9.2f} '
+                f'{e["wall"] / e["count"] * 1000:>9.1f} {e["max_wall"] * 1000:>9.1f} {e["cpu"]:>8.2f} '
+                f'{e["rss_delta"] / 2**20:>8.1f} {e["vram_peak"] / 2**20:>8.1f}  {inputs}'
+            )
+        return '\n'.join(lines)
+
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+def trace_stage(name: str, category: str = 'stage', attrs: Callable[..., dict] = None):
+    """
+    Decorator that runs an async method inside a span. `attrs` receives the same arguments
+    as the method (without `self`) and returns input size attributes for the span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if not _tracer.enabled:
+                return await func(self, *args, **kwargs)
+            span_attrs = {}
+            if attrs is not None:
+                try:
+                    span_attrs = attrs(*args, **kwargs) or {}
+                except Exception:
+                    pass
+            with _tracer.span(name, category, **span_attrs):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
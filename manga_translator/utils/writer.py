@@ -0,0 +1,205 @@
+import os
+import time
+import atexit
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .log import get_logger
+
+logger = get_logger('writer')
+
+
+class OutputWriter:
+    """
+    Encodes and writes output files on a pool of worker threads so that slow disks
+    (e.g. network filesystems) don't stall the event loop.
+
+    At most `max_pending` jobs are queued or running at a time. Submitting more blocks
+    the caller (or awaits, for `submit_async`) until a slot frees up, which bounds the
+    memory held by images waiting to be written.
+
+    Callers hand over ownership of the submitted arrays/images and must not modify them
+    afterwards. A failed job is logged and counted, and its future raises the exception. Files are written to a temporary name and renamed once complete, so
+    readers polling for a result never see a partially written file.
+
+    Example usage:
+
+    writer = OutputWriter(workers=2, max_pending=8)
+    writer.write_image('result/mask.png', mask)
+    await writer.save_async(dest, save_result, result, dest, ctx)
+    writer.flush()
+    """
+    def __init__(self, workers: int = 2, max_pending: int = 8):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='output-writer')
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._closed = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.files_written = 0
+            self.bytes_written = 0
+            self.errors = 0
+            # Total time spent encoding and writing inside the workers
+            self.io_time = 0.0
+            # Time callers spent blocked because the queue was full
+            self.wait_time = 0.0
+
+    def _run(self, func: Callable, args, kwargs, path: Optional[str] = None):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            if path and os.path.isfile(path):
+                with self._lock:
+                    self.files_written += 1
+                    self.bytes_written += os.path.getsize(path)
+            return result
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.error(f'Failed to write output: {e.__class__.__name__}: {e}')
+            # The future fails, so callers waiting for the result see the error
+            raise
+        finally:
+            with self._lock:
+                self.io_time += time.perf_counter() - start
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def _dispatch(self, func: Callable, args, kwargs, path: Optional[str] = None) -> Future:
+        future = self._executor.submit(self._run, func, args, kwargs, path)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _acquire_slot(self):
+        if self._closed:
+            raise RuntimeError('OutputWriter is closed')
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self.wait_time += time.perf_counter() - start
+
+    async def _acquire_slot_async(self):
+        if self._closed:
+            raise RuntimeError('OutputWriter is closed')
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            await asyncio.to_thread(self._slots.acquire)
+            with self._lock:
+                self.wait_time += time.perf_counter() - start
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """Queues `func(*args, **kwargs)`, blocking while `max_pending` jobs are outstanding."""
+        self._acquire_slot()
+        return self._dispatch(func, args, kwargs)
+
+    async def submit_async(self, func: Callable, *args, **kwargs) -> Future:
+        """Like `submit` but waits for a free slot without blocking the event loop."""
+        await self._acquire_slot_async()
+        return self._dispatch(func, args, kwargs)
+
+    def save(self, path: str, func: Callable, *args, **kwargs) -> Future:
+        """Like `submit` for a job that writes `path`, which is then counted in the stats."""
+        self._acquire_slot()
+        return self._dispatch(func, args, kwargs, path)
+
+    async def save_async(self, path: str, func: Callable, *args, **kwargs) -> Future:
+        await self._acquire_slot_async()
+        return self._dispatch(func, args, kwargs, path)
+
+    @staticmethod
+    def _encode_and_write(path: str, img: np.ndarray, params):
+        ext = os.path.splitext(path)[1]
+        result, buf = cv2.imencode(ext, img, params or [])
+        if not result:
+            raise ValueError(f'Failed to encode image to buffer for path: {path}')
+        tmp_path = f'{path}.{threading.get_ident()}.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp_path, path)
+
+    def write_image(self, path: str, img: np.ndarray, params: Optional[list] = None) -> Future:
+        """Queues a cv2 (BGR) image to be encoded by extension and written to `path`."""
+        return self.save(path, self._encode_and_write, path, img, params)
+
+    async def write_image_async(self, path: str, img: np.ndarray, params: Optional[list] = None) -> Future:
+        return await self.save_async(path, self._encode_and_write, path, img, params)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Blocks until every queued job has finished."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    async def flush_async(self):
+        await asyncio.to_thread(self.flush)
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'files_written': self.files_written,
+                'bytes_written': self.bytes_written,
+                'errors': self.errors,
+                'io_time': self.io_time,
+                'wait_time': self.wait_time,
+                'pending': len(self._pending),
+            }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        return (f'{s["files_written"]} files, {s["bytes_written"] / (1024 * 1024):.1f} MB written in {s["io_time"]:.2f}s of I/O, '
+                f'{s["wait_time"]:.2f}s blocked on the writer queue' + (f', {s["errors"]} errors' if s['errors'] else ''))
+
+
+_output_writers: Dict[Tuple[int, int], OutputWriter] = {}
+_output_writer_lock = threading.Lock()
+
+def get_output_writer(workers: int = None, max_pending: int = None) -> OutputWriter:
+    """
+    Returns the process wide output writer for `workers`/`max_pending`, creating it on
+    first use. Translators with different settings get writers of their own, so none of
+    them closes a writer another one is still using.
+    """
+    key = (workers or 2, max_pending or 8)
+    with _output_writer_lock:
+        writer = _output_writers.get(key)
+        if writer is None:
+            writer = _output_writers[key] = OutputWriter(*key)
+        return writer
+
+@atexit.register
+def _flush_output_writer():
+    with _output_writer_lock:
+        writers = list(_output_writers.values())
+    for writer in writers:
+        writer.close()